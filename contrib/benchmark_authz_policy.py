@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+"""Compare the permission checks of `AuthzPolicy` on a synthetic large
+authz file with a linear scan of the sections, as performed before
+the authz file was compiled.
+
+Usage: benchmark_authz_policy.py [sections] [tickets]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from fnmatch import fnmatchcase
+from itertools import groupby
+
+from trac.perm import PermissionSystem
+from trac.resource import Resource
+from trac.test import EnvironmentStub
+from trac.util import create_file, to_list
+from trac.util.text import printout
+from tracopt.perm.authz_policy import AuthzPolicy
+
+
+def generate_authz(sections):
+    lines = ['[groups]',
+             'developers = %s' % ', '.join('dev%d' % i for i in xrange(50)),
+             'managers = %s' % ', '.join('mgr%d' % i for i in xrange(10)),
+             '']
+    for i in xrange(sections):
+        if i % 4 == 0:
+            lines.append('[wiki:Project%d/*]' % i)
+        elif i % 4 == 1:
+            lines.append('[milestone:release-%d*]' % i)
+        else:
+            lines.append('[ticket:%d]' % i)
+        lines.extend(['user%d = TICKET_ADMIN' % i,
+                      '@managers = TICKET_VIEW, MILESTONE_VIEW',
+                      'anonymous =', ''])
+    lines.extend(['[*]',
+                  '@developers = TICKET_MODIFY, WIKI_MODIFY',
+                  '* = TICKET_VIEW, WIKI_VIEW', ''])
+    return '\n'.join(lines)
+
+
+def legacy_check_permission(policy, action, username, resource):
+    """Check the permission by matching each section in turn."""
+    resource_key = policy.normalise_resource(resource)
+    if username and username != 'anonymous':
+        valid_users = ['*', 'authenticated', username]
+    else:
+        valid_users = ['*', 'anonymous']
+    permissions = None
+    for resource_section in [a for a in policy.authz.sections()
+                               if a != 'groups']:
+        resource_glob = resource_section
+        if '@' not in resource_glob:
+            resource_glob += '@*'
+        if fnmatchcase(resource_key, resource_glob):
+            for who, perms in policy.authz.items(resource_section):
+                if who in valid_users or \
+                        who in policy.groups_by_user.get(username, []):
+                    permissions = to_list(perms)
+                    break
+            if permissions is not None:
+                break
+    if permissions is None:
+        return None
+    elif permissions == []:
+        return False
+    ps = PermissionSystem(policy.env)
+    for deny, perms in groupby(permissions,
+                               key=lambda p: p.startswith('!')):
+        if deny and action in ps.expand_actions(p[1:] for p in perms):
+            return False
+        elif action in ps.expand_actions(perms):
+            return True
+    return None
+
+
+def run(check, tickets, usernames):
+    start = time.time()
+    decisions = [check('TICKET_VIEW', username, Resource('ticket', id))
+                 for username in usernames
+                 for id in xrange(1, tickets + 1)]
+    return time.time() - start, decisions
+
+
+def main(sections=2000, tickets=20):
+    dir = tempfile.mkdtemp(prefix='trac-authz-')
+    try:
+        authz_file = os.path.join(dir, 'authz.conf')
+        create_file(authz_file, generate_authz(sections))
+        env = EnvironmentStub(enable=['trac.*', AuthzPolicy], path=dir)
+        env.config.set('authz_policy', 'authz_file', authz_file)
+        policy = AuthzPolicy(env)
+        start = time.time()
+        policy.parse_authz()
+        printout("parsed and compiled %d sections in %.1f ms"
+                 % (sections, (time.time() - start) * 1000))
+
+        usernames = ['anonymous', 'dev1', 'mgr1', 'user2', 'somebody']
+        checks = tickets * len(usernames)
+        legacy_time, legacy_decisions = run(
+            lambda action, username, resource:
+                legacy_check_permission(policy, action, username, resource),
+            tickets, usernames)
+        compiled_time, compiled_decisions = run(
+            lambda action, username, resource:
+                policy.check_permission(action, username, resource, None),
+            tickets, usernames)
+        assert legacy_decisions == compiled_decisions
+        printout("linear scan %10.1f us/check" %
+                 (legacy_time * 1e6 / checks))
+        printout("compiled    %10.1f us/check" %
+                 (compiled_time * 1e6 / checks))
+    finally:
+        shutil.rmtree(dir)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
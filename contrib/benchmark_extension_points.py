@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+"""Measure the time spent looking up the extensions of the extension
+points typically accessed while processing a request, with and without
+the extensions cached by the component manager.
+
+Usage: benchmark_extension_points.py [requests]
+"""
+
+import sys
+import time
+
+from trac.loader import load_components
+from trac.test import EnvironmentStub
+from trac.ticket.api import TicketSystem
+from trac.util.text import printout
+from trac.web.chrome import Chrome
+from trac.web.main import RequestDispatcher
+from trac.wiki.api import WikiSystem
+
+
+def get_extension_points(env):
+    """Return the `(component, name)` of the extension points accessed
+    while processing a typical request.
+    """
+    return [(RequestDispatcher(env), 'authenticators'),
+            (RequestDispatcher(env), 'handlers'),
+            (RequestDispatcher(env), 'filters'),
+            (Chrome(env), 'navigation_contributors'),
+            (Chrome(env), 'template_providers'),
+            (Chrome(env), 'stream_filters'),
+            (TicketSystem(env), 'change_listeners'),
+            (WikiSystem(env), 'macro_providers'),
+            (WikiSystem(env), 'syntax_providers')]
+
+
+def run(env, requests, cached):
+    extension_points = get_extension_points(env)
+    start = time.time()
+    for i in xrange(requests):
+        if not cached:
+            env._extensions.clear()
+        for component, name in extension_points:
+            getattr(component, name)
+    return time.time() - start
+
+
+def main(requests=10000):
+    env = EnvironmentStub(enable=['trac.*'])
+    load_components(env)
+    run(env, 1, True)
+    for label, cached in (("uncached", False), ("cached", True)):
+        elapsed = run(env, requests, cached)
+        printout("%-8s %8.2f us/request" % (label,
+                                            elapsed * 1e6 / requests))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
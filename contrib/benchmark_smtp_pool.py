@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+"""Measure the time spent sending notification emails with
+`SmtpEmailSender`, connecting to the SMTP server for each email and
+reusing the idle connections kept open with `[notification]
+smtp_idle_timeout`.
+
+The emails are sent to a local test SMTP server, which waits for
+`latency` milliseconds when a client greets it, to simulate the cost of
+connecting to and authenticating with a remote server.
+
+Usage: benchmark_smtp_pool.py [emails] [latency]
+"""
+
+import os
+import sys
+import time
+
+from trac.notification.mail import SmtpEmailSender
+from trac.test import EnvironmentStub
+from trac.tests.notification import SMTPServerStore, SMTPThreadedServer
+from trac.util.text import printout
+
+
+class SlowGreetingStore(SMTPServerStore):
+    """Store for SMTP data delaying the greeting of the clients."""
+
+    def __init__(self, latency):
+        SMTPServerStore.__init__(self)
+        self.latency = latency
+        self.connections = 0
+
+    def helo(self, args):
+        time.sleep(self.latency)
+        SMTPServerStore.helo(self, args)
+        self.connections += 1
+
+
+def run(port, emails, latency, idle_timeout):
+    smtpd = SMTPThreadedServer(port)
+    smtpd.store = SlowGreetingStore(latency)
+    smtpd.start()
+    env = EnvironmentStub()
+    env.config.set('notification', 'smtp_server', '127.0.0.1')
+    env.config.set('notification', 'smtp_port', str(port))
+    env.config.set('notification', 'smtp_idle_timeout', str(idle_timeout))
+    sender = SmtpEmailSender(env)
+    try:
+        start = time.time()
+        for idx in xrange(emails):
+            sender.send('trac@example.org', ['user%d@example.org' % idx],
+                        'Subject: Test %d\n\nBody' % idx)
+        return time.time() - start, smtpd.store.connections
+    finally:
+        sender.close()
+        smtpd.stop()
+
+
+def main(emails=100, latency=20):
+    port = 8000 + os.getpid() % 1000
+    for label, idle_timeout in (("connection per email", 0),
+                                ("pooled connection", 60)):
+        duration, connections = run(port, emails, latency / 1000.0,
+                                    idle_timeout)
+        printout("%-20s %8.2f ms/email %5d connections"
+                 % (label, duration * 1000 / emails, connections))
+        port += 1
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
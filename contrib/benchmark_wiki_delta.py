@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+"""Compare the size of the SQLite database and the time spent fetching
+the versions of a wiki page, with the previous versions stored in full
+and stored as line deltas with `[wiki] delta_storage`.
+
+A page of `lines` lines is saved `versions` times, changing three lines
+for each new version.
+
+Usage: benchmark_wiki_delta.py [versions] [lines] [fetches]
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from trac.env import Environment
+from trac.util.text import printout
+from trac.wiki.model import WikiPage
+
+
+def generate_text(lines, version):
+    text = ['Line %d of the page, with some text to make it longer.' % idx
+            for idx in xrange(lines)]
+    for idx in xrange(3):
+        line = (version * 3 + idx) % lines
+        text[line] = 'Line %d changed in version %d.' % (line, version)
+    return '\n'.join(text) + '\n'
+
+
+def fetch_time(env, versions, fetches):
+    start = time.time()
+    for idx in xrange(fetches):
+        WikiPage(env, 'TestPage', random.randint(1, versions - 1)).text
+    old = (time.time() - start) / fetches
+    start = time.time()
+    for idx in xrange(fetches):
+        WikiPage(env, 'TestPage').text
+    latest = (time.time() - start) / fetches
+    return old, latest
+
+
+def run(versions, lines, fetches, delta_storage):
+    dir = tempfile.mkdtemp(prefix='trac-wiki-delta-')
+    try:
+        env = Environment(dir, create=True,
+                          options=[('trac', 'database',
+                                    'sqlite:db/trac.db'),
+                                   ('wiki', 'delta_storage',
+                                    str(delta_storage).lower())])
+        start = time.time()
+        for version in xrange(1, versions + 1):
+            page = WikiPage(env, 'TestPage')
+            page.text = generate_text(lines, version)
+            page.save('joe', 'Version %d' % version)
+        save = (time.time() - start) / versions
+        env.db_transaction("VACUUM")
+        size = os.path.getsize(os.path.join(dir, 'db', 'trac.db'))
+        old, latest = fetch_time(env, versions, fetches)
+        env.shutdown()
+        return size, save, old, latest
+    finally:
+        shutil.rmtree(dir)
+
+
+def main(versions=300, lines=1500, fetches=100):
+    random.seed(0)
+    printout("%-11s %10s %12s %12s %12s"
+             % ("storage", "db size", "save", "old version", "latest"))
+    for label, delta_storage in (("full text", False), ("deltas", True)):
+        size, save, old, latest = run(versions, lines, fetches,
+                                      delta_storage)
+        printout("%-11s %7.1f MB %9.2f ms %9.2f ms %9.2f ms"
+                 % (label, size / 1048576.0, save * 1000, old * 1000,
+                    latest * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:4]])
@@ -128,12 +128,14 @@ facilities.
         trac.mimeview.pygments = trac.mimeview.pygments[Pygments]
         trac.mimeview.rst = trac.mimeview.rst[reST]
         trac.mimeview.txtl = trac.mimeview.txtl[Textile]
+        trac.notification.admin = trac.notification.admin
         trac.notification.api = trac.notification.api
         trac.notification.compat = trac.notification.compat
         trac.notification.mail = trac.notification.mail
         trac.notification.prefs = trac.notification.prefs
         trac.prefs = trac.prefs.web_ui
         trac.search = trac.search.web_ui
+        trac.search.index = trac.search.index
         trac.ticket.admin = trac.ticket.admin
         trac.ticket.batch = trac.ticket.batch
         trac.ticket.query = trac.ticket.query
@@ -27,7 +27,9 @@ from StringIO import StringIO
 # IAdminCommandProvider implementations
 import trac.admin.api
 import trac.attachment
+import trac.notification.admin
 import trac.perm
+import trac.search.index
 import trac.ticket.admin
 import trac.versioncontrol.admin
 import trac.versioncontrol.api
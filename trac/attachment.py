@@ -36,7 +36,8 @@ from trac.core import *
 from trac.mimeview import *
 from trac.perm import PermissionError, IPermissionPolicy
 from trac.resource import *
-from trac.search import search_to_sql, shorten_result
+from trac.search import SearchIndex, fetch_ordered_rows, search_to_sql, \
+                         shorten_result
 from trac.util import content_disposition, create_zipinfo, get_reporter_id
 from trac.util.datefmt import format_datetime, from_utimestamp, \
                               to_datetime, to_utimestamp, utc
@@ -113,6 +114,10 @@ class ILegacyAttachmentPolicyDelegate(Interface):
                              ATTACHMENT_CREATE is checked, the
                              resource ``.id`` will be `None`.
             :param perm: the permission cache for that username and resource
+
+           As for the permission policies, a delegate can set a
+           `cacheable` attribute to `True` to allow its decisions to
+           be reused by later requests.
             """
 
 
@@ -312,26 +317,49 @@ class AttachmentModule(Component):
             return format_to(self.env, None, context.child(attachment.parent),
                              descr)
 
-    def get_search_results(self, req, resource_realm, terms):
+    def get_search_results(self, req, resource_realm, terms, limit=None):
         """Return a search result generator suitable for ISearchSource.
 
         Search results are attachments on resources of the given
         `resource_realm.realm` whose filename, description or author match
-        the given terms.
+        the given terms. They are sorted by decreasing date, and fetched
+        by batches of `limit` rows if specified (''since 1.2'').
         """
-        with self.env.db_query as db:
-            sql_query, args = search_to_sql(
-                    db, ['filename', 'description', 'author'], terms)
-            for id, time, filename, desc, author in db("""
+        index = SearchIndex(self.env)
+        if index.enabled:
+            matches = set()
+            prefix = resource_realm.realm + ':'
+            for realm, docid, score in index.search(terms, self.realm):
+                if docid.startswith(prefix):
+                    matches.add(tuple(docid[len(prefix):].rsplit('/', 1)))
+            ids = list(set(id for id, filename in matches))
+            rows = []
+            with self.env.db_query as db:
+                for chunk in (ids[i:i + 100]
+                              for i in xrange(0, len(ids), 100)):
+                    rows.extend(row for row in db("""
+                        SELECT id, time, filename, description, author
+                        FROM attachment WHERE type=%%s AND id IN (%s)
+                        """ % ','.join(('%s',) * len(chunk)),
+                        [resource_realm.realm] + chunk)
+                        if (row[0], row[2]) in matches)
+            rows.sort(key=lambda row: row[1], reverse=True)
+        else:
+            with self.env.db_query as db:
+                sql_query, args = search_to_sql(
+                        db, ['filename', 'description', 'author'], terms)
+                rows = fetch_ordered_rows(self.env, """
                     SELECT id, time, filename, description, author
-                    FROM attachment WHERE type = %s AND """ + sql_query,
-                    (resource_realm.realm,) + args):
-                attachment = resource_realm(id=id).child(self.realm, filename)
-                if 'ATTACHMENT_VIEW' in req.perm(attachment):
-                    yield (get_resource_url(self.env, attachment, req.href),
-                           get_resource_shortname(self.env, attachment),
-                           from_utimestamp(time), author,
-                           shorten_result(desc, terms))
+                    FROM attachment WHERE type = %s AND """ + sql_query +
+                    " ORDER BY time DESC, id, filename",
+                    (resource_realm.realm,) + args, limit)
+        for id, time, filename, desc, author in rows:
+            attachment = resource_realm(id=id).child(self.realm, filename)
+            if 'ATTACHMENT_VIEW' in req.perm(attachment):
+                yield (get_resource_url(self.env, attachment, req.href),
+                       get_resource_shortname(self.env, attachment),
+                       from_utimestamp(time), author,
+                       shorten_result(desc, terms))
 
     # IResourceManager methods
 
@@ -535,7 +563,10 @@ class AttachmentModule(Component):
     def _render_view(self, req, attachment):
         req.perm(attachment.resource).require('ATTACHMENT_VIEW')
         can_delete = 'ATTACHMENT_DELETE' in req.perm(attachment.resource)
-        req.check_modified(attachment.date, str(can_delete))
+        format = req.args.get('format')
+        if format not in ('raw', 'txt'):
+            # `send_file` checks the entity tag of the file itself
+            req.check_modified(attachment.date, str(can_delete))
 
         data = {'mode': 'view',
                 'title': get_resource_name(self.env, attachment.resource),
@@ -551,7 +582,6 @@ class AttachmentModule(Component):
             mime_type = mimeview.get_mimetype(attachment.filename, str_data)
 
             # Eventually send the file directly
-            format = req.args.get('format')
             if format == 'zip':
                 self._download_as_zip(req, attachment.resource.parent,
                                       [attachment])
@@ -953,6 +983,11 @@ class LegacyAttachmentPolicy(Component):
 
     realm = AttachmentModule.realm
 
+    @property
+    def cacheable(self):
+        return all(getattr(delegate, 'cacheable', False)
+                   for delegate in self.delegates)
+
     # IPermissionPolicy methods
 
     _perm_maps = {
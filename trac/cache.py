@@ -12,11 +12,21 @@
 # history and logs, available at http://trac.edgewall.org/.
 
 import functools
+import os
+import struct
 
-from trac.core import Component
+try:
+    import fcntl
+    import mmap
+except ImportError:
+    fcntl = mmap = None
+
+from trac.config import Option, PathOption
+from trac.core import *
 from trac.util.concurrency import ThreadLocal, threading
+from trac.util.text import exception_to_unicode
 
-__all__ = ['CacheManager', 'cached']
+__all__ = ['CacheManager', 'ICacheInvalidationBus', 'cached']
 
 _id_to_key = {}
 
@@ -73,11 +83,21 @@ class CachedSingletonProperty(CachedPropertyBase):
         return CacheManager(instance.env).get(id, self.retriever, instance)
 
     def __delete__(self, instance):
+        CacheManager(instance.env).invalidate(self._get_id(instance))
+
+    def update(self, instance, updater):
+        """Update the cached value of `instance` in place.
+
+        See `CacheManager.update`. (''since 1.2'')
+        """
+        CacheManager(instance.env).update(self._get_id(instance), updater)
+
+    def _get_id(self, instance):
         try:
-            id = self.id
+            return self.id
         except AttributeError:
             id = self.id = key_to_id(self.make_key(instance.__class__))
-        CacheManager(instance.env).invalidate(id)
+            return id
 
 
 class CachedProperty(CachedPropertyBase):
@@ -107,11 +127,21 @@ class CachedProperty(CachedPropertyBase):
         return CacheManager(instance.env).get(id, self.retriever, instance)
 
     def __delete__(self, instance):
+        CacheManager(instance.env).invalidate(self._get_id(instance))
+
+    def update(self, instance, updater):
+        """Update the cached value of `instance` in place.
+
+        See `CacheManager.update`. (''since 1.2'')
+        """
+        CacheManager(instance.env).update(self._get_id(instance), updater)
+
+    def _get_id(self, instance):
         id = getattr(instance, self.key_attr)
         if isinstance(id, str):
             id = key_to_id(self.make_key(instance.__class__) + ':' + id)
             setattr(instance, self.key_attr, id)
-        CacheManager(instance.env).invalidate(id)
+        return id
 
 
 def cached(fn_or_attr=None):
@@ -122,7 +152,10 @@ def cached(fn_or_attr=None):
     data retrieval method is transparently called by the
     `CacheManager` on first use after the program start or after the
     cache has been invalidated.  Invalidating the cache for this value
-    is done by ``del``\ eting the attribute.
+    is done by ``del``\ eting the attribute.  When the new value can be
+    derived cheaply from the cached one, the cache can be updated in
+    place instead, e.g. ``WikiSystem.pages.update(self, updater)``
+    (see `CacheManager.update`).
 
     Note that the cache validity is maintained using the `cache` table
     in the database.  Cache invalidation is performed within a
@@ -180,15 +213,210 @@ def cached(fn_or_attr=None):
     return decorator
 
 
+class ICacheInvalidationBus(Interface):
+    """Extension point interface for components propagating cache
+    invalidations between the processes of an environment without
+    querying the `cache` table.
+
+    The generations published on the bus are only hints telling when
+    the generation stored in the database may have changed; the
+    database remains the authority whenever they differ.
+
+    :since 1.2:
+    """
+
+    def is_available():
+        """Return whether the bus can be used. When it can't, the
+        `CacheManager` falls back to querying the `cache` table once
+        per request.
+        """
+
+    def get_generation(id):
+        """Return the last generation published for the cache `id`,
+        or `None` if it is unknown or the bus is unavailable.
+        """
+
+    def publish(id, generation):
+        """Publish `generation` as the current generation of the cache
+        `id`. Older generations than the last published one must be
+        ignored.
+        """
+
+
+class SharedMemoryInvalidationBus(Component):
+    """Cache invalidation bus for processes running on a single host,
+    storing the cache generations in a memory-mapped file.
+
+    The file holds a fixed-size open-addressing hash table of
+    `(id, generation)` pairs. Readers access it without locking,
+    writers serialize through an exclusive lock on the file. The bus
+    is unavailable on platforms lacking `fcntl` and `mmap`.
+    """
+
+    implements(ICacheInvalidationBus)
+
+    generation_file = PathOption('trac', 'cache_generation_file',
+                                 '../files/cache-generations',
+        """Path to the memory-mapped file shared by the processes of
+        the environment when `[trac] cache_invalidation_bus` is set to
+        `SharedMemoryInvalidationBus`. Relative paths are resolved
+        relative to the `conf` directory of the environment. The file
+        must be on a local filesystem. (''since 1.2'')""")
+
+    slots = 8192
+    _slot = struct.Struct('<qq')
+
+    def __init__(self):
+        self._map = None
+        self._fd = None
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def close(self):
+        """Release the memory-mapped file."""
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                os.close(self._fd)
+                self._map = self._fd = None
+
+    # ICacheInvalidationBus methods
+
+    def is_available(self):
+        return self._open() is not None
+
+    def get_generation(self, id):
+        table = self._open()
+        if table is None:
+            return None
+        key = id + 1
+        size = self._slot.size
+        start = id % self.slots
+        for i in xrange(self.slots):
+            offset = ((start + i) % self.slots) * size
+            slot_key, generation = self._slot.unpack(
+                table[offset:offset + size])
+            if slot_key == key:
+                return generation
+            if slot_key == 0:
+                break
+        return None
+
+    def publish(self, id, generation):
+        table = self._open()
+        if table is None:
+            return
+        key = id + 1
+        size = self._slot.size
+        start = id % self.slots
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            for i in xrange(self.slots):
+                offset = ((start + i) % self.slots) * size
+                slot_key, slot_generation = self._slot.unpack(
+                    table[offset:offset + size])
+                if slot_key == key:
+                    if generation > slot_generation:
+                        table[offset + 8:offset + size] = \
+                            struct.pack('<q', generation)
+                    return
+                if slot_key == 0:
+                    # Write the generation before the key, so that
+                    # lock-free readers never see a key without its
+                    # generation
+                    table[offset + 8:offset + size] = \
+                        struct.pack('<q', generation)
+                    table[offset:offset + 8] = struct.pack('<q', key)
+                    return
+            self.log.warning("Cache generation table %s is full",
+                             self.generation_file)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    # Internal methods
+
+    def _open(self):
+        table = self._map
+        if table is not None or self._failed:
+            return table
+        with self._lock:
+            if self._map is None and not self._failed:
+                if mmap is None:
+                    self.log.warning("Shared memory cache invalidation is "
+                                     "not supported on this platform")
+                    self._failed = True
+                    return None
+                path = self.generation_file
+                length = self.slots * self._slot.size
+                try:
+                    dir = os.path.dirname(path)
+                    if not os.path.isdir(dir):
+                        os.makedirs(dir)
+                    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0666)
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX)
+                        try:
+                            if os.fstat(fd).st_size < length:
+                                os.ftruncate(fd, length)
+                        finally:
+                            fcntl.flock(fd, fcntl.LOCK_UN)
+                        self._map = mmap.mmap(fd, length)
+                        self._fd = fd
+                    except:
+                        os.close(fd)
+                        raise
+                except (EnvironmentError, mmap.error) as e:
+                    self.log.warning("Can't open cache generation table "
+                                     "%s, falling back to the database: "
+                                     "%s", path, exception_to_unicode(e))
+                    self._failed = True
+            return self._map
+
+
 class CacheManager(Component):
     """Cache manager."""
 
     required = True
 
+    invalidation_buses = ExtensionPoint(ICacheInvalidationBus)
+
+    invalidation_bus = Option('trac', 'cache_invalidation_bus', '',
+        """Name of a component implementing `ICacheInvalidationBus`,
+        used to learn about cache invalidations performed by other
+        processes instead of querying the `cache` table on each
+        request. All the processes accessing the environment must use
+        the same bus, e.g. `SharedMemoryInvalidationBus` when they all
+        run on the same host. When empty or when the bus is
+        unavailable, the `cache` table is queried.
+        (''since 1.2'')""")
+
     def __init__(self):
         self._cache = {}
         self._local = ThreadLocal(meta=None, cache=None)
         self._lock = threading.RLock()
+        self._bus = None, None
+
+    @property
+    def bus(self):
+        """The configured `ICacheInvalidationBus`, or `None` if no bus
+        is configured or if it is unavailable.
+        """
+        name = self.invalidation_bus
+        bus_name, bus = self._bus
+        if name != bus_name:
+            bus = None
+            if name:
+                for component in self.invalidation_buses:
+                    if component.__class__.__name__ == name:
+                        bus = component
+                        break
+                else:
+                    self.log.warning("Cache invalidation bus %s not found, "
+                                     "falling back to the database", name)
+            self._bus = name, bus
+        if bus is not None and bus.is_available():
+            return bus
+        return None
 
     # Public interface
 
@@ -198,6 +426,10 @@ class CacheManager(Component):
 
     def get(self, id, retriever, instance):
         """Get cached or fresh data for the given id."""
+        bus = self.bus
+        if bus is not None:
+            return self._get_from_bus(bus, id, retriever, instance)
+
         # Get cache metadata
         local_meta = self._local.meta
         local_cache = self._local.cache
@@ -246,6 +478,20 @@ class CacheManager(Component):
 
     def invalidate(self, id):
         """Invalidate cached data for the given id."""
+        self.update(id, None)
+
+    def update(self, id, updater):
+        """Invalidate cached data for the given id in the other
+        processes, and replace it with `updater(data)` in this process.
+
+        The `updater` is only called if the data cached in this process
+        is known to be up-to-date, otherwise the data is retrieved again
+        on next access. As the cached data may be in use by other
+        threads, `updater` must return a new object instead of
+        modifying `data`.
+
+        :since 1.2:
+        """
         with self.env.db_transaction as db:
             with self._lock:
                 # Invalidate in other processes
@@ -259,15 +505,59 @@ class CacheManager(Component):
                 #    and we can safely INSERT a new row.
                 db("UPDATE cache SET generation=generation+1 WHERE id=%s",
                    (id,))
-                if not db("SELECT generation FROM cache WHERE id=%s", (id,)):
+                rows = db("SELECT generation FROM cache WHERE id=%s", (id,))
+                if not rows:
                     db("INSERT INTO cache VALUES (%s, %s, %s)",
                        (id, 0, _id_to_key.get(id, '<unknown>')))
-
-                # Invalidate in this process
-                self._cache.pop(id, None)
+                generation = rows[0][0] if rows else 0
+                bus = self.bus
+                if bus is not None:
+                    # Other processes may see the new generation before
+                    # the transaction is committed, in which case they
+                    # keep checking the database until it is.
+                    bus.publish(id, generation)
+
+                # Invalidate or update in this process
+                entry = self._cache.pop(id, None)
+                if updater is not None and entry is not None and \
+                        entry[1] == generation - 1:
+                    self._cache[id] = updater(entry[0]), generation
 
                 # Invalidate in this thread
                 try:
                     del self._local.cache[id]
                 except (KeyError, TypeError):
                     pass
+
+    # Internal methods
+
+    def _get_from_bus(self, bus, id, retriever, instance):
+        generation = bus.get_generation(id)
+        if generation is not None:
+            try:
+                data, data_generation = self._cache[id]
+                if data_generation == generation:
+                    return data
+            except KeyError:
+                pass
+
+        # The bus knows of a newer generation or doesn't know the id,
+        # check the database
+        with self.env.db_query as db:
+            with self._lock:
+                for db_generation, in db(
+                        "SELECT generation FROM cache WHERE id=%s", (id,)):
+                    break
+                else:
+                    db_generation = -1
+                try:
+                    data, data_generation = self._cache[id]
+                    if data_generation == db_generation:
+                        bus.publish(id, db_generation)
+                        return data
+                except KeyError:
+                    pass
+                data = retriever(instance)
+                self._cache[id] = data, db_generation
+                bus.publish(id, db_generation)
+                return data
@@ -77,10 +77,21 @@ class ExtensionPoint(property):
     def extensions(self, component):
         """Return a list of components that declare to implement the
         extension point interface.
+
+        The list is computed once for each component manager, and
+        computed again when components are enabled or disabled, or when
+        new component classes are defined.
         """
+        compmgr = component.compmgr
+        generation = ComponentMeta._generation
+        cached = compmgr._extensions.get(self.interface)
+        if cached is not None and cached[0] == generation:
+            return list(cached[1])
         classes = ComponentMeta._registry.get(self.interface, ())
-        components = [component.compmgr[cls] for cls in classes]
-        return [c for c in components if c]
+        components = [compmgr[cls] for cls in classes]
+        extensions = tuple(c for c in components if c)
+        compmgr._extensions[self.interface] = (generation, extensions)
+        return list(extensions)
 
     def __repr__(self):
         """Return a textual representation of the extension point."""
@@ -94,6 +105,7 @@ class ComponentMeta(type):
     """
     _components = []
     _registry = {}
+    _generation = 0
 
     def __new__(mcs, name, bases, d):
         """Create the component class."""
@@ -114,6 +126,8 @@ class ComponentMeta(type):
                 classes = registry.setdefault(interface, [])
                 if new_class not in classes:
                     classes.append(new_class)
+        # Invalidate the extensions cached by the component managers
+        ComponentMeta._generation += 1
 
         return new_class
 
@@ -186,6 +200,7 @@ class ComponentManager(object):
         """Initialize the component manager."""
         self.components = {}
         self.enabled = {}
+        self._extensions = {}
         if isinstance(self, Component):
             self.components[self.__class__] = self
 
@@ -230,6 +245,7 @@ class ComponentManager(object):
             component = component.__class__
         self.enabled[component] = False
         self.components[component] = None
+        self._extensions.clear()
 
     def component_activated(self, component):
         """Can be overridden by sub-classes so that special
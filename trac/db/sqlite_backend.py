@@ -129,7 +129,7 @@ def _to_sql(table):
             ctype = "integer PRIMARY KEY"
         elif len(table.key) == 1 and column.name in table.key:
             ctype += " PRIMARY KEY"
-        coldefs.append("    %s %s" % (column.name, ctype))
+        coldefs.append("    %s %s" % (_quote(column.name), ctype))
     if len(table.key) > 1:
         coldefs.append("    UNIQUE (%s)" % ','.join(table.key))
     sql.append(',\n'.join(coldefs) + '\n);')
@@ -17,7 +17,7 @@
 from trac.db import Table, Column, Index
 
 # Database version identifier. Used for automatic upgrades.
-db_version = 41
+db_version = 44
 
 def __mkreports(reports):
     """Utility function used to create report data in same syntax as the
@@ -84,6 +84,11 @@ schema = [
         Column('comment'),
         Column('readonly', type='int'),
         Index(['time'])],
+    Table('wiki_delta', key=('name', 'version'))[
+        Column('name'),
+        Column('version', type='int'),
+        Column('base', type='int'),
+        Column('delta')],
 
     # Version control cache
     Table('repository', key=('id', 'name'))[
@@ -192,6 +197,24 @@ schema = [
         Column('target'),
         Index(['sid', 'authenticated', 'class']),
         Index(['class', 'realm', 'target'])],
+    Table('notify_queue', key='id')[
+        Column('id', auto_increment=True),
+        Column('time', type='int64'),
+        Column('next_attempt', type='int64'),
+        Column('attempts', type='int'),
+        Column('from_addr'),
+        Column('recipients'),
+        Column('message'),
+        Column('error'),
+        Index(['next_attempt'])],
+
+    # Search system
+    Table('search_index', key=('realm', 'id', 'term'))[
+        Column('realm'),
+        Column('id'),
+        Column('term'),
+        Column('weight', type='int'),
+        Index(['term'])],
 ]
 
 
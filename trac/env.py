@@ -16,6 +16,7 @@
 
 """Trac Environment model and related APIs."""
 
+import gzip
 import hashlib
 import os.path
 import setuptools
@@ -395,6 +396,7 @@ class Environment(Component, ComponentManager):
     def enable_component(self, cls):
         """Enable a component or module."""
         self._component_rules[self._component_name(cls)] = True
+        self._extensions.clear()
 
     def verify(self):
         """Verify that the provided path points to a valid Trac environment
@@ -875,8 +877,16 @@ class EnvironmentAdmin(Component):
     # IAdminCommandProvider methods
 
     def get_admin_commands(self):
-        yield ('deploy', '<directory>',
-               'Extract static resources from Trac and all plugins',
+        yield ('deploy', '<directory> [--fingerprint]',
+               """Extract static resources from Trac and all plugins
+
+               With the --fingerprint option, a copy of each resource
+               is also written under the fingerprinted name used in the
+               URLs of the resources when [trac] fingerprint_resources
+               is enabled, e.g. trac.0123456789.css, and the style
+               sheets and scripts are precompressed with gzip, e.g.
+               trac.0123456789.css.gz.
+               """,
                None, self._do_deploy)
         yield ('hotcopy', '<backupdir> [--no-database]',
                """Make a hot backup copy of an environment
@@ -895,7 +905,10 @@ class EnvironmentAdmin(Component):
                """,
                None, self._do_upgrade)
 
-    def _do_deploy(self, dest):
+    def _do_deploy(self, dest, fingerprint=None):
+        if fingerprint not in (None, '--fingerprint'):
+            raise AdminCommandError(_("Invalid argument '%(arg)s'",
+                                      arg=fingerprint), show_usage=True)
         target = os.path.normpath(dest)
         chrome_target = os.path.join(target, 'htdocs')
         script_target = os.path.join(target, 'cgi-bin')
@@ -919,6 +932,8 @@ class EnvironmentAdmin(Component):
                 if os.path.exists(source):
                     dest = os.path.join(chrome_target, key)
                     copytree(source, dest, overwrite=True)
+                    if fingerprint:
+                        self._fingerprint_resources(source, dest)
 
         # Create and copy scripts
         makedirs(script_target, overwrite=True)
@@ -932,6 +947,29 @@ class EnvironmentAdmin(Component):
             with open(dest, 'w') as out:
                 stream.render('text', out=out, encoding='utf-8')
 
+    # Extensions of the resources precompressed by `deploy --fingerprint`
+    compressible_extensions = ('.css', '.js', '.svg', '.txt', '.html',
+                               '.json', '.xml')
+
+    def _fingerprint_resources(self, source, dest):
+        from trac.web.chrome import Chrome
+        chrome = Chrome(self.env)
+        for dirpath, dirnames, filenames in os.walk(source):
+            target = os.path.join(dest, os.path.relpath(dirpath, source))
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                fingerprinted = os.path.join(target,
+                    chrome.add_fingerprint(filename,
+                                           chrome.get_fingerprint(path)))
+                shutil.copy2(path, fingerprinted)
+                ext = os.path.splitext(filename)[1].lower()
+                if ext in self.compressible_extensions:
+                    for name in (os.path.join(target, filename),
+                                 fingerprinted):
+                        with open(name, 'rb') as src:
+                            with gzip.open(name + '.gz', 'wb') as dst:
+                                shutil.copyfileobj(src, dst)
+
     def _do_hotcopy(self, dest, no_db=None):
         if no_db not in (None, '--no-database'):
             raise AdminCommandError(_("Invalid argument '%(arg)s'", arg=no_db),
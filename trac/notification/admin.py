@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import time
+
+from trac.admin import AdminCommandError, IAdminCommandProvider
+from trac.core import *
+from trac.notification.api import NotificationSystem
+from trac.util import as_int
+from trac.util.text import printout
+from trac.util.translation import _
+
+
+class NotificationAdmin(Component):
+    """trac-admin command provider for notification administration."""
+
+    implements(IAdminCommandProvider)
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('notification send', '[interval]',
+               """Send the queued notification emails
+
+               The emails which are due are sent, and those which cannot
+               be sent are rescheduled. When [interval] is specified, the
+               queue is processed again every [interval] seconds until the
+               command is interrupted.
+
+               Emails are queued when `[notification] use_email_queue` is
+               enabled.
+               """,
+               None, self._do_send)
+
+    def _do_send(self, interval=None):
+        if interval is not None:
+            interval = as_int(interval, None, min=1)
+            if interval is None:
+                raise AdminCommandError(_("Invalid interval"))
+        notifysys = NotificationSystem(self.env)
+        while True:
+            sent, failed = notifysys.send_queued_emails()
+            if sent or failed or interval is None:
+                printout(_("%(sent)s queued emails sent, %(failed)s "
+                           "failed.", sent=sent, failed=failed))
+            if interval is None:
+                break
+            time.sleep(interval)
@@ -17,12 +17,17 @@
 # history and logs, available at http://trac.edgewall.org/log/.
 
 from collections import defaultdict
+from datetime import datetime, timedelta
 from operator import itemgetter
 
 from trac.config import (BoolOption, ConfigSection, ExtensionOption,
-                         ListOption, Option)
-from trac.core import Component, Interface, ExtensionPoint
+                         IntOption, ListOption, Option)
+from trac.core import Component, Interface, ExtensionPoint, implements
 from trac.util import as_bool, lazy, to_list
+from trac.util.concurrency import threading
+from trac.util.datefmt import to_utimestamp, utc
+from trac.util.text import exception_to_unicode, to_unicode
+from trac.web.api import IRequestFilter
 
 
 __all__ = ['IEmailAddressResolver', 'IEmailDecorator', 'IEmailSender',
@@ -212,6 +217,8 @@ class NotificationEvent(object):
 
 class NotificationSystem(Component):
 
+    implements(IRequestFilter)
+
     email_sender = ExtensionOption('notification', 'email_sender',
                                    IEmailSender, 'SmtpEmailSender',
         """Name of the component implementing `IEmailSender`.
@@ -306,6 +313,34 @@ class NotificationSystem(Component):
         will disable it.
         """)
 
+    use_email_queue = BoolOption('notification', 'use_email_queue', 'false',
+        """Store notification emails in a queue in the database instead
+        of sending them while processing the request which triggered
+        the notification. The queued emails are sent by the worker
+        threads configured with `email_queue_workers`, which are started
+        by each web server process when it handles its first request.
+        Emails queued by other processes, e.g. `trac-admin` or
+        repository hooks, wait until a web server process is running;
+        otherwise `trac-admin $ENV notification send` must be run
+        periodically, e.g. from cron. (''since 1.2'')""")
+
+    email_queue_workers = IntOption('notification', 'email_queue_workers', 1,
+        """Number of threads sending the queued notification emails in
+        each web server process, when `use_email_queue` is enabled. Set
+        to 0 if the queue is only processed by running
+        `trac-admin $ENV notification send` periodically.
+        (''since 1.2'')""")
+
+    email_queue_retries = IntOption('notification', 'email_queue_retries', 5,
+        """Number of attempts made for sending a queued notification
+        email before giving up. (''since 1.2'')""")
+
+    email_queue_retry_delay = IntOption('notification',
+                                        'email_queue_retry_delay', 60,
+        """Number of seconds to wait before retrying to send a queued
+        notification email after the first failure. The delay is doubled
+        after each subsequent failure. (''since 1.2'')""")
+
     notification_subscriber_section = ConfigSection('notification-subscriber',
         """The notifications subscriptions are controlled by plugins. All
         `INotificationSubscriber` components are in charge. These components
@@ -320,6 +355,15 @@ class NotificationSystem(Component):
     distributors = ExtensionPoint(INotificationDistributor)
     subscribers = ExtensionPoint(INotificationSubscriber)
 
+    # Number of seconds after which an email being sent by another
+    # process is considered as abandoned
+    email_queue_lease = 600
+
+    def __init__(self):
+        self._queue_event = threading.Event()
+        self._queue_workers = None
+        self._queue_lock = threading.Lock()
+
     @property
     def smtp_always_cc(self):  # For backward compatibility
         return self.config.get('notification', 'smtp_always_cc')
@@ -347,8 +391,142 @@ class NotificationSystem(Component):
                    d['adverb'])
 
     def send_email(self, from_addr, recipients, message):
-        """Send message to recipients via e-mail."""
-        self.email_sender.send(from_addr, recipients, message)
+        """Send message to recipients via e-mail.
+
+        The message is queued if `[notification] use_email_queue` is
+        enabled.
+        """
+        if self.use_email_queue:
+            self.enqueue_email(from_addr, recipients, message)
+        else:
+            self.email_sender.send(from_addr, recipients, message)
+
+    def enqueue_email(self, from_addr, recipients, message):
+        """Store an e-mail message in the queue of messages to be sent.
+
+        :return: the id of the queued message
+        """
+        now = to_utimestamp(datetime.now(utc))
+        with self.env.db_transaction as db:
+            cursor = db.cursor()
+            cursor.execute("""
+                INSERT INTO notify_queue (time,next_attempt,attempts,
+                                          from_addr,recipients,message)
+                VALUES (%s,%s,0,%s,%s,%s)
+                """, (now, now, from_addr, '\n'.join(recipients),
+                      to_unicode(message)))
+            id = db.get_last_id(cursor, 'notify_queue')
+        self.log.debug("Queued notification email %d for %s", id,
+                       recipients)
+        # Wake up the workers, if started by this web server process
+        self._queue_event.set()
+        return id
+
+    def send_queued_emails(self, limit=None):
+        """Send the queued e-mail messages which are due.
+
+        Messages are removed from the queue once sent. A message which
+        cannot be sent is retried later with an exponential backoff, and
+        discarded after `[notification] email_queue_retries` attempts.
+
+        :param limit: the maximum number of messages to send
+        :return: a `(sent, failed)` tuple with the number of messages
+                 sent and of messages which couldn't be sent
+        """
+        sent = failed = 0
+        now = to_utimestamp(datetime.now(utc))
+        query = """
+            SELECT id, next_attempt FROM notify_queue
+            WHERE next_attempt<=%s ORDER BY next_attempt, id"""
+        if limit:
+            query += " LIMIT %d" % limit
+        for id, next_attempt in self.env.db_query(query, (now,)):
+            message = self._claim_queued_email(id, next_attempt)
+            if message is None:
+                continue
+            attempts, from_addr, recipients, message = message
+            try:
+                self.email_sender.send(from_addr, recipients,
+                                       message.encode('utf-8'))
+            except Exception as e:
+                failed += 1
+                self._reschedule_queued_email(id, attempts + 1, e)
+            else:
+                sent += 1
+                self.env.db_transaction(
+                    "DELETE FROM notify_queue WHERE id=%s", (id,))
+        return sent, failed
+
+    def _claim_queued_email(self, id, next_attempt):
+        """Mark a queued message as being sent by this process, and
+        return its `(attempts, from_addr, recipients, message)`, or
+        `None` if another process claimed it first.
+        """
+        lease = datetime.now(utc) + timedelta(seconds=self.email_queue_lease)
+        with self.env.db_transaction as db:
+            cursor = db.cursor()
+            cursor.execute("""
+                UPDATE notify_queue SET next_attempt=%s
+                WHERE id=%s AND next_attempt=%s
+                """, (to_utimestamp(lease), id, next_attempt))
+            if cursor.rowcount != 1:
+                return None
+            for attempts, from_addr, recipients, message in db("""
+                    SELECT attempts, from_addr, recipients, message
+                    FROM notify_queue WHERE id=%s""", (id,)):
+                return attempts, from_addr, recipients.split('\n'), message
+
+    def _reschedule_queued_email(self, id, attempts, error):
+        error = exception_to_unicode(error)
+        if attempts >= self.email_queue_retries:
+            self.log.error("Failed to send notification email %d after %d "
+                           "attempts, discarding it: %s", id, attempts, error)
+            self.env.db_transaction(
+                "DELETE FROM notify_queue WHERE id=%s", (id,))
+            return
+        delay = self.email_queue_retry_delay * 2 ** (attempts - 1)
+        self.log.warning("Failed to send notification email %d, retrying "
+                         "in %d seconds: %s", id, delay, error)
+        next_attempt = datetime.now(utc) + timedelta(seconds=delay)
+        self.env.db_transaction("""
+            UPDATE notify_queue SET next_attempt=%s, attempts=%s, error=%s
+            WHERE id=%s
+            """, (to_utimestamp(next_attempt), attempts, error, id))
+
+    def _start_queue_workers(self):
+        with self._queue_lock:
+            if self._queue_workers is not None:
+                return
+            self._queue_workers = []
+            for idx in xrange(max(0, self.email_queue_workers)):
+                worker = threading.Thread(target=self._run_queue_worker,
+                                          name='NotificationQueue-%d' % idx)
+                worker.daemon = True
+                worker.start()
+                self._queue_workers.append(worker)
+
+    def _run_queue_worker(self):
+        timeout = max(1, min(self.email_queue_retry_delay, 60))
+        while True:
+            self._queue_event.wait(timeout)
+            self._queue_event.clear()
+            try:
+                while self.send_queued_emails(limit=10) != (0, 0):
+                    pass
+            except Exception as e:
+                self.log.error("Failed to process the notification email "
+                               "queue: %s",
+                               exception_to_unicode(e, traceback=True))
+
+    # IRequestFilter methods
+
+    def pre_process_request(self, req, handler):
+        if self.use_email_queue and self._queue_workers is None:
+            self._start_queue_workers()
+        return handler
+
+    def post_process_request(self, req, template, data, content_type):
+        return template, data, content_type
 
     def notify(self, event):
         """Distribute an event to all subscriptions.
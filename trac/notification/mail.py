@@ -19,6 +19,7 @@
 import os
 import re
 import smtplib
+import socket
 import time
 from email.charset import BASE64, QP, SHORTEST, Charset
 from email.header import Header
@@ -39,6 +40,7 @@ from trac.notification.api import (
     INotificationDistributor, INotificationFormatter, INotificationSubscriber,
     NotificationSystem)
 from trac.util.compat import close_fds
+from trac.util.concurrency import threading
 from trac.util.datefmt import to_utimestamp
 from trac.util.text import CRLF, exception_to_unicode, fix_eol, to_unicode
 from trac.util.translation import _, tag_
@@ -433,12 +435,116 @@ class SmtpEmailSender(Component):
     use_tls = BoolOption('notification', 'use_tls', 'false',
         """Use SSL/TLS to send notifications over SMTP.""")
 
+    smtp_idle_timeout = IntOption('notification', 'smtp_idle_timeout', 0,
+        """Number of seconds during which a connection to the SMTP
+        server is kept open after sending a notification, so that it can
+        be reused for sending the next notifications without connecting
+        and authenticating again. Idle connections are closed once this
+        delay has elapsed. Set to 0 to close the connection after each
+        notification. (''since 1.2'')""")
+
+    smtp_pool_size = IntOption('notification', 'smtp_pool_size', 2,
+        """Maximum number of idle connections to the SMTP server kept
+        open when `smtp_idle_timeout` is set. (''since 1.2'')""")
+
+    def __init__(self):
+        self._pool = []
+        self._pool_lock = threading.Lock()
+        self._reaper = None
+
     def send(self, from_addr, recipients, message):
         # Ensure the message complies with RFC2822: use CRLF line endings
         message = fix_eol(message, CRLF)
 
         self.log.info("Sending notification through SMTP at %s:%d to %s",
                       self.smtp_server, self.smtp_port, recipients)
+        server = self._get_pooled_connection()
+        if server is not None:
+            try:
+                self._sendmail(server, from_addr, recipients, message)
+            except (smtplib.SMTPServerDisconnected, socket.error) as e:
+                # The server closed the idle connection in the meantime
+                self.log.debug("Pooled SMTP connection lost (%s), "
+                               "reconnecting", exception_to_unicode(e))
+                self._quit(server)
+            except:
+                self._quit(server)
+                raise
+            else:
+                self._release_connection(server)
+                return
+        server = self._connect()
+        try:
+            self._sendmail(server, from_addr, recipients, message)
+        except:
+            self._quit(server)
+            raise
+        self._release_connection(server)
+
+    def close(self):
+        """Close the idle connections to the SMTP server."""
+        with self._pool_lock:
+            pool, self._pool = self._pool, []
+            if self._reaper:
+                self._reaper.cancel()
+                self._reaper = None
+        for server, released in pool:
+            self._quit(server)
+
+    def _get_pooled_connection(self):
+        """Return an idle connection reset with `RSET`, or `None` if
+        there's no usable idle connection.
+        """
+        while True:
+            with self._pool_lock:
+                if not self._pool:
+                    return None
+                server, released = self._pool.pop()
+            if time.time() - released > self.smtp_idle_timeout:
+                self._quit(server)
+                continue
+            try:
+                server.rset()
+            except (smtplib.SMTPException, socket.error):
+                self._quit(server)
+                continue
+            return server
+
+    def _release_connection(self, server):
+        if self.smtp_idle_timeout > 0:
+            with self._pool_lock:
+                if len(self._pool) < self.smtp_pool_size:
+                    self._pool.append((server, time.time()))
+                    if not self._reaper:
+                        self._schedule_reaper(self.smtp_idle_timeout)
+                    return
+        self._quit(server)
+
+    def _schedule_reaper(self, delay):
+        # Must be called with `_pool_lock` held
+        self._reaper = threading.Timer(delay, self._reap_idle_connections)
+        self._reaper.daemon = True
+        self._reaper.start()
+
+    def _reap_idle_connections(self):
+        """Close the idle connections older than `smtp_idle_timeout`, and
+        schedule the next run if idle connections remain.
+        """
+        timeout = self.smtp_idle_timeout
+        now = time.time()
+        with self._pool_lock:
+            self._reaper = None
+            expired = [(server, released) for server, released in self._pool
+                       if now - released >= timeout]
+            self._pool = [(server, released) for server, released
+                          in self._pool if now - released < timeout]
+            if self._pool:
+                oldest = min(released for server, released in self._pool)
+                self._schedule_reaper(max(0, oldest + timeout - now))
+        for server, released in expired:
+            self._quit(server)
+
+    def _connect(self):
         try:
             server = smtplib.SMTP(self.smtp_server, self.smtp_port)
         except smtplib.socket.error as e:
@@ -460,22 +566,24 @@ class SmtpEmailSender(Component):
         if self.smtp_user:
             server.login(self.smtp_user.encode('utf-8'),
                          self.smtp_password.encode('utf-8'))
+        return server
+
+    def _sendmail(self, server, from_addr, recipients, message):
         start = time.time()
         server.sendmail(from_addr, recipients, message)
         t = time.time() - start
         if t > 5:
             self.log.warning("Slow mail submission (%.2f s), "
                              "check your mail setup", t)
-        if self.use_tls:
-            # avoid false failure detection when the server closes
-            # the SMTP connection with TLS enabled
-            import socket
-            try:
-                server.quit()
-            except socket.sslerror:
-                pass
-        else:
+
+    def _quit(self, server):
+        try:
             server.quit()
+        except (smtplib.SMTPException, socket.error):
+            # avoid false failure detection when the server closes
+            # the SMTP connection with TLS enabled, or has already
+            # closed an idle connection
+            server.close()
 
 
 class SendmailEmailSender(Component):
@@ -13,7 +13,10 @@
 
 import unittest
 
-from trac.notification.api import parse_subscriber_config
+from trac.core import Component, implements
+from trac.notification.api import IEmailSender, NotificationSystem, \
+                                  parse_subscriber_config
+from trac.test import EnvironmentStub
 
 
 class ParseSubscriberConfigTestCase(unittest.TestCase):
@@ -119,9 +122,138 @@ class ParseSubscriberConfigTestCase(unittest.TestCase):
         self.assertEqual(expected, parse_subscriber_config(config))
 
 
+class QueueTestEmailSender(Component):
+
+    implements(IEmailSender)
+
+    def __init__(self):
+        self.history = []
+        self.fail = False
+
+    def send(self, from_addr, recipients, message):
+        if self.fail:
+            raise IOError("Connection refused")
+        self.history.append((from_addr, recipients, message))
+
+
+class EmailQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*', QueueTestEmailSender])
+        config = self.env.config
+        config.set('notification', 'email_sender', 'QueueTestEmailSender')
+        config.set('notification', 'use_email_queue', 'enabled')
+        config.set('notification', 'email_queue_workers', '0')
+        config.set('notification', 'email_queue_retries', '3')
+        self.notifysys = NotificationSystem(self.env)
+        self.sender = self.notifysys.email_sender
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _queue(self):
+        return self.env.db_query("""
+            SELECT id, attempts, next_attempt, error FROM notify_queue
+            ORDER BY id""")
+
+    def _make_due(self):
+        self.env.db_transaction("UPDATE notify_queue SET next_attempt=0")
+
+    def test_send_email_is_queued(self):
+        self.notifysys.send_email('trac@example.org',
+                                  ['joe@example.org', 'jim@example.org'],
+                                  'Subject: Test\r\n\r\nBody \xc3\xa9')
+        self.assertEqual([], self.sender.history)
+        self.assertEqual(1, len(self._queue()))
+
+        self.assertEqual((1, 0), self.notifysys.send_queued_emails())
+        self.assertEqual([('trac@example.org',
+                           ['joe@example.org', 'jim@example.org'],
+                           'Subject: Test\r\n\r\nBody \xc3\xa9')],
+                         self.sender.history)
+        self.assertEqual([], self._queue())
+
+    def test_send_email_not_queued(self):
+        self.env.config.set('notification', 'use_email_queue', 'disabled')
+        self.notifysys.send_email('trac@example.org', ['joe@example.org'],
+                                  'Subject: Test')
+        self.assertEqual(1, len(self.sender.history))
+        self.assertEqual([], self._queue())
+
+    def test_send_queued_emails_limit(self):
+        for idx in xrange(3):
+            self.notifysys.enqueue_email('trac@example.org',
+                                         ['joe@example.org'],
+                                         'Subject: %d' % idx)
+        self.assertEqual((2, 0), self.notifysys.send_queued_emails(limit=2))
+        self.assertEqual(['Subject: 0', 'Subject: 1'],
+                         [h[2] for h in self.sender.history])
+        self.assertEqual((1, 0), self.notifysys.send_queued_emails())
+        self.assertEqual((0, 0), self.notifysys.send_queued_emails())
+
+    def test_retry_with_backoff(self):
+        id = self.notifysys.enqueue_email('trac@example.org',
+                                          ['joe@example.org'], 'Subject: X')
+        self.sender.fail = True
+        self.assertEqual((0, 1), self.notifysys.send_queued_emails())
+        (id_, attempts, next_attempt1, error), = self._queue()
+        self.assertEqual((id, 1, u'IOError: Connection refused'),
+                         (id_, attempts, error))
+        # Not due yet
+        self.assertEqual((0, 0), self.notifysys.send_queued_emails())
+
+        self._make_due()
+        self.assertEqual((0, 1), self.notifysys.send_queued_emails())
+        (id_, attempts, next_attempt2, error), = self._queue()
+        self.assertEqual(2, attempts)
+
+        self.sender.fail = False
+        self._make_due()
+        self.assertEqual((1, 0), self.notifysys.send_queued_emails())
+        self.assertEqual([], self._queue())
+        self.assertEqual(1, len(self.sender.history))
+
+    def test_discard_after_retries(self):
+        self.notifysys.enqueue_email('trac@example.org', ['joe@example.org'],
+                                     'Subject: X')
+        self.sender.fail = True
+        for idx in xrange(3):
+            self._make_due()
+            self.assertEqual((0, 1), self.notifysys.send_queued_emails())
+        self.assertEqual([], self._queue())
+
+    def test_claimed_email_not_sent_twice(self):
+        id = self.notifysys.enqueue_email('trac@example.org',
+                                          ['joe@example.org'], 'Subject: X')
+        (id_, attempts, next_attempt, error), = self._queue()
+        self.assertIsNotNone(
+            self.notifysys._claim_queued_email(id, next_attempt))
+        self.assertIsNone(
+            self.notifysys._claim_queued_email(id, next_attempt))
+        self.assertEqual((0, 0), self.notifysys.send_queued_emails())
+
+    def test_workers_started_by_first_request(self):
+        self.assertIsNone(self.notifysys._queue_workers)
+        self.notifysys.pre_process_request(None, None)
+        self.assertEqual([], self.notifysys._queue_workers)
+
+    def test_workers_not_started_by_enqueue_email(self):
+        self.env.config.set('notification', 'email_queue_workers', '1')
+        self.notifysys.enqueue_email('trac@example.org', ['joe@example.org'],
+                                     'Subject: X')
+        self.assertIsNone(self.notifysys._queue_workers)
+        self.assertEqual(1, len(self._queue()))
+
+    def test_workers_not_started_without_queue(self):
+        self.env.config.set('notification', 'use_email_queue', 'disabled')
+        self.notifysys.pre_process_request(None, None)
+        self.assertIsNone(self.notifysys._queue_workers)
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(ParseSubscriberConfigTestCase))
+    suite.addTest(unittest.makeSuite(EmailQueueTestCase))
     return suite
 
 
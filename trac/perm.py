@@ -20,15 +20,17 @@ from __future__ import print_function
 
 import csv
 import os
-from itertools import groupby
+from itertools import groupby, izip
 from time import time
 
 from trac.admin import AdminCommandError, IAdminCommandProvider, get_dir_list
 from trac.cache import cached
-from trac.config import ExtensionOption, OrderedExtensionsOption
+from trac.config import ExtensionOption, IntOption, OrderedExtensionsOption
 from trac.core import *
 from trac.resource import Resource, get_resource_name
 from trac.util import file_or_std
+from trac.util.compat import OrderedDict
+from trac.util.concurrency import ThreadLocal, threading
 from trac.util.text import path_to_unicode, print_table, printout, \
                            stream_encoding, to_unicode, wrap
 from trac.util.translation import _, N_
@@ -163,6 +165,33 @@ class IPermissionPolicy(Interface):
         Note that performing permission checks on realm resources may seem
         redundant for now as the action name itself contains the realm, but
         this will probably change in the future (e.g. `'VIEW' in ...`).
+
+        A policy can set a `cacheable` attribute to `True` to allow its
+        decisions to be reused by later requests. Its decisions must then
+        only depend on the arguments, on the permissions of the permission
+        store and on state whose changes invalidate the
+        `PermissionDecisionCache`.
+        """
+
+    def check_permissions_bulk(action, username, resources, perm):
+        """Check that the action can be performed by username on each
+        of the resources.
+
+        This method is optional. When implemented, it is used instead of
+        `check_permission` for deciding on many resources at once, for
+        example when filtering the tickets of a query, and can share the
+        work between the resources.
+
+        :param resources: a list of resources
+        :param perm: the permission cache for that username, which can be
+                     called with a resource for doing secondary checks on
+                     other permissions.
+
+        :return: a list containing the decision on each resource, with
+                 the same meaning as the value returned by
+                 `check_permission`.
+
+        :since: 1.2
         """
 
 
@@ -243,6 +272,7 @@ class DefaultPermissionStore(Component):
 
         # Invalidate cached property
         del self._all_permissions
+        PermissionDecisionCache(self.env).invalidate()
 
     def revoke_permission(self, username, action):
         """Revokes a users' permission to perform the specified action."""
@@ -253,6 +283,7 @@ class DefaultPermissionStore(Component):
 
         # Invalidate cached property
         del self._all_permissions
+        PermissionDecisionCache(self.env).invalidate()
 
 
 class DefaultPermissionGroupProvider(Component):
@@ -275,33 +306,13 @@ class DefaultPermissionPolicy(Component):
 
     implements(IPermissionPolicy)
 
-    # Number of seconds a cached user permission set is valid for.
-    CACHE_EXPIRY = 5
-    # How frequently to clear the entire permission cache
-    CACHE_REAP_TIME = 60
-
-    def __init__(self):
-        self.permission_cache = {}
-        self.last_reap = time()
+    cacheable = True
 
     # IPermissionPolicy methods
 
     def check_permission(self, action, username, resource, perm):
-        now = time()
-
-        if now - self.last_reap > self.CACHE_REAP_TIME:
-            self.permission_cache = {}
-            self.last_reap = time()
-
-        timestamp, permissions = self.permission_cache.get(username, (0, None))
-
-        # Cache hit?
-        if now - timestamp > self.CACHE_EXPIRY:
-            # No, pull permissions from database.
-            permissions = PermissionSystem(self.env). \
-                          get_user_permissions(username)
-            self.permission_cache[username] = (now, permissions)
-
+        permissions = PermissionSystem(self.env). \
+                      get_user_permissions(username)
         return action in permissions or None
 
 
@@ -335,6 +346,7 @@ class PermissionSystem(Component):
     def __init__(self):
         self.permission_cache = {}
         self.last_reap = time()
+        self._check_state = ThreadLocal(cacheable=True)
 
     # Public API
 
@@ -345,11 +357,13 @@ class PermissionSystem(Component):
             raise TracError(_('%(name)s is not a valid action.', name=action))
 
         self.store.grant_permission(username, action)
+        PermissionDecisionCache(self.env).invalidate()
 
     def revoke_permission(self, username, action):
         """Revokes the permission of the specified user to perform an
         action."""
         self.store.revoke_permission(username, action)
+        PermissionDecisionCache(self.env).invalidate()
 
     def get_actions_dict(self):
         """Get all actions from permission requestors as a `dict`.
@@ -418,6 +432,11 @@ class PermissionSystem(Component):
             return dict.fromkeys(self.get_actions(), True)
 
         # Return all permissions that the given user has
+        cache = PermissionDecisionCache(self.env)
+        key = ('permissions', username)
+        permissions = cache.get(key)
+        if permissions is not None:
+            return dict(permissions)
         actions = self.get_actions_dict()
         permissions = {}
         def expand_meta(action):
@@ -427,6 +446,7 @@ class PermissionSystem(Component):
                     expand_meta(a)
         for perm in self.store.get_user_permissions(username) or []:
             expand_meta(perm)
+        cache.set(key, dict(permissions))
         return permissions
 
     def get_all_permissions(self):
@@ -484,11 +504,107 @@ class PermissionSystem(Component):
                          perm=None):
         """Return True if permission to perform action for the given resource
         is allowed."""
+        return self._check_permission(action, username, resource, perm)[0]
+
+    def filter_resources(self, action, username, resources, perm=None):
+        """Return the list of the resources on which the action can be
+        performed by the user.
+
+        The permission policies implementing `check_permissions_bulk`
+        decide on all the resources at once.
+
+        :param resources: an iterable of resources
+        :param perm: the permission cache of the user, which also
+                     remembers the decisions.
+
+        :since: 1.2
+        """
+        if username is None:
+            username = 'anonymous'
+        if perm is None:
+            perm = PermissionCache(self.env, username)
+        resources = [resource if resource and resource.realm is not None
+                     else None for resource in resources]
+        cache = PermissionDecisionCache(self.env)
+        decisions = [None] * len(resources)
+        pending = []
+        for idx, resource in enumerate(resources):
+            key = (username, hash(resource), action)
+            cached = perm._cache.get(key)
+            if cached and cached[1] == resource:
+                if not cached[2]:
+                    self._reuse_uncacheable_decision()
+                decisions[idx] = cached[0]
+                continue
+            decision = cache.get(('decision', username, action,
+                                  _resource_key(resource)))
+            if decision is not None:
+                perm._cache[key] = (decision, resource, True)
+                decisions[idx] = decision
+            else:
+                pending.append(idx)
+
+        if pending:
+            state = self._check_state
+            outer_cacheable = state.cacheable
+            state.cacheable = True
+            try:
+                undecided = self._apply_policies_bulk(action, username,
+                                                      resources, perm,
+                                                      state, decisions,
+                                                      pending)
+            finally:
+                cacheable = state.cacheable
+                state.cacheable = outer_cacheable and cacheable
+            for idx in undecided:
+                decisions[idx] = False
+            if undecided:
+                self.log.debug("No policy allowed %s performing %s on %d "
+                               "resources", username, action, len(undecided))
+            for idx in pending:
+                resource = resources[idx]
+                decision = decisions[idx]
+                perm._cache[(username, hash(resource), action)] = \
+                    (decision, resource, cacheable)
+                if cacheable:
+                    cache.set(('decision', username, action,
+                               _resource_key(resource)), decision)
+
+        return [resource for resource, decision in izip(resources, decisions)
+                if decision]
+
+    def _check_permission(self, action, username, resource, perm):
+        """Return a `(decision, cacheable)` tuple, where `cacheable`
+        tells whether the decision can be reused by later requests.
+        """
         if username is None:
             username = 'anonymous'
         if resource and resource.realm is None:
             resource = None
+        cache = PermissionDecisionCache(self.env)
+        key = ('decision', username, action, _resource_key(resource))
+        decision = cache.get(key)
+        if decision is not None:
+            return decision, True
+        # Secondary checks done by the policies through `perm` clear the
+        # flag when their own decision isn't cacheable
+        state = self._check_state
+        outer_cacheable = state.cacheable
+        state.cacheable = True
+        try:
+            decision = self._apply_policies(action, username, resource,
+                                            perm, state)
+        finally:
+            cacheable = state.cacheable
+            state.cacheable = outer_cacheable and cacheable
+        if cacheable:
+            cache.set(key, decision)
+        return decision, cacheable
+
+    def _apply_policies(self, action, username, resource, perm, state):
         for policy in self.policies:
+            if not getattr(policy, 'cacheable', False):
+                state.cacheable = False
             decision = policy.check_permission(action, username, resource,
                                                perm)
             if decision is not None:
@@ -501,6 +617,48 @@ class PermissionSystem(Component):
                        username, action, resource)
         return False
 
+    def _apply_policies_bulk(self, action, username, resources, perm, state,
+                             decisions, pending):
+        """Store in `decisions` the decisions on the resources at the
+        `pending` indexes, and return the indexes of the resources on
+        which no policy decided.
+        """
+        for policy in self.policies:
+            if not pending:
+                break
+            if not getattr(policy, 'cacheable', False):
+                state.cacheable = False
+            batch = [resources[idx] for idx in pending]
+            if hasattr(policy, 'check_permissions_bulk'):
+                results = policy.check_permissions_bulk(action, username,
+                                                        batch, perm)
+            else:
+                results = [policy.check_permission(
+                               action, username, resource,
+                               perm(resource) if resource else perm)
+                           for resource in batch]
+            undecided = []
+            denied = 0
+            for idx, decision in izip(pending, results):
+                if decision is None:
+                    undecided.append(idx)
+                else:
+                    decisions[idx] = decision
+                    if decision is False:
+                        denied += 1
+            if denied:
+                self.log.debug("%s denies %s performing %s on %d resources",
+                               policy.__class__.__name__, username, action,
+                               denied)
+            pending = undecided
+        return pending
+
+    def _reuse_uncacheable_decision(self):
+        """Tell that a decision which can't be reused by later requests
+        is reused by the current permission check.
+        """
+        self._check_state.cacheable = False
+
     # IPermissionRequestor methods
 
     def get_permission_actions(self):
@@ -510,6 +668,82 @@ class PermissionSystem(Component):
         return [('TRAC_ADMIN', actions)]
 
 
+class PermissionDecisionCache(Component):
+    """Cache of the permission decisions and of the permissions of the
+    users, shared by the requests handled by the process.
+
+    Only the decisions of the policies declaring themselves `cacheable`
+    are cached. The cache is invalidated in all processes when a
+    permission is granted or revoked, and by the cacheable policies when
+    the state their decisions depend on changes. Entries expire after
+    `[trac] permission_cache_lifetime` seconds so that changes made
+    outside of Trac, for example to the groups of the users, are
+    eventually taken into account.
+    """
+
+    lifetime = IntOption('trac', 'permission_cache_lifetime', 60,
+        """Number of seconds during which the permission decisions and
+        the permissions of the users are reused by later requests. Set to
+        0 to disable the cache. (''since 1.2'')""")
+
+    max_entries = 10000
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @cached
+    def _generation(self):
+        return object()
+
+    def get(self, key):
+        """Return the value cached for `key`, or `None` if not cached."""
+        if self.lifetime <= 0:
+            return None
+        generation = self._generation
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            entry_generation, created, value = entry
+            if entry_generation is not generation or \
+                    time() - created > self.lifetime:
+                return None
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value):
+        """Cache `value` for `key`."""
+        if self.lifetime <= 0:
+            return
+        generation = self._generation
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (generation, time(), value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """Invalidate the cache in all processes, as well as the
+        rendered wiki texts, whose links depend on the permissions, and
+        the cached timeline events, which are filtered by permission.
+        """
+        from trac.timeline.web_ui import TimelineEventCache
+        from trac.wiki.formatter import WikiRenderCache
+        del self._generation
+        WikiRenderCache(self.env).invalidate('permission')
+        TimelineEventCache(self.env).invalidate()
+
+
+def _resource_key(resource):
+    """Return a hashable key identifying `resource` and its parents."""
+    key = ()
+    while resource:
+        key += (resource.realm, resource.id, resource.version)
+        resource = resource.parent
+    return key
+
+
 class PermissionCache(object):
     """Cache that maintains the permissions of a single user.
 
@@ -585,20 +819,31 @@ class PermissionCache(object):
         key = (self.username, hash(resource), action)
         cached = self._cache.get(key)
         if cached:
-            cache_decision, cache_resource = cached
+            cache_decision, cache_resource, cacheable = cached
             if resource == cache_resource:
+                if not cacheable:
+                    PermissionSystem(self.env)._reuse_uncacheable_decision()
                 return cache_decision
         perm = self
         if resource is not self._resource:
             perm = PermissionCache(self.env, self.username, resource,
                                    self._cache)
-        decision = PermissionSystem(self.env). \
-                   check_permission(action, perm.username, resource, perm)
-        self._cache[key] = (decision, resource)
+        decision, cacheable = PermissionSystem(self.env). \
+            _check_permission(action, perm.username, resource, perm)
+        self._cache[key] = (decision, resource, cacheable)
         return decision
 
     __contains__ = has_permission
 
+    def filter(self, action, resources):
+        """Return the list of the resources on which the action can be
+        performed.
+
+        :since: 1.2
+        """
+        return PermissionSystem(self.env).filter_resources(
+            action, self.username, resources, self)
+
     def require(self, action, realm_or_resource=None, id=False, version=False,
                 message=None):
         resource = self._normalize_resource(realm_or_resource, id, version)
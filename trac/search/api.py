@@ -11,9 +11,13 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/log/.
 
+import heapq
 import re
+from itertools import islice
 
+from trac.config import BoolOption, ExtensionOption
 from trac.core import *
+from trac.util.datefmt import to_utimestamp
 
 
 class ISearchSource(Interface):
@@ -40,6 +44,120 @@ class ISearchSource(Interface):
         `(href, title, date, author, excerpt).`
         """
 
+    def get_ordered_search_results(req, terms, filters, limit):
+        """Return an iterable of the search results matching each
+        search term in `terms`, sorted by decreasing date.
+
+        `limit` is the number of results needed by the caller, or
+        `None` if all the results are needed. The source should fetch
+        the results lazily, e.g. by batches of `limit` rows, as the
+        caller stops iterating once it has enough results.
+
+        This method is optional. The results of the sources which don't
+        implement it are retrieved with `get_search_results` and sorted.
+
+        :since 1.2:
+        """
+
+
+class ISearchIndexer(Interface):
+    """Extension point interface for full-text search index backends.
+
+    Documents are identified by a `(realm, id)` pair, where `id` is a
+    string. The backend only stores enough information to find and
+    rank the documents; search sources render the results themselves.
+
+    :since 1.2:
+    """
+
+    def add_document(realm, id, texts):
+        """Add or replace the document `(realm, id)` in the index.
+
+        `texts` is an iterable of strings holding the searchable
+        content of the document.
+        """
+
+    def remove_document(realm, id):
+        """Remove the document `(realm, id)` from the index."""
+
+    def clear(realm=None):
+        """Remove all the documents of `realm` from the index, or all
+        documents if `realm` is `None`.
+        """
+
+    def query(terms, realms):
+        """Return an iterable of `(realm, id, score)` tuples for the
+        documents of the given `realms` matching all the search `terms`.
+
+        The order of the returned tuples is not significant.
+        """
+
+
+class SearchIndex(Component):
+    """Front-end to the full-text search index.
+
+    Search sources use this component to find matching documents
+    without scanning their tables, when the index is enabled.
+
+    :since 1.2:
+    """
+
+    use_index = BoolOption('search', 'use_index', 'false',
+        """Use the full-text search index instead of scanning the
+        database tables for each search. The index matches words
+        starting with the search terms rather than arbitrary
+        substrings. After enabling the index, it must be built once
+        with `trac-admin $ENV search reindex`; it is then kept up to
+        date as resources are changed. Changesets are indexed when the
+        repository hooks call `trac-admin $ENV changeset added`.
+        (''since 1.2'')""")
+
+    indexer = ExtensionOption('search', 'indexer', ISearchIndexer,
+                              'DefaultSearchIndexer',
+        """Name of the component implementing `ISearchIndexer`, which
+        stores the full-text search index. (''since 1.2'')""")
+
+    @property
+    def enabled(self):
+        """Whether the search index is enabled."""
+        return self.use_index
+
+    def add_document(self, realm, id, texts):
+        """Add or replace a document in the index, if enabled."""
+        if self.use_index:
+            self.indexer.add_document(realm, unicode(id), texts)
+
+    def remove_document(self, realm, id):
+        """Remove a document from the index, if enabled."""
+        if self.use_index:
+            self.indexer.remove_document(realm, unicode(id))
+
+    def clear(self, realm=None):
+        """Remove all documents of `realm`, or all documents."""
+        self.indexer.clear(realm)
+
+    def search(self, terms, realms):
+        """Return a list of `(realm, id, score)` tuples of the
+        documents matching all the search `terms`, ranked by
+        decreasing score.
+        """
+        if isinstance(realms, basestring):
+            realms = [realms]
+        return sorted(self.indexer.query(terms, realms),
+                      key=lambda r: (-r[2], r[0], r[1]))
+
+
+def tokenize_search_text(text):
+    """Split `text` into the lowercase words stored in the full-text
+    search index.
+
+    >>> tokenize_search_text(u'Fix #123: the WikiFormatter crash')
+    [u'fix', u'123', u'the', u'wikiformatter', u'crash']
+    """
+    return [word[:64] for word in _word_re.findall(text.lower())]
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+
 
 def search_to_sql(db, columns, terms):
     """Convert a search query into an SQL WHERE clause and corresponding
@@ -63,6 +181,49 @@ def search_to_regexps(terms):
     return [re.compile(re.escape(term)) for term in terms]
 
 
+def fetch_ordered_rows(env, sql, args, limit=None):
+    """Yield the rows returned by the query `sql`, which must end with
+    an `ORDER BY` clause.
+
+    When `limit` is given, the rows are fetched by batches of `limit`
+    rows, so that further batches are only queried when the previous
+    ones have been consumed. Each batch is fetched with its own
+    connection, so the generator can be consumed lazily.
+
+    :since 1.2:
+    """
+    if not limit:
+        for row in env.db_query(sql, args):
+            yield row
+        return
+    offset = 0
+    while True:
+        rows = env.db_query(sql + " LIMIT %s OFFSET %s",
+                            tuple(args) + (limit, offset))
+        for row in rows:
+            yield row
+        if len(rows) < limit:
+            break
+        offset += limit
+
+
+def merge_search_results(iterables, limit=None):
+    """Merge iterables of search results sorted by decreasing date into
+    a single iterator of results sorted by decreasing date.
+
+    The iterables are only consumed as far as needed for producing at
+    most `limit` results.
+
+    :since 1.2:
+    """
+    def decorate(idx, results):
+        for seq, result in enumerate(results):
+            yield -to_utimestamp(result[2]), idx, seq, result
+    merged = heapq.merge(*[decorate(idx, results or [])
+                           for idx, results in enumerate(iterables)])
+    return (item[3] for item in islice(merged, limit))
+
+
 def shorten_result(text='', keywords=[], maxlen=240, fuzz=60):
     if not text:
         text = ''
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import sys
+
+from trac.admin import AdminCommandError, IAdminCommandProvider
+from trac.attachment import IAttachmentChangeListener
+from trac.core import *
+from trac.search.api import ISearchIndexer, SearchIndex, \
+                            tokenize_search_text
+from trac.ticket.api import IMilestoneChangeListener, ITicketChangeListener
+from trac.util.text import printout
+from trac.util.translation import _, ngettext
+from trac.versioncontrol.api import IRepositoryChangeListener, \
+                                    RepositoryManager
+from trac.versioncontrol.cache import CachedRepository
+from trac.wiki.api import IWikiChangeListener
+
+
+def attachment_document_id(parent_realm, parent_id, filename):
+    """Return the identifier of an attachment in the search index, of
+    the form `parent_realm:parent_id/filename`.
+    """
+    return u'%s:%s/%s' % (parent_realm, parent_id, filename)
+
+
+class DefaultSearchIndexer(Component):
+    """Inverted index of words stored in the `search_index` table.
+
+    Each row associates a word with a document and the number of
+    occurrences of the word in the document, which is used as the
+    score of the document for that word.
+    """
+
+    implements(ISearchIndexer)
+
+    # ISearchIndexer methods
+
+    def add_document(self, realm, id, texts):
+        weights = {}
+        for text in texts:
+            for word in tokenize_search_text(text or ''):
+                weights[word] = weights.get(word, 0) + 1
+        with self.env.db_transaction as db:
+            db("DELETE FROM search_index WHERE realm=%s AND id=%s",
+               (realm, id))
+            db.executemany("""
+                INSERT INTO search_index (realm,id,term,weight)
+                VALUES (%s,%s,%s,%s)
+                """, [(realm, id, word, weight)
+                      for word, weight in weights.iteritems()])
+
+    def remove_document(self, realm, id):
+        self.env.db_transaction(
+            "DELETE FROM search_index WHERE realm=%s AND id=%s", (realm, id))
+
+    def clear(self, realm=None):
+        if realm is None:
+            self.env.db_transaction("DELETE FROM search_index")
+        else:
+            self.env.db_transaction(
+                "DELETE FROM search_index WHERE realm=%s", (realm,))
+
+    def query(self, terms, realms):
+        words = set()
+        for term in terms:
+            words.update(tokenize_search_text(term))
+        if not words or not realms:
+            return []
+        matches = None
+        with self.env.db_query as db:
+            for word in words:
+                scores = {}
+                for realm, id, score in db("""
+                        SELECT realm, id, SUM(weight) FROM search_index
+                        WHERE term %s AND realm IN (%s)
+                        GROUP BY realm, id
+                        """ % (db.prefix_match(),
+                               ','.join(('%s',) * len(realms))),
+                        [db.prefix_match_value(word)] + list(realms)):
+                    key = (realm, id)
+                    if matches is None or key in matches:
+                        scores[key] = score + (matches or {}).get(key, 0)
+                matches = scores
+                if not matches:
+                    break
+        return [(realm, id, score)
+                for (realm, id), score in matches.iteritems()]
+
+
+class SearchIndexUpdater(Component):
+    """Keep the full-text search index up to date and provide the
+    `search reindex` command for rebuilding it.
+    """
+
+    implements(IAdminCommandProvider, IAttachmentChangeListener,
+               IMilestoneChangeListener, IRepositoryChangeListener,
+               ITicketChangeListener, IWikiChangeListener)
+
+    realms = ('ticket', 'wiki', 'milestone', 'changeset', 'attachment')
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('search reindex', '[realm] [...]',
+               """Rebuild the full-text search index
+
+               The index is rebuilt for the given realms (ticket, wiki,
+               milestone, changeset or attachment), or for all of them
+               if no realm is specified. Note that this operation can
+               take a long time to complete.
+               """,
+               self._complete_reindex, self._do_reindex)
+
+    def _complete_reindex(self, args):
+        return self.realms
+
+    def _do_reindex(self, *realms):
+        for realm in realms:
+            if realm not in self.realms:
+                raise AdminCommandError(_("Unknown realm '%(realm)s'",
+                                          realm=realm))
+        index = SearchIndex(self.env)
+        for realm in realms or self.realms:
+            printout(_("Reindexing %(realm)s...", realm=realm))
+            count = 0
+            with self.env.db_transaction:
+                index.clear(realm)
+                for id, texts in getattr(self, '_get_%s_documents' % realm)():
+                    # Stored as unicode, as by `SearchIndex.add_document`
+                    index.indexer.add_document(realm, unicode(id), texts)
+                    count += 1
+                    if count % 100 == 0:
+                        sys.stdout.write(' [%d]\r' % count)
+                        sys.stdout.flush()
+            printout(ngettext("%(num)s document indexed.",
+                              "%(num)s documents indexed.", num=count))
+
+    # IAttachmentChangeListener methods
+
+    def attachment_added(self, attachment):
+        SearchIndex(self.env).add_document('attachment',
+            attachment_document_id(attachment.parent_realm,
+                                   attachment.parent_id, attachment.filename),
+            (attachment.filename, attachment.description, attachment.author))
+
+    def attachment_deleted(self, attachment):
+        SearchIndex(self.env).remove_document('attachment',
+            attachment_document_id(attachment.parent_realm,
+                                   attachment.parent_id, attachment.filename))
+
+    def attachment_reparented(self, attachment, old_parent_realm,
+                              old_parent_id):
+        SearchIndex(self.env).remove_document('attachment',
+            attachment_document_id(old_parent_realm, old_parent_id,
+                                   attachment.filename))
+        self.attachment_added(attachment)
+
+    # IMilestoneChangeListener methods
+
+    def milestone_created(self, milestone):
+        SearchIndex(self.env).add_document('milestone', milestone.name,
+            (milestone.name, milestone.description))
+
+    def milestone_changed(self, milestone, old_values):
+        if 'name' in old_values:
+            SearchIndex(self.env).remove_document('milestone',
+                                                  old_values['name'])
+        self.milestone_created(milestone)
+
+    def milestone_deleted(self, milestone):
+        SearchIndex(self.env).remove_document('milestone', milestone.name)
+
+    # IRepositoryChangeListener methods
+
+    def changeset_added(self, repos, changeset):
+        if isinstance(repos, CachedRepository):
+            SearchIndex(self.env).add_document('changeset',
+                u'%s:%s' % (repos.id, repos.db_rev(changeset.rev)),
+                (changeset.rev, changeset.message, changeset.author))
+
+    def changeset_modified(self, repos, changeset, old_changeset):
+        self.changeset_added(repos, changeset)
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        self._index_ticket(ticket.id)
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        self._index_ticket(ticket.id)
+
+    def ticket_deleted(self, ticket):
+        SearchIndex(self.env).remove_document('ticket', ticket.id)
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        self._index_ticket(ticket.id)
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        self._index_ticket(ticket.id)
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        self._index_wiki_page(page.name)
+
+    def wiki_page_changed(self, page, version, t, comment, author, ipnr):
+        self._index_wiki_page(page.name)
+
+    def wiki_page_deleted(self, page):
+        SearchIndex(self.env).remove_document('wiki', page.name)
+
+    def wiki_page_version_deleted(self, page):
+        self._index_wiki_page(page.name)
+
+    def wiki_page_renamed(self, page, old_name):
+        SearchIndex(self.env).remove_document('wiki', old_name)
+        self._index_wiki_page(page.name)
+
+    def wiki_page_comment_modified(self, page, old_comment):
+        pass
+
+    # Internal methods
+
+    def _index_ticket(self, id):
+        index = SearchIndex(self.env)
+        if index.enabled:
+            for id, texts in self._get_ticket_documents(id):
+                index.add_document('ticket', id, texts)
+
+    def _index_wiki_page(self, name):
+        index = SearchIndex(self.env)
+        if index.enabled:
+            for name, texts in self._get_wiki_documents(name):
+                index.add_document('wiki', name, texts)
+
+    def _get_ticket_documents(self, id=None):
+        if id is None:
+            change_where = custom_where = ticket_where = ''
+            args = ()
+        else:
+            change_where = " AND ticket=%s"
+            custom_where = " WHERE ticket=%s"
+            ticket_where = " WHERE id=%s"
+            args = (id,)
+        with self.env.db_query as db:
+            extra = {}
+            for tid, value in db("""
+                    SELECT ticket, newvalue FROM ticket_change
+                    WHERE field='comment'""" + change_where, args):
+                extra.setdefault(tid, []).append(value)
+            for tid, value in db("""
+                    SELECT ticket, value FROM ticket_custom""" + custom_where,
+                    args):
+                extra.setdefault(tid, []).append(value)
+            for row in db("""
+                    SELECT id, summary, keywords, description, reporter, cc
+                    FROM ticket""" + ticket_where, args):
+                tid = row[0]
+                yield tid, [unicode(tid)] + list(row[1:]) + \
+                           extra.get(tid, [])
+
+    def _get_wiki_documents(self, name=None):
+        where = ' AND w1.name=%s' if name is not None else ''
+        args = (name,) if name is not None else ()
+        for name, author, text in self.env.db_query("""
+                SELECT w1.name, w1.author, w1.text
+                FROM wiki w1, (SELECT name, max(version) AS ver
+                               FROM wiki GROUP BY name) w2
+                WHERE w1.version = w2.ver AND w1.name = w2.name%s
+                """ % where, args):
+            yield name, (name, author, text)
+
+    def _get_milestone_documents(self):
+        for name, description in self.env.db_query("""
+                SELECT name, description FROM milestone"""):
+            yield name, (name, description)
+
+    def _get_changeset_documents(self):
+        repositories = dict((repos.id, repos) for repos
+                            in RepositoryManager(self.env)
+                                              .get_real_repositories()
+                            if isinstance(repos, CachedRepository))
+        for id, rev, author, message in self.env.db_query("""
+                SELECT repos, rev, author, message FROM revision"""):
+            repos = repositories.get(id)
+            if repos is not None:
+                yield (u'%s:%s' % (id, rev),
+                       (repos.rev_db(rev), message, author))
+
+    def _get_attachment_documents(self):
+        for type, id, filename, description, author in self.env.db_query("""
+                SELECT type, id, filename, description, author
+                FROM attachment"""):
+            yield (attachment_document_id(type, id, filename),
+                   (filename, description, author))
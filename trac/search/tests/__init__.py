@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import unittest
+
+from trac.search.tests import index, web_ui
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(index.suite())
+    suite.addTest(web_ui.suite())
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
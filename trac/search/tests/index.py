@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from trac.attachment import Attachment, AttachmentModule
+from trac.resource import Resource
+from trac.search.api import SearchIndex, tokenize_search_text
+from trac.search.index import DefaultSearchIndexer, SearchIndexUpdater
+from trac.test import EnvironmentStub, Mock, MockPerm
+from trac.ticket.model import Milestone, Ticket
+from trac.ticket.roadmap import MilestoneModule
+from trac.ticket.web_ui import TicketModule
+from trac.web.href import Href
+from trac.wiki.model import WikiPage
+from trac.wiki.web_ui import WikiModule
+
+
+class TokenizeSearchTextTestCase(unittest.TestCase):
+
+    def test_words_are_lowercased(self):
+        self.assertEqual([u'fix', u'123', u'the', u'crash'],
+                         tokenize_search_text(u'Fix #123: the CRASH.'))
+
+    def test_unicode_words(self):
+        self.assertEqual([u'éléphant', u'größe'],
+                         tokenize_search_text(u'Éléphant, Größe'))
+
+
+class DefaultSearchIndexerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*'])
+        self.env.config.set('search', 'use_index', 'enabled')
+        self.index = SearchIndex(self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_default_indexer(self):
+        self.assertIsInstance(self.index.indexer, DefaultSearchIndexer)
+
+    def test_all_terms_must_match(self):
+        self.index.add_document('wiki', 'A', ['foo bar', 'baz'])
+        self.index.add_document('wiki', 'B', ['foo'])
+        self.assertEqual([('wiki', 'A')],
+                         [r[:2] for r in self.index.search(['foo', 'baz'],
+                                                           'wiki')])
+
+    def test_prefix_match(self):
+        self.index.add_document('wiki', 'A', ['formatter'])
+        self.assertEqual([('wiki', 'A')],
+                         [r[:2] for r in self.index.search(['Format'],
+                                                           'wiki')])
+        self.assertEqual([], self.index.search(['matter'], 'wiki'))
+
+    def test_ranking(self):
+        self.index.add_document('wiki', 'A', ['foo'])
+        self.index.add_document('wiki', 'B', ['foo foo foo'])
+        self.index.add_document('wiki', 'C', ['foo foo'])
+        self.index.add_document('ticket', '1', ['foo foo foo foo'])
+        self.assertEqual([('wiki', 'B', 3), ('wiki', 'C', 2),
+                          ('wiki', 'A', 1)],
+                         self.index.search(['foo'], 'wiki'))
+        self.assertEqual(('ticket', '1', 4),
+                         self.index.search(['foo'], ['wiki', 'ticket'])[0])
+
+    def test_replace_and_remove_document(self):
+        self.index.add_document('wiki', 'A', ['foo'])
+        self.index.add_document('wiki', 'A', ['bar'])
+        self.assertEqual([], self.index.search(['foo'], 'wiki'))
+        self.assertEqual(1, len(self.index.search(['bar'], 'wiki')))
+        self.index.remove_document('wiki', 'A')
+        self.assertEqual([], self.index.search(['bar'], 'wiki'))
+
+    def test_disabled_index_is_not_updated(self):
+        self.env.config.set('search', 'use_index', 'disabled')
+        self.index.add_document('wiki', 'A', ['foo'])
+        self.assertEqual(
+            [], self.env.db_query("SELECT * FROM search_index"))
+
+
+class SearchIndexUpdaterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True, enable=['trac.*'],
+                                   path=tempfile.mkdtemp())
+        self.env.config.set('search', 'use_index', 'enabled')
+        self.index = SearchIndex(self.env)
+        self.req = Mock(href=Href('/trac'), perm=MockPerm(),
+                        authname='anonymous', tz=None, locale=None)
+
+    def tearDown(self):
+        self.env.reset_db()
+        shutil.rmtree(self.env.path)
+
+    def _search(self, terms, realm):
+        return [r[1] for r in self.index.search(terms, realm)]
+
+    def _insert_ticket(self, **kwargs):
+        ticket = Ticket(self.env)
+        for name, value in kwargs.iteritems():
+            ticket[name] = value
+        ticket.insert()
+        return ticket
+
+    def test_ticket_changes_are_indexed(self):
+        ticket = self._insert_ticket(summary='Broken formatter',
+                                     reporter='joe')
+        self.assertEqual([unicode(ticket.id)],
+                         self._search(['formatter'], 'ticket'))
+        ticket.save_changes('jane', 'Fixed in trunk')
+        self.assertEqual([unicode(ticket.id)],
+                         self._search(['trunk', 'broken'], 'ticket'))
+        ticket.delete()
+        self.assertEqual([], self._search(['formatter'], 'ticket'))
+
+    def test_wiki_changes_are_indexed(self):
+        page = WikiPage(self.env, 'SandBox')
+        page.text = 'Playground for new users'
+        page.save('joe', 'Created')
+        self.assertEqual(['SandBox'], self._search(['playground'], 'wiki'))
+        page.rename('PlayGround')
+        self.assertEqual(['PlayGround'], self._search(['playground'], 'wiki'))
+        page.delete()
+        self.assertEqual([], self._search(['playground'], 'wiki'))
+
+    def test_milestone_changes_are_indexed(self):
+        milestone = Milestone(self.env)
+        milestone.name = 'release-1.0'
+        milestone.description = 'First stable release'
+        milestone.insert()
+        self.assertEqual(['release-1.0'], self._search(['stable'],
+                                                       'milestone'))
+        milestone.name = 'release-1.1'
+        milestone.update()
+        self.assertEqual(['release-1.1'], self._search(['stable'],
+                                                       'milestone'))
+
+    def test_reindex(self):
+        self.env.config.set('search', 'use_index', 'disabled')
+        ticket = self._insert_ticket(summary='Broken formatter',
+                                     reporter='joe')
+        self.assertEqual([], self._search(['formatter'], 'ticket'))
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            SearchIndexUpdater(self.env)._do_reindex('ticket')
+        finally:
+            sys.stdout = stdout
+        self.assertEqual([unicode(ticket.id)],
+                         self._search(['formatter'], 'ticket'))
+
+    def test_reindex_stores_ids_as_listeners(self):
+        indexer = self.index.indexer
+        added = []
+        add_document = indexer.add_document
+        def record(realm, id, texts):
+            added.append(id)
+            add_document(realm, id, texts)
+        indexer.add_document = record
+        ticket = self._insert_ticket(summary='Broken formatter',
+                                     reporter='joe')
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            SearchIndexUpdater(self.env)._do_reindex('ticket')
+        finally:
+            sys.stdout = stdout
+        self.assertEqual([unicode(ticket.id)] * 2, added)
+        self.assertEqual([unicode], [type(id) for id in set(added)])
+
+    def test_ticket_search_results(self):
+        self._insert_ticket(summary='Broken formatter', reporter='joe')
+        self._insert_ticket(summary='Broken parser', reporter='joe')
+        results = list(TicketModule(self.env).get_search_results(
+            self.req, ['broken', 'parser'], ['ticket']))
+        self.assertEqual(1, len(results))
+        self.assertEqual('/trac/ticket/2', results[0][0])
+
+    def test_ticket_search_results_fetched_by_chunks(self):
+        for idx in xrange(250):
+            self._insert_ticket(summary='Ticket %d' % idx, reporter='joe')
+        results = list(TicketModule(self.env).get_search_results(
+            self.req, ['ticket'], ['ticket']))
+        self.assertEqual(250, len(results))
+
+    def test_attachment_search_results(self):
+        for idx in xrange(3):
+            self._insert_ticket(summary='Ticket %d' % idx)
+        for id, filename, description in ((1, 'a.txt', 'Crash log'),
+                                          (1, 'b.txt', 'Screenshot'),
+                                          (2, 'c.txt', 'Crash dump'),
+                                          (3, 'd.txt', 'Crash trace')):
+            attachment = Attachment(self.env, 'ticket', id)
+            attachment.description = description
+            attachment.insert(filename, StringIO(''), 0)
+        Attachment(self.env, 'milestone', 'milestone1').insert(
+            'crash.txt', StringIO(''), 0)
+        results = list(AttachmentModule(self.env).get_search_results(
+            self.req, Resource('ticket'), ['crash']))
+        self.assertEqual(['/trac/attachment/ticket/1/a.txt',
+                          '/trac/attachment/ticket/2/c.txt',
+                          '/trac/attachment/ticket/3/d.txt'],
+                         sorted(r[0] for r in results))
+
+    def test_wiki_search_results(self):
+        page = WikiPage(self.env, 'SandBox')
+        page.text = 'Playground for new users'
+        page.save('joe', 'Created')
+        results = list(WikiModule(self.env).get_search_results(
+            self.req, ['users'], ['wiki']))
+        self.assertEqual(['/trac/wiki/SandBox'], [r[0] for r in results])
+
+    def test_milestone_search_results(self):
+        milestone = Milestone(self.env)
+        milestone.name = 'release-1.0'
+        milestone.description = 'First stable release'
+        milestone.insert()
+        results = list(MilestoneModule(self.env).get_search_results(
+            self.req, ['stable'], ['milestone']))
+        self.assertEqual(['/trac/milestone/release-1.0'],
+                         [r[0] for r in results])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TokenizeSearchTextTestCase))
+    suite.addTest(unittest.makeSuite(DefaultSearchIndexerTestCase))
+    suite.addTest(unittest.makeSuite(SearchIndexUpdaterTestCase))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from datetime import datetime, timedelta
+import unittest
+
+from trac.core import Component, TracError, implements
+from trac.search.api import ISearchSource, fetch_ordered_rows, \
+                            merge_search_results
+from trac.search.web_ui import SearchModule
+from trac.test import EnvironmentStub, Mock, MockPerm, locale_en
+from trac.util.datefmt import utc
+from trac.wiki.model import WikiPage
+from trac.wiki.web_ui import WikiModule
+
+
+def _result(name, day):
+    return ('/' + name, name,
+            datetime(2016, 1, 1, tzinfo=utc) + timedelta(days=day), 'joe',
+            'excerpt')
+
+
+class OrderedSearchSource(Component):
+
+    implements(ISearchSource)
+
+    count = 30
+    consumed = 0
+
+    def get_search_filters(self, req):
+        yield ('ordered', 'Ordered')
+
+    def get_search_results(self, req, terms, filters):
+        return self.get_ordered_search_results(req, terms, filters, None)
+
+    def get_ordered_search_results(self, req, terms, filters, limit):
+        if 'ordered' not in filters:
+            return
+        for idx in xrange(OrderedSearchSource.count):
+            OrderedSearchSource.consumed += 1
+            yield _result('ordered%d' % idx,
+                          OrderedSearchSource.count - idx)
+
+
+class UnorderedSearchSource(Component):
+
+    implements(ISearchSource)
+
+    def get_search_filters(self, req):
+        yield ('unordered', 'Unordered')
+
+    def get_search_results(self, req, terms, filters):
+        if 'unordered' not in filters:
+            return
+        for day in (3, 1, 5):
+            yield _result('unordered%d' % day, day)
+
+
+class MergeSearchResultsTestCase(unittest.TestCase):
+
+    def test_merge(self):
+        results = merge_search_results([
+            [_result('a', 5), _result('b', 2)],
+            [],
+            [_result('c', 6), _result('d', 2), _result('e', 1)]])
+        self.assertEqual(['c', 'a', 'b', 'd', 'e'],
+                         [result[1] for result in results])
+
+    def test_limit(self):
+        consumed = []
+        def results():
+            for day in xrange(20, 0, -1):
+                consumed.append(day)
+                yield _result('a%d' % day, day)
+        results = merge_search_results([results(), [_result('b', 19)]], 3)
+        self.assertEqual(['a20', 'a19', 'b'],
+                         [result[1] for result in results])
+        self.assertEqual([20, 19, 18], consumed)
+
+
+class FetchOrderedRowsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.env.db_transaction.executemany(
+            "INSERT INTO system (name, value) VALUES (%s, %s)",
+            [('search%02d' % idx, str(idx)) for idx in xrange(7)])
+        self.sql = """SELECT name FROM system WHERE name LIKE 'search%%'
+                      ORDER BY name"""
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_without_limit(self):
+        rows = list(fetch_ordered_rows(self.env, self.sql, ()))
+        self.assertEqual(['search%02d' % idx for idx in xrange(7)],
+                         [row[0] for row in rows])
+
+    def test_fetched_by_batches(self):
+        queries = []
+        def db_query(sql, args):
+            queries.append(args)
+            return self.env.db_query(sql, args)
+        rows = fetch_ordered_rows(Mock(db_query=db_query), self.sql, (), 3)
+        self.assertEqual(['search00', 'search01', 'search02', 'search03'],
+                         [rows.next()[0] for idx in xrange(4)])
+        self.assertEqual([(3, 0), (3, 3)], queries)
+        self.assertEqual(['search04', 'search05', 'search06'],
+                         [row[0] for row in rows])
+        self.assertEqual([(3, 0), (3, 3), (3, 6)], queries)
+
+
+class SearchModuleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True,
+                                   enable=['trac.*', OrderedSearchSource,
+                                           UnorderedSearchSource])
+        self.search_module = SearchModule(self.env)
+        OrderedSearchSource.count = 30
+        OrderedSearchSource.consumed = 0
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _create_request(self, **args):
+        return Mock(args=args, chrome={'links': {}}, href=self.env.href,
+                    path_info='/search', perm=MockPerm(),
+                    authname='anonymous', tz=utc, locale=locale_en,
+                    lc_time=locale_en)
+
+    def test_unordered_source_results_are_sorted(self):
+        req = self._create_request()
+        results = self.search_module._do_search(req, ['term'],
+                                                ['ordered', 'unordered'])
+        names = [result[1] for result in results]
+        self.assertEqual(33, len(names))
+        self.assertEqual(['ordered24', 'ordered25', 'unordered5',
+                          'ordered26', 'ordered27', 'unordered3',
+                          'ordered28', 'ordered29', 'unordered1'],
+                         names[-9:])
+
+    def test_ordered_source_consumed_up_to_limit(self):
+        req = self._create_request()
+        results = list(self.search_module._do_search(req, ['term'],
+                                                     ['ordered'], 11))
+        self.assertEqual(11, len(results))
+        self.assertEqual(11, OrderedSearchSource.consumed)
+
+    def test_exact_number_of_results(self):
+        req = self._create_request(q='term', ordered='on')
+        template, data, content_type = \
+            self.search_module.process_request(req)
+        results = data['results']
+        self.assertFalse(data['more_results'])
+        self.assertEqual(30, results.num_items)
+        self.assertEqual(3, results.num_pages)
+        self.assertEqual(['ordered%d' % idx for idx in xrange(10)],
+                         [result['title'] for result in results])
+
+    def test_more_results_than_counted(self):
+        OrderedSearchSource.count = 1000
+        req = self._create_request(q='term', ordered='on', page='2')
+        template, data, content_type = \
+            self.search_module.process_request(req)
+        results = data['results']
+        self.assertTrue(data['more_results'])
+        self.assertEqual(120, results.num_items)
+        self.assertEqual(121, OrderedSearchSource.consumed)
+        self.assertEqual(['ordered%d' % idx for idx in xrange(10, 20)],
+                         [result['title'] for result in results])
+
+    def test_page_out_of_range(self):
+        req = self._create_request(q='term', ordered='on', page='4')
+        self.assertRaises(TracError, self.search_module.process_request,
+                          req)
+
+    def test_invalid_page_shows_first_page(self):
+        for page in ('0', '-20', 'invalid'):
+            req = self._create_request(q='term', ordered='on', page=page)
+            template, data, content_type = \
+                self.search_module.process_request(req)
+            self.assertEqual(['ordered%d' % idx for idx in xrange(10)],
+                             [result['title'] for result in data['results']])
+
+    def test_wiki_results_ordered_by_date(self):
+        t = datetime(2016, 1, 1, tzinfo=utc)
+        for idx, name in enumerate(['PageA', 'PageB', 'PageC', 'PageD']):
+            page = WikiPage(self.env, name)
+            page.text = 'matching text'
+            page.save('joe', 'created', t=t + timedelta(days=idx % 2 * 2 +
+                                                          idx / 2))
+        req = self._create_request()
+        results = WikiModule(self.env).get_ordered_search_results(
+            req, ['matching'], ['wiki'], 1)
+        self.assertEqual(['/trac.cgi/wiki/PageD', '/trac.cgi/wiki/PageB',
+                          '/trac.cgi/wiki/PageC', '/trac.cgi/wiki/PageA'],
+                         [result[0] for result in results])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(MergeSearchResultsTestCase))
+    suite.addTest(unittest.makeSuite(FetchOrderedRowsTestCase))
+    suite.addTest(unittest.makeSuite(SearchModuleTestCase))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
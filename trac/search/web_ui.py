@@ -16,13 +16,15 @@
 
 import pkg_resources
 import re
+from operator import itemgetter
 
 from genshi.builder import tag
 
 from trac.config import IntOption, ListOption
 from trac.core import *
 from trac.perm import IPermissionRequestor
-from trac.search.api import ISearchSource
+from trac.search.api import ISearchSource, merge_search_results
+from trac.util import as_int
 from trac.util.datefmt import format_datetime, user_time
 from trac.util.html import find_element
 from trac.util.presentation import Paginator
@@ -45,6 +47,9 @@ class SearchModule(Component):
 
     RESULTS_PER_PAGE = 10
 
+    # Number of pages after the current one for which results are fetched
+    LOOKAHEAD_PAGES = 10
+
     min_query_length = IntOption('search', 'min_query_length', 3,
         """Minimum length of query string allowed when performing a search.
         """)
@@ -105,9 +110,13 @@ class SearchModule(Component):
 
             terms = self._parse_query(req, query)
             if terms:
-                results = self._do_search(req, terms, filters)
+                page = as_int(req.args.get('page'), 1, min=1)
+                limit = (page + self.LOOKAHEAD_PAGES) * \
+                        self.RESULTS_PER_PAGE + 1
+                results = list(self._do_search(req, terms, filters, limit))
                 if results:
-                    data.update(self._prepare_results(req, filters, results))
+                    data.update(self._prepare_results(req, filters, results,
+                                                      limit))
 
         add_stylesheet(req, 'common/css/search.css')
         return 'search.html', data, None
@@ -210,16 +219,36 @@ class SearchModule(Component):
                            'Query must be at least %(num)s characters long.',
                            num=self.min_query_length))
 
-    def _do_search(self, req, terms, filters):
-        results = []
+    def _do_search(self, req, terms, filters, limit=None):
+        """Return an iterator over at most `limit` search results of all
+        the sources, sorted by decreasing date.
+        """
+        sources_results = []
         for source in self.search_sources:
-            results.extend(source.get_search_results(req, terms, filters)
-                           or [])
-        return sorted(results, key=lambda x: x[2], reverse=True)
-
-    def _prepare_results(self, req, filters, results):
-        page = int(req.args.get('page', '1'))
-        results = Paginator(results, page - 1, self.RESULTS_PER_PAGE)
+            get_ordered_search_results = \
+                getattr(source, 'get_ordered_search_results', None)
+            if get_ordered_search_results:
+                results = get_ordered_search_results(req, terms, filters,
+                                                     limit)
+            else:
+                results = sorted(source.get_search_results(req, terms,
+                                                           filters) or [],
+                                 key=itemgetter(2), reverse=True)
+            sources_results.append(results)
+        return merge_search_results(sources_results, limit)
+
+    def _prepare_results(self, req, filters, results, limit=None):
+        page = as_int(req.args.get('page'), 1, min=1)
+        more_results = limit is not None and len(results) >= limit
+        if more_results:
+            # Only report the results which have been counted for sure
+            results = results[:limit - 1]
+        start = (page - 1) * self.RESULTS_PER_PAGE
+        if not 0 <= start < len(results):
+            raise TracError(_("Page %(page)s is beyond the number of "
+                              "pages in the query", page=page))
+        results = Paginator(results[start:start + self.RESULTS_PER_PAGE],
+                            page - 1, self.RESULTS_PER_PAGE, len(results))
         for idx, result in enumerate(results):
             results[idx] = {'href': result[0], 'title': result[1],
                             'date': user_time(req, format_datetime, result[2]),
@@ -256,4 +285,5 @@ class SearchModule(Component):
         page_href = req.href.search(
             zip(filters, ['on'] * len(filters)), q=req.args.get('q'),
             noquickjump=1)
-        return {'results': results, 'page_href': page_href}
+        return {'results': results, 'page_href': page_href,
+                'more_results': more_results}
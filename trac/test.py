@@ -133,6 +133,9 @@ class MockPerm(object):
     def __call__(self, realm_or_resource, id=False, version=False):
         return self
 
+    def filter(self, action, resources):
+        return list(resources)
+
     def require(self, action, realm_or_resource=None, id=False, version=False):
         pass
     assert_permission = require
@@ -398,6 +401,7 @@ def suite():
     import trac.db.tests
     import trac.mimeview.tests
     import trac.notification.tests
+    import trac.search.tests
     import trac.ticket.tests
     import trac.timeline.tests
     import trac.upgrades.tests
@@ -417,6 +421,7 @@ def suite():
     suite.addTest(trac.db.tests.suite())
     suite.addTest(trac.mimeview.tests.suite())
     suite.addTest(trac.notification.tests.suite())
+    suite.addTest(trac.search.tests.suite())
     suite.addTest(trac.ticket.tests.suite())
     suite.addTest(trac.timeline.tests.suite())
     suite.addTest(trac.upgrades.tests.suite())
@@ -13,8 +13,8 @@
 
 import unittest
 
-from trac.tests import attachment, config, core, env, perm, notification, \
-                       resource, wikisyntax, functional
+from trac.tests import attachment, cache, config, core, env, perm, \
+                       notification, resource, wikisyntax, functional
 
 def suite():
     suite = unittest.TestSuite()
@@ -25,6 +25,7 @@ def suite():
 def basicSuite():
     suite = unittest.TestSuite()
     suite.addTest(attachment.suite())
+    suite.addTest(cache.suite())
     suite.addTest(config.suite())
     suite.addTest(core.suite())
     suite.addTest(env.suite())
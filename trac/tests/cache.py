@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from trac.cache import CacheManager, SharedMemoryInvalidationBus, cached, \
+                       mmap
+from trac.core import Component
+from trac.test import EnvironmentStub
+
+
+class Counter(Component):
+
+    calls = 0
+
+    @cached
+    def value(self):
+        self.calls += 1
+        return self.calls
+
+
+class SharedMemoryInvalidationBusTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'generations')
+        self.envs = [self._create_env() for i in xrange(2)]
+
+    def tearDown(self):
+        for env in self.envs:
+            SharedMemoryInvalidationBus(env).close()
+        self.envs[0].reset_db()
+        shutil.rmtree(self.dir)
+
+    def _create_env(self):
+        env = EnvironmentStub()
+        env.config.set('trac', 'cache_invalidation_bus',
+                       'SharedMemoryInvalidationBus')
+        env.config.set('trac', 'cache_generation_file', self.filename)
+        return env
+
+    def test_bus_is_resolved_once(self):
+        cache_manager = CacheManager(self.envs[0])
+        bus = cache_manager.bus
+        self.assertIsInstance(bus, SharedMemoryInvalidationBus)
+        self.envs[0].config.set('trac', 'cache_invalidation_bus', '')
+        self.assertIsNone(cache_manager.bus)
+        self.envs[0].config.set('trac', 'cache_invalidation_bus',
+                                'SharedMemoryInvalidationBus')
+        self.assertIs(bus, cache_manager.bus)
+
+    def test_publish_and_get_generation(self):
+        bus1 = SharedMemoryInvalidationBus(self.envs[0])
+        bus2 = SharedMemoryInvalidationBus(self.envs[1])
+        self.assertIsNone(bus2.get_generation(42))
+        bus1.publish(42, 3)
+        self.assertEqual(3, bus2.get_generation(42))
+        bus1.publish(42, 2)
+        self.assertEqual(3, bus2.get_generation(42))
+        bus2.publish(42 + bus1.slots, 7)
+        self.assertEqual(7, bus1.get_generation(42 + bus1.slots))
+        self.assertEqual(3, bus1.get_generation(42))
+
+    def test_invalidation_is_propagated(self):
+        counter1 = Counter(self.envs[0])
+        counter2 = Counter(self.envs[1])
+        self.assertEqual(1, counter1.value)
+        self.assertEqual(1, counter2.value)
+        del counter1.value
+        self.assertEqual(2, counter2.value)
+        self.assertEqual(2, counter1.value)
+
+    def test_cache_table_not_queried_when_valid(self):
+        counter = Counter(self.envs[0])
+        self.assertEqual(1, counter.value)
+        del counter.value
+        self.assertEqual(2, counter.value)
+        self.envs[0].db_transaction("DELETE FROM cache")
+        # the process cache is still considered valid
+        self.assertEqual(2, counter.value)
+
+    def test_uncommitted_generation_is_not_trusted(self):
+        counter1 = Counter(self.envs[0])
+        counter2 = Counter(self.envs[1])
+        self.assertEqual(1, counter2.value)
+        del counter1.value
+        bus = SharedMemoryInvalidationBus(self.envs[0])
+        id = Counter.value.id
+        # simulate a generation published by a transaction that was
+        # rolled back
+        bus.publish(id, bus.get_generation(id) + 1)
+        self.assertEqual(2, counter2.value)
+        self.assertEqual(2, counter2.value)
+        self.assertEqual(2, counter2.calls)
+
+    def test_unavailable_bus_falls_back_to_database(self):
+        for env in self.envs:
+            env.config.set('trac', 'cache_generation_file',
+                           os.path.join(self.filename, 'not', 'a', 'dir'))
+        open(self.filename, 'w').close()
+        for env in self.envs:
+            self.assertIsNone(CacheManager(env).bus)
+        counter1 = Counter(self.envs[0])
+        counter2 = Counter(self.envs[1])
+        self.assertEqual(1, counter2.value)
+        del counter1.value
+        CacheManager(self.envs[1]).reset_metadata()
+        self.assertEqual(2, counter2.value)
+
+
+class CacheUpdateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.envs = [EnvironmentStub(), EnvironmentStub()]
+
+    def tearDown(self):
+        self.envs[0].reset_db()
+
+    def test_update_in_place(self):
+        counter = Counter(self.envs[0])
+        self.assertEqual(1, counter.value)
+        Counter.value.update(counter, lambda value: value + 10)
+        self.assertEqual(11, counter.value)
+        self.assertEqual(1, counter.calls)
+
+    def test_update_invalidates_other_processes(self):
+        counter1 = Counter(self.envs[0])
+        counter2 = Counter(self.envs[1])
+        self.assertEqual(1, counter1.value)
+        self.assertEqual(1, counter2.value)
+        Counter.value.update(counter1, lambda value: value + 10)
+        for env in self.envs:
+            CacheManager(env).reset_metadata()
+        self.assertEqual(2, counter2.value)
+        self.assertEqual(11, counter1.value)
+
+    def test_stale_value_is_not_updated(self):
+        counter1 = Counter(self.envs[0])
+        counter2 = Counter(self.envs[1])
+        self.assertEqual(1, counter1.value)
+        del counter2.value
+        Counter.value.update(counter1, lambda value: value + 10)
+        self.assertEqual(2, counter1.value)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(CacheUpdateTestCase))
+    if mmap:
+        suite.addTest(unittest.makeSuite(SharedMemoryInvalidationBusTestCase))
+    else:
+        print("SKIP: trac/tests/cache.py (no mmap/fcntl support)")
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
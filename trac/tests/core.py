@@ -248,6 +248,62 @@ class ComponentTestCase(unittest.TestCase):
         results = [test.test() for test in ComponentA(self.compmgr).tests]
         self.assertEqual(['x', 'y'], sorted(results))
 
+    def test_extension_point_cached(self):
+        """
+        Verify that the extensions are only looked up once by the component
+        manager.
+        """
+        class CountingComponentManager(ComponentManager):
+            lookups = 0
+            def __getitem__(self, cls):
+                self.lookups += 1
+                return ComponentManager.__getitem__(self, cls)
+        class ComponentA(Component):
+            tests = ExtensionPoint(ITest)
+        class ComponentB(Component):
+            implements(ITest)
+        class ComponentC(Component):
+            implements(ITest)
+        mgr = CountingComponentManager()
+        tests = ComponentA(mgr).tests
+        self.assertEqual(2, mgr.lookups)
+        self.assertEqual(tests, ComponentA(mgr).tests)
+        self.assertIsNot(tests, ComponentA(mgr).tests)
+        self.assertEqual(2, mgr.lookups)
+
+    def test_extension_point_new_component(self):
+        """
+        Verify that a component class defined after the extensions have
+        been looked up is an extension.
+        """
+        class ComponentA(Component):
+            tests = ExtensionPoint(ITest)
+        class ComponentB(Component):
+            implements(ITest)
+        self.assertEqual([ComponentB(self.compmgr)],
+                         ComponentA(self.compmgr).tests)
+        class ComponentC(Component):
+            implements(ITest)
+        self.assertEqual([ComponentB(self.compmgr), ComponentC(self.compmgr)],
+                         ComponentA(self.compmgr).tests)
+
+    def test_extension_point_disabled_component(self):
+        """
+        Verify that a component disabled after the extensions have been
+        looked up is no longer an extension.
+        """
+        class ComponentA(Component):
+            tests = ExtensionPoint(ITest)
+        class ComponentB(Component):
+            implements(ITest)
+        class ComponentC(Component):
+            implements(ITest)
+        self.assertEqual([ComponentB(self.compmgr), ComponentC(self.compmgr)],
+                         ComponentA(self.compmgr).tests)
+        self.compmgr.disable_component(ComponentB)
+        self.assertEqual([ComponentC(self.compmgr)],
+                         ComponentA(self.compmgr).tests)
+
     def test_inherited_extension_point(self):
         """
         Verify that extension points are inherited to sub-classes.
@@ -170,7 +170,9 @@ class SMTPServerEngine:
         elif cmd == "RSET":
             rv = self.impl.reset(data[5:])
             self.data_accum = ""
-            self.state = SMTPServerEngine.ST_INIT
+            # RSET aborts the current transaction but keeps the session
+            if self.state != SMTPServerEngine.ST_INIT:
+                self.state = SMTPServerEngine.ST_HELO
         elif cmd == "NOOP":
             pass
         elif cmd == "QUIT":
@@ -467,10 +469,97 @@ class SmtpEmailSenderTestCase(unittest.TestCase):
                           'admin@domain.com', ['foo@domain.com'], "")
 
 
+class SMTPConnectionCounter(SMTPServerStore):
+    """Store for SMTP data also counting the client connections"""
+
+    def __init__(self):
+        SMTPServerStore.__init__(self)
+        self.connections = 0
+
+    def helo(self, args):
+        SMTPServerStore.helo(self, args)
+        self.connections += 1
+
+
+class SmtpEmailSenderPoolTestCase(unittest.TestCase):
+
+    port = SMTP_TEST_PORT + 1
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.env.config.set('notification', 'smtp_server', '127.0.0.1')
+        self.env.config.set('notification', 'smtp_port', str(self.port))
+        self.smtpd = SMTPThreadedServer(self.port)
+        self.smtpd.store = SMTPConnectionCounter()
+        self.smtpd.start()
+        self.sender = SmtpEmailSender(self.env)
+
+    def tearDown(self):
+        self.sender.close()
+        self.smtpd.stop()
+
+    def _send(self, count):
+        for idx in xrange(count):
+            self.sender.send('admin@domain.com', ['foo%d@domain.com' % idx],
+                             'Subject: Test %d\n\nBody' % idx)
+            self.assertEqual('admin@domain.com', self.smtpd.get_sender())
+            self.assertEqual(['foo%d@domain.com' % idx],
+                             self.smtpd.get_recipients())
+            self.assertEqual('Subject: Test %d\r\n\r\nBody' % idx,
+                             self.smtpd.get_message())
+
+    def test_connection_per_message(self):
+        self._send(3)
+        self.assertEqual(3, self.smtpd.store.connections)
+
+    def test_connection_reused(self):
+        self.env.config.set('notification', 'smtp_idle_timeout', '60')
+        self._send(20)
+        self.assertEqual(1, self.smtpd.store.connections)
+
+    def test_idle_connection_expired(self):
+        self.env.config.set('notification', 'smtp_idle_timeout', '60')
+        self._send(1)
+        # Simulate an idle connection older than the timeout
+        self.sender._pool = [(server, released - 120)
+                             for server, released in self.sender._pool]
+        self._send(1)
+        self.assertEqual(2, self.smtpd.store.connections)
+
+    def test_idle_connection_reaped(self):
+        self.env.config.set('notification', 'smtp_idle_timeout', '60')
+        self._send(1)
+        self.assertIsNotNone(self.sender._reaper)
+        self.assertEqual(1, len(self.sender._pool))
+        self.sender._pool = [(server, released - 120)
+                             for server, released in self.sender._pool]
+        self.sender._reaper.cancel()
+        self.sender._reap_idle_connections()
+        self.assertEqual([], self.sender._pool)
+        self.assertIsNone(self.sender._reaper)
+
+    def test_reaper_rescheduled_for_remaining_connections(self):
+        self.env.config.set('notification', 'smtp_idle_timeout', '60')
+        self._send(1)
+        self.sender._reaper.cancel()
+        self.sender._reap_idle_connections()
+        self.assertEqual(1, len(self.sender._pool))
+        self.assertIsNotNone(self.sender._reaper)
+
+    def test_reconnect_when_connection_lost(self):
+        self.env.config.set('notification', 'smtp_idle_timeout', '60')
+        self._send(1)
+        for server, released in self.sender._pool:
+            server.sock.close()
+        self._send(1)
+        self.assertEqual(2, self.smtpd.store.connections)
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(SendmailEmailSenderTestCase))
     suite.addTest(unittest.makeSuite(SmtpEmailSenderTestCase))
+    suite.addTest(unittest.makeSuite(SmtpEmailSenderPoolTestCase))
     return suite
 
 
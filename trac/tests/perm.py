@@ -356,6 +356,204 @@ class PermissionPolicyTestCase(unittest.TestCase):
                           ('testuser', 'TEST_ADMIN'): None})
 
 
+class TestCacheablePermissionPolicy(Component):
+    implements(perm.IPermissionPolicy)
+
+    cacheable = True
+
+    def __init__(self):
+        self.calls = []
+
+    def check_permission(self, action, username, resource, perm):
+        self.calls.append((username, action, resource))
+        if action == 'TEST_ADMIN':
+            # Secondary check decided by the following policies
+            return 'TEST_MODIFY' in perm or None
+
+
+class PermissionDecisionCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[perm.DefaultPermissionStore,
+                                           perm.DefaultPermissionPolicy,
+                                           TestPermissionPolicy,
+                                           TestCacheablePermissionPolicy,
+                                           TestPermissionRequestor])
+        self.env.config.set('trac', 'permission_policies',
+                            'TestCacheablePermissionPolicy, '
+                            'DefaultPermissionPolicy')
+        self.perm_system = perm.PermissionSystem(self.env)
+        self.policy = TestCacheablePermissionPolicy(self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def new_perm(self, username='testuser'):
+        return perm.PermissionCache(self.env, username)
+
+    def test_decisions_reused_by_later_requests(self):
+        self.perm_system.grant_permission('testuser', 'TEST_MODIFY')
+        resource = Resource('wiki', 'WikiStart')
+        self.assertIn('TEST_MODIFY', self.new_perm()(resource))
+        self.assertIn('TEST_MODIFY', self.new_perm()(resource))
+        self.assertNotIn('TEST_CREATE', self.new_perm()(resource))
+        self.assertNotIn('TEST_CREATE', self.new_perm()(resource))
+        self.assertIn('TEST_MODIFY', self.new_perm()('wiki', 'SandBox'))
+        self.assertEqual([('testuser', 'TEST_MODIFY', resource),
+                          ('testuser', 'TEST_CREATE', resource),
+                          ('testuser', 'TEST_MODIFY',
+                           Resource('wiki', 'SandBox'))],
+                         self.policy.calls)
+
+    def test_grant_revoke_invalidates(self):
+        self.assertNotIn('TEST_MODIFY', self.new_perm())
+        self.perm_system.grant_permission('testuser', 'TEST_MODIFY')
+        self.assertIn('TEST_MODIFY', self.new_perm())
+        self.perm_system.revoke_permission('testuser', 'TEST_MODIFY')
+        self.assertNotIn('TEST_MODIFY', self.new_perm())
+        perm.DefaultPermissionStore(self.env) \
+            .grant_permission('testuser', 'TEST_MODIFY')
+        self.assertIn('TEST_MODIFY', self.new_perm())
+        self.assertEqual(4, len(self.policy.calls))
+
+    def test_user_permissions_cached(self):
+        self.perm_system.grant_permission('testuser', 'TEST_ADMIN')
+        permissions = self.perm_system.get_user_permissions('testuser')
+        expected = {'TEST_ADMIN': True, 'TEST_CREATE': True,
+                    'TEST_DELETE': True, 'TEST_MODIFY': True}
+        self.assertEqual(expected, permissions)
+        permissions['TRAC_ADMIN'] = True
+        self.env.db_transaction("DELETE FROM permission")
+        del perm.DefaultPermissionStore(self.env)._all_permissions
+        self.assertEqual(expected,
+                         self.perm_system.get_user_permissions('testuser'))
+        perm.PermissionDecisionCache(self.env).invalidate()
+        self.assertEqual({},
+                         self.perm_system.get_user_permissions('testuser'))
+
+    def test_uncacheable_policy(self):
+        self.env.config.set('trac', 'permission_policies',
+                            'TestCacheablePermissionPolicy, '
+                            'TestPermissionPolicy, DefaultPermissionPolicy')
+        policy = TestPermissionPolicy(self.env)
+        policy.grant('testuser', ['TEST_CREATE'])
+        self.assertIn('TEST_CREATE', self.new_perm())
+        self.assertIn('TEST_CREATE', self.new_perm())
+        self.assertEqual(2, len(self.policy.calls))
+        policy.revoke('testuser', ['TEST_CREATE'])
+        self.assertNotIn('TEST_CREATE', self.new_perm())
+
+    def test_uncacheable_secondary_decision(self):
+        self.env.config.set('trac', 'permission_policies',
+                            'TestCacheablePermissionPolicy, '
+                            'TestPermissionPolicy, DefaultPermissionPolicy')
+        policy = TestPermissionPolicy(self.env)
+        policy.grant('testuser', ['TEST_MODIFY'])
+        perm_cache = self.new_perm()
+        self.assertIn('TEST_MODIFY', perm_cache)
+        # The secondary check reuses the decision of the request
+        self.assertIn('TEST_ADMIN', perm_cache)
+        self.assertIn('TEST_ADMIN', self.new_perm())
+        policy.revoke('testuser', ['TEST_MODIFY'])
+        self.assertNotIn('TEST_ADMIN', self.new_perm())
+
+    def test_disabled(self):
+        self.env.config.set('trac', 'permission_cache_lifetime', 0)
+        self.perm_system.grant_permission('testuser', 'TEST_MODIFY')
+        self.assertIn('TEST_MODIFY', self.new_perm())
+        self.assertIn('TEST_MODIFY', self.new_perm())
+        self.assertEqual(2, len(self.policy.calls))
+
+    def test_max_entries(self):
+        cache = perm.PermissionDecisionCache(self.env)
+        # Decision and permissions of a user
+        cache.max_entries = 4
+        for username in ('user1', 'user2', 'user1', 'user3', 'user1',
+                         'user4', 'user1', 'user2'):
+            self.assertNotIn('TEST_MODIFY', self.new_perm(username))
+        self.assertEqual(['user1', 'user2', 'user3', 'user4', 'user2'],
+                         [call[0] for call in self.policy.calls])
+
+
+class TestBulkPermissionPolicy(Component):
+    implements(perm.IPermissionPolicy)
+
+    cacheable = True
+
+    def __init__(self):
+        self.calls = []
+
+    def check_permission(self, action, username, resource, perm):
+        return self.check_permissions_bulk(action, username, [resource],
+                                           perm)[0]
+
+    def check_permissions_bulk(self, action, username, resources, perm):
+        self.calls.append(list(resources))
+        # Odd tickets are denied, the others are left to other policies
+        return [False if resource.id % 2 else None
+                for resource in resources]
+
+
+class FilterResourcesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[perm.DefaultPermissionStore,
+                                           perm.DefaultPermissionPolicy,
+                                           TestBulkPermissionPolicy,
+                                           TestCacheablePermissionPolicy,
+                                           TestPermissionRequestor])
+        self.env.config.set('trac', 'permission_policies',
+                            'TestBulkPermissionPolicy, '
+                            'TestCacheablePermissionPolicy, '
+                            'DefaultPermissionPolicy')
+        self.perm_system = perm.PermissionSystem(self.env)
+        self.perm_system.grant_permission('testuser', 'TEST_MODIFY')
+        self.bulk_policy = TestBulkPermissionPolicy(self.env)
+        self.policy = TestCacheablePermissionPolicy(self.env)
+        self.resources = [Resource('ticket', id) for id in xrange(1, 7)]
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_filter_resources(self):
+        allowed = self.perm_system.filter_resources('TEST_MODIFY',
+                                                    'testuser',
+                                                    self.resources)
+        self.assertEqual([2, 4, 6], [resource.id for resource in allowed])
+        self.assertEqual([self.resources], self.bulk_policy.calls)
+        self.assertEqual([('testuser', 'TEST_MODIFY', self.resources[idx])
+                          for idx in (1, 3, 5)], self.policy.calls)
+        self.assertEqual([], self.perm_system.filter_resources(
+            'TEST_MODIFY', 'anonymous', self.resources))
+
+    def test_filter_permission_cache(self):
+        perm_cache = perm.PermissionCache(self.env, 'testuser')
+        allowed = perm_cache.filter('TEST_MODIFY', self.resources)
+        self.assertEqual([2, 4, 6], [resource.id for resource in allowed])
+        # Decisions are reused by the permission cache
+        for resource in self.resources:
+            self.assertEqual(resource.id % 2 == 0,
+                             'TEST_MODIFY' in perm_cache(resource))
+        self.assertEqual(1, len(self.bulk_policy.calls))
+        self.assertEqual(3, len(self.policy.calls))
+
+    def test_filter_cached_decisions(self):
+        self.assertIn('TEST_MODIFY', perm.PermissionCache(
+            self.env, 'testuser', self.resources[1]))
+        allowed = self.perm_system.filter_resources('TEST_MODIFY',
+                                                    'testuser',
+                                                    self.resources)
+        self.assertEqual([2, 4, 6], [resource.id for resource in allowed])
+        self.assertEqual([[self.resources[1]],
+                          [self.resources[idx] for idx in (0, 2, 3, 4, 5)]],
+                         self.bulk_policy.calls)
+        allowed = self.perm_system.filter_resources('TEST_MODIFY',
+                                                    'testuser',
+                                                    self.resources)
+        self.assertEqual([2, 4, 6], [resource.id for resource in allowed])
+        self.assertEqual(2, len(self.bulk_policy.calls))
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(DefaultPermissionStoreTestCase))
@@ -363,6 +561,8 @@ def suite():
     suite.addTest(unittest.makeSuite(PermissionSystemTestCase))
     suite.addTest(unittest.makeSuite(PermissionCacheTestCase))
     suite.addTest(unittest.makeSuite(PermissionPolicyTestCase))
+    suite.addTest(unittest.makeSuite(PermissionDecisionCacheTestCase))
+    suite.addTest(unittest.makeSuite(FilterResourcesTestCase))
     return suite
 
 
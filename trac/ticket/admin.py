@@ -860,6 +860,19 @@ class TicketAdmin(Component):
     def get_admin_commands(self):
         yield ('ticket remove', '<number>', 'Remove ticket',
                None, self._do_remove)
+        yield ('ticket custom_table', '<rebuild|drop>',
+               """Rebuild or drop the materialized table of custom fields
+
+               With "rebuild", the `ticket_custom_wide` table is created,
+               or recreated if it exists, with a column for each custom
+               field defined in the [ticket-custom] section. It is then
+               kept in sync with the ticket changes and used by the ticket
+               queries. It must be rebuilt after custom fields are added.
+
+               With "drop", the table is dropped and the ticket queries
+               use the `ticket_custom` table only.
+               """,
+               self._complete_custom_table, self._do_custom_table)
 
     def _do_remove(self, number):
         try:
@@ -870,3 +883,21 @@ class TicketAdmin(Component):
             model.Ticket(self.env, number).delete()
         printout(_("Ticket #%(num)s and all associated data removed.",
                    num=number))
+
+    def _complete_custom_table(self, args):
+        if len(args) == 1:
+            return ['rebuild', 'drop']
+
+    def _do_custom_table(self, action):
+        table = model.CustomFieldsTable(self.env)
+        if action == 'rebuild':
+            table.rebuild()
+            printout(_("Table %(table)s rebuilt with %(count)s custom "
+                       "fields.", table=table.table_name,
+                       count=len(table.fields)))
+        elif action == 'drop':
+            table.drop()
+            printout(_("Table %(table)s dropped.", table=table.table_name))
+        else:
+            raise AdminCommandError(_("Invalid action: %(action)s",
+                                      action=action), show_usage=True)
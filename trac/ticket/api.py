@@ -24,12 +24,13 @@ from trac.config import (
     BoolOption, ConfigSection, ListOption, Option, OrderedExtensionsOption
 )
 from trac.core import *
-from trac.perm import IPermissionRequestor, PermissionCache, PermissionSystem
+from trac.perm import IPermissionRequestor, PermissionCache, \
+                     PermissionDecisionCache, PermissionSystem
 from trac.resource import IResourceManager
 from trac.util import Ranges, as_int
 from trac.util.text import shorten_line
 from trac.util.translation import _, N_, gettext
-from trac.wiki import IWikiSyntaxProvider, WikiParser
+from trac.wiki import IWikiSyntaxProvider, WikiParser, WikiRenderCache
 
 
 class TicketFieldList(list):
@@ -144,6 +145,19 @@ class ITicketChangeListener(Interface):
         fields that have changed.
         """
 
+    def tickets_changed(changes, comment, author):
+        """Called when several tickets are modified at once, e.g. by
+        a batch modification.
+
+        `changes` is a list of `(ticket, old_values)` tuples, with the
+        same meaning as the arguments of `ticket_changed`.
+
+        This method is optional: `ticket_changed` is called for each
+        ticket instead when it is not implemented.
+
+        (''since 1.2'')
+        """
+
     def ticket_deleted(ticket):
         """Called when a ticket is deleted."""
 
@@ -508,17 +522,13 @@ class TicketSystem(Component):
             r = Ranges(link)
             if len(r) == 1:
                 num = r.a
+                formatter.add_dependency(self.realm, num)
                 ticket = formatter.resource(self.realm, num)
                 from trac.ticket.model import Ticket
-                if Ticket.id_is_valid(num) and \
-                        'TICKET_VIEW' in formatter.perm(ticket):
-                    # TODO: attempt to retrieve ticket view directly,
-                    #       something like: t = Ticket.view(num)
-                    for type, summary, status, resolution in \
-                            self.env.db_query("""
-                            SELECT type, summary, status, resolution
-                            FROM ticket WHERE id=%s
-                            """, (str(num),)):
+                if Ticket.id_is_valid(num):
+                    values = formatter.resolve_link(self, self.realm, num)
+                    if values and 'TICKET_VIEW' in formatter.perm(ticket):
+                        type, summary, status, resolution = values
                         title = self.format_summary(summary, status,
                                                     resolution, type)
                         href = formatter.href.ticket(num) + params + fragment
@@ -537,6 +547,15 @@ class TicketSystem(Component):
             pass
         return tag.a(label, class_='missing ticket')
 
+    def resolve_links(self, formatter, ns, targets):
+        """Return the type, summary, status and resolution of the
+        tickets whose ids are given in `targets`.
+        """
+        return dict((row[0], row[1:]) for row in self.env.db_query("""
+                SELECT id, type, summary, status, resolution
+                FROM ticket WHERE id IN (%s)
+                """ % ','.join(str(int(id)) for id in targets)))
+
     def _format_comment_link(self, formatter, ns, target, label):
         resource = None
         if ':' in target:
@@ -553,6 +572,7 @@ class TicketSystem(Component):
 
         if resource and resource.id and resource.realm == self.realm and \
                 cnum and (all(c.isdigit() for c in cnum) or cnum == 'description'):
+            formatter.add_dependency(self.realm, resource.id)
             href = title = class_ = None
             if self.resource_exists(resource):
                 from trac.ticket.model import Ticket
@@ -642,3 +662,77 @@ class TicketSystem(Component):
             return revcount[0][0] >= resource.version
         else:
             return False
+
+
+class TicketPermissionCacheInvalidator(Component):
+    """Invalidate the cached permission decisions when the ownership
+    of a ticket changes, as permission policies commonly grant
+    permissions to the reporter and to the owner of a ticket.
+    """
+
+    implements(ITicketChangeListener)
+
+    ownership_fields = ('owner', 'reporter')
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        PermissionDecisionCache(self.env).invalidate()
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        if any(f in old_values for f in self.ownership_fields):
+            PermissionDecisionCache(self.env).invalidate()
+
+    def tickets_changed(self, changes, comment, author):
+        if any(f in old_values for ticket, old_values in changes
+                               for f in self.ownership_fields):
+            PermissionDecisionCache(self.env).invalidate()
+
+    def ticket_deleted(self, ticket):
+        PermissionDecisionCache(self.env).invalidate()
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        pass
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        if any(f in changes for f in self.ownership_fields):
+            PermissionDecisionCache(self.env).invalidate()
+
+
+class TicketRenderCacheInvalidator(Component):
+    """Invalidate the cached wiki renderings linking to a ticket or to
+    a milestone when it changes, as the links show the existence of
+    the ticket and its summary and status.
+    """
+
+    implements(IMilestoneChangeListener, ITicketChangeListener)
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        WikiRenderCache(self.env).invalidate('ticket', ticket.id)
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        WikiRenderCache(self.env).invalidate('ticket', ticket.id)
+
+    def ticket_deleted(self, ticket):
+        WikiRenderCache(self.env).invalidate('ticket', ticket.id)
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        pass
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        WikiRenderCache(self.env).invalidate('ticket', ticket.id)
+
+    # IMilestoneChangeListener methods
+
+    def milestone_created(self, milestone):
+        WikiRenderCache(self.env).invalidate('milestone')
+
+    def milestone_changed(self, milestone, old_values):
+        WikiRenderCache(self.env).invalidate('milestone')
+
+    def milestone_deleted(self, milestone):
+        WikiRenderCache(self.env).invalidate('milestone')
@@ -17,6 +17,7 @@ import re
 from datetime import datetime
 
 from genshi.builder import tag
+from genshi.core import Markup
 
 from trac.core import *
 from trac.notification.api import NotificationSystem
@@ -24,9 +25,10 @@ from trac.perm import IPermissionRequestor
 from trac.ticket import TicketSystem, Ticket
 from trac.ticket.notification import BatchTicketChangeEvent
 from trac.util.datefmt import parse_date, user_time, utc
+from trac.util.presentation import to_json
 from trac.util.text import exception_to_unicode, to_unicode
 from trac.util.translation import _, tag_
-from trac.web import IRequestHandler
+from trac.web import IRequestHandler, RequestDone
 from trac.web.chrome import add_warning, add_script_data
 
 
@@ -67,6 +69,10 @@ class BatchModifyModule(Component):
 
         if new_values is not None:
             selected_tickets = self._get_selected_tickets(req)
+            if len(selected_tickets) > Ticket.batch_size:
+                self._send_ticket_changes_progress(req, selected_tickets,
+                                                   new_values, comment,
+                                                   action)
             self._save_ticket_changes(req, selected_tickets,
                                       new_values, comment, action)
 
@@ -131,8 +137,7 @@ class BatchModifyModule(Component):
         action_controls = []
         ts = TicketSystem(self.env)
         tickets_by_action = {}
-        for t in tickets:
-            ticket = Ticket(self.env, t['id'])
+        for ticket in Ticket.select(self.env, [t['id'] for t in tickets]):
             actions = ts.get_available_actions(req, ticket)
             for action in actions:
                 tickets_by_action.setdefault(action, []).append(ticket)
@@ -162,13 +167,17 @@ class BatchModifyModule(Component):
                 yield controller
 
     def _save_ticket_changes(self, req, selected_tickets,
-                             new_values, comment, action):
-        """Save all of the changes to tickets."""
+                             new_values, comment, action, progress=None):
+        """Save all of the changes to tickets.
+
+        `progress` is passed to `Ticket.save_all_changes`.
+        """
         when = datetime.now(utc)
         list_fields = self._get_list_fields()
         with self.env.db_transaction as db:
-            for id in selected_tickets:
-                t = Ticket(self.env, int(id))
+            tickets = Ticket.select(self.env, selected_tickets)
+            side_effects = []
+            for t in tickets:
                 _values = new_values.copy()
                 for field in list_fields:
                     if field in new_values:
@@ -186,7 +195,10 @@ class BatchModifyModule(Component):
                     _values.update(controller.get_ticket_changes(req, t,
                                                                  action))
                 t.populate(_values)
-                t.save_changes(req.authname, comment, when=when)
+                side_effects.append((t, controllers))
+            Ticket.save_all_changes(self.env, tickets, req.authname, comment,
+                                    when, progress)
+            for t, controllers in side_effects:
                 for controller in controllers:
                     controller.apply_action_side_effects(req, t, action)
         event = BatchTicketChangeEvent(selected_tickets, when,
@@ -202,6 +214,51 @@ class BatchModifyModule(Component):
                                   "notifications: %(message)s",
                                   message=to_unicode(e)))
 
+    def _send_ticket_changes_progress(self, req, selected_tickets,
+                                      new_values, comment, action):
+        """Save the changes to many tickets, while sending a page
+        reporting the progress after each batch of tickets is stored.
+
+        The page returns to the query page once the changes are saved,
+        unless there are warnings to show.
+        """
+        query_href = req.session['query_href'] or req.href.query()
+
+        def write(fragment):
+            req.write(unicode(fragment).encode('utf-8'))
+
+        def progress(done, total):
+            write(tag.p(_("%(done)s of %(total)s tickets saved",
+                          done=done, total=total)))
+
+        req.send_response(200)
+        req.send_header('Content-Type', 'text/html;charset=utf-8')
+        req.send_header('Cache-Control', 'no-cache')
+        req.send_header('Expires', 'Fri, 01 Jan 1999 00:00:00 GMT')
+        req.end_headers()
+        title = _("Batch Modify")
+        write('<!DOCTYPE html>\n<html>')
+        write(tag.head(tag.meta(charset='utf-8'), tag.title(title)))
+        write('<body>')
+        write(tag.h1(title))
+        try:
+            self._save_ticket_changes(req, selected_tickets, new_values,
+                                      comment, action, progress)
+        except Exception as e:
+            self.log.error("Failure saving ticket batch change: %s",
+                           exception_to_unicode(e, traceback=True))
+            add_warning(req, tag_("The changes could not be saved: "
+                                  "%(message)s", message=to_unicode(e)))
+        warnings = req.chrome['warnings']
+        for warning in warnings:
+            write(tag.p(tag.strong(_("Warning:")), ' ', warning))
+        if not warnings:
+            write(tag.script(Markup("window.location.replace(%s);"
+                                    % to_json(query_href))))
+        write(tag.p(tag.a(_("Back to query"), href=query_href)))
+        write('</body></html>')
+        raise RequestDone
+
     def _change_list(self, old_list, new_list, new_list2, mode):
         changed_list = [k.strip()
                         for k in self.list_separator_re.split(old_list)
@@ -17,6 +17,7 @@
 # Author: Jonas Borgström <jonas@edgewall.com>
 #         Christopher Lenz <cmlenz@gmx.de>
 
+import copy
 import re
 from datetime import datetime
 
@@ -24,6 +25,8 @@ from trac import core
 from trac.attachment import Attachment
 from trac.cache import cached
 from trac.core import TracError
+from trac.db.api import DatabaseManager
+from trac.db.schema import Column, Table
 from trac.resource import Resource, ResourceNotFound
 from trac.ticket.api import TicketSystem
 from trac.util import embedded_numbers
@@ -161,6 +164,12 @@ class Ticket(object):
             raise ResourceNotFound(_("Ticket %(id)s does not exist.",
                                      id=tkt_id), _("Invalid ticket number"))
 
+        custom_rows = self.env.db_query("""
+            SELECT name, value FROM ticket_custom WHERE ticket=%s
+            """, (tkt_id,))
+        self._load_values(tkt_id, row, custom_rows)
+
+    def _load_values(self, tkt_id, row, custom_rows):
         self.id = tkt_id
         for i, field in enumerate(self.std_fields):
             value = row[i]
@@ -172,9 +181,7 @@ class Ticket(object):
                 self.values[field] = value
 
         # Fetch custom fields if available
-        for name, value in self.env.db_query("""
-                SELECT name, value FROM ticket_custom WHERE ticket=%s
-                """, (tkt_id,)):
+        for name, value in custom_rows:
             if name in self.custom_fields:
                 if name in self.time_fields:
                     self.values[name] = _db_str_to_datetime(value)
@@ -183,6 +190,46 @@ class Ticket(object):
                 else:
                     self.values[name] = value
 
+    @classmethod
+    def select(cls, env, tkt_ids):
+        """Retrieve the tickets with the given ids, in the same order,
+        reading the standard and the custom fields of all the tickets
+        with one query each.
+
+        :raises ResourceNotFound: if one of the tickets doesn't exist.
+        :since: 1.2
+        """
+        tkt_ids = [int(tkt_id) for tkt_id in tkt_ids]
+        if not tkt_ids:
+            return []
+        template = cls(env)
+        rows = {}
+        custom_rows = {}
+        in_ids = ','.join(str(tkt_id) for tkt_id in sorted(set(tkt_ids))
+                                      if cls.id_is_valid(tkt_id))
+        if in_ids:
+            with env.db_query as db:
+                for row in db("SELECT id,%s FROM ticket WHERE id IN (%s)"
+                              % (','.join(template.std_fields), in_ids)):
+                    rows[row[0]] = row[1:]
+                for tkt_id, name, value in db("""
+                        SELECT ticket, name, value FROM ticket_custom
+                        WHERE ticket IN (%s)""" % in_ids):
+                    custom_rows.setdefault(tkt_id, []).append((name, value))
+        tickets = []
+        for tkt_id in tkt_ids:
+            if tkt_id not in rows:
+                raise ResourceNotFound(_("Ticket %(id)s does not exist.",
+                                         id=tkt_id),
+                                       _("Invalid ticket number"))
+            ticket = copy.copy(template)
+            ticket.values = {}
+            ticket._old = {}
+            ticket._load_values(tkt_id, rows[tkt_id],
+                                custom_rows.get(tkt_id, ()))
+            tickets.append(ticket)
+        return tickets
+
     def __getitem__(self, name):
         return self.values.get(name)
 
@@ -271,6 +318,9 @@ class Ticket(object):
                        VALUES (%s, %s, %s)
                     """, [(tkt_id, c, db_values.get(c))
                           for c in custom_fields])
+                CustomFieldsTable(self.env).update(
+                    db, tkt_id, dict((c, db_values.get(c))
+                                     for c in custom_fields))
 
         self.id = int(tkt_id)
         self._old = {}
@@ -367,6 +417,10 @@ class Ticket(object):
                       VALUES (%s, %s, %s, %s, %s, %s)
                       """, (self.id, when_ts, author, name,
                             old_db_values.get(name), db_values.get(name)))
+            CustomFieldsTable(self.env).update(
+                db, self.id, dict((name, db_values.get(name))
+                                  for name in self._old
+                                  if name in self.custom_fields))
 
             # always save comment, even if empty
             # (numbering support for timeline)
@@ -383,6 +437,141 @@ class Ticket(object):
             listener.ticket_changed(self, comment, author, old_values)
         return int(cnum.rsplit('.', 1)[-1])
 
+    batch_size = 500
+
+    @classmethod
+    def save_all_changes(cls, env, tickets, author=None, comment=None,
+                         when=None, progress=None):
+        """Store the changes of several tickets in the database, as
+        `save_changes` does for each ticket, with the same `author`,
+        `comment` and time of change.
+
+        The rows of the tickets are written with one statement of each
+        kind for every `batch_size` tickets, within one transaction.
+        The change listeners implementing `tickets_changed` are called
+        once for all the tickets, the others once per ticket.
+
+        :param progress: optional callable, called with the number of
+                         tickets stored so far and the number of tickets
+                         to store after each batch of tickets.
+        :return: the list of the tickets that were modified.
+        :since: 1.2
+        """
+        modified = []
+        for ticket in tickets:
+            assert ticket.exists, "Cannot update a new ticket"
+            if 'cc' in ticket.values:
+                ticket['cc'] = _fixup_cc_list(ticket.values['cc'])
+            props_unchanged = all(ticket.values.get(k) == v
+                                  for k, v in ticket._old.iteritems())
+            if comment and comment.strip() or not props_unchanged:
+                modified.append(ticket)
+        if not modified:
+            return []
+
+        if when is None:
+            when = datetime.now(utc)
+        when_ts = to_utimestamp(when)
+
+        with env.db_transaction as db:
+            for start in xrange(0, len(modified), cls.batch_size):
+                batch = modified[start:start + cls.batch_size]
+                cls._save_batch_changes(env, db, batch, author, comment,
+                                        when_ts)
+                if progress:
+                    progress(start + len(batch), len(modified))
+
+        changes = []
+        for ticket in modified:
+            changes.append((ticket, ticket._old))
+            ticket._old = {}
+            ticket.values['changetime'] = when
+
+        for listener in TicketSystem(env).change_listeners:
+            tickets_changed = getattr(listener, 'tickets_changed', None)
+            if tickets_changed:
+                tickets_changed(changes, comment, author)
+            else:
+                for ticket, old_values in changes:
+                    listener.ticket_changed(ticket, comment, author,
+                                            old_values)
+        return modified
+
+    @staticmethod
+    def _save_batch_changes(env, db, tickets, author, comment, when_ts):
+        in_ids = ','.join(str(ticket.id) for ticket in tickets)
+
+        # find the number of the last comment of each ticket
+        history = {}
+        for tkt_id, ts, old in db("""
+                SELECT DISTINCT tc1.ticket, tc1.time,
+                  COALESCE(tc2.oldvalue,'')
+                FROM ticket_change AS tc1
+                LEFT OUTER JOIN ticket_change AS tc2
+                ON tc2.ticket=tc1.ticket AND tc2.time=tc1.time
+                   AND tc2.field='comment'
+                WHERE tc1.ticket IN (%s) ORDER BY tc1.ticket, tc1.time DESC
+                """ % in_ids):
+            history.setdefault(tkt_id, []).append(old)
+        custom_rows = set(db("""
+            SELECT ticket, name FROM ticket_custom WHERE ticket IN (%s)
+            """ % in_ids))
+
+        std_updates = {}
+        custom_updates = []
+        custom_inserts = []
+        change_rows = []
+        custom_table = CustomFieldsTable(env)
+        for ticket in tickets:
+            num = 0
+            for old in history.get(ticket.id, ()):
+                # Use oldvalue if available, else count edits
+                try:
+                    num += int(old.rsplit('.', 1)[-1])
+                    break
+                except ValueError:
+                    num += 1
+            cnum = str(num + 1)
+
+            db_values = ticket._to_db_types(ticket.values)
+            old_db_values = ticket._to_db_types(ticket._old)
+            for name in ticket._old:
+                value = db_values.get(name)
+                if name in ticket.custom_fields:
+                    if (ticket.id, name) in custom_rows:
+                        custom_updates.append((value, ticket.id, name))
+                    else:
+                        custom_inserts.append((ticket.id, name, value))
+                else:
+                    std_updates.setdefault(name, []).append((value,
+                                                             ticket.id))
+                change_rows.append((ticket.id, when_ts, author, name,
+                                    old_db_values.get(name), value))
+            change_rows.append((ticket.id, when_ts, author, 'comment', cnum,
+                                comment))
+            custom_table.update(db, ticket.id,
+                                dict((name, db_values.get(name))
+                                     for name in ticket._old
+                                     if name in ticket.custom_fields))
+
+        db.executemany("UPDATE ticket SET changetime=%s WHERE id=%s",
+                       [(when_ts, ticket.id) for ticket in tickets])
+        for name, args in std_updates.iteritems():
+            db.executemany("UPDATE ticket SET %s=%%s WHERE id=%%s" % name,
+                           args)
+        if custom_updates:
+            db.executemany("""UPDATE ticket_custom SET value=%s
+                              WHERE ticket=%s AND name=%s
+                              """, custom_updates)
+        if custom_inserts:
+            db.executemany("""INSERT INTO ticket_custom (ticket,name,value)
+                              VALUES (%s,%s,%s)
+                              """, custom_inserts)
+        db.executemany("""INSERT INTO ticket_change
+                            (ticket,time,author,field,oldvalue,newvalue)
+                          VALUES (%s,%s,%s,%s,%s,%s)
+                          """, change_rows)
+
     def _to_db_types(self, values):
         values = values.copy()
         for field, value in values.iteritems():
@@ -451,6 +640,7 @@ class Ticket(object):
             db("DELETE FROM ticket WHERE id=%s", (self.id,))
             db("DELETE FROM ticket_change WHERE ticket=%s", (self.id,))
             db("DELETE FROM ticket_custom WHERE ticket=%s", (self.id,))
+            CustomFieldsTable(self.env).delete(db, self.id)
 
         for listener in TicketSystem(self.env).change_listeners:
             listener.ticket_deleted(self)
@@ -520,6 +710,8 @@ class Ticket(object):
                         db("""UPDATE ticket_custom SET value=%s
                               WHERE ticket=%s AND name=%s
                               """, (oldvalue, self.id, field))
+                        CustomFieldsTable(self.env).update(
+                            db, self.id, {field: oldvalue})
 
             # Delete the change
             db("DELETE FROM ticket_change WHERE ticket=%s AND time=%s",
@@ -918,6 +1110,94 @@ class Component(object):
             yield component
 
 
+class CustomFieldsTable(core.Component):
+    """Materialized table of the custom ticket fields.
+
+    The optional `ticket_custom_wide` table has one row per ticket and
+    one column per custom field, holding the values of the
+    `ticket_custom` table. When it exists, it is kept in sync by the
+    `Ticket` model, and the ticket queries read the custom fields from
+    it rather than joining `ticket_custom` once per field. It is built
+    and dropped with the `ticket custom_table` commands of `trac-admin`.
+
+    (''since 1.2'')
+    """
+
+    table_name = 'ticket_custom_wide'
+
+    @cached
+    def fields(self):
+        """Set of the custom fields having a column in the table, empty
+        if the table doesn't exist.
+        """
+        with self.env.db_query as db:
+            if self.table_name not in db.get_table_names():
+                return frozenset()
+            return frozenset(name for name in
+                                  db.get_column_names(self.table_name)
+                                  if name != 'ticket')
+
+    def update(self, db, tkt_id, values):
+        """Store the custom field `values` of a ticket in the table.
+
+        :param db: the transaction in which the ticket is modified
+        :param values: a `dict` of database values indexed by field name
+        """
+        names = [name for name in values if name in self.fields]
+        if not names:
+            return
+        columns = [db.quote(name) for name in names]
+        args = [values[name] for name in names]
+        if db("SELECT ticket FROM %s WHERE ticket=%%s" % self.table_name,
+              (tkt_id,)):
+            db("UPDATE %s SET %s WHERE ticket=%%s"
+               % (self.table_name, ','.join('%s=%%s' % column
+                                            for column in columns)),
+               args + [tkt_id])
+        else:
+            db("INSERT INTO %s (ticket,%s) VALUES (%s)"
+               % (self.table_name, ','.join(columns),
+                  ','.join(['%s'] * (len(columns) + 1))),
+               [tkt_id] + args)
+
+    def delete(self, db, tkt_id):
+        """Delete the row of a ticket from the table."""
+        if self.fields:
+            db("DELETE FROM %s WHERE ticket=%%s" % self.table_name,
+               (tkt_id,))
+
+    def rebuild(self):
+        """Create the table with a column for each custom field, or
+        recreate it if it already exists, and fill it from the
+        `ticket_custom` table.
+        """
+        names = [f['name'] for f in TicketSystem(self.env).fields
+                           if f.get('custom') and f['name'] != 'ticket']
+        dbm = DatabaseManager(self.env)
+        with self.env.db_transaction as db:
+            if self.table_name in db.get_table_names():
+                db.drop_table(self.table_name)
+            dbm.create_tables([Table(self.table_name, key='ticket')[
+                [Column('ticket', type='int')] +
+                [Column(name) for name in names]]])
+            if names:
+                columns = [db.quote(name) for name in names]
+                db("""INSERT INTO %s (ticket,%s)
+                      SELECT ticket,%s FROM ticket_custom GROUP BY ticket
+                      """ % (self.table_name, ','.join(columns),
+                             ','.join(['MAX(CASE WHEN name=%s '
+                                       'THEN value END)'] * len(columns))),
+                   names)
+            del self.fields
+
+    def drop(self):
+        """Drop the table."""
+        with self.env.db_transaction as db:
+            if self.table_name in db.get_table_names():
+                db.drop_table(self.table_name)
+            del self.fields
+
+
 class MilestoneCache(core.Component):
     """Cache for milestone data and factory for 'milestone' resources."""
 
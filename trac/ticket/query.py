@@ -21,18 +21,23 @@ from itertools import groupby
 from math import ceil
 import csv
 import re
+import time
 
 from genshi.builder import tag
 
+from trac.cache import cached
 from trac.config import Option, IntOption
 from trac.core import *
 from trac.db import get_column_names
 from trac.mimeview.api import IContentConverter, Mimeview
 from trac.resource import Resource
-from trac.ticket.api import TicketSystem
-from trac.ticket.model import Milestone
-from trac.ticket.roadmap import group_milestones
+from trac.ticket.api import IMilestoneChangeListener, ITicketChangeListener, \
+                           TicketSystem
+from trac.ticket.model import CustomFieldsTable, Milestone
+from trac.ticket.roadmap import apply_ticket_permissions, group_milestones
 from trac.util import Ranges, as_bool
+from trac.util.compat import OrderedDict
+from trac.util.concurrency import threading
 from trac.util.datefmt import from_utimestamp, format_date_or_datetime, \
                               parse_date, to_timestamp, to_utimestamp, utc, \
                               user_time
@@ -66,7 +71,7 @@ class Query(object):
 
     def __init__(self, env, report=None, constraints=None, cols=None,
                  order=None, desc=0, group=None, groupdesc=0, verbose=0,
-                 rows=None, page=None, max=None, format=None):
+                 rows=None, page=None, max=None, format=None, after=None):
         self.env = env
         self.id = report  # if not None, it's the corresponding saved query
         constraints = constraints or []
@@ -108,6 +113,20 @@ class Query(object):
         except ValueError:
             raise TracError(_("Query max %(max)s is invalid.", max=max))
 
+        # after=n retrieves the tickets following ticket n in the query
+        # results, which is cheaper than skipping the previous pages
+        if after in ('none', ''):
+            after = None
+        if after is not None:
+            try:
+                after = int(after)
+                if after < 1:
+                    raise ValueError()
+            except ValueError:
+                raise TracError(_("Query after %(after)s is invalid.",
+                                  after=after))
+        self.after = after
+
         if self.max == 0:
             self.has_more_pages = False
             self.offset = 0
@@ -146,7 +165,7 @@ class Query(object):
 
     @classmethod
     def from_string(cls, env, string, **kw):
-        kw_strs = ['order', 'group', 'page', 'max', 'format']
+        kw_strs = ['order', 'group', 'page', 'max', 'format', 'after']
         kw_arys = ['rows']
         kw_bools = ['desc', 'groupdesc', 'verbose']
         kw_synonyms = {'row': 'rows'}
@@ -268,6 +287,23 @@ class Query(object):
             cols[-1] = self.order
         return cols
 
+    @property
+    def seekable(self):
+        """Whether the pages of the query results can be retrieved by
+        seeking after the last ticket of the previous page (see the
+        `after` parameter), rather than by skipping the tickets of all
+        the previous pages.
+
+        This is the case when the query is paginated, not grouped, and
+        ordered by a field other than `milestone`, `version` or a custom
+        time field.
+        """
+        if not self.max or self.group or \
+                self.order in ('milestone', 'version'):
+            return False
+        field = self.fields.by_name(self.order, {})
+        return not (field.get('custom') and self.order in self.time_fields)
+
     def count(self, req=None, cached_ids=None, authname=None, tzinfo=None,
               locale=None):
         """Get the number of matching tickets for the present query.
@@ -276,9 +312,14 @@ class Query(object):
         return self._count(sql, args)
 
     def _count(self, sql, args):
-        cnt = self.env.db_query("SELECT COUNT(*) FROM (%s) AS x"
-                                % sql, args)[0][0]
-        # "AS x" is needed for MySQL ("Subqueries in the FROM Clause")
+        cache = self.env[QueryCountCache]
+        cnt = cache.get(sql, args) if cache else None
+        if cnt is None:
+            cnt = self.env.db_query("SELECT COUNT(*) FROM (%s) AS x"
+                                    % sql, args)[0][0]
+            # "AS x" is needed for MySQL ("Subqueries in the FROM Clause")
+            if cache:
+                cache.set(sql, args, cnt)
         self.env.log.debug("Count results in Query: %d", cnt)
         return cnt
 
@@ -302,11 +343,20 @@ class Query(object):
                 max = self.max
                 if self.group:
                     max += 1
-                sql += " LIMIT %d OFFSET %d" % (max, self.offset)
                 if (self.page > int(ceil(float(self.num_items) / self.max)) and
                         self.num_items != 0):
                     raise TracError(_("Page %(page)s is beyond the number of "
                                       "pages in the query", page=self.page))
+                seek_sql = None
+                if self.after is not None and self.seekable:
+                    seek_sql, seek_args = self._get_sql(req, cached_ids,
+                                                        authname, tzinfo,
+                                                        locale, self.after)
+                if seek_sql is not None:
+                    sql, args = seek_sql, seek_args
+                    sql += " LIMIT %d" % max
+                else:
+                    sql += " LIMIT %d OFFSET %d" % (max, self.offset)
 
             cursor.execute(sql, args)
             columns = get_column_names(cursor)
@@ -339,7 +389,7 @@ class Query(object):
             return results
 
     def get_href(self, href, id=None, order=None, desc=None, format=None,
-                 max=None, page=None):
+                 max=None, page=None, after=None):
         """Create a link corresponding to this query.
 
         :param href: the `Href` object used to build the URL
@@ -350,6 +400,8 @@ class Query(object):
         :param max: optionally override the max items per page
         :param page: optionally specify which page of results (defaults to
                      the first)
+        :param after: optionally specify the ticket after which the page
+                      of results starts
 
         Note: `get_resource_url` of a 'query' resource?
         """
@@ -397,6 +449,7 @@ class Query(object):
                           row=self.rows,
                           max=max,
                           page=page,
+                          after=after,
                           format=format)
 
     def to_string(self):
@@ -412,6 +465,16 @@ class Query(object):
     def get_sql(self, req=None, cached_ids=None, authname=None, tzinfo=None,
                 locale=None):
         """Return a (sql, params) tuple for the query."""
+        return self._get_sql(req, cached_ids, authname, tzinfo, locale)
+
+    def _get_sql(self, req=None, cached_ids=None, authname=None, tzinfo=None,
+                 locale=None, after=None):
+        """Return a (sql, params) tuple for the query.
+
+        If `after` is a ticket id, only the tickets sorted after that
+        ticket are selected. `(None, None)` is returned if the ticket
+        doesn't exist and is needed for comparing with other tickets.
+        """
         if req is not None:
             authname = req.authname
             tzinfo = req.tz
@@ -437,37 +500,52 @@ class Query(object):
         list_fields = [f['name'] for f in self.fields
                                  if f['type'] == 'text' and
                                     f.get('format') == 'list']
+        # Custom fields materialized in the ticket_custom_wide table
+        wide_fields = CustomFieldsTable(self.env).fields
+        wide_cols = [k for k in cols if k in custom_fields
+                                        and k in wide_fields]
+        joined_cols = [k for k in cols if k in custom_fields
+                                          and k not in wide_fields]
         # 31 is max of joins in SQLite 32-bit, 3 is for order, group and
         # "priority" columns
         max_joins = 31
-        use_joins = len(set(cols) & set(custom_fields)) + 3 <= max_joins
+        use_joins = len(joined_cols) + bool(wide_cols) + 3 <= max_joins
 
         sql = []
         sql.append("SELECT " + ",".join('t.%s AS %s' % (c, c) for c in cols
                                         if c not in custom_fields))
         sql.append(",priority.value AS priority_value")
         with self.env.db_query as db:
+            wide_join = "\n  LEFT OUTER JOIN %s AS tcw ON (tcw.ticket=t.id)" \
+                        % CustomFieldsTable.table_name if wide_cols else ''
             if use_joins:
                 # Use LEFT OUTER JOIN for ticket_custom table
+                sql.extend(",tcw.%s AS %s" % ((db.quote(k),) * 2)
+                           for k in wide_cols)
                 sql.extend(",%s.value AS %s" % ((db.quote(k),) * 2)
-                           for k in cols if k in custom_fields)
+                           for k in joined_cols)
                 sql.append("\nFROM ticket AS t")
+                sql.append(wide_join)
                 sql.extend("\n  LEFT OUTER JOIN ticket_custom AS %(qk)s ON "
                            "(%(qk)s.ticket=t.id AND %(qk)s.name='%(k)s')"
                             % {'qk': db.quote(k), 'k': k}
-                            for k in cols if k in custom_fields)
+                            for k in joined_cols)
             else:
                 # Use subquery for ticket_custom table
                 sql.extend(",%s AS %s" % ((db.quote(k),) * 2)
-                           for k in cols if k in custom_fields)
+                           for k in wide_cols + joined_cols)
                 sql.append('\nFROM (\n  SELECT ')
                 sql.append(','.join('t.%s AS %s' % (c, c)
                                     for c in cols if c not in custom_fields))
+                sql.extend(",\n  tcw.%s AS %s" % ((db.quote(k),) * 2)
+                           for k in wide_cols)
                 sql.extend(",\n  (SELECT c.value FROM ticket_custom c "
                            "WHERE c.ticket=t.id AND c.name='%s') AS %s"
                            % (k, db.quote(k))
-                           for k in cols if k in custom_fields)
-                sql.append("\n  FROM ticket AS t) AS t")
+                           for k in joined_cols)
+                sql.append("\n  FROM ticket AS t")
+                sql.append(wide_join)
+                sql.append(") AS t")
 
             # Join with the enum table for proper sorting
             for col in [c for c in enum_columns
@@ -482,6 +560,61 @@ class Query(object):
                 sql.append("\n  LEFT OUTER JOIN %s ON (%s.name=%s)"
                            % (col, col, col))
 
+            def get_custom_column(name):
+                if not use_joins:
+                    return 't.' + db.quote(name)
+                elif name in wide_fields:
+                    return 'tcw.' + db.quote(name)
+                else:
+                    return db.quote(name) + '.value'
+
+            def get_column(name):
+                if name in enum_columns:
+                    return name + '.value'
+                elif name not in custom_fields:
+                    return 't.' + name
+                else:
+                    return get_custom_column(name)
+
+            # Condition selecting the tickets sorted after ticket `after`
+            seek_sql = seek_args = None
+            if after is not None:
+                if self.order == 'id':
+                    seek_sql = 't.id<%s' if self.desc else 't.id>%s'
+                    seek_args = [after]
+                else:
+                    col = get_column(self.order)
+                    if self.order in self.time_fields:
+                        empty, value = 'COALESCE(%s,0)=0' % col, col
+                    else:
+                        empty = "COALESCE(%s,'')=''" % col
+                        value = db.cast(col, 'int') \
+                                if self.order in enum_columns \
+                                else "COALESCE(%s,'')" % col
+                    from_sql = ''.join(sql)
+                    from_sql = from_sql[from_sql.index('\nFROM'):]
+                    for is_empty, key in db("""
+                            SELECT %s,%s%s
+                            WHERE t.id=%%s
+                            """ % (empty, value, from_sql), (after,)):
+                        break
+                    else:
+                        return None, None
+                    if is_empty and self.desc:
+                        seek_sql = "(NOT (%s) OR t.id>%%s)" % empty
+                        seek_args = [after]
+                    elif is_empty:
+                        seek_sql = "(%s AND t.id>%%s)" % empty
+                        seek_args = [after]
+                    elif self.desc:
+                        seek_sql = "NOT (%s) AND (%s<%%s OR %s=%%s " \
+                                   "AND t.id>%%s)" % (empty, value, value)
+                        seek_args = [key, key, after]
+                    else:
+                        seek_sql = "(%s OR %s>%%s OR %s=%%s AND t.id>%%s)" \
+                                   % (empty, value, value)
+                        seek_args = [key, key, after]
+
             def get_timestamp(date):
                 if date:
                     try:
@@ -493,10 +626,8 @@ class Query(object):
             def get_constraint_sql(name, value, mode, neg):
                 if name not in custom_fields:
                     col = 't.' + name
-                elif use_joins:
-                    col = db.quote(name) + '.value'
                 else:
-                    col = 't.' + db.quote(name)
+                    col = get_custom_column(name)
                 value = value[len(mode) + neg:]
 
                 if name in self.time_fields:
@@ -599,10 +730,8 @@ class Query(object):
                     elif not mode and len(v) > 1 and k not in self.time_fields:
                         if k not in custom_fields:
                             col = 't.' + k
-                        elif use_joins:
-                            col = db.quote(k) + '.value'
                         else:
-                            col = 't.' + db.quote(k)
+                            col = get_custom_column(k)
                         clauses.append("COALESCE(%s,'') %sIN (%s)"
                                        % (col, 'NOT ' if neg else '',
                                           ','.join('%s' for val in v)))
@@ -629,11 +758,20 @@ class Query(object):
                              (get_clause_sql(c) for c in self.constraints))
             if clauses:
                 sql.append("\nWHERE ")
+                if seek_sql:
+                    sql.append("(")
                 sql.append(" OR ".join('(%s)' % c for c in clauses))
                 if cached_ids:
                     sql.append(" OR ")
                     sql.append("id in (%s)" %
                                (','.join(str(id) for id in cached_ids)))
+                if seek_sql:
+                    sql.append(")\n  AND ")
+            elif seek_sql:
+                sql.append("\nWHERE ")
+            if seek_sql:
+                sql.append(seek_sql)
+                args.extend(seek_args)
 
             sql.append("\nORDER BY ")
             order_cols = [(self.order, self.desc)]
@@ -641,14 +779,7 @@ class Query(object):
                 order_cols.insert(0, (self.group, self.groupdesc))
 
             for name, desc in order_cols:
-                if name in enum_columns:
-                    col = name + '.value'
-                elif name not in custom_fields:
-                    col = 't.' + name
-                elif use_joins:
-                    col = db.quote(name) + '.value'
-                else:
-                    col = 't.' + db.quote(name)
+                col = get_column(name)
                 desc = ' DESC' if desc else ''
                 # FIXME: This is a somewhat ugly hack.  Can we also have the
                 #        column type for this?  If it's an integer, we do
@@ -670,6 +801,10 @@ class Query(object):
                     sql.append("COALESCE(version.time,0)=0%s,"
                                "version.time%s,%s%s"
                                % (desc, desc, col, desc))
+                elif seek_sql and name != 'id' and \
+                        name not in self.time_fields:
+                    # Sort empty values consistently with the seek condition
+                    sql.append("COALESCE(%s,'')%s" % (col, desc))
                 else:
                     sql.append("%s%s" % (col, desc))
                 if name == self.group and not name == self.order:
@@ -753,6 +888,13 @@ class Query(object):
                     for (label, milestones) in groups]
             fields[name] = field
 
+        if context.perm is not None:
+            # Check the permissions on all the tickets at once, the
+            # decisions are reused when rendering the results
+            context.perm.filter('TICKET_VIEW',
+                                [Resource('ticket', ticket['id'])
+                                 for ticket in tickets])
+
         groups = {}
         groupsequence = []
         for ticket in tickets:
@@ -790,8 +932,10 @@ class Query(object):
 
         if req:
             if results.has_next_page:
+                after = tickets[-1]['id'] if self.seekable and tickets \
+                        else None
                 next_href = self.get_href(req.href, max=self.max,
-                                          page=self.page + 1)
+                                          page=self.page + 1, after=after)
                 add_link(req, 'next', next_href, _("Next Page"))
 
             if results.has_previous_page:
@@ -827,6 +971,111 @@ class Query(object):
                 'paginator': results}
 
 
+class QueryCountCache(Component):
+    """Cache of the number of tickets matching the recently executed
+    queries.
+
+    The entries are keyed by the SQL and the parameters of the query,
+    which reflect the query constraints after substitution of `$USER`
+    and the time zone of the user. The cache is invalidated in all
+    processes when a ticket is modified or a milestone is renamed or
+    deleted, and entries expire after
+    `[query] count_cache_lifetime` seconds so that tickets modified
+    directly in the database are eventually taken into account.
+    """
+
+    implements(IMilestoneChangeListener, ITicketChangeListener)
+
+    lifetime = IntOption('query', 'count_cache_lifetime', 60,
+        """Number of seconds during which the number of tickets matching
+        a query is reused for displaying other pages of the results or
+        the `count` format of the `TicketQuery` macro. Set to 0 to
+        disable the cache. (''since 1.2'')""")
+
+    max_entries = 1000
+
+    def __init__(self):
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    @cached
+    def _generation(self):
+        return object()
+
+    def get(self, sql, args):
+        """Return the number of tickets matching the query `sql` with
+        parameters `args`, or `None` if not cached.
+        """
+        if self.lifetime <= 0:
+            return None
+        key = (sql, tuple(args))
+        generation = self._generation
+        with self._lock:
+            entry = self._counts.pop(key, None)
+            if entry is None:
+                return None
+            entry_generation, created, count = entry
+            if entry_generation is not generation or \
+                    time.time() - created > self.lifetime:
+                return None
+            self._counts[key] = entry
+            return count
+
+    def set(self, sql, args, count):
+        """Remember the number of tickets matching the query `sql` with
+        parameters `args`.
+        """
+        if self.lifetime <= 0:
+            return
+        key = (sql, tuple(args))
+        generation = self._generation
+        with self._lock:
+            self._counts.pop(key, None)
+            self._counts[key] = (generation, time.time(), count)
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+
+    def invalidate(self):
+        """Invalidate the cache in all processes."""
+        del self._generation
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        self.invalidate()
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        if old_values:
+            self.invalidate()
+
+    def tickets_changed(self, changes, comment, author):
+        if any(old_values for ticket, old_values in changes):
+            self.invalidate()
+
+    def ticket_deleted(self, ticket):
+        self.invalidate()
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        pass
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        self.invalidate()
+
+    # IMilestoneChangeListener methods
+
+    def milestone_created(self, milestone):
+        pass
+
+    def milestone_changed(self, milestone, old_values):
+        # Renaming a milestone retargets its tickets
+        if 'name' in old_values:
+            self.invalidate()
+
+    def milestone_deleted(self, milestone):
+        self.invalidate()
+
+
 class QueryModule(Component):
 
     implements(IRequestHandler, INavigationContributor, IWikiSyntaxProvider,
@@ -963,7 +1212,7 @@ class QueryModule(Component):
                       'groupdesc' in args, 'verbose' in args,
                       rows,
                       args.get('page'),
-                      max)
+                      max, after=args.get('after'))
 
         if 'update' in req.args:
             # Reset session vars
@@ -1183,22 +1432,22 @@ class QueryModule(Component):
 
             chrome = Chrome(self.env)
             context = web_context(req)
-            results = query.execute(req)
+            results = apply_ticket_permissions(self.env, req,
+                                               query.execute(req))
             for result in results:
                 ticket = Resource(self.realm, result['id'])
-                if 'TICKET_VIEW' in req.perm(ticket):
-                    values = []
-                    for col in cols:
-                        value = result[col]
-                        if col in ('cc', 'owner', 'reporter'):
-                            value = chrome.format_emails(context.child(ticket),
-                                                         value)
-                        elif col in query.time_fields:
-                            format = query.fields.by_name(col).get('format')
-                            value = user_time(req, format_date_or_datetime,
-                                              format, value) if value else ''
-                        values.append(value)
-                    yield writerow(values)
+                values = []
+                for col in cols:
+                    value = result[col]
+                    if col in ('cc', 'owner', 'reporter'):
+                        value = chrome.format_emails(context.child(ticket),
+                                                     value)
+                    elif col in query.time_fields:
+                        format = query.fields.by_name(col).get('format')
+                        value = user_time(req, format_date_or_datetime,
+                                          format, value) if value else ''
+                    values.append(value)
+                yield writerow(values)
 
         return iterate(), '%s;charset=utf-8' % mimetype
 
@@ -1285,6 +1534,12 @@ class TicketQueryMacro(WikiMacroBase):
     The `max` parameter can be used to limit the number of tickets shown
     (defaults to '''0''', i.e. no maximum).
 
+    The `page` parameter selects which page of `max` tickets is shown
+    (defaults to '''1'''). Alternatively, the `after` parameter can be
+    set to a ticket id in order to show the `max` tickets following that
+    ticket, which is faster for pages far from the first one.
+    (//since 1.2//)
+
     The `order` parameter sets the field used for ordering tickets
     (defaults to '''id''').
 
@@ -1329,7 +1584,7 @@ class TicketQueryMacro(WikiMacroBase):
             if m:
                 kw = arg[:m.end() - 1].strip()
                 value = arg[m.end():]
-                if kw in ('order', 'max', 'format', 'col'):
+                if kw in ('order', 'max', 'page', 'after', 'format', 'col'):
                     kwargs[kw] = value
                 else:
                     clauses[-1][kw] = value
@@ -1391,7 +1646,6 @@ class TicketQueryMacro(WikiMacroBase):
 
         if format == 'progress':
             from trac.ticket.roadmap import (RoadmapModule,
-                                             apply_ticket_permissions,
                                              get_ticket_stats,
                                              grouped_stats_data)
 
@@ -1459,8 +1713,7 @@ class TicketQueryMacro(WikiMacroBase):
         # Formats above had their own permission checks, here we need to
         # do it explicitly:
 
-        tickets = [t for t in tickets
-                   if 'TICKET_VIEW' in req.perm(self.realm, t['id'])]
+        tickets = apply_ticket_permissions(self.env, req, tickets)
 
         if not tickets:
             return tag.span(_("No results"), class_='query_no_results')
@@ -23,19 +23,22 @@ from genshi.builder import tag
 
 from trac import __version__
 from trac.attachment import Attachment, AttachmentModule
+from trac.cache import cached
 from trac.config import ConfigSection, ExtensionOption, Option
 from trac.core import *
 from trac.notification.api import NotificationSystem
 from trac.perm import IPermissionRequestor
 from trac.resource import *
-from trac.search import ISearchSource, search_to_regexps, shorten_result
+from trac.search import ISearchSource, SearchIndex, merge_search_results, \
+                         search_to_regexps, shorten_result
 from trac.util import as_bool, partition
 from trac.util.datefmt import parse_date, utc, pretty_timedelta, to_datetime, \
                               get_datetime_format_hint, format_date, \
                               format_datetime, from_utimestamp, user_time
 from trac.util.text import CRLF, exception_to_unicode, to_unicode
 from trac.util.translation import _, tag_
-from trac.ticket.api import TicketSystem
+from trac.ticket.api import IMilestoneChangeListener, \
+                           ITicketChangeListener, TicketSystem
 from trac.ticket.notification import BatchTicketChangeEvent
 from trac.ticket.model import Milestone, MilestoneCache, Ticket
 from trac.timeline.api import ITimelineEventProvider
@@ -54,6 +57,18 @@ class ITicketGroupStatsProvider(Interface):
         This method returns a valid `TicketGroupStats` object.
         """
 
+    def get_ticket_group_stats_from_counts(status_counts):
+        """Gather statistics on a group of tickets from the number of
+        tickets in each status, given as a `dict` mapping the status to
+        the count.
+
+        This method is optional and used to compute the statistics of
+        many groups without querying the tickets of each group. It
+        returns a valid `TicketGroupStats` object.
+
+        (''since 1.2'')
+        """
+
 class TicketGroupStats(object):
     """Encapsulates statistics on a group of tickets."""
 
@@ -226,17 +241,22 @@ class DefaultTicketGroupStatsProvider(Component):
             return self.default_milestone_groups
 
     def get_ticket_group_stats(self, ticket_ids):
-        total_cnt = len(ticket_ids)
-        all_statuses = set(TicketSystem(self.env).get_all_status())
         status_cnt = {}
-        for s in all_statuses:
-            status_cnt[s] = 0
-        if total_cnt:
+        if ticket_ids:
             for status, count in self.env.db_query("""
                     SELECT status, count(status) FROM ticket
                     WHERE id IN (%s) GROUP BY status
                     """ % ",".join(str(x) for x in sorted(ticket_ids))):
                 status_cnt[status] = count
+        return self.get_ticket_group_stats_from_counts(status_cnt)
+
+    def get_ticket_group_stats_from_counts(self, status_counts):
+        all_statuses = set(TicketSystem(self.env).get_all_status())
+        status_cnt = {}
+        for s in all_statuses:
+            status_cnt[s] = 0
+        for status, count in status_counts.iteritems():
+            status_cnt[status] = count
 
         stat = TicketGroupStats(_('ticket status'), _('tickets'))
         remaining_statuses = set(all_statuses)
@@ -292,6 +312,38 @@ class DefaultTicketGroupStatsProvider(Component):
 def get_ticket_stats(provider, tickets):
     return provider.get_ticket_group_stats([t['id'] for t in tickets])
 
+def get_milestones_stats(env, req, provider, milestones):
+    """Return the statistics on the tickets of each of the `milestones`
+    that the user can view, in the same order.
+
+    The tickets of all the milestones are read from the
+    `MilestoneTicketsCache` and filtered by permissions in one call.
+
+    :since: 1.2
+    """
+    tickets = MilestoneTicketsCache(env).tickets
+    names = [milestone.name for milestone in milestones]
+    resources = [Resource('ticket', tkt_id) for name in names
+                 for tkt_id, status in tickets.get(name, ())]
+    allowed = set(resource.id for resource in
+                  req.perm.filter('TICKET_VIEW', resources))
+    from_counts = getattr(provider, 'get_ticket_group_stats_from_counts',
+                          None)
+    stats = []
+    for name in names:
+        visible = [(tkt_id, status) for tkt_id, status
+                                    in tickets.get(name, ())
+                                    if tkt_id in allowed]
+        if from_counts:
+            status_cnt = {}
+            for tkt_id, status in visible:
+                status_cnt[status] = status_cnt.get(status, 0) + 1
+            stats.append(from_counts(status_cnt))
+        else:
+            stats.append(provider.get_ticket_group_stats(
+                [tkt_id for tkt_id, status in visible]))
+    return stats
+
 def get_tickets_for_milestone(env, milestone=None, field='component'):
     """Retrieve all tickets associated with the given `milestone`.
     """
@@ -311,8 +363,10 @@ def get_tickets_for_milestone(env, milestone=None, field='component'):
 def apply_ticket_permissions(env, req, tickets):
     """Apply permissions to a set of milestone tickets as returned by
     `get_tickets_for_milestone()`."""
-    return [t for t in tickets
-            if 'TICKET_VIEW' in req.perm('ticket', t['id'])]
+    resources = [Resource('ticket', t['id']) for t in tickets]
+    allowed = set(resource.id for resource in
+                  req.perm.filter('TICKET_VIEW', resources))
+    return [t for t in tickets if t['id'] in allowed]
 
 def milestone_stats_data(env, req, stat, name, grouped_by='component',
                          group=None):
@@ -380,6 +434,68 @@ def grouped_stats_data(env, stats_provider, tickets, by, per_group_stats_data):
     return data
 
 
+class MilestoneTicketsCache(Component):
+    """Cache of the tickets associated with each milestone, used for
+    computing the statistics of the roadmap.
+
+    (''since 1.2'')
+    """
+
+    implements(IMilestoneChangeListener, ITicketChangeListener)
+
+    @cached
+    def tickets(self):
+        """Dictionary mapping each milestone name to the list of
+        `(id, status)` tuples of its tickets.
+        """
+        tickets = {}
+        for tkt_id, milestone, status in self.env.db_query("""
+                SELECT id, milestone, status FROM ticket
+                WHERE COALESCE(milestone, '')!='' ORDER BY id
+                """):
+            tickets.setdefault(milestone, []).append((tkt_id, status))
+        return tickets
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        if ticket['milestone']:
+            del self.tickets
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        if 'milestone' in old_values or 'status' in old_values:
+            del self.tickets
+
+    def tickets_changed(self, changes, comment, author):
+        if any('milestone' in old_values or 'status' in old_values
+               for ticket, old_values in changes):
+            del self.tickets
+
+    def ticket_deleted(self, ticket):
+        if ticket['milestone']:
+            del self.tickets
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        pass
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        if 'milestone' in changes or 'status' in changes:
+            del self.tickets
+
+    # IMilestoneChangeListener methods
+
+    def milestone_created(self, milestone):
+        pass
+
+    def milestone_changed(self, milestone, old_values):
+        if 'name' in old_values:
+            del self.tickets
+
+    def milestone_deleted(self, milestone):
+        del self.tickets
+
+
 def group_milestones(milestones, include_completed):
     """Group milestones into "open with due date", "open with no due date",
     and possibly "completed". Return a list of (label, milestones) tuples."""
@@ -445,22 +561,17 @@ class RoadmapModule(Component):
         milestones = [m for m in milestones
                       if 'MILESTONE_VIEW' in req.perm(m.resource)]
 
-        stats = []
         queries = []
 
-        for milestone in milestones:
-            tickets = get_tickets_for_milestone(
-                    self.env, milestone=milestone.name, field='owner')
-            tickets = apply_ticket_permissions(self.env, req, tickets)
-            stat = get_ticket_stats(self.stats_provider, tickets)
-            stats.append(milestone_stats_data(self.env, req, stat,
-                                              milestone.name))
-            #milestone['tickets'] = tickets # for the iCalendar view
-
         if req.args.get('format') == 'ics':
             self._render_ics(req, milestones)
             return
 
+        stats = [milestone_stats_data(self.env, req, stat, milestone.name)
+                 for milestone, stat
+                 in zip(milestones, get_milestones_stats(
+                            self.env, req, self.stats_provider, milestones))]
+
         # FIXME should use the 'webcal:' scheme, probably
         username = None
         if req.authname and req.authname != 'anonymous':
@@ -606,6 +717,8 @@ class MilestoneModule(Component):
 
     realm = 'milestone'
 
+    timeline_events_cacheable = True
+
     stats_provider = ExtensionOption('milestone', 'stats_provider',
                                      ITicketGroupStatsProvider,
                                      'DefaultTicketGroupStatsProvider',
@@ -1003,6 +1116,7 @@ class MilestoneModule(Component):
         yield ('milestone', self._format_link)
 
     def _format_link(self, formatter, ns, name, label):
+        formatter.add_dependency(self.realm)
         name, query, fragment = formatter.split_link(name)
         return self._render_link(formatter.context, name, label,
                                  query + fragment)
@@ -1086,23 +1200,36 @@ class MilestoneModule(Component):
             yield ('milestone', _('Milestones'))
 
     def get_search_results(self, req, terms, filters):
+        return self.get_ordered_search_results(req, terms, filters, None)
+
+    def get_ordered_search_results(self, req, terms, filters, limit):
         if not 'milestone' in filters:
-            return
-        term_regexps = search_to_regexps(terms)
+            return []
         milestone_realm = Resource(self.realm)
-        for name, due, completed, description \
-                in MilestoneCache(self.env).milestones.itervalues():
-            if all(r.search(description) or r.search(name)
-                   for r in term_regexps):
-                milestone = milestone_realm(id=name)
-                if 'MILESTONE_VIEW' in req.perm(milestone):
-                    dt = (completed if completed else
-                          due if due else datetime.now(utc))
-                    yield (get_resource_url(self.env, milestone, req.href),
-                           get_resource_name(self.env, milestone), dt,
-                           '', shorten_result(description, terms))
-
-        # Attachments
-        for result in AttachmentModule(self.env).get_search_results(
-                req, milestone_realm, terms):
-            yield result
+        return merge_search_results([
+            self._get_milestone_search_results(req, milestone_realm, terms),
+            AttachmentModule(self.env).get_search_results(
+                req, milestone_realm, terms, limit)])
+
+    def _get_milestone_search_results(self, req, milestone_realm, terms):
+        milestones = MilestoneCache(self.env).milestones
+        index = SearchIndex(self.env)
+        if index.enabled:
+            matches = [milestones[id] for realm, id, score
+                       in index.search(terms, self.realm)
+                       if id in milestones]
+        else:
+            term_regexps = search_to_regexps(terms)
+            matches = [m for m in milestones.itervalues()
+                       if all(r.search(m[3]) or r.search(m[0])
+                              for r in term_regexps)]
+        now = datetime.now(utc)
+        matches = sorted(((completed or due or now, name, description)
+                          for name, due, completed, description in matches),
+                         key=lambda match: match[0], reverse=True)
+        for dt, name, description in matches:
+            milestone = milestone_realm(id=name)
+            if 'MILESTONE_VIEW' in req.perm(milestone):
+                yield (get_resource_url(self.env, milestone, req.href),
+                       get_resource_name(self.env, milestone), dt,
+                       '', shorten_result(description, terms))
@@ -13,12 +13,17 @@
 
 from datetime import datetime, timedelta
 
-from trac.perm import PermissionCache, PermissionSystem
+from trac.core import Component, implements
+from trac.perm import IPermissionPolicy, PermissionCache, PermissionSystem
 from trac.resource import Resource
-from trac.test import EnvironmentStub, Mock
+from trac.test import EnvironmentStub, Mock, MockPerm
 from trac.ticket.api import TicketSystem
 from trac.ticket.model import Milestone, Ticket, Version
 from trac.util.datefmt import utc
+from trac.web.chrome import web_context
+from trac.web.href import Href
+from trac.wiki.api import IWikiSyntaxProvider
+from trac.wiki.formatter import format_to_html, format_to_oneliner
 
 import unittest
 
@@ -291,8 +296,127 @@ class TicketSystemTestCase(unittest.TestCase):
         self.assertFalse(self.ticket_system.resource_exists(r4))
 
 
+class TicketOwnerPolicy(Component):
+    implements(IPermissionPolicy)
+
+    cacheable = True
+
+    def check_permission(self, action, username, resource, perm):
+        if action == 'TICKET_MODIFY' and resource and \
+                resource.realm == 'ticket' and resource.id is not None:
+            return Ticket(self.env, resource.id)['owner'] == username
+
+
+class TicketPermissionCacheInvalidatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*', TicketOwnerPolicy])
+        self.env.config.set('trac', 'permission_policies',
+                            'TicketOwnerPolicy, DefaultPermissionPolicy')
+        self.ticket = Ticket(self.env)
+        self.ticket.populate({'summary': 'Summary', 'owner': 'joe'})
+        self.ticket.insert()
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _can_modify(self, username):
+        perm = PermissionCache(self.env, username)
+        return 'TICKET_MODIFY' in perm(self.ticket.resource)
+
+    def test_owner_change(self):
+        self.assertTrue(self._can_modify('joe'))
+        self.assertFalse(self._can_modify('bob'))
+        self.ticket['owner'] = 'bob'
+        self.ticket.save_changes('admin')
+        self.assertFalse(self._can_modify('joe'))
+        self.assertTrue(self._can_modify('bob'))
+
+    def test_other_change(self):
+        self.assertTrue(self._can_modify('joe'))
+        self.env.db_transaction("UPDATE ticket SET owner='bob'")
+        self.ticket['summary'] = 'Modified summary'
+        self.ticket.save_changes('admin')
+        # Cached decision
+        self.assertTrue(self._can_modify('joe'))
+
+
+class CountingResolver(Component):
+    """Link resolver recording the targets it formats in the request."""
+
+    implements(IWikiSyntaxProvider)
+
+    def get_wiki_syntax(self):
+        yield (r"@@\d+", lambda formatter, match, fullmatch:
+                             self._format_link(formatter, 'counted',
+                                               match[2:], match))
+
+    def get_link_resolvers(self):
+        yield ('counted', self._format_link)
+
+    def _format_link(self, formatter, ns, target, label):
+        formatter.context.req.formatted.append(target)
+        return label
+
+
+class TicketLinkResolutionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True)
+        self.ticket_system = TicketSystem(self.env)
+        for summary in ('First', 'Second', 'Third'):
+            ticket = Ticket(self.env)
+            ticket.populate({'summary': summary, 'reporter': 'joe',
+                             'status': 'new'})
+            ticket.insert()
+        self.resolved = []
+        resolve_links = self.ticket_system.resolve_links
+        def record_resolve_links(formatter, ns, targets):
+            self.resolved.append(sorted(targets))
+            return resolve_links(formatter, ns, targets)
+        self.ticket_system.resolve_links = record_resolve_links
+        self.req = Mock(href=Href('/'), abs_href=Href('http://example.org/'),
+                        authname='anonymous', perm=MockPerm(), args={},
+                        formatted=[])
+        self.context = web_context(self.req, 'wiki', 'WikiStart')
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_links_resolved_in_bulk(self):
+        html = unicode(format_to_html(self.env, self.context,
+                                      "#1 and ticket:2\n"
+                                      "|| [ticket:3 third] || #4 ||\n"
+                                      "#1"))
+        self.assertEqual([[1, 2, 3, 4]], self.resolved)
+        self.assertIn('title="defect: First (new)"', html)
+        self.assertIn('title="defect: Third (new)"', html)
+        self.assertIn('<a class="missing ticket">#4</a>', html)
+
+    def test_links_resolved_in_bulk_oneliner(self):
+        html = unicode(format_to_oneliner(self.env, self.context,
+                                          "#2, #3 and #1"))
+        self.assertEqual([[1, 2, 3]], self.resolved)
+        self.assertIn('title="defect: Second (new)"', html)
+
+    def test_other_resolvers_run_once(self):
+        format_to_html(self.env, self.context,
+                       "#1 counted:1 counted:2\n * counted:3 @@4 #2")
+        self.assertEqual(['1', '2', '3', '4'], self.req.formatted)
+        self.assertEqual([[1, 2]], self.resolved)
+
+    def test_links_in_processors_resolved_separately(self):
+        format_to_html(self.env, self.context,
+                       "#1\n{{{#!div\n#2 #3\n}}}\n")
+        self.assertEqual([[1], [2, 3]], self.resolved)
+
+
 def suite():
-    return unittest.makeSuite(TicketSystemTestCase)
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TicketSystemTestCase))
+    suite.addTest(unittest.makeSuite(TicketPermissionCacheInvalidatorTestCase))
+    suite.addTest(unittest.makeSuite(TicketLinkResolutionTestCase))
+    return suite
 
 
 if __name__ == '__main__':
@@ -381,6 +381,35 @@ class ProcessRequestTestCase(unittest.TestCase):
         self.assertFieldChanged(1, 'reporter', 'user1')
         self.assertFieldChanged(2, 'reporter', 'user1')
 
+    def test_progress_sent_for_many_tickets(self):
+        """The progress is reported while saving more than one batch of
+        tickets."""
+        for idx in xrange(3):
+            self._insert_ticket('Ticket %d' % idx, reporter='user1')
+        output = []
+        req = self._create_request('has_ta_&_bm', args={
+            'batchmod_value_reporter': 'user2',
+            'batchmod_value_comment': '',
+            'action': 'leave',
+            'selected_tickets': '1,2,3',
+        }, chrome={'warnings': []}, send_response=lambda code: None,
+           send_header=lambda name, value: None, end_headers=lambda: None,
+           write=output.append)
+
+        bmm = BatchModifyModule(self.env)
+        batch_size = Ticket.batch_size
+        Ticket.batch_size = 2
+        try:
+            self.assertRaises(RequestDone, bmm.process_request, req)
+        finally:
+            Ticket.batch_size = batch_size
+        output = ''.join(output)
+        self.assertIn('<p>2 of 3 tickets saved</p>', output)
+        self.assertIn('<p>3 of 3 tickets saved</p>', output)
+        self.assertIn('window.location.replace("/trac.cgi/query")', output)
+        for id in (1, 2, 3):
+            self.assertFieldChanged(id, 'reporter', 'user2')
+
 
 def suite():
     suite = unittest.TestSuite()
@@ -24,7 +24,7 @@ from trac.core import TracError, implements
 from trac.resource import Resource, ResourceNotFound
 from trac.test import EnvironmentStub
 from trac.ticket.model import (
-    Ticket, Component, Milestone, Priority, Type, Version
+    CustomFieldsTable, Ticket, Component, Milestone, Priority, Type, Version
 )
 from trac.ticket.roadmap import MilestoneModule
 from trac.ticket.api import (
@@ -83,6 +83,24 @@ class TestTicketChangeListener_2(core.Component):
         self.changes = changes
 
 
+class TestTicketsChangedListener(core.Component):
+    implements(ITicketChangeListener)
+
+    calls = []
+
+    def ticket_created(self, ticket):
+        pass
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        pass
+
+    def tickets_changed(self, changes, comment, author):
+        self.calls.append((changes, comment, author))
+
+    def ticket_deleted(self, ticket):
+        pass
+
+
 class TicketTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -484,6 +502,99 @@ class TicketTestCase(unittest.TestCase):
         self.assertEqual('deleted', listener.action)
         self.assertEqual(ticket, listener.ticket)
 
+    def test_select(self):
+        id1 = self._insert_ticket('Foo', reporter='joe', foo='bar')
+        id2 = self._insert_ticket('Bar', reporter='jim')
+        tickets = Ticket.select(self.env, [str(id2), id1])
+        self.assertEqual([id2, id1], [ticket.id for ticket in tickets])
+        for ticket in tickets:
+            expected = Ticket(self.env, ticket.id)
+            self.assertEqual(expected.values, ticket.values)
+            self.assertEqual({}, ticket._old)
+        self.assertEqual('bar', tickets[1]['foo'])
+        tickets[0]['reporter'] = 'jane'
+        self.assertEqual('joe', tickets[1]['reporter'])
+        self.assertEqual([], Ticket.select(self.env, []))
+        self.assertRaises(ResourceNotFound, Ticket.select, self.env,
+                          [id1, 42])
+        self.assertRaises(ResourceNotFound, Ticket.select, self.env, [-1])
+
+    def _change_tickets(self, tickets):
+        for idx, ticket in enumerate(tickets):
+            ticket['summary'] = 'Summary %d' % idx
+            ticket['foo'] = 'Foo %d' % idx
+            ticket['cc'] = 'joe;jim, joe'
+
+    def test_save_all_changes(self):
+        t1 = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
+        t2 = datetime(2001, 1, 1, 1, 1, 2, 0, utc)
+        ids = [self._insert_ticket('Foo', reporter='joe', foo='bar'),
+               self._insert_ticket('Bar', reporter='jim')]
+        expected_ids = [self._insert_ticket('Foo', reporter='joe', foo='bar'),
+                        self._insert_ticket('Bar', reporter='jim')]
+        for tkt_id in ids + expected_ids:
+            ticket = Ticket(self.env, tkt_id)
+            ticket.save_changes('joe', 'First', t1)
+
+        tickets = Ticket.select(self.env, ids)
+        self._change_tickets(tickets)
+        self.assertEqual(tickets, Ticket.save_all_changes(
+            self.env, tickets, 'jane', 'Second', t2))
+        expected = Ticket.select(self.env, expected_ids)
+        self._change_tickets(expected)
+        for ticket in expected:
+            ticket.save_changes('jane', 'Second', t2)
+
+        for ticket, expected_ticket in zip(tickets, expected):
+            self.assertEqual({}, ticket._old)
+            self.assertEqual(t2, ticket['changetime'])
+            values = Ticket(self.env, ticket.id).values
+            del values['time'], expected_ticket.values['time']
+            self.assertEqual(expected_ticket.values, values)
+            self.assertEqual(expected_ticket.get_changelog(),
+                             ticket.get_changelog())
+        self.assertEqual('joe, jim', tickets[0]['cc'])
+
+    def test_save_all_changes_unmodified(self):
+        tkt_id = self._insert_ticket('Foo', reporter='joe')
+        tickets = Ticket.select(self.env, [tkt_id])
+        self.assertEqual([], Ticket.save_all_changes(self.env, tickets))
+        self.assertEqual([], tickets[0].get_changelog())
+        self.assertEqual(tickets, Ticket.save_all_changes(self.env, tickets,
+                                                          'joe', 'Comment'))
+        self.assertEqual(1, len(tickets[0].get_changelog()))
+
+    def test_save_all_changes_progress(self):
+        ids = [self._insert_ticket('Foo', reporter='joe')
+               for idx in xrange(5)]
+        tickets = Ticket.select(self.env, ids)
+        calls = []
+        batch_size = Ticket.batch_size
+        Ticket.batch_size = 2
+        try:
+            Ticket.save_all_changes(self.env, tickets, 'joe', 'Comment',
+                                    progress=lambda *args: calls.append(args))
+        finally:
+            Ticket.batch_size = batch_size
+        self.assertEqual([(2, 5), (4, 5), (5, 5)], calls)
+
+    def test_save_all_changes_listeners(self):
+        listener = TestTicketChangeListener(self.env)
+        TestTicketsChangedListener.calls = []
+        ids = [self._insert_ticket('Foo', reporter='joe', component='foo'),
+               self._insert_ticket('Bar', reporter='joe', component='foo')]
+        tickets = Ticket.select(self.env, ids)
+        for ticket in tickets:
+            ticket['component'] = 'bar'
+        Ticket.save_all_changes(self.env, tickets, 'jane', 'Comment')
+        self.assertEqual('changed', listener.action)
+        self.assertEqual(tickets[1], listener.ticket)
+        self.assertEqual({'component': 'foo'}, listener.old_values)
+        self.assertEqual([([(tickets[0], {'component': 'foo'}),
+                            (tickets[1], {'component': 'foo'})],
+                           'Comment', 'jane')],
+                         TestTicketsChangedListener.calls)
+
 
 class TicketCommentTestCase(unittest.TestCase):
 
@@ -848,6 +959,86 @@ class TicketCommentDeleteTestCase(TicketCommentTestCase):
                               foo=('change 1', 'change2')),
                          listener.changes)
 
+class CustomFieldsTableTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True)
+        self.env.config.set('ticket-custom', 'foo', 'text')
+        self.env.config.set('ticket-custom', 'bar', 'checkbox')
+        self.env.config.set('ticket-custom', 'due_date', 'text')
+        self.table = CustomFieldsTable(self.env)
+
+    def tearDown(self):
+        self.table.drop()
+        self.env.reset_db()
+
+    def _insert_ticket(self, **values):
+        ticket = Ticket(self.env)
+        ticket.populate(values)
+        ticket['summary'] = 'Summary'
+        ticket.insert()
+        return ticket
+
+    def _get_rows(self):
+        with self.env.db_query as db:
+            return db("""SELECT ticket,foo,bar,%s FROM ticket_custom_wide
+                         ORDER BY ticket""" % db.quote('due_date'))
+
+    def test_no_table(self):
+        self.assertEqual(frozenset(), self.table.fields)
+        ticket = self._insert_ticket(foo='a')
+        ticket['foo'] = 'b'
+        ticket.save_changes('joe')
+        ticket.delete()
+
+    def test_rebuild(self):
+        ticket1 = self._insert_ticket(foo='a', bar='1')
+        ticket2 = self._insert_ticket()
+        self.env.db_transaction("""
+            DELETE FROM ticket_custom WHERE ticket=%s
+            """, (ticket2.id,))
+        self.table.rebuild()
+        self.assertEqual(frozenset(['foo', 'bar', 'due_date']),
+                         self.table.fields)
+        self.assertEqual([(ticket1.id, 'a', '1', None)], self._get_rows())
+
+    def test_column_names(self):
+        self.table.rebuild()
+        with self.env.db_query as db:
+            self.assertEqual(['ticket', 'bar', 'due_date', 'foo'],
+                             db.get_column_names('ticket_custom_wide'))
+
+    def test_kept_in_sync(self):
+        self.table.rebuild()
+        ticket = self._insert_ticket(foo='a')
+        self.assertEqual([(ticket.id, 'a', None, None)], self._get_rows())
+        ticket['due_date'] = 'value'
+        ticket.save_changes('joe', when=datetime(2016, 1, 1, tzinfo=utc))
+        ticket['foo'] = 'b'
+        ticket.save_changes('joe', when=datetime(2016, 1, 2, tzinfo=utc))
+        self.assertEqual([(ticket.id, 'b', None, 'value')], self._get_rows())
+        ticket.delete_change(cdate=datetime(2016, 1, 2, tzinfo=utc))
+        self.assertEqual([(ticket.id, 'a', None, 'value')], self._get_rows())
+        ticket.delete()
+        self.assertEqual([], self._get_rows())
+
+    def test_row_inserted_on_change(self):
+        ticket = self._insert_ticket()
+        self.env.db_transaction("DELETE FROM ticket_custom")
+        self.table.rebuild()
+        self.assertEqual([], self._get_rows())
+        ticket['foo'] = 'a'
+        ticket.save_changes('joe')
+        self.assertEqual([(ticket.id, 'a', None, None)], self._get_rows())
+
+    def test_drop(self):
+        self.table.rebuild()
+        self.table.drop()
+        self.assertEqual(frozenset(), self.table.fields)
+        with self.env.db_query as db:
+            self.assertNotIn('ticket_custom_wide', db.get_table_names())
+
+
 class EnumTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -1311,6 +1502,7 @@ def suite():
     suite.addTest(unittest.makeSuite(TicketTestCase))
     suite.addTest(unittest.makeSuite(TicketCommentEditTestCase))
     suite.addTest(unittest.makeSuite(TicketCommentDeleteTestCase))
+    suite.addTest(unittest.makeSuite(CustomFieldsTableTestCase))
     suite.addTest(unittest.makeSuite(EnumTestCase))
     suite.addTest(unittest.makeSuite(MilestoneTestCase))
     suite.addTest(unittest.makeSuite(ComponentTestCase))
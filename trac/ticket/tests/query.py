@@ -17,10 +17,13 @@ import re
 import unittest
 
 from trac.mimeview.api import Mimeview
+from trac.core import TracError
 from trac.test import Mock, EnvironmentStub, MockPerm, locale_en
 from trac.ticket.api import TicketSystem
-from trac.ticket.model import Milestone, Severity, Ticket, Version
-from trac.ticket.query import Query, QueryModule, TicketQueryMacro
+from trac.ticket.model import CustomFieldsTable, Milestone, Severity, \
+                              Ticket, Version
+from trac.ticket.query import Query, QueryCountCache, QueryModule, \
+                              TicketQueryMacro
 from trac.util.datefmt import utc
 from trac.web.api import arg_list_to_args, parse_arg_list
 from trac.web.chrome import web_context
@@ -84,6 +87,7 @@ class QueryTestCase(unittest.TestCase):
         del tktsys.custom_fields
 
     def tearDown(self):
+        CustomFieldsTable(self.env).drop()
         self.env.reset_db()
 
     def _insert_tickets(self, owner, status, priority, milestone, version,
@@ -419,6 +423,61 @@ ORDER BY COALESCE(%(foo)s.value,'')='',%(foo)s.value,COALESCE(t.id,0)=0,t.id"""
         self.assertEqual(['something'] * 3 + [''] * 7,
                          [t['foo'] for t in tickets])
 
+    def test_constrained_by_custom_field_in_wide_table(self):
+        self.env.config.set('ticket-custom', 'foo', 'text')
+        self.env.config.set('ticket-custom', 'bar', 'text')
+        self._update_tickets('foo', [None, '', 'something'])
+        CustomFieldsTable(self.env).rebuild()
+        self._update_tickets('bar', ['other'])
+        query = Query.from_string(self.env, 'foo=something&col=foo&col=bar',
+                                  order='id')
+        sql, args = query.get_sql()
+        with self.env.db_query as db:
+            foo = db.quote('foo')
+            bar = db.quote('bar')
+        self.assertEqualSQL(sql,
+"""SELECT t.id AS id,t.status AS status,t.priority AS priority,t.time AS time,t.changetime AS changetime,priority.value AS priority_value,tcw.%(foo)s AS %(foo)s,tcw.%(bar)s AS %(bar)s
+FROM ticket AS t
+  LEFT OUTER JOIN ticket_custom_wide AS tcw ON (tcw.ticket=t.id)
+  LEFT OUTER JOIN enum AS priority ON (priority.type='priority' AND priority.name=priority)
+WHERE ((COALESCE(tcw.%(foo)s,'')=%%s))
+ORDER BY COALESCE(t.id,0)=0,t.id"""
+        % {'foo': foo, 'bar': bar})
+        self.assertEqual(['something'], args)
+        tickets = query.execute(self.req)
+        self.assertEqual(['something'] * 3, [t['foo'] for t in tickets])
+        self.assertEqual(['other'] * 3, [t['bar'] for t in tickets])
+
+    def test_custom_field_missing_from_wide_table(self):
+        self.env.config.set('ticket-custom', 'foo', 'text')
+        self._update_tickets('foo', [None, '', 'something'])
+        CustomFieldsTable(self.env).rebuild()
+        self.env.config.set('ticket-custom', 'bar', 'text')
+        tktsys = TicketSystem(self.env)
+        tktsys.reset_ticket_fields()
+        del tktsys.custom_fields
+        self._update_tickets('bar', ['other'])
+        query = Query.from_string(self.env, 'bar=other&col=foo&col=bar',
+                                  order='id')
+        sql, args = query.get_sql()
+        with self.env.db_query as db:
+            foo = db.quote('foo')
+            bar = db.quote('bar')
+        self.assertEqualSQL(sql,
+"""SELECT t.id AS id,t.status AS status,t.priority AS priority,t.time AS time,t.changetime AS changetime,priority.value AS priority_value,tcw.%(foo)s AS %(foo)s,%(bar)s.value AS %(bar)s
+FROM ticket AS t
+  LEFT OUTER JOIN ticket_custom_wide AS tcw ON (tcw.ticket=t.id)
+  LEFT OUTER JOIN ticket_custom AS %(bar)s ON (%(bar)s.ticket=t.id AND %(bar)s.name='bar')
+  LEFT OUTER JOIN enum AS priority ON (priority.type='priority' AND priority.name=priority)
+WHERE ((COALESCE(%(bar)s.value,'')=%%s))
+ORDER BY COALESCE(t.id,0)=0,t.id"""
+        % {'foo': foo, 'bar': bar})
+        self.assertEqual(['other'], args)
+        tickets = query.execute(self.req)
+        self.assertEqual(10, len(tickets))
+        self.assertEqual(['', '', 'something'] * 3 + [''],
+                         [t['foo'] for t in tickets])
+
     def test_constrained_by_id_ranges(self):
         query = Query.from_string(self.env, 'id=42,44,51-55&order=id')
         sql, args = query.get_sql()
@@ -945,6 +1004,141 @@ ORDER BY COALESCE(t.id,0)=0,t.id""")
         data = query.template_data(context, tickets)
         self.assertEqual(['$USER'], data['clauses'][0]['owner']['values'])
 
+    def _execute_pages(self, **kwargs):
+        pages = []
+        after = None
+        while True:
+            query = Query(self.env, max=3, page=len(pages) + 1, after=after,
+                          **kwargs)
+            tickets = query.execute(self.req)
+            pages.append([t['id'] for t in tickets])
+            if not query.has_more_pages or \
+                    query.page * query.max >= query.num_items:
+                return pages
+            after = tickets[-1]['id']
+
+    def test_seek_ordered_by_id(self):
+        query = Query(self.env, order='id', max=3, after=self.tktids[2])
+        self.assertTrue(query.seekable)
+        sql, args = query._get_sql(after=query.after)
+        self.assertEqualSQL(sql,
+"""SELECT t.id AS id,t.summary AS summary,t.owner AS owner,t.type AS type,t.status AS status,t.priority AS priority,t.milestone AS milestone,t.time AS time,t.changetime AS changetime,priority.value AS priority_value
+FROM ticket AS t
+  LEFT OUTER JOIN enum AS priority ON (priority.type='priority' AND priority.name=priority)
+WHERE t.id>%s
+ORDER BY COALESCE(t.id,0)=0,t.id""")
+        self.assertEqual([self.tktids[2]], args)
+        tickets = query.execute(self.req)
+        self.assertEqual(self.tktids[3:6], [t['id'] for t in tickets])
+        self.assertEqual(self.n_tickets, query.num_items)
+
+    def test_seek_with_constraints(self):
+        query = Query.from_string(self.env, 'owner=someone|none&order=owner'
+                                            '&max=1&after=%d'
+                                            % self.tktids[2])
+        sql, args = query._get_sql(after=query.after)
+        self.assertEqualSQL(sql,
+"""SELECT t.id AS id,t.summary AS summary,t.owner AS owner,t.type AS type,t.status AS status,t.priority AS priority,t.milestone AS milestone,t.time AS time,t.changetime AS changetime,priority.value AS priority_value
+FROM ticket AS t
+  LEFT OUTER JOIN enum AS priority ON (priority.type='priority' AND priority.name=priority)
+WHERE ((COALESCE(t.owner,'') IN (%s,%s)))
+  AND (COALESCE(t.owner,'')='' OR COALESCE(t.owner,'')>%s OR COALESCE(t.owner,'')=%s AND t.id>%s)
+ORDER BY COALESCE(t.owner,'')='',COALESCE(t.owner,''),t.id""")
+        self.assertEqual(['someone', 'none', 'someone', 'someone',
+                          self.tktids[2]], args)
+        tickets = query.execute(self.req)
+        self.assertEqual([self.tktids[7]], [t['id'] for t in tickets])
+
+    def test_seek_pages_match_offset_pages(self):
+        self._update_tickets('keywords', [None, 'a', '', 'b', 'a'])
+        for order in ('id', 'priority', 'owner', 'time', 'keywords',
+                      'summary'):
+            for desc in (0, 1):
+                expected = [t['id'] for t
+                            in Query(self.env, order=order, desc=desc,
+                                     max=0).execute(self.req)]
+                pages = self._execute_pages(order=order, desc=desc)
+                self.assertEqual(expected, sum(pages, []),
+                                 (order, desc, pages))
+                self.assertEqual([3, 3, 3, 1], map(len, pages))
+
+    def test_seek_not_seekable(self):
+        for kwargs in ({'group': 'owner'}, {'order': 'milestone'},
+                       {'order': 'version'}, {'max': 0}):
+            query = Query(self.env, page=2, after=self.tktids[2],
+                          **dict({'max': 3}, **kwargs))
+            self.assertFalse(query.seekable)
+        query = Query(self.env, order='milestone', max=3, page=2,
+                      after=self.tktids[0])
+        offset = Query(self.env, order='milestone', max=3, page=2)
+        self.assertEqual([t['id'] for t in offset.execute(self.req)],
+                         [t['id'] for t in query.execute(self.req)])
+
+    def test_seek_after_missing_ticket(self):
+        query = Query(self.env, order='priority', max=3, page=2, after=999)
+        offset = Query(self.env, order='priority', max=3, page=2)
+        self.assertEqual([t['id'] for t in offset.execute(self.req)],
+                         [t['id'] for t in query.execute(self.req)])
+        query = Query(self.env, order='id', max=3, page=2, after=999)
+        self.assertEqual([], query.execute(self.req))
+
+    def test_invalid_after(self):
+        self.assertRaises(TracError, Query, self.env, after='-1')
+        self.assertRaises(TracError, Query, self.env, after='foo')
+        self.assertEqual(None, Query(self.env, after='').after)
+
+    def test_template_data_next_page_seeks(self):
+        req = Mock(href=self.env.href, perm=MockPerm(), authname='anonymous',
+                   tz=None, locale=None, chrome={'links': {}})
+        context = web_context(req, 'query')
+        query = Query(self.env, order='id', max=3)
+        tickets = query.execute(req)
+        query.template_data(context, tickets, req=req)
+        self.assertEqual('/trac.cgi/query?max=3&after=%d&page=2&order=id'
+                         % self.tktids[2],
+                         req.chrome['links']['next'][0]['href'])
+
+    def test_count_is_cached(self):
+        query = Query.from_string(self.env, 'owner=someone')
+        self.assertEqual(2, query.count(self.req))
+        self.env.db_transaction("UPDATE ticket SET owner='someone'")
+        self.assertEqual(2, query.count(self.req))
+        query = Query.from_string(self.env, 'owner=$USER')
+        self.assertEqual(self.n_tickets, query.count(authname='someone'))
+        self.assertEqual(0, query.count(authname='none'))
+
+    def test_count_cache_invalidated_on_ticket_change(self):
+        query = Query.from_string(self.env, 'owner=someone')
+        self.assertEqual(2, query.count(self.req))
+        ticket = Ticket(self.env, self.tktids[0])
+        ticket['owner'] = 'someone'
+        ticket.save_changes()
+        self.assertEqual(3, query.count(self.req))
+
+    def test_count_cache_invalidated_on_milestone_rename(self):
+        cache = QueryCountCache(self.env)
+        cache.set('SELECT COUNT(*)', [], 1)
+        milestone = Milestone(self.env, 'milestone4')  # Without tickets
+        milestone.description = 'Changed'
+        milestone.update()
+        self.assertEqual(1, cache.get('SELECT COUNT(*)', []))
+        milestone.name = 'renamed'
+        milestone.update()
+        self.assertIsNone(cache.get('SELECT COUNT(*)', []))
+
+    def test_count_cache_invalidated_on_milestone_delete(self):
+        cache = QueryCountCache(self.env)
+        cache.set('SELECT COUNT(*)', [], 1)
+        Milestone(self.env, 'milestone4').delete()  # Without tickets
+        self.assertIsNone(cache.get('SELECT COUNT(*)', []))
+
+    def test_count_cache_disabled(self):
+        self.env.config.set('query', 'count_cache_lifetime', 0)
+        query = Query.from_string(self.env, 'owner=someone')
+        self.assertEqual(2, query.count(self.req))
+        self.env.db_transaction("UPDATE ticket SET owner='someone'")
+        self.assertEqual(self.n_tickets, query.count(self.req))
+
 
 class QueryLinksTestCase(unittest.TestCase):
 
@@ -1041,6 +1235,10 @@ class TicketQueryMacroTestCase(unittest.TestCase):
                            'owner=joe&milestone=milestone1',
                            dict(col='id|summary|component', max='30', order='component'),
                            'table')
+        self.assertQueryIs('owner=joe, max=30, page=2, after=42, format=table',
+                           'owner=joe',
+                           dict(max='30', order='id', page='2', after='42'),
+                           'table')
 
     def test_special_char_escaping(self):
         self.assertQueryIs(r'owner=joe|jack, milestone=this\&that\|here\,now',
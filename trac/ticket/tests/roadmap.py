@@ -140,6 +140,92 @@ class DefaultTicketGroupStatsProviderTestCase(unittest.TestCase):
         self.assertEqual(67, open['percent'], 'open percent incorrect')
 
 
+class MilestonesStatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True)
+        self.provider = DefaultTicketGroupStatsProvider(self.env)
+        self.milestones = list(Milestone.select(self.env))
+        self.denied = set()
+        self.req = Mock(perm=Mock(filter=self._filter))
+        for milestone, status in [('milestone1', 'new'),
+                                  ('milestone1', 'closed'),
+                                  ('milestone1', 'closed'),
+                                  ('milestone2', 'assigned'),
+                                  ('', 'new')]:
+            self._insert_ticket(milestone, status)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _filter(self, action, resources):
+        self.assertEqual('TICKET_VIEW', action)
+        return [r for r in resources if r.id not in self.denied]
+
+    def _insert_ticket(self, milestone, status):
+        ticket = Ticket(self.env)
+        ticket.populate({'summary': 'Summary', 'milestone': milestone,
+                         'status': status})
+        return ticket.insert()
+
+    def _get_counts(self):
+        return [(stat.count, stat.done_count) for stat in
+                get_milestones_stats(self.env, self.req, self.provider,
+                                     self.milestones)]
+
+    def test_stats(self):
+        self.assertEqual([(3, 2), (1, 0), (0, 0), (0, 0)],
+                         self._get_counts())
+
+    def test_stats_equal_per_milestone_stats(self):
+        stats = get_milestones_stats(self.env, self.req, self.provider,
+                                     self.milestones)
+        for milestone, stat in zip(self.milestones, stats):
+            tickets = get_tickets_for_milestone(self.env, milestone.name)
+            expected = get_ticket_stats(self.provider, tickets)
+            self.assertEqual(expected.intervals, stat.intervals)
+            self.assertEqual(expected.qry_args, stat.qry_args)
+
+    def test_permissions_filtered(self):
+        self.denied.add(2)
+        self.assertEqual([(2, 1), (1, 0), (0, 0), (0, 0)],
+                         self._get_counts())
+
+    def test_provider_without_counts(self):
+        class Provider(object):
+            def get_ticket_group_stats(self, ticket_ids):
+                return ticket_ids
+        self.denied.add(3)
+        self.assertEqual([[1, 2], [4], [], []],
+                         get_milestones_stats(self.env, self.req, Provider(),
+                                              self.milestones))
+
+    def test_cache_invalidated(self):
+        cache = MilestoneTicketsCache(self.env)
+        self._get_counts()
+        ticket = Ticket(self.env, 1)
+        ticket['status'] = 'closed'
+        ticket.save_changes('joe')
+        self.assertEqual([(3, 3), (1, 0), (0, 0), (0, 0)],
+                         self._get_counts())
+        ticket['milestone'] = 'milestone3'
+        ticket.save_changes('joe')
+        self.assertEqual([(2, 2), (1, 0), (1, 1), (0, 0)],
+                         self._get_counts())
+        self._insert_ticket('milestone4', 'new')
+        self.assertEqual([(2, 2), (1, 0), (1, 1), (1, 0)],
+                         self._get_counts())
+        Ticket(self.env, 4).delete()
+        self.assertEqual([(2, 2), (0, 0), (1, 1), (1, 0)],
+                         self._get_counts())
+        milestone = Milestone(self.env, 'milestone3')
+        milestone.name = 'milestone5'
+        milestone.update()
+        self.assertEqual({'milestone1': [(2, 'closed'), (3, 'closed')],
+                          'milestone4': [(6, 'new')],
+                          'milestone5': [(1, 'closed')]}, cache.tickets)
+
+
 class MilestoneModuleTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -239,6 +325,7 @@ def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(TicketGroupStatsTestCase))
     suite.addTest(unittest.makeSuite(DefaultTicketGroupStatsProviderTestCase))
+    suite.addTest(unittest.makeSuite(MilestonesStatsTestCase))
     suite.addTest(unittest.makeSuite(MilestoneModuleTestCase))
     suite.addTest(unittest.makeSuite(MilestoneModulePermissionsTestCase))
     return suite
@@ -12,6 +12,7 @@
 # history and logs, available at http://trac.edgewall.org/log/.
 
 import unittest
+from datetime import datetime, timedelta
 
 from trac.core import TracError
 from trac.resource import ResourceNotFound
@@ -192,6 +193,25 @@ class TicketModuleTestCase(unittest.TestCase):
         self.assertRaises(ResourceNotFound,
                           self.ticket_module.process_request, req)
 
+    def test_timeline_events_filtered_by_batches(self):
+        ids = [self._insert_ticket(summary='Ticket %d' % idx)
+               for idx in xrange(5)]
+        filtered = []
+        def filter(action, resources):
+            filtered.append([resource.id for resource in resources])
+            return [resource for resource in resources
+                             if resource.id != ids[1]]
+        req = self._create_request(perm=Mock(filter=filter))
+        now = datetime.now(utc)
+        events = self.ticket_module.get_timeline_events(
+            req, now - timedelta(hours=1), now + timedelta(hours=1),
+            ['ticket'])
+        self.assertEqual([], filtered)
+        self.assertEqual(ids[0], events.next()[3][0].id)
+        self.assertEqual([sorted(ids)], [sorted(i) for i in filtered])
+        self.assertEqual([ids[2], ids[3], ids[4]],
+                         [ev[3][0].id for ev in events])
+
 
 def suite():
     suite = unittest.TestSuite()
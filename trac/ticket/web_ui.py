@@ -17,6 +17,7 @@
 import csv
 from datetime import datetime
 from functools import partial
+from itertools import islice
 import pkg_resources
 import re
 from StringIO import StringIO
@@ -33,7 +34,8 @@ from trac.resource import (
     Resource, ResourceNotFound, get_resource_url, render_resource_link,
     get_resource_shortname
 )
-from trac.search import ISearchSource, search_to_sql, shorten_result
+from trac.search import ISearchSource, SearchIndex, fetch_ordered_rows, \
+                         merge_search_results, search_to_sql, shorten_result
 from trac.ticket.api import TicketSystem, ITicketManipulator
 from trac.ticket.model import Milestone, Ticket
 from trac.ticket.notification import TicketChangeEvent
@@ -75,6 +77,8 @@ class TicketModule(Component):
 
     realm = TicketSystem.realm
 
+    timeline_events_cacheable = True
+
     timeline_details = BoolOption('timeline', 'ticket_show_details', 'false',
         """Enable the display of all ticket changes in the timeline, not only
         open / close operations.""")
@@ -191,46 +195,83 @@ class TicketModule(Component):
             yield ('ticket', _("Tickets"))
 
     def get_search_results(self, req, terms, filters):
+        return self.get_ordered_search_results(req, terms, filters, None)
+
+    def get_ordered_search_results(self, req, terms, filters, limit):
         if 'ticket' not in filters:
-            return
+            return []
         ticket_realm = Resource(self.realm)
+        return merge_search_results([
+            self._get_ticket_search_results(req, ticket_realm, terms, limit),
+            AttachmentModule(self.env).get_search_results(req, ticket_realm,
+                                                          terms, limit)])
+
+    def _get_ticket_search_results(self, req, ticket_realm, terms, limit):
+        index = SearchIndex(self.env)
         with self.env.db_query as db:
-            sql, args = search_to_sql(db, ['summary', 'keywords',
-                                           'description', 'reporter', 'cc',
-                                           db.cast('id', 'text')], terms)
-            sql2, args2 = search_to_sql(db, ['newvalue'], terms)
-            sql3, args3 = search_to_sql(db, ['value'], terms)
+            if index.enabled:
+                ids = [int(id) for realm, id, score
+                               in index.search(terms, self.realm)]
+                rows = []
+                for chunk in (ids[i:i + 100]
+                              for i in xrange(0, len(ids), 100)):
+                    rows.extend(db("""
+                        SELECT summary, description, reporter, type, id,
+                               time, status, resolution
+                        FROM ticket WHERE id IN (%s)
+                        """ % ','.join(('%s',) * len(chunk)), chunk))
+                rows.sort(key=lambda row: (-row[5], row[4]))
+                rows = iter(rows)
+            else:
+                sql, args = search_to_sql(db, ['summary', 'keywords',
+                                               'description', 'reporter',
+                                               'cc', db.cast('id', 'text')],
+                                          terms)
+                sql2, args2 = search_to_sql(db, ['newvalue'], terms)
+                sql3, args3 = search_to_sql(db, ['value'], terms)
+                sql = """SELECT id FROM ticket WHERE %s
+                       UNION
+                         SELECT ticket FROM ticket_change
+                         WHERE field='comment' AND %s
+                       UNION
+                         SELECT ticket FROM ticket_custom WHERE %s
+                       """ % (sql, sql2, sql3)
+                args += args2 + args3
+                rows = fetch_ordered_rows(self.env, """
+                    SELECT summary, description, reporter, type, id, time,
+                           status, resolution
+                    FROM ticket WHERE id IN (%s) ORDER BY time DESC, id
+                    """ % sql, args, limit)
             ticketsystem = TicketSystem(self.env)
-            for summary, desc, author, type, tid, ts, status, resolution in \
-                    db("""SELECT summary, description, reporter, type, id,
-                                 time, status, resolution
-                          FROM ticket
-                          WHERE id IN (
-                              SELECT id FROM ticket WHERE %s
-                            UNION
-                              SELECT ticket FROM ticket_change
-                              WHERE field='comment' AND %s
-                            UNION
-                              SELECT ticket FROM ticket_custom WHERE %s
-                          )
-                          """ % (sql, sql2, sql3),
-                          args + args2 + args3):
-                t = ticket_realm(id=tid)
-                if 'TICKET_VIEW' in req.perm(t):
-                    yield (req.href.ticket(tid),
-                           tag_("%(title)s: %(message)s",
-                                title=tag.span(
-                                    get_resource_shortname(self.env, t),
-                                    class_=status),
-                                message=ticketsystem.format_summary(
-                                    summary, status, resolution, type)),
-                           from_utimestamp(ts), author,
-                           shorten_result(desc, terms))
-
-        # Attachments
-        for result in AttachmentModule(self.env).get_search_results(
-            req, ticket_realm, terms):
-            yield result
+            # Check the permissions of the tickets by batches of rows
+            batch_size = limit or 1000
+            while True:
+                batch = list(islice(rows, batch_size))
+                viewable = self._filter_viewable(req,
+                                                 [row[4] for row in batch])
+                for summary, desc, author, type, tid, ts, status, \
+                        resolution in batch:
+                    if tid in viewable:
+                        t = ticket_realm(id=tid)
+                        yield (req.href.ticket(tid),
+                               tag_("%(title)s: %(message)s",
+                                    title=tag.span(
+                                        get_resource_shortname(self.env, t),
+                                        class_=status),
+                                    message=ticketsystem.format_summary(
+                                        summary, status, resolution, type)),
+                               from_utimestamp(ts), author,
+                               shorten_result(desc, terms))
+                if len(batch) < batch_size:
+                    break
+
+    def _filter_viewable(self, req, ids):
+        """Return the set of the `ids` of the tickets which can be
+        viewed by the user.
+        """
+        resources = [Resource(self.realm, id) for id in set(ids)]
+        return set(resource.id for resource in
+                   req.perm.filter('TICKET_VIEW', resources))
 
     # ITimelineEventProvider methods
 
@@ -257,8 +298,6 @@ class TicketModule(Component):
                            component),
                           status, fields, comment, cid):
             ticket = ticket_realm(id=id)
-            if 'TICKET_VIEW' not in req.perm(ticket):
-                return None
             resolution = fields.get('resolution')
             info = ''
             if status == 'edit':
@@ -324,13 +363,28 @@ class TicketModule(Component):
                 if ev:
                     yield (ev, data[1])
 
+        def filter_viewable_events(events, batch_size=100):
+            # Check the permissions of the tickets by batches of events
+            while True:
+                batch = list(islice(events, batch_size))
+                if not batch:
+                    break
+                viewable = self._filter_viewable(req, [ev[3][0].id
+                                                       for ev, t in batch])
+                for ev, t in batch:
+                    if ev[3][0].id in viewable:
+                        yield ev, t
+                if len(batch) < batch_size:
+                    break
+
         # Ticket changes
         with self.env.db_query as db:
             if 'ticket' in filters or 'ticket_details' in filters:
                 prev_t = None
                 prev_ev = None
                 batch_ev = None
-                for ev, t in produce_ticket_change_events(db):
+                for ev, t in filter_viewable_events(
+                        produce_ticket_change_events(db)):
                     if batch_ev:
                         if prev_t == t:
                             ticket = ev[3][0]
@@ -358,13 +412,14 @@ class TicketModule(Component):
 
                 # New tickets
                 if 'ticket' in filters:
-                    for row in db("""SELECT id, time, reporter, type, summary,
-                                            description, component
-                                     FROM ticket WHERE time>=%s AND time<=%s
-                                     """, (ts_start, ts_stop)):
-                        ev = produce_event(row, 'new', {}, None, None)
-                        if ev:
-                            yield ev
+                    rows = db("""SELECT id, time, reporter, type, summary,
+                                        description, component
+                                 FROM ticket WHERE time>=%s AND time<=%s
+                                 """, (ts_start, ts_stop))
+                    for ev, t in filter_viewable_events(
+                            (produce_event(row, 'new', {}, None, None), row[1])
+                            for row in rows):
+                        yield ev
 
             # Attachments
             if 'ticket_details' in filters:
@@ -23,6 +23,21 @@ from trac.core import *
 class ITimelineEventProvider(Interface):
     """Extension point interface for adding sources for timed events to the
     timeline.
+
+    Providers can declare the following optional class attributes:
+
+     - `timeline_events_ordered`: when `True`, `get_timeline_events`
+       returns the events in descending `date` order, so the timeline
+       can merge them with the events of other providers without
+       sorting them and stop retrieving them once enough events have
+       been collected.
+     - `timeline_events_cacheable`: when `True`, the events returned
+       for a past day may be cached across requests, for a given user,
+       locale and set of filters. The event data must therefore not
+       refer to objects bound to the request, like repositories.
+
+    :since 1.2: the optional `timeline_events_ordered` and
+                `timeline_events_cacheable` attributes.
     """
 
     def get_timeline_filters(req):
@@ -14,9 +14,11 @@
 import unittest
 from datetime import datetime, timedelta
 
-from trac.perm import PermissionError
+from trac.core import Component, ComponentMeta, implements
+from trac.perm import PermissionDecisionCache, PermissionError
 from trac.test import EnvironmentStub, Mock, MockPerm, locale_en
-from trac.timeline.web_ui import TimelineModule
+from trac.timeline.api import ITimelineEventProvider
+from trac.timeline.web_ui import TimelineEventCache, TimelineModule
 from trac.util.datefmt import (
     format_date, format_datetime, format_time, pretty_timedelta, utc,
 )
@@ -119,10 +121,137 @@ user2 =
         self.assertRaises(PermissionError, self.process_request, req)
 
 
+class TimelineEventsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._orig_components = ComponentMeta._components
+        self._orig_registry = ComponentMeta._registry
+        ComponentMeta._components = list(ComponentMeta._components)
+        ComponentMeta._registry = dict((interface, list(classes))
+                                       for interface, classes
+                                       in ComponentMeta._registry.iteritems())
+        now = datetime.now(utc)
+        self.today = datetime(now.year, now.month, now.day, tzinfo=utc)
+        self.calls = calls = []
+
+        def create_events(name, dates):
+            return [(name, date, 'joe', None) for date in dates]
+
+        class OrderedProvider(Component):
+            implements(ITimelineEventProvider)
+            timeline_events_ordered = True
+            events = create_events('ordered', [self.today - timedelta(hours=h)
+                                               for h in xrange(1, 200, 2)])
+            consumed = 0
+            def get_timeline_filters(self, req):
+                yield ('ordered', 'Ordered events')
+            def get_timeline_events(self, req, start, stop, filters):
+                calls.append(('ordered', start, stop))
+                for event in self.events:
+                    if start <= event[1] <= stop:
+                        self.consumed += 1
+                        yield event
+            def render_timeline_event(self, context, field, event):
+                return None
+
+        class CacheableProvider(Component):
+            implements(ITimelineEventProvider)
+            timeline_events_cacheable = True
+            events = create_events('cacheable',
+                                   [self.today - timedelta(hours=h)
+                                    for h in xrange(200, 0, -2)])
+            def get_timeline_filters(self, req):
+                yield ('cacheable', 'Cacheable events')
+            def get_timeline_events(self, req, start, stop, filters):
+                calls.append(('cacheable', start, stop))
+                return [e for e in self.events if start <= e[1] <= stop]
+            def render_timeline_event(self, context, field, event):
+                return None
+
+        self.OrderedProvider = OrderedProvider
+        self.CacheableProvider = CacheableProvider
+        self.env = EnvironmentStub(enable=[OrderedProvider,
+                                           CacheableProvider,
+                                           TimelineEventCache])
+        self.env.config.set('timeline', 'max_daysback', -1)
+
+    def tearDown(self):
+        ComponentMeta._components = self._orig_components
+        ComponentMeta._registry = self._orig_registry
+        self.env.reset_db()
+
+    def _process_request(self, **args):
+        req = Mock(href=self.env.href, abs_href=self.env.abs_href,
+                   authname='anonymous', tz=utc, locale=None,
+                   lc_time=locale_en, chrome={}, perm=MockPerm(),
+                   session=Mock(get=lambda k, d=None: d,
+                                set=lambda k, v, d=None: None),
+                   args=args)
+        return TimelineModule(self.env).process_request(req)[1]
+
+    def test_events_are_merged_in_descending_order(self):
+        data = self._process_request(daysback='10')
+        dates = [e['date'] for e in data['events']]
+        self.assertEqual(200, len(dates))
+        self.assertEqual(sorted(dates, reverse=True), dates)
+        self.assertEqual(['ordered', 'cacheable'],
+                         [e['kind'] for e in data['events'][:2]])
+
+    def test_ordered_provider_stops_at_maxrows(self):
+        data = self._process_request(daysback='10', max='10')
+        self.assertEqual(10, len(data['events']))
+        self.assertEqual(self.today - timedelta(hours=1),
+                         data['events'][0]['date'])
+        self.assertGreater(20, self.OrderedProvider(self.env).consumed)
+
+    def _cacheable_calls(self):
+        return [call[1:] for call in self.calls if call[0] == 'cacheable']
+
+    def test_past_days_are_cached(self):
+        self._process_request(daysback='10')
+        del self.calls[:]
+        self._process_request(daysback='10')
+        # Only today and the partial first day are retrieved again
+        calls = self._cacheable_calls()
+        self.assertEqual(2, len(calls))
+        self.assertEqual(self.today, calls[0][0])
+        self.assertEqual(calls[1][0], calls[1][1])
+
+    def test_cache_is_invalidated(self):
+        self._process_request(daysback='10')
+        TimelineEventCache(self.env).invalidate()
+        del self.calls[:]
+        self._process_request(daysback='10')
+        calls = self._cacheable_calls()
+        self.assertEqual(3, len(calls))
+        self.assertEqual(self.today, calls[0][0])
+        self.assertEqual(self.today - timedelta(microseconds=1),
+                         calls[1][1])
+
+    def test_cache_is_invalidated_on_permission_change(self):
+        self._process_request(daysback='10')
+        PermissionDecisionCache(self.env).invalidate()
+        del self.calls[:]
+        self._process_request(daysback='10')
+        calls = self._cacheable_calls()
+        self.assertEqual(3, len(calls))
+        self.assertEqual(self.today - timedelta(microseconds=1),
+                         calls[1][1])
+
+    def test_cache_can_be_disabled(self):
+        self.env.config.set('timeline', 'event_cache_size', 0)
+        self._process_request(daysback='10')
+        del self.calls[:]
+        self._process_request(daysback='10')
+        calls = self._cacheable_calls()
+        self.assertEqual(1, len(calls))
+        self.assertNotEqual(self.today, calls[0][0])
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(PrettyDateinfoTestCase))
     suite.addTest(unittest.makeSuite(TimelinePermissionsTestCase))
+    suite.addTest(unittest.makeSuite(TimelineEventsTestCase))
     return suite
 
 if __name__ == '__main__':
@@ -17,27 +17,35 @@
 # Author: Jonas Borgström <jonas@edgewall.com>
 #         Christopher Lenz <cmlenz@gmx.de>
 
+import heapq
 import pkg_resources
 import re
+import time
 from datetime import datetime, timedelta
 
 from genshi.builder import tag
 
+from trac.attachment import IAttachmentChangeListener
+from trac.cache import cached
 from trac.config import IntOption, BoolOption
 from trac.core import *
 from trac.perm import IPermissionRequestor
+from trac.ticket.api import IMilestoneChangeListener, ITicketChangeListener
 from trac.timeline.api import ITimelineEventProvider
 from trac.util import as_int
+from trac.util.compat import OrderedDict
+from trac.util.concurrency import threading
 from trac.util.datefmt import format_date, format_datetime, format_time, \
                               localtz, parse_date, pretty_timedelta, \
                               to_datetime, to_utimestamp, user_time, utc
 from trac.util.text import exception_to_unicode, to_unicode
 from trac.util.translation import _, tag_
+from trac.versioncontrol.api import IRepositoryChangeListener
 from trac.web import IRequestHandler, IRequestFilter
 from trac.web.chrome import (Chrome, INavigationContributor,
                              ITemplateProvider, add_link, add_stylesheet,
                              add_warning, auth_link, prevnext_nav, web_context)
-from trac.wiki.api import IWikiSyntaxProvider
+from trac.wiki.api import IWikiChangeListener, IWikiSyntaxProvider
 from trac.wiki.formatter import concat_path_query_fragment, \
                                 split_url_into_path_query_fragment
 
@@ -190,24 +198,30 @@ class TimelineModule(Component):
             else:
                 include.add(name)
 
-        # gather all events for the given period of time
-        events = []
-        for provider in self.event_providers:
+        # merge the events of all providers for the given period of time,
+        # stopping once enough events have been collected
+        def provider_events(idx, provider):
             try:
-                for event in provider.get_timeline_events(req, start, stop,
-                                                          filters) or []:
+                for seq, event in enumerate(cache.get_events(req, provider,
+                                                             start, stop,
+                                                             filters)):
                     author = (event[2] or '').lower()
                     if (not include or author in include) \
                             and author not in exclude:
-                        events.append(self._event_data(provider, event))
+                        yield -to_utimestamp(event[1]), idx, seq, event, \
+                              provider
             except Exception as e:  # cope with a failure of that provider
                 self._provider_failure(e, req, provider, filters,
                                        [f[0] for f in available_filters])
 
-        # prepare sorted global list
-        events = sorted(events, key=lambda e: e['date'], reverse=True)
-        if maxrows:
-            events = events[:maxrows]
+        cache = TimelineEventCache(self.env)
+        events = []
+        for ts, idx, seq, event, provider in heapq.merge(
+                *[provider_events(idx, provider)
+                  for idx, provider in enumerate(self.event_providers)]):
+            events.append(self._event_data(provider, event))
+            if maxrows and len(events) >= maxrows:
+                break
 
         data['events'] = events
 
@@ -414,3 +428,216 @@ class TimelineModule(Component):
                        "Timeline or notify your Trac administrator about the "
                        "error (detailed information was written to the log).",
                        other_events=other_events))))
+
+
+class TimelineEventCache(Component):
+    """Cache of the timeline events of past days.
+
+    The events are cached per provider, user, locale and set of
+    filters, in buckets of one UTC day. Only the days which are over
+    and which are entirely covered by a request are cached. The cache
+    is invalidated when resources shown in past events are modified
+    or deleted and when permissions change, and entries expire after
+    `[timeline] event_cache_lifetime` seconds so that changes made
+    directly in the database are eventually taken into account.
+    """
+
+    implements(IAttachmentChangeListener, IMilestoneChangeListener,
+               IRepositoryChangeListener, ITicketChangeListener,
+               IWikiChangeListener)
+
+    size = IntOption('timeline', 'event_cache_size', 1000,
+        """Maximum number of days of events kept in the timeline event
+        cache, for all users and providers. Set to 0 to disable the
+        cache. (''since 1.2'')""")
+
+    lifetime = IntOption('timeline', 'event_cache_lifetime', 3600,
+        """Number of seconds after which the events of a day kept in
+        the timeline event cache are retrieved again from the event
+        providers. (''since 1.2'')""")
+
+    def __init__(self):
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    @cached
+    def _generation(self):
+        return object()
+
+    def get_events(self, req, provider, start, stop, filters):
+        """Return an iterable of the events of `provider` between
+        `start` and `stop`, in descending date order.
+        """
+        ordered = getattr(provider, 'timeline_events_ordered', False)
+        if self.size <= 0 or \
+                not getattr(provider, 'timeline_events_cacheable', False):
+            return self._fetch(req, provider, start, stop, filters, ordered)
+        return self._get_cached_events(req, provider, start, stop, filters,
+                                       ordered)
+
+    def invalidate(self):
+        """Invalidate the cache in all processes."""
+        del self._generation
+
+    # IAttachmentChangeListener methods
+
+    def attachment_added(self, attachment):
+        pass
+
+    def attachment_deleted(self, attachment):
+        self.invalidate()
+
+    def attachment_reparented(self, attachment, old_parent_realm,
+                              old_parent_id):
+        self.invalidate()
+
+    # IMilestoneChangeListener methods
+
+    def milestone_created(self, milestone):
+        if milestone.completed:
+            self.invalidate()
+
+    def milestone_changed(self, milestone, old_values):
+        self.invalidate()
+
+    def milestone_deleted(self, milestone):
+        self.invalidate()
+
+    # IRepositoryChangeListener methods
+
+    def changeset_added(self, repos, changeset):
+        # Changesets can be dated in the past
+        self.invalidate()
+
+    def changeset_modified(self, repos, changeset, old_changeset):
+        self.invalidate()
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        pass
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        # Past events show the current summary, type and component
+        if any(f in old_values for f in ('summary', 'type', 'component')):
+            self.invalidate()
+
+    def ticket_deleted(self, ticket):
+        self.invalidate()
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        self.invalidate()
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        self.invalidate()
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        pass
+
+    def wiki_page_changed(self, page, version, t, comment, author, ipnr):
+        pass
+
+    def wiki_page_deleted(self, page):
+        self.invalidate()
+
+    def wiki_page_version_deleted(self, page):
+        self.invalidate()
+
+    def wiki_page_renamed(self, page, old_name):
+        self.invalidate()
+
+    def wiki_page_comment_modified(self, page, old_comment):
+        self.invalidate()
+
+    # Internal methods
+
+    def _fetch(self, req, provider, start, stop, filters, ordered):
+        events = provider.get_timeline_events(req, start, stop,
+                                              filters) or []
+        if ordered:
+            return events
+        return sorted(events, key=lambda e: e[1], reverse=True)
+
+    def _get_cached_events(self, req, provider, start, stop, filters,
+                           ordered):
+        one_day = timedelta(days=1)
+        one_usec = timedelta(microseconds=1)
+        now = datetime.now(utc)
+        today = datetime(now.year, now.month, now.day, tzinfo=utc)
+        key = (provider.__class__.__name__, tuple(sorted(filters)),
+               req.authname, unicode(req.locale))
+
+        # Split the period into segments of at most one UTC day, in
+        # descending order; days which are over and entirely included
+        # are cacheable
+        segments = []
+        stop = stop.astimezone(utc)
+        start = start.astimezone(utc)
+        day = datetime(stop.year, stop.month, stop.day, tzinfo=utc)
+        while day + one_day > start:
+            seg_start = max(start, day)
+            seg_stop = min(stop, day + one_day - one_usec)
+            cacheable = seg_start == day and \
+                        seg_stop == day + one_day - one_usec and \
+                        day + one_day <= today
+            segments.append((seg_start, seg_stop, cacheable))
+            day -= one_day
+
+        generation = self._generation
+        idx = 0
+        while idx < len(segments):
+            seg_start, seg_stop, cacheable = segments[idx]
+            if not cacheable:
+                for event in self._fetch(req, provider, seg_start, seg_stop,
+                                         filters, ordered):
+                    yield event
+                idx += 1
+                continue
+            events = self._get_bucket(key + (seg_start,), generation)
+            if events is not None:
+                for event in events:
+                    yield event
+                idx += 1
+                continue
+            # Retrieve the consecutive days missing from the cache at once
+            last = idx
+            while last + 1 < len(segments) and segments[last + 1][2] and \
+                    self._get_bucket(key + (segments[last + 1][0],),
+                                     generation) is None:
+                last += 1
+            buckets = dict((segments[i][0], [])
+                           for i in xrange(idx, last + 1))
+            for event in self._fetch(req, provider, segments[last][0],
+                                     seg_stop, filters, ordered):
+                date = event[1].astimezone(utc)
+                day = datetime(date.year, date.month, date.day, tzinfo=utc)
+                if day in buckets:
+                    buckets[day].append(event)
+            for day, events in buckets.iteritems():
+                self._set_bucket(key + (day,), generation, events)
+            for i in xrange(idx, last + 1):
+                for event in buckets[segments[i][0]]:
+                    yield event
+            idx = last + 1
+
+    def _get_bucket(self, key, generation):
+        with self._lock:
+            entry = self._buckets.pop(key, None)
+            if entry is None:
+                return None
+            entry_generation, created, events = entry
+            if entry_generation is not generation or \
+                    time.time() - created > self.lifetime:
+                return None
+            self._buckets[key] = entry
+            return events
+
+    def _set_bucket(self, key, generation, events):
+        with self._lock:
+            self._buckets.pop(key, None)
+            self._buckets[key] = (generation, time.time(), events)
+            while len(self._buckets) > self.size:
+                self._buckets.popitem(last=False)
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from trac.db import Table, Column, DatabaseManager
+
+
+def do_upgrade(env, version, cursor):
+    """Add the wiki_delta table."""
+    table = Table('wiki_delta', key=('name', 'version'))[
+                Column('name'),
+                Column('version', type='int'),
+                Column('base', type='int'),
+                Column('delta')]
+
+    DatabaseManager(env).create_tables([table])
@@ -13,12 +13,15 @@
 
 import unittest
 
-from trac.upgrades.tests import db41
+from trac.upgrades.tests import db41, db42, db43, db44
 
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(db41.suite())
+    suite.addTest(db42.suite())
+    suite.addTest(db43.suite())
+    suite.addTest(db44.suite())
     return suite
 
 
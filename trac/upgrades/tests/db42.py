@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+import unittest
+
+from trac.db.api import DatabaseManager
+from trac.search.api import SearchIndex
+from trac.search.index import DefaultSearchIndexer
+from trac.test import EnvironmentStub
+from trac.upgrades import db42
+
+VERSION = 42
+
+
+class UpgradeTestCase(unittest.TestCase):
+    """Add the search_index table."""
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*', DefaultSearchIndexer])
+        self.env.config.set('search', 'use_index', 'enabled')
+        self.dbm = DatabaseManager(self.env)
+        self.dbm.drop_tables(['search_index'])
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_table_created(self):
+        self.assertNotIn('search_index', self.dbm.get_table_names())
+        with self.env.db_transaction as db:
+            db42.do_upgrade(self.env, VERSION, db.cursor())
+
+        self.assertIn('search_index', self.dbm.get_table_names())
+        with self.env.db_query as db:
+            self.assertEqual(['realm', 'id', 'term', 'weight'],
+                             db.get_column_names('search_index'))
+
+    def test_index_usable(self):
+        with self.env.db_transaction as db:
+            db42.do_upgrade(self.env, VERSION, db.cursor())
+
+        index = SearchIndex(self.env)
+        index.add_document('wiki', 'WikiStart', ["Welcome to the wiki"])
+        self.assertEqual([('wiki', 'WikiStart')],
+                         [(realm, id) for realm, id, score
+                          in index.search(['welcome'], ['wiki'])])
+
+
+def suite():
+    return unittest.makeSuite(UpgradeTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
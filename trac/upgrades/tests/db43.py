@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+import unittest
+
+from trac.db.api import DatabaseManager
+from trac.notification.api import NotificationSystem
+from trac.test import EnvironmentStub
+from trac.upgrades import db43
+
+VERSION = 43
+
+
+class UpgradeTestCase(unittest.TestCase):
+    """Add the notify_queue table."""
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.env.config.set('notification', 'email_queue_workers', '0')
+        self.dbm = DatabaseManager(self.env)
+        self.dbm.drop_tables(['notify_queue'])
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_table_created(self):
+        self.assertNotIn('notify_queue', self.dbm.get_table_names())
+        with self.env.db_transaction as db:
+            db43.do_upgrade(self.env, VERSION, db.cursor())
+
+        self.assertIn('notify_queue', self.dbm.get_table_names())
+        with self.env.db_query as db:
+            self.assertEqual(['id', 'time', 'next_attempt', 'attempts',
+                              'from_addr', 'recipients', 'message', 'error'],
+                             db.get_column_names('notify_queue'))
+
+    def test_email_enqueued(self):
+        with self.env.db_transaction as db:
+            db43.do_upgrade(self.env, VERSION, db.cursor())
+
+        id = NotificationSystem(self.env).enqueue_email(
+            'trac@example.org', ['joe@example.org'], 'Subject: Test')
+        self.assertEqual([('trac@example.org', 'joe@example.org', 0)],
+                         self.env.db_query("""
+                            SELECT from_addr, recipients, attempts
+                            FROM notify_queue WHERE id=%s""", (id,)))
+
+
+def suite():
+    return unittest.makeSuite(UpgradeTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/.
+
+from datetime import datetime
+import unittest
+
+from trac.db.api import DatabaseManager
+from trac.test import EnvironmentStub
+from trac.upgrades import db44
+from trac.util.datefmt import to_utimestamp, utc
+from trac.wiki.model import WikiPage
+
+VERSION = 44
+
+
+class UpgradeTestCase(unittest.TestCase):
+    """Add the wiki_delta table."""
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.env.config.set('wiki', 'delta_storage', 'enabled')
+        self.dbm = DatabaseManager(self.env)
+        self.dbm.drop_tables(['wiki_delta'])
+        # Versions stored before the upgrade hold their full text
+        t = to_utimestamp(datetime(2016, 1, 1, tzinfo=utc))
+        self.env.db_transaction.executemany("""
+            INSERT INTO wiki (name, version, time, author, text)
+            VALUES (%s,%s,%s,%s,%s)
+            """, [('TestPage', 1, t, 'joe', 'Line 1\n'),
+                  ('TestPage', 2, t + 1, 'joe', 'Line 1\nLine 2\n')])
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_table_created(self):
+        self.assertNotIn('wiki_delta', self.dbm.get_table_names())
+        with self.env.db_transaction as db:
+            db44.do_upgrade(self.env, VERSION, db.cursor())
+
+        self.assertIn('wiki_delta', self.dbm.get_table_names())
+        with self.env.db_query as db:
+            self.assertEqual(['name', 'version', 'base', 'delta'],
+                             db.get_column_names('wiki_delta'))
+
+    def test_existing_versions_readable(self):
+        with self.env.db_transaction as db:
+            db44.do_upgrade(self.env, VERSION, db.cursor())
+
+        self.assertEqual('Line 1\n', WikiPage(self.env, 'TestPage', 1).text)
+        self.assertEqual('Line 1\nLine 2\n',
+                         WikiPage(self.env, 'TestPage', 2).text)
+
+    def test_new_version_stored_as_delta(self):
+        with self.env.db_transaction as db:
+            db44.do_upgrade(self.env, VERSION, db.cursor())
+
+        page = WikiPage(self.env, 'TestPage')
+        page.text = 'Line 1\nLine 2\nLine 3\n'
+        page.save('joe', 'Testing')
+        self.assertEqual([('TestPage', 2)], self.env.db_query("""
+            SELECT name, version FROM wiki_delta"""))
+        self.assertEqual('Line 1\nLine 2\n',
+                         WikiPage(self.env, 'TestPage', 2).text)
+        self.assertEqual('Line 1\n', WikiPage(self.env, 'TestPage', 1).text)
+
+
+def suite():
+    return unittest.makeSuite(UpgradeTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -13,6 +13,7 @@
 
 import os.path
 import sys
+import time
 
 from genshi.builder import tag
 
@@ -139,6 +140,8 @@ class VersionControlAdmin(Component):
         for repos in sorted(repositories, key=lambda r: r.reponame):
             printout(_('Resyncing repository history for %(reponame)s... ',
                        reponame=repos.reponame or '(default)'))
+            self._sync_start = time.time()
+            self._sync_count = 0
             repos.sync(self._sync_feedback, clean=clean)
             for cnt, in self.env.db_query(
                     "SELECT count(rev) FROM revision WHERE repos=%s",
@@ -148,7 +151,13 @@ class VersionControlAdmin(Component):
         printout(_('Done.'))
 
     def _sync_feedback(self, rev):
-        sys.stdout.write(' [%s]\r' % rev)
+        self._sync_count += 1
+        elapsed = time.time() - self._sync_start
+        if elapsed > 0:
+            sys.stdout.write(' [%s] (%.1f revisions/s)\r'
+                             % (rev, self._sync_count / elapsed))
+        else:
+            sys.stdout.write(' [%s]\r' % rev)
         sys.stdout.flush()
 
     def _do_resync(self, reponame, rev=None):
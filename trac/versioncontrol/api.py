@@ -14,13 +14,15 @@
 #
 # Author: Christopher Lenz <cmlenz@gmx.de>
 
+import errno
 import os.path
 import time
 from abc import ABCMeta, abstractmethod
 from datetime import datetime
 
 from trac.admin import AdminCommandError, IAdminCommandProvider, get_dir_list
-from trac.config import ConfigSection, ListOption, Option
+from trac.config import ConfigSection, IntOption, ListOption, Option, \
+                        PathOption
 from trac.core import *
 from trac.resource import IResourceManager, Resource, ResourceNotFound
 from trac.util import as_bool
@@ -30,6 +32,11 @@ from trac.util.text import printout, to_unicode, exception_to_unicode
 from trac.util.translation import _
 from trac.web.api import IRequestFilter
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 
 def is_default(reponame):
     """Check whether `reponame` is the default repository."""
@@ -344,17 +351,63 @@ class RepositoryManager(Component):
         the "Repositories" admin panel. (''since 0.12'')
         """)
 
+    sync_batch_size = IntOption('versioncontrol', 'sync_batch_size', 1,
+        """Maximum number of revisions stored in the cache of a
+        repository within a single database transaction when
+        synchronizing the repository. Larger batches make the initial
+        synchronization of big repositories much faster, but an
+        interrupted synchronization resumes from the last complete
+        batch. (''since 1.2'')
+        """)
+
+    sync_workers = IntOption('versioncontrol', 'sync_workers', 1,
+        """Number of threads retrieving changesets from the repository
+        in parallel when synchronizing the cache of a repository. Only
+        increase it for repository connectors which can be used from
+        several threads at once, like the git connector.
+        (''since 1.2'')
+        """)
+
+    sync_interval = IntOption('versioncontrol', 'sync_interval', 0,
+        """Interval in seconds between the synchronizations of the
+        repositories having `sync_per_request` enabled. When set to a
+        positive value, these repositories are synchronized by a
+        background thread instead of on each request, and only one
+        process of the environment synchronizes them at a time. The
+        default of 0 synchronizes the repositories on each request.
+        (''since 1.2'')
+        """)
+
+    sync_trigger_file = PathOption('versioncontrol', 'sync_trigger_file',
+                                   '../files/repository-sync',
+        """Path to a file which repository hooks can touch to have
+        the background thread synchronize the repositories without
+        waiting for `sync_interval` to elapse. A lock file with the
+        same name and a `.lock` suffix ensures that a single process
+        synchronizes the repositories. Relative paths are resolved
+        relative to the `conf` directory of the environment. The file
+        must be on a local filesystem. (''since 1.2'')
+        """)
+
+    sync_poll_interval = 1
+
     def __init__(self):
         self._cache = {}
         self._lock = threading.Lock()
         self._connectors = None
         self._all_repositories = None
+        self._sync_scheduler = None
+        self._sync_stop = threading.Event()
 
     # IRequestFilter methods
 
     def pre_process_request(self, req, handler):
         from trac.web.chrome import Chrome, add_warning
         if handler is not Chrome(self.env):
+            if self.sync_interval > 0:
+                # Synchronized in the background, never block the request
+                self._start_sync_scheduler()
+                return handler
             for repo_info in self.get_all_repositories().values():
                 if not as_bool(repo_info.get('sync_per_request')):
                     continue
@@ -723,6 +776,43 @@ class RepositoryManager(Component):
                     getattr(listener, event)(repos, changeset, *args)
         return errors
 
+    def sync_repositories(self, blocking=True):
+        """Synchronize the repositories having `sync_per_request`
+        enabled.
+
+        The lock file of `sync_trigger_file` is held while
+        synchronizing, so that a single process of the environment
+        synchronizes the repositories at a time.
+
+        :param blocking: if `False`, return immediately when another
+                         process holds the lock.
+        :return: `False` if the lock couldn't be acquired, `True`
+                 otherwise.
+        """
+        lock_fd = self._acquire_sync_lock(blocking)
+        if lock_fd is False:
+            return False
+        try:
+            for repo_info in self.get_all_repositories().values():
+                if not as_bool(repo_info.get('sync_per_request')):
+                    continue
+                start = time.time()
+                repo_name = repo_info['name'] or '(default)'
+                try:
+                    self.get_repository(repo_info['name']).sync()
+                except Exception as e:
+                    self.log.error("Failed to sync with repository \"%s\": "
+                                   "%s", repo_name,
+                                   exception_to_unicode(e, traceback=True))
+                else:
+                    self.log.info("Synchronized '%s' repository in %0.2f "
+                                  "seconds", repo_name, time.time() - start)
+        finally:
+            if lock_fd is not None:
+                fcntl.flock(lock_fd, fcntl.LOCK_UN)
+                os.close(lock_fd)
+        return True
+
     def shutdown(self, tid=None):
         """Free `Repository` instances bound to a given thread identifier"""
         if tid:
@@ -731,9 +821,83 @@ class RepositoryManager(Component):
                 repositories = self._cache.pop(tid, {})
                 for reponame, repos in repositories.iteritems():
                     repos.close()
+        else:
+            self._sync_stop.set()
 
     # private methods
 
+    def _acquire_sync_lock(self, blocking):
+        """Lock the sync lock file, returning its descriptor, `None`
+        when file locking isn't available or `False` when another
+        process holds the lock.
+        """
+        if fcntl is None:
+            return None
+        path = self.sync_trigger_file + '.lock'
+        dir = os.path.dirname(path)
+        if not os.path.isdir(dir):
+            os.makedirs(dir)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0666)
+        try:
+            flags = fcntl.LOCK_EX if blocking else \
+                    fcntl.LOCK_EX | fcntl.LOCK_NB
+            fcntl.flock(fd, flags)
+        except IOError as e:
+            os.close(fd)
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        except:
+            os.close(fd)
+            raise
+        return fd
+
+    def _get_sync_trigger_mtime(self):
+        try:
+            return os.stat(self.sync_trigger_file).st_mtime
+        except OSError:
+            return None
+
+    def _start_sync_scheduler(self):
+        if self._sync_scheduler is not None:
+            return
+        with self._lock:
+            if self._sync_scheduler is None:
+                self._sync_stop.clear()
+                scheduler = threading.Thread(target=self._run_sync_scheduler,
+                                             name='RepositorySync')
+                scheduler.daemon = True
+                scheduler.start()
+                self._sync_scheduler = scheduler
+
+    def _run_sync_scheduler(self):
+        last_sync = None
+        last_trigger = self._get_sync_trigger_mtime()
+        try:
+            while not self._sync_stop.is_set():
+                trigger = self._get_sync_trigger_mtime()
+                if last_sync is None or trigger != last_trigger or \
+                        time.time() - last_sync >= self.sync_interval:
+                    try:
+                        synced = self.sync_repositories(blocking=False)
+                    except Exception as e:
+                        self.log.error("Failed to synchronize the "
+                                       "repositories: %s",
+                                       exception_to_unicode(e,
+                                                            traceback=True))
+                        synced = True
+                    # Retried at the next poll when another process holds
+                    # the lock, as that process may have read the state of
+                    # the repositories before the trigger file was touched
+                    if synced:
+                        last_sync = time.time()
+                        last_trigger = trigger
+                self._sync_stop.wait(self.sync_poll_interval)
+        finally:
+            self.shutdown(threading._get_ident())
+            with self._lock:
+                self._sync_scheduler = None
+
     def _get_connector(self, rtype):
         """Retrieve the appropriate connector for the given repository type.
 
@@ -15,12 +15,16 @@
 # Author: Christopher Lenz <cmlenz@gmx.de>
 
 import os
+import sys
+import time
 
 from trac.cache import cached
 from trac.core import TracError
+from trac.util.concurrency import threading
 from trac.util.datefmt import from_utimestamp, to_utimestamp
 from trac.util.translation import _
-from trac.versioncontrol import Changeset, Node, Repository, NoSuchChangeset
+from trac.versioncontrol import Changeset, Node, Repository, \
+                                RepositoryManager, NoSuchChangeset
 
 
 _kindmap = {'D': Node.DIRECTORY, 'F': Node.FILE}
@@ -170,19 +174,24 @@ class CachedRepository(Repository):
 
             # prepare for resyncing (there might still be a race
             # condition at this point)
+            batch_size = max(1, RepositoryManager(self.env).sync_batch_size)
             while next_youngest is not None:
-                srev = self.db_rev(next_youngest)
+                start = time.time()
+                revs = []
+                while next_youngest is not None and len(revs) < batch_size:
+                    revs.append(next_youngest)
+                    next_youngest = self.repos.next_rev(next_youngest)
+                self.log.info("Trying to sync revisions [%s:%s]", revs[0],
+                              revs[-1])
+                changesets = self._get_changesets(revs)
 
                 with self.env.db_transaction as db:
-                    self.log.info("Trying to sync revision [%s]",
-                                  next_youngest)
-                    cset = self.repos.get_changeset(next_youngest)
                     try:
                         # steps 1. and 2.
-                        self.insert_changeset(next_youngest, cset)
+                        self._insert_changesets(db, changesets)
                     except Exception as e: # *another* 1.1. resync attempt won
-                        self.log.warning('Revision %s already cached: %r',
-                                         next_youngest, e)
+                        self.log.warning('Revisions %s:%s already cached: %r',
+                                         revs[0], revs[-1], e)
                         # the other resync attempts is also
                         # potentially still in progress, so for our
                         # process/thread, keep ''previous'' notion of
@@ -196,16 +205,17 @@ class CachedRepository(Repository):
                     # possibility of failures at point 0.)
                     db("""
                         UPDATE repository SET value=%s WHERE id=%s AND name=%s
-                        """, (str(next_youngest), self.id, CACHE_YOUNGEST_REV))
+                        """, (str(revs[-1]), self.id, CACHE_YOUNGEST_REV))
                     del self.metadata
 
                 # 4. iterate (1. should always succeed now)
-                youngest = next_youngest
-                next_youngest = self.repos.next_rev(next_youngest)
+                youngest = revs[-1]
+                self._log_sync_throughput(len(revs), start)
 
                 # 5. provide some feedback
                 if feedback:
-                    feedback(youngest)
+                    for rev in revs:
+                        feedback(rev)
 
     def remove_cache(self):
         """Remove the repository cache."""
@@ -276,28 +286,78 @@ class CachedRepository(Repository):
         """:deprecated: since 1.1.2, use `insert_changeset` instead. Will
                         be removed in 1.3.1.
         """
-        srev = self.db_rev(rev)
+        self._insert_changesets(db, [(rev, cset, cset.get_changes())])
+
+    def _insert_changesets(self, db, changesets):
+        """Create revision and node_change records for a list of
+        `(rev, cset, changes)` tuples, where `changes` is the list of
+        changes of the changeset `cset`.
+        """
         # 1. Attempt to resync the 'revision' table.  In case of
         # concurrent syncs, only such insert into the `revision` table
         # will succeed, the others will fail and raise an exception.
-        db("""
+        db.executemany("""
             INSERT INTO revision (repos,rev,time,author,message)
             VALUES (%s,%s,%s,%s,%s)
-            """, (self.id, srev, to_utimestamp(cset.date),
-                  cset.author, cset.message))
+            """, [(self.id, self.db_rev(rev), to_utimestamp(cset.date),
+                   cset.author, cset.message)
+                  for rev, cset, changes in changesets])
         # 2. now *only* one process was able to get there (i.e. there
         # *shouldn't* be any race condition here)
-        for path, kind, action, bpath, brev in cset.get_changes():
-            self.log.debug("Caching node change in [%s]: %r", rev,
-                           (path, kind, action, bpath, brev))
-            kind = _inverted_kindmap[kind]
-            action = _inverted_actionmap[action]
-            db("""
+        node_changes = []
+        for rev, cset, changes in changesets:
+            srev = self.db_rev(rev)
+            for path, kind, action, bpath, brev in changes:
+                node_changes.append((self.id, srev, path,
+                                     _inverted_kindmap[kind],
+                                     _inverted_actionmap[action], bpath,
+                                     brev))
+        if node_changes:
+            db.executemany("""
                 INSERT INTO node_change
                     (repos,rev,path,node_type,change_type,base_path,
                      base_rev)
                 VALUES (%s,%s,%s,%s,%s,%s,%s)
-                """, (self.id, srev, path, kind, action, bpath, brev))
+                """, node_changes)
+
+    def _get_changesets(self, revs):
+        """Retrieve the changesets and their changes from the repository,
+        as a list of `(rev, cset, changes)` tuples.
+
+        The changesets are retrieved by `[versioncontrol] sync_workers`
+        threads.
+        """
+        def get_changeset(rev):
+            cset = self.repos.get_changeset(rev)
+            return rev, cset, list(cset.get_changes())
+
+        workers = min(RepositoryManager(self.env).sync_workers, len(revs))
+        if workers <= 1:
+            return [get_changeset(rev) for rev in revs]
+
+        changesets = [None] * len(revs)
+        errors = []
+        def worker(first):
+            try:
+                for idx in xrange(first, len(revs), workers):
+                    changesets[idx] = get_changeset(revs[idx])
+            except Exception:
+                errors.append(sys.exc_info())
+        threads = [threading.Thread(target=worker, args=(idx,))
+                   for idx in xrange(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return changesets
+
+    def _log_sync_throughput(self, count, start):
+        elapsed = time.time() - start
+        self.log.info("Synchronized %d revisions in %.2f seconds "
+                      "(%.1f revisions/s)", count, elapsed,
+                      count / elapsed if elapsed > 0 else count)
 
     def get_node(self, path, rev=None):
         return self.repos.get_node(path, self.normalize_rev(rev))
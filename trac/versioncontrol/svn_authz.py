@@ -17,11 +17,13 @@
 #         Matthew Good <trac@matt-good.net>
 
 import os.path
+from threading import Lock
 
 from trac.config import Option, PathOption
 from trac.core import *
 from trac.perm import IPermissionPolicy
 from trac.util import read_file
+from trac.util.compat import OrderedDict
 from trac.util.text import exception_to_unicode, to_unicode
 from trac.util.translation import _
 from trac.versioncontrol.api import RepositoryManager
@@ -108,6 +110,30 @@ def parse(authz, modules):
     return authz
 
 
+def index_allowed_users(authz):
+    """Index the users granted access to a path or to one of its
+    descendants.
+
+    Return a dict of modules, each containing a dict mapping directory
+    paths ending with `/` to the set of users granted read access by the
+    section of that path or by a section of a path below it.
+    """
+    index = {}
+    for module, paths in authz.iteritems():
+        allowed = index[module] = {}
+        for spath, section in paths.iteritems():
+            users = set(user for user, result in section.iteritems()
+                             if result)
+            if not users or not spath.startswith('/'):
+                continue
+            idx = 0
+            while idx != -1:
+                prefix = spath[:idx + 1]
+                allowed.setdefault(prefix, set()).update(users)
+                idx = spath.find('/', idx + 1)
+    return index
+
+
 class AuthzSourcePolicy(Component):
     """Permission policy for `source:` and `changeset:` resources using a
     Subversion authz file.
@@ -136,8 +162,16 @@ class AuthzSourcePolicy(Component):
 
     _mtime = 0
     _authz = {}
+    _allowed = {}
     _users = set()
 
+    # number of changeset decisions which are remembered
+    max_changeset_decisions = 10000
+
+    def __init__(self):
+        self._changeset_decisions = OrderedDict()
+        self._changeset_decisions_lock = Lock()
+
     _handled_perms = frozenset([(None, 'BROWSER_VIEW'),
                                 (None, 'CHANGESET_VIEW'),
                                 (None, 'FILE_VIEW'),
@@ -155,6 +189,7 @@ class AuthzSourcePolicy(Component):
             authz, users = self._get_authz_info()
             if authz is None:
                 return False
+            allowed = self._allowed
 
             if username == 'anonymous':
                 usernames = ('$anonymous', '*')
@@ -180,12 +215,11 @@ class AuthzSourcePolicy(Component):
                     path += '/'
 
                 # Allow access to parent directories of allowed resources
-                if any(section.get(user) is True
-                       for module in modules
-                       for spath, section in authz.get(module, {}).iteritems()
-                       if spath.startswith(path)
-                       for user in usernames):
-                    return True
+                for module in modules:
+                    allowed_users = allowed.get(module, {}).get(path)
+                    if allowed_users and \
+                            any(user in allowed_users for user in usernames):
+                        return True
 
                 # Walk from resource up parent directories
                 for spath in parent_iter(path):
@@ -201,10 +235,26 @@ class AuthzSourcePolicy(Component):
                 return check_path(resource.id)
 
             elif realm == 'changeset':
+                if resource.id is None:
+                    key = None
+                else:
+                    key = (resource.parent.id, unicode(resource.id), username)
+                    with self._changeset_decisions_lock:
+                        if key in self._changeset_decisions:
+                            result = self._changeset_decisions.pop(key)
+                            self._changeset_decisions[key] = result
+                            return result
                 changes = list(repos.get_changeset(resource.id).get_changes())
-                if not changes or any(check_path(change[0])
-                                      for change in changes):
-                    return True
+                result = True if not changes or \
+                                 any(check_path(change[0])
+                                     for change in changes) else None
+                if key is not None:
+                    with self._changeset_decisions_lock:
+                        self._changeset_decisions[key] = result
+                        if len(self._changeset_decisions) > \
+                                self.max_changeset_decisions:
+                            self._changeset_decisions.popitem(last=False)
+                return result
 
     def _get_authz_info(self):
         try:
@@ -215,9 +265,12 @@ class AuthzSourcePolicy(Component):
                                exception_to_unicode(e))
             self._mtime = mtime = 0
             self._authz = None
+            self._allowed = {}
             self._users = set()
+            self._clear_changeset_decisions()
         if mtime != self._mtime:
             self._mtime = mtime
+            self._clear_changeset_decisions()
             rm = RepositoryManager(self.env)
             modules = set(repos.reponame
                           for repos in rm.get_real_repositories())
@@ -227,13 +280,19 @@ class AuthzSourcePolicy(Component):
             self.log.info('Parsing authz file: %s', self.authz_file)
             try:
                 self._authz = parse(read_file(self.authz_file), modules)
+                self._allowed = index_allowed_users(self._authz)
                 self._users = set(user for paths in self._authz.itervalues()
                                   for path in paths.itervalues()
                                   for user, result in path.iteritems()
                                   if result)
             except Exception as e:
                 self._authz = None
+                self._allowed = {}
                 self._users = set()
                 self.log.error('Error parsing authz file: %s',
                                exception_to_unicode(e))
         return self._authz, self._users
+
+    def _clear_changeset_decisions(self):
+        with self._changeset_decisions_lock:
+            self._changeset_decisions.clear()
@@ -14,6 +14,10 @@
 #
 # Author: Eli Carter <eli.carter@commprove.com>
 
+import os.path
+import shutil
+import tempfile
+import time
 import unittest
 from datetime import datetime
 
@@ -21,6 +25,7 @@ from trac.core import TracError
 from trac.resource import Resource, get_resource_description, get_resource_url
 from trac.test import EnvironmentStub, Mock
 from trac.util.datefmt import utc
+from trac.versioncontrol import api
 from trac.versioncontrol.api import Changeset, DbRepositoryProvider, \
                                     EmptyChangeset, Node, Repository, \
                                     RepositoryManager
@@ -243,11 +248,110 @@ class DbRepositoryProviderTestCase(unittest.TestCase):
         self.db_provider.modify_repository('', {'dir': '/path/to/new-path'})
 
 
+class SyncSchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.trigger = os.path.join(self.dir, 'repository-sync')
+        self.env = EnvironmentStub()
+        self.env.config.set('versioncontrol', 'sync_trigger_file',
+                            self.trigger)
+        self.env.config.set('repositories', 'repos.dir', '/path/to/repos')
+        self.env.config.set('repositories', 'repos.sync_per_request',
+                            'enabled')
+        self.env.config.set('repositories', 'other.dir', '/path/to/other')
+        self.rm = RepositoryManager(self.env)
+        self.synced = []
+        self.rm.get_repository = \
+            lambda reponame: Mock(sync=lambda: self.synced.append(reponame))
+        self.rm.sync_poll_interval = 0.01
+
+    def tearDown(self):
+        self.rm.shutdown()
+        for i in xrange(100):
+            if self.rm._sync_scheduler is None:
+                break
+            time.sleep(0.01)
+        self.env.reset_db()
+        shutil.rmtree(self.dir)
+
+    def _wait_synced(self, count):
+        for i in xrange(500):
+            if len(self.synced) >= count:
+                break
+            time.sleep(0.01)
+        return len(self.synced)
+
+    def test_sync_per_request(self):
+        self.rm.pre_process_request(Mock(), None)
+        self.assertEqual(['repos'], self.synced)
+        self.assertIsNone(self.rm._sync_scheduler)
+
+    def test_sync_repositories(self):
+        self.assertTrue(self.rm.sync_repositories())
+        self.assertEqual(['repos'], self.synced)
+        self.assertTrue(os.path.isfile(self.trigger + '.lock'))
+
+    def test_sync_repositories_locked(self):
+        if api.fcntl is None:
+            return
+        fd = os.open(self.trigger + '.lock', os.O_RDWR | os.O_CREAT)
+        try:
+            api.fcntl.flock(fd, api.fcntl.LOCK_EX)
+            self.assertFalse(self.rm.sync_repositories(blocking=False))
+            self.assertEqual([], self.synced)
+        finally:
+            os.close(fd)
+        self.assertTrue(self.rm.sync_repositories(blocking=False))
+        self.assertEqual(['repos'], self.synced)
+
+    def test_background_sync(self):
+        self.env.config.set('versioncontrol', 'sync_interval', 3600)
+        self.rm.get_repository = lambda reponame: \
+            Mock(sync=lambda: (time.sleep(0.1),
+                               self.synced.append(reponame)))
+        start = time.time()
+        self.rm.pre_process_request(Mock(), None)
+        self.assertLess(time.time() - start, 0.1)
+        self.assertEqual([], self.synced)
+        self.assertIsNotNone(self.rm._sync_scheduler)
+        self.assertEqual(1, self._wait_synced(1))
+
+    def test_background_sync_triggered(self):
+        self.env.config.set('versioncontrol', 'sync_interval', 3600)
+        self.rm.pre_process_request(Mock(), None)
+        self.assertEqual(1, self._wait_synced(1))
+        time.sleep(0.05)
+        self.assertEqual(['repos'], self.synced)
+        with open(self.trigger, 'w'):
+            pass
+        self.assertEqual(2, self._wait_synced(2))
+
+    def test_background_sync_retried_when_locked(self):
+        if api.fcntl is None:
+            return
+        self.env.config.set('versioncontrol', 'sync_interval', 3600)
+        self.rm.pre_process_request(Mock(), None)
+        self.assertEqual(1, self._wait_synced(1))
+        fd = os.open(self.trigger + '.lock', os.O_RDWR | os.O_CREAT)
+        try:
+            api.fcntl.flock(fd, api.fcntl.LOCK_EX)
+            with open(self.trigger, 'w'):
+                pass
+            time.sleep(0.05)
+            self.assertEqual(['repos'], self.synced)
+        finally:
+            os.close(fd)
+        # The trigger is processed once the lock is released
+        self.assertEqual(2, self._wait_synced(2))
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(ApiTestCase))
     suite.addTest(unittest.makeSuite(ResourceManagerTestCase))
     suite.addTest(unittest.makeSuite(DbRepositoryProviderTestCase))
+    suite.addTest(unittest.makeSuite(SyncSchedulerTestCase))
     return suite
 
 
@@ -118,6 +118,58 @@ class CacheTestCase(unittest.TestCase):
             self.assertEqual(('1', 'trunk/README', 'F', 'A', None, None),
                              rows[1])
 
+    def _get_many_changesets_repos(self, youngest_rev):
+        t = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
+        repos = self.get_repos(get_changeset=lambda x: changesets[int(x)],
+                               youngest_rev=youngest_rev)
+        def get_changes(rev):
+            return lambda: iter([('trunk/file%d' % rev, Node.FILE,
+                                  Changeset.ADD, None, None)])
+        changesets = [Mock(Changeset, repos, rev, 'Message %d' % rev, 'joe',
+                           t, get_changes=get_changes(rev))
+                      for rev in xrange(youngest_rev + 1)]
+        return repos
+
+    def test_batched_sync(self):
+        self.env.config.set('versioncontrol', 'sync_batch_size', '10')
+        self.env.config.set('versioncontrol', 'sync_workers', '4')
+        repos = self._get_many_changesets_repos(24)
+        cache = CachedRepository(self.env, repos, self.log)
+        revs = []
+        cache.sync(feedback=revs.append)
+
+        self.assertEqual(range(25), revs)
+        self.assertEqual('24', cache.metadata.get('youngest_rev'))
+        with self.env.db_query as db:
+            self.assertEqual([(str(rev), 'Message %d' % rev)
+                              for rev in xrange(25)],
+                             sorted(db("SELECT rev, message FROM revision"),
+                                    key=lambda row: int(row[0])))
+            self.assertEqual([(str(rev), 'trunk/file%d' % rev)
+                              for rev in xrange(25)],
+                             sorted(db("SELECT rev, path FROM node_change"),
+                                    key=lambda row: int(row[0])))
+
+    def test_batched_sync_already_cached(self):
+        self.env.config.set('versioncontrol', 'sync_batch_size', '10')
+        repos = self._get_many_changesets_repos(24)
+        cache = CachedRepository(self.env, repos, self.log)
+        # Simulate another process having cached revision 15 while this
+        # one was syncing the previous batch
+        get_changesets = cache._get_changesets
+        def _get_changesets(revs):
+            if 15 in revs:
+                cache.insert_changeset(15, repos.get_changeset(15))
+            return get_changesets(revs)
+        cache._get_changesets = _get_changesets
+        revs = []
+        cache.sync(feedback=revs.append)
+
+        self.assertEqual(range(10), revs)
+        self.assertEqual('9', cache.metadata.get('youngest_rev'))
+        with self.env.db_query as db:
+            self.assertEqual([(11,)], db("SELECT COUNT(*) FROM revision"))
+
     def test_update_sync(self):
         t1 = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
         t2 = datetime(2002, 1, 1, 1, 1, 1, 0, utc)
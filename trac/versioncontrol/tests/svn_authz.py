@@ -20,7 +20,7 @@ from trac.test import EnvironmentStub, Mock
 from trac.util import create_file
 from trac.versioncontrol.api import RepositoryManager
 from trac.versioncontrol.svn_authz import AuthzSourcePolicy, ParseError, \
-                                          parse
+                                          index_allowed_users, parse
 
 
 class AuthzParserTestCase(unittest.TestCase):
@@ -84,6 +84,29 @@ foo = r
             },
         }, authz)
 
+    def test_index_allowed_users(self):
+        index = index_allowed_users({
+            '': {
+                '/': {'*': False},
+                '/trunk': {'foo': True, 'bar': False},
+                '/trunk/sub/': {'bar': True},
+                '/branches/b1/x': {'baz': True},
+            },
+            'module': {
+                '/trunk': {'foo': False},
+            },
+        })
+        self.assertEqual({
+            '': {
+                '/': set(['foo', 'bar', 'baz']),
+                '/trunk/': set(['bar']),
+                '/trunk/sub/': set(['bar']),
+                '/branches/': set(['baz']),
+                '/branches/b1/': set(['baz']),
+            },
+            'module': {},
+        }, index)
+
     def test_parse_errors(self):
         self.assertRaises(ParseError, parse, """\
 user = r
@@ -387,6 +410,30 @@ unknown = r
         self.assertRevPerm(None, 'user', 'scoped', 456)
         self.assertRevPerm(True, 'user', 'scoped', 789)
 
+    def test_changeset_decisions_cached(self):
+        self.assertRevPerm(True, 'joe', 'scoped', 123)
+        self.assertRevPerm(None, 'jane', 'scoped', 123)
+
+        rm = RepositoryManager(self.env)
+        get_repository = rm.get_repository
+        def get_repository_without_changesets(reponame):
+            repos = get_repository(reponame)
+            repos.get_changeset = lambda rev: self.fail("changes listed")
+            return repos
+        rm.get_repository = get_repository_without_changesets
+        self.assertRevPerm(True, 'joe', 'scoped', 123)
+        self.assertRevPerm(None, 'jane', 'scoped', 123)
+        del rm.get_repository
+
+        # The decisions are discarded when the authz file changes
+        self.policy._mtime = 0
+        create_file(self.authz, """\
+[scoped:/scope/dir1]
+jane = r
+""")
+        self.assertRevPerm(None, 'joe', 'scoped', 123)
+        self.assertRevPerm(True, 'jane', 'scoped', 123)
+
 
 def suite():
     suite = unittest.TestSuite()
@@ -31,7 +31,8 @@ from trac.core import *
 from trac.mimeview.api import Mimeview
 from trac.perm import IPermissionRequestor
 from trac.resource import Resource, ResourceNotFound
-from trac.search import ISearchSource, search_to_sql, shorten_result
+from trac.search import ISearchSource, SearchIndex, fetch_ordered_rows, \
+                         search_to_sql, shorten_result
 from trac.timeline.api import ITimelineEventProvider
 from trac.util import as_bool, content_disposition, embedded_numbers, pathjoin
 from trac.util.datefmt import from_utimestamp, pretty_timedelta
@@ -1130,17 +1131,40 @@ class ChangesetModule(Component):
             yield ('changeset', _('Changesets'))
 
     def get_search_results(self, req, terms, filters):
+        return self.get_ordered_search_results(req, terms, filters, None)
+
+    def get_ordered_search_results(self, req, terms, filters, limit):
         if not 'changeset' in filters:
             return
         rm = RepositoryManager(self.env)
         repositories = dict((repos.params['id'], repos)
                             for repos in rm.get_real_repositories())
         uids_seen = set()
+        index = SearchIndex(self.env)
         with self.env.db_query as db:
-            sql, args = search_to_sql(db, ['rev', 'message', 'author'], terms)
-            for id, rev, ts, author, log in db("""
+            if index.enabled:
+                revs_by_repos = {}
+                for realm, docid, score in index.search(terms, self.realm):
+                    id, rev = docid.split(':', 1)
+                    revs_by_repos.setdefault(int(id), []).append(rev)
+                rows = []
+                for id, revs in revs_by_repos.iteritems():
+                    for chunk in (revs[i:i + 100]
+                                  for i in xrange(0, len(revs), 100)):
+                        rows.extend(db("""
+                            SELECT repos, rev, time, author, message
+                            FROM revision WHERE repos=%%s AND rev IN (%s)
+                            """ % ','.join(('%s',) * len(chunk)),
+                            [id] + chunk))
+                rows.sort(key=lambda row: row[2], reverse=True)
+            else:
+                sql, args = search_to_sql(db, ['rev', 'message', 'author'],
+                                          terms)
+                rows = fetch_ordered_rows(self.env, """
                     SELECT repos, rev, time, author, message
-                    FROM revision WHERE """ + sql, args):
+                    FROM revision WHERE """ + sql +
+                    " ORDER BY time DESC, repos, rev", args, limit)
+            for id, rev, ts, author, log in rows:
                 repos = repositories.get(id)
                 if not repos:
                     continue  # revisions for a no longer active repository
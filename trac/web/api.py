@@ -642,11 +642,16 @@ class Request(object):
     def send_file(self, path, mimetype=None):
         """Send a local file to the browser.
 
-        This method includes the "Last-Modified", "Content-Type" and
-        "Content-Length" headers in the response, corresponding to the file
-        attributes. It also checks the last modification time of the local file
-        against the "If-Modified-Since" provided by the user agent, and sends a
-        "304 Not Modified" response if it matches.
+        This method includes the "Last-Modified", "ETag", "Content-Type"
+        and "Content-Length" headers in the response, corresponding to the
+        file attributes. It sends a "304 Not Modified" response if the
+        "If-None-Match" or the "If-Modified-Since" header provided by the
+        user agent matches the file.
+
+        :since 1.2: a single byte range requested with the "Range" header,
+                    optionally conditioned by the "If-Range" header, is
+                    sent as a "206 Partial Content" response, and the
+                    entity tag of the file is sent in the "ETag" header.
         """
         if not os.path.isfile(path):
             raise HTTPNotFound(_("File %(path)s not found", path=path))
@@ -654,8 +659,17 @@ class Request(object):
         stat = os.stat(path)
         mtime = datetime.fromtimestamp(stat.st_mtime, localtz)
         last_modified = http_date(mtime)
-        if last_modified == self.get_header('If-Modified-Since'):
+        etag = '"%x-%x"' % (stat.st_size, int(stat.st_mtime * 1000000))
+        inm = self.get_header('If-None-Match')
+        if inm is not None:
+            not_modified = any(tag.strip() in (etag, '*')
+                               for tag in inm.split(','))
+        else:
+            not_modified = \
+                last_modified == self.get_header('If-Modified-Since')
+        if not_modified:
             self.send_response(304)
+            self.send_header('ETag', etag)
             self.send_header('Content-Length', 0)
             self.end_headers()
             raise RequestDone
@@ -664,25 +678,88 @@ class Request(object):
             mimetype = mimetypes.guess_type(path)[0] or \
                        'application/octet-stream'
 
-        self.send_response(200)
-        self.send_header('Content-Type', mimetype)
-        self.send_header('Content-Length', stat.st_size)
-        self.send_header('Last-Modified', last_modified)
         use_xsendfile = getattr(self, 'use_xsendfile', False)
+        xsendfile_header = None
         if use_xsendfile:
             xsendfile_header = getattr(self, 'xsendfile_header', None)
-            if xsendfile_header:
-                self.send_header(xsendfile_header, os.path.abspath(path))
-            else:
+            if not xsendfile_header:
                 use_xsendfile = False
+
+        # Let the web server handle the ranges when it sends the file
+        byte_range = None
+        if not use_xsendfile:
+            if_range = self.get_header('If-Range')
+            if if_range is None or if_range in (etag, last_modified):
+                byte_range = self._parse_range(stat.st_size)
+        if byte_range == ():
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%d' % stat.st_size)
+            self.send_header('Content-Length', 0)
+            self.end_headers()
+            raise RequestDone
+
+        if byte_range:
+            start, end = byte_range
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d'
+                                              % (start, end, stat.st_size))
+            length = end - start + 1
+        else:
+            start = 0
+            self.send_response(200)
+            length = stat.st_size
+        self.send_header('Content-Type', mimetype)
+        self.send_header('Content-Length', length)
+        self.send_header('Last-Modified', last_modified)
+        self.send_header('ETag', etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        if use_xsendfile:
+            self.send_header(xsendfile_header, os.path.abspath(path))
         self.end_headers()
 
         if not use_xsendfile and self.method != 'HEAD':
             fileobj = open(path, 'rb')
-            file_wrapper = self.environ.get('wsgi.file_wrapper', _FileWrapper)
-            self._response = file_wrapper(fileobj, 4096)
+            blocksize = getattr(self, 'send_file_block_size', 65536)
+            if byte_range:
+                fileobj.seek(start)
+                self._response = _FileWrapper(fileobj, blocksize, length)
+            else:
+                file_wrapper = self.environ.get('wsgi.file_wrapper',
+                                                _FileWrapper)
+                self._response = file_wrapper(fileobj, blocksize)
         raise RequestDone
 
+    _range_re = re.compile(r'\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*\Z')
+
+    def _parse_range(self, size):
+        """Return the `(start, end)` byte positions of the range
+        requested by the "Range" header, `None` if the whole file should
+        be sent, or `()` if the range can't be satisfied.
+        """
+        header = self.get_header('Range')
+        if header is None or self.method not in ('GET', 'HEAD'):
+            return None
+        match = self._range_re.match(header)
+        if not match:
+            # Ignore multiple and invalid ranges
+            return None
+        start, end = match.groups()
+        if not start:
+            if not end:
+                return None
+            # Suffix range of the last bytes
+            length = int(end)
+            if not length or not size:
+                return ()
+            return max(size - length, 0), size - 1
+        start = int(start)
+        if end and int(end) < start:
+            return None
+        if start >= size:
+            return ()
+        end = min(int(end), size - 1) if end else size - 1
+        return start, end
+
     def read(self, size=None):
         """Read the specified number of bytes from the request body."""
         fileobj = self.environ['wsgi.input']
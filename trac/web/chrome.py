@@ -23,6 +23,7 @@ web content are also using facilities provided here.
 
 import datetime
 from functools import partial
+from hashlib import md5
 import itertools
 import operator
 import os.path
@@ -148,7 +149,7 @@ def add_stylesheet(req, filename, mimetype='text/css', **attrs):
     application root path. If it is relative, the link will be based off the
     `/chrome/` path.
     """
-    href = chrome_resource_path(req, filename)
+    href = chrome_resource_path(req, _fingerprinted(req, filename))
     add_link(req, 'stylesheet', href, mimetype=mimetype, **attrs)
 
 
@@ -166,7 +167,7 @@ def add_script(req, filename, mimetype='text/javascript', charset='utf-8',
     if filename in scriptset:
         return False  # Already added that script
 
-    href = chrome_resource_path(req, filename)
+    href = chrome_resource_path(req, _fingerprinted(req, filename))
     script = {'href': href, 'type': mimetype, 'charset': charset,
               'prefix': Markup('<!--[if %s]>' % ie_if) if ie_if else None,
               'suffix': Markup('<![endif]-->') if ie_if else None}
@@ -372,6 +373,13 @@ def chrome_resource_path(req, filename):
 _chrome_resource_path = chrome_resource_path  # will be removed in 1.3.1
 
 
+def _fingerprinted(req, filename):
+    fingerprinted_filename = req.chrome.get('fingerprinted_filename')
+    if fingerprinted_filename:
+        return fingerprinted_filename(filename)
+    return filename
+
+
 def _save_messages(req, url, permanent):
     """Save warnings and notices in case of redirect, so that they can
     be displayed after the redirect."""
@@ -591,8 +599,33 @@ class Chrome(Component):
         Otherwise, send contents with `Content-Length` header after entire of
         the contents are rendered. (''since 1.0.6'')""")
 
+    fingerprint_resources = BoolOption('trac', 'fingerprint_resources',
+                                       'false',
+        """Insert a hash of the content in the URLs of the style sheets and
+        scripts served below `/chrome/`, e.g. `css/trac.0123456789.css`, so
+        that browsers can cache them for a year and reload them as soon as
+        they change. Resources below `/chrome/common/` are not
+        fingerprinted when [#trac-section htdocs_location] is set.
+
+        When the web server serves `/chrome/` from a directory created
+        by `trac-admin deploy`, that directory must contain the
+        fingerprinted copies of the resources: run `trac-admin deploy`
+        with the `--fingerprint` option before enabling this option,
+        and again after each upgrade of Trac or of a plugin, and after
+        each change of the site resources. (''since 1.2'')""")
+
     templates = None
 
+    # Seconds during which fingerprinted resources can be cached
+    fingerprinted_max_age = 365 * 24 * 3600
+
+    _fingerprint_re = re.compile(r'(.*)\.([0-9a-f]{10})((?:\.[^./]*)?)\Z')
+
+    def __init__(self):
+        self._htdocs_dirs = (None, {})
+        self._resolved_paths = {}
+        self._fingerprints = {}
+
     # DocType for 'text/html' output
     html_doctype = DocType.XHTML_STRICT
 
@@ -706,19 +739,20 @@ class Chrome(Component):
         prefix = req.args['prefix']
         filename = req.args['filename']
 
-        dirs = []
-        for provider in self.template_providers:
-            for dir in [os.path.normpath(dir[1]) for dir
-                        in provider.get_htdocs_dirs() or []
-                        if dir[0] == prefix and dir[1]]:
-                dirs.append(dir)
-                path = os.path.normpath(os.path.join(dir, filename))
-                if os.path.commonprefix([dir, path]) != dir:
-                    raise TracError(_("Invalid chrome path %(path)s.",
-                                      path=filename))
-                elif os.path.isfile(path):
-                    req.send_file(path, get_mimetype(path))
-
+        path = self.resolve_resource(prefix, filename)
+        if not path:
+            match = self._fingerprint_re.match(filename)
+            if match:
+                path = self.resolve_resource(prefix,
+                                             match.group(1) + match.group(3))
+                if path and self.get_fingerprint(path) == match.group(2):
+                    req.send_header('Cache-Control',
+                                    'public, max-age=%d, immutable'
+                                    % self.fingerprinted_max_age)
+        if path:
+            req.send_file(path, get_mimetype(path))
+
+        dirs = self._get_htdocs_dirs().get(prefix, [])
         self.log.warning('File %s not found in any of %s', filename, dirs)
         raise HTTPNotFound('File %s not found', filename)
 
@@ -758,6 +792,95 @@ class Chrome(Component):
 
     # Public API methods
 
+    def resolve_resource(self, prefix, filename):
+        """Return the path of the static resource `filename` in the
+        htdocs directories mapped to `/chrome/<prefix>/`, or `None` if
+        the resource doesn't exist.
+
+        The resolved paths are remembered, so that the directories are
+        only searched again when a resource is removed or the htdocs
+        directories change. (''since 1.2'')
+
+        :raises TracError: if `filename` is outside of the directories.
+        """
+        key = (prefix, filename)
+        path = self._resolved_paths.get(key)
+        if path and os.path.isfile(path):
+            return path
+        for dir in self._get_htdocs_dirs().get(prefix, []):
+            path = os.path.normpath(os.path.join(dir, filename))
+            if os.path.commonprefix([dir, path]) != dir:
+                raise TracError(_("Invalid chrome path %(path)s.",
+                                  path=filename))
+            elif os.path.isfile(path):
+                self._resolved_paths[key] = path
+                return path
+        self._resolved_paths.pop(key, None)
+        return None
+
+    def get_fingerprint(self, path):
+        """Return the hash of the content of the file `path` inserted
+        in the fingerprinted URLs of static resources. (''since 1.2'')
+        """
+        stat = os.stat(path)
+        entry = self._fingerprints.get(path)
+        if not entry or entry[0] != (stat.st_mtime, stat.st_size):
+            with open(path, 'rb') as f:
+                fingerprint = md5(f.read()).hexdigest()[:10]
+            entry = self._fingerprints[path] = \
+                    ((stat.st_mtime, stat.st_size), fingerprint)
+        return entry[1]
+
+    @staticmethod
+    def add_fingerprint(filename, fingerprint):
+        """Insert `fingerprint` before the extension of `filename`.
+        (''since 1.2'')
+        """
+        dirname, basename = filename.rsplit('/', 1) \
+                            if '/' in filename else ('', filename)
+        name, ext = os.path.splitext(basename)
+        basename = '%s.%s%s' % (name, fingerprint, ext)
+        return '%s/%s' % (dirname, basename) if dirname else basename
+
+    def fingerprinted_filename(self, filename):
+        """Return the `filename` of a static resource as used by
+        `add_stylesheet` and `add_script`, with the fingerprint of the
+        resource when it is served below `/chrome/`. (''since 1.2'')
+        """
+        if not self.fingerprint_resources or '/' not in filename or \
+                filename.startswith(('/', 'http://', 'https://')):
+            return filename
+        prefix, name = filename.split('/', 1)
+        if prefix == 'common' and self.htdocs_location:
+            return filename
+        try:
+            path = self.resolve_resource(prefix, name)
+        except TracError:
+            return filename
+        if not path:
+            return filename
+        return '%s/%s' % (prefix,
+                          self.add_fingerprint(name,
+                                               self.get_fingerprint(path)))
+
+    def _get_htdocs_dirs(self):
+        """Return a dictionary mapping each prefix of `/chrome/` to the
+        list of its htdocs directories, built once for the enabled
+        template providers.
+        """
+        providers = tuple(self.template_providers)
+        key = (providers, self.shared_htdocs_dir, self.env.get_htdocs_dir())
+        if self._htdocs_dirs[0] != key:
+            dirs = {}
+            for provider in providers:
+                for prefix, dir in provider.get_htdocs_dirs() or []:
+                    if dir:
+                        dirs.setdefault(prefix, []) \
+                            .append(os.path.normpath(dir))
+            self._htdocs_dirs = (key, dirs)
+            self._resolved_paths.clear()
+        return self._htdocs_dirs[1]
+
     def get_all_templates_dirs(self):
         """Return a list of the names of all known templates directories."""
         dirs = []
@@ -780,6 +903,7 @@ class Chrome(Component):
 
         htdocs_location = self.htdocs_location or req.href.chrome('common')
         chrome['htdocs_location'] = htdocs_location.rstrip('/') + '/'
+        chrome['fingerprinted_filename'] = self.fingerprinted_filename
 
         # HTML <head> links
         add_link(req, 'start', req.href.wiki())
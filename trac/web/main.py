@@ -37,7 +37,8 @@ from genshi.template import TemplateLoader
 
 from trac import __version__ as TRAC_VERSION
 from trac.config import BoolOption, ChoiceOption, ConfigurationError, \
-                        ExtensionOption, Option, OrderedExtensionsOption
+                        ExtensionOption, IntOption, Option, \
+                        OrderedExtensionsOption
 from trac.core import *
 from trac.env import open_environment
 from trac.loader import get_plugin_info, match_plugins_to_frames
@@ -156,6 +157,12 @@ class RequestDispatcher(Component):
         """The header to use if `use_xsendfile` is enabled. If Nginx is used,
         set `X-Accel-Redirect`. (''since 1.0.6'')""")
 
+    send_file_block_size = IntOption('trac', 'send_file_block_size', 65536,
+        """Size in bytes of the blocks in which files from the filesystem,
+        like attachments and static resources, are read and written to
+        the response, when not sent with `sendfile` or by the web server.
+        (''since 1.2'')""")
+
     # Public API
 
     def authenticate(self, req):
@@ -195,6 +202,7 @@ class RequestDispatcher(Component):
             'form_token': self._get_form_token,
             'use_xsendfile': self._get_use_xsendfile,
             'xsendfile_header': self._get_xsendfile_header,
+            'send_file_block_size': self._get_send_file_block_size,
         })
 
         try:
@@ -386,6 +394,9 @@ class RequestDispatcher(Component):
     def _get_use_xsendfile(self, req):
         return self.use_xsendfile
 
+    def _get_send_file_block_size(self, req):
+        return max(self.send_file_block_size, 4096)
+
     # RFC7230 3.2 Header Fields
     _xsendfile_header_re = re.compile(r"[-0-9A-Za-z!#$%&'*+.^_`|~]+\Z")
     _warn_xsendfile_header = False
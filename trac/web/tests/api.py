@@ -353,6 +353,8 @@ class RequestSendFileTestCase(unittest.TestCase):
         self.filename = os.path.join(self.dir, 'test.txt')
         self.data = 'contents\n'
         create_file(self.filename, self.data, 'wb')
+        stat = os.stat(self.filename)
+        self.etag = '"%x-%x"' % (stat.st_size, int(stat.st_mtime * 1000000))
         self.req = None
 
     def tearDown(self):
@@ -383,9 +385,93 @@ class RequestSendFileTestCase(unittest.TestCase):
         self.assertEqual('text/plain', self.headers['Content-Type'])
         self.assertEqual(str(len(self.data)), self.headers['Content-Length'])
         self.assertNotIn('X-Sendfile', self.headers)
+        self.assertEqual(self.etag, self.headers['ETag'])
+        self.assertEqual('bytes', self.headers['Accept-Ranges'])
         self.assertEqual(self.data, ''.join(req._response))
         self.assertEqual('', self.response.getvalue())
 
+    def _send_range(self, range, **kwargs):
+        req = self._create_req(HTTP_RANGE=range, **kwargs)
+        self.assertRaises(RequestDone, req.send_file, self.filename,
+                          'text/plain')
+        return req
+
+    def test_send_file_range(self):
+        req = self._send_range('bytes=2-4')
+        self.assertEqual('206 Partial Content', self.status)
+        self.assertEqual('bytes 2-4/9', self.headers['Content-Range'])
+        self.assertEqual('3', self.headers['Content-Length'])
+        self.assertEqual('nte', ''.join(req._response))
+
+    def test_send_file_open_ended_range(self):
+        req = self._send_range('bytes=4-')
+        self.assertEqual('206 Partial Content', self.status)
+        self.assertEqual('bytes 4-8/9', self.headers['Content-Range'])
+        self.assertEqual('ents\n', ''.join(req._response))
+
+    def test_send_file_suffix_range(self):
+        req = self._send_range('bytes=-3')
+        self.assertEqual('206 Partial Content', self.status)
+        self.assertEqual('bytes 6-8/9', self.headers['Content-Range'])
+        self.assertEqual('ts\n', ''.join(req._response))
+
+    def test_send_file_range_past_end(self):
+        req = self._send_range('bytes=5-100')
+        self.assertEqual('206 Partial Content', self.status)
+        self.assertEqual('bytes 5-8/9', self.headers['Content-Range'])
+        self.assertEqual('nts\n', ''.join(req._response))
+
+    def test_send_file_unsatisfiable_range(self):
+        req = self._send_range('bytes=9-')
+        self.assertEqual('416 Requested Range Not Satisfiable', self.status)
+        self.assertEqual('bytes */9', self.headers['Content-Range'])
+        self.assertEqual('0', self.headers['Content-Length'])
+        self.assertEqual(None, req._response)
+
+    def test_send_file_multiple_ranges_ignored(self):
+        req = self._send_range('bytes=0-1,4-5')
+        self.assertEqual('200 Ok', self.status)
+        self.assertNotIn('Content-Range', self.headers)
+        self.assertEqual(self.data, ''.join(req._response))
+
+    def test_send_file_if_range(self):
+        req = self._send_range('bytes=2-4', HTTP_IF_RANGE=self.etag)
+        self.assertEqual('206 Partial Content', self.status)
+        self.assertEqual('nte', ''.join(req._response))
+
+    def test_send_file_if_range_not_matching(self):
+        req = self._send_range('bytes=2-4', HTTP_IF_RANGE='"other"')
+        self.assertEqual('200 Ok', self.status)
+        self.assertEqual(self.data, ''.join(req._response))
+
+    def test_send_file_range_with_xsendfile(self):
+        req = self._send_range('bytes=2-4', use_xsendfile=True)
+        self.assertEqual('200 Ok', self.status)
+        self.assertEqual(str(len(self.data)), self.headers['Content-Length'])
+        self.assertEqual(None, req._response)
+
+    def test_send_file_if_none_match(self):
+        req = self._create_req(HTTP_IF_NONE_MATCH='"other", ' + self.etag)
+        self.assertRaises(RequestDone, req.send_file, self.filename,
+                          'text/plain')
+        self.assertEqual('304 Not Modified', self.status)
+        self.assertEqual(self.etag, self.headers['ETag'])
+        self.assertEqual(None, req._response)
+
+    def test_send_file_if_none_match_not_matching(self):
+        req = self._create_req(HTTP_IF_NONE_MATCH='"other"')
+        self.assertRaises(RequestDone, req.send_file, self.filename,
+                          'text/plain')
+        self.assertEqual('200 Ok', self.status)
+        self.assertEqual(self.data, ''.join(req._response))
+
+    def test_send_file_block_size(self):
+        req = self._create_req()
+        req.callbacks['send_file_block_size'] = lambda r: 4
+        self.assertRaises(RequestDone, req.send_file, self.filename,
+                          'text/plain')
+        self.assertEqual(['cont', 'ents', '\n'], list(req._response))
+
     def test_send_file_with_xsendfile(self):
         req = self._create_req(use_xsendfile=True)
         self.assertRaises(RequestDone, req.send_file, self.filename,
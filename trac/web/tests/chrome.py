@@ -458,6 +458,113 @@ class ChromeTestCase2(unittest.TestCase):
         self.assertTrue(self.chrome.match_request(req))
         self.assertRaises(RequestDone, self.chrome.process_request, req)
 
+    def _create_site_file(self, filename, content):
+        htdocs_dir = self.env.get_htdocs_dir()
+        path = os.path.join(htdocs_dir, filename)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        create_file(path, content)
+        return path
+
+    def _process_request(self, path_info):
+        from trac.web.api import RequestDone
+        sent = {'headers': []}
+        def send_file(path, mimetype):
+            sent['path'] = path
+            raise RequestDone
+        def send_header(name, value):
+            sent['headers'].append((name, value))
+        req = Request(path_info=path_info, send_file=send_file,
+                      send_header=send_header)
+        self.assertTrue(self.chrome.match_request(req))
+        self.assertRaises(RequestDone, self.chrome.process_request, req)
+        return sent
+
+    def test_add_fingerprint(self):
+        self.assertEqual('css/trac.0123456789.css',
+                         Chrome.add_fingerprint('css/trac.css', '0123456789'))
+        self.assertEqual('js/jquery.min.0123456789.js',
+                         Chrome.add_fingerprint('js/jquery.min.js',
+                                                '0123456789'))
+        self.assertEqual('README.0123456789',
+                         Chrome.add_fingerprint('README', '0123456789'))
+
+    def test_fingerprinted_filename(self):
+        self.env.config.set('trac', 'fingerprint_resources', True)
+        path = self._create_site_file('css/site.css', 'body {}')
+        fingerprint = self.chrome.get_fingerprint(path)
+        self.assertEqual(10, len(fingerprint))
+        self.assertEqual('site/css/site.%s.css' % fingerprint,
+                         self.chrome.fingerprinted_filename('site/css/site.css'))
+        for filename in ('site/css/missing.css', '/trac/site.css',
+                         'http://example.org/site.css', 'site/../trac.ini'):
+            self.assertEqual(filename,
+                             self.chrome.fingerprinted_filename(filename))
+
+    def test_fingerprinted_filename_changes_with_content(self):
+        self.env.config.set('trac', 'fingerprint_resources', True)
+        path = self._create_site_file('site.js', 'var a;')
+        filename = self.chrome.fingerprinted_filename('site/site.js')
+        create_file(path, 'var a, b;')
+        os.utime(path, (0, 0))
+        self.assertNotEqual(filename,
+                            self.chrome.fingerprinted_filename('site/site.js'))
+
+    def test_fingerprint_resources_disabled_by_default(self):
+        self._create_site_file('site.css', 'body {}')
+        self.assertEqual('site/site.css',
+                         self.chrome.fingerprinted_filename('site/site.css'))
+
+    def test_htdocs_location_not_fingerprinted(self):
+        self.env.config.set('trac', 'fingerprint_resources', True)
+        self.env.config.set('trac', 'htdocs_location',
+                            'http://static.example.org/')
+        self.assertEqual('common/css/trac.css',
+                         self.chrome.fingerprinted_filename(
+                             'common/css/trac.css'))
+
+    def test_add_stylesheet_fingerprinted(self):
+        self.env.config.set('trac', 'fingerprint_resources', True)
+        path = self._create_site_file('site.css', 'body {}')
+        req = Request(base_path='/trac.cgi', href=Href('/trac.cgi'))
+        req.chrome['fingerprinted_filename'] = \
+            self.chrome.fingerprinted_filename
+        add_stylesheet(req, 'site/site.css')
+        self.assertEqual('/trac.cgi/chrome/site/site.%s.css'
+                         % self.chrome.get_fingerprint(path),
+                         req.chrome['links']['stylesheet'][0]['href'])
+
+    def test_fingerprinted_resource_cached(self):
+        self.env.config.set('trac', 'fingerprint_resources', True)
+        path = self._create_site_file('site.css', 'body {}')
+        filename = self.chrome.fingerprinted_filename('site/site.css')
+        sent = self._process_request('/chrome/' + filename)
+        self.assertEqual(path, sent['path'])
+        self.assertEqual([('Cache-Control',
+                           'public, max-age=31536000, immutable')],
+                         sent['headers'])
+
+    def test_stale_fingerprinted_resource_not_cached(self):
+        path = self._create_site_file('site.css', 'body {}')
+        sent = self._process_request('/chrome/site/site.0123456789.css')
+        self.assertEqual(path, sent['path'])
+        self.assertEqual([], sent['headers'])
+
+    def test_resource_not_cached(self):
+        path = self._create_site_file('site.css', 'body {}')
+        sent = self._process_request('/chrome/site/site.css')
+        self.assertEqual(path, sent['path'])
+        self.assertEqual([], sent['headers'])
+
+    def test_removed_resource_not_found(self):
+        from trac.web.api import HTTPNotFound
+        path = self._create_site_file('site.css', 'body {}')
+        self._process_request('/chrome/site/site.css')
+        os.remove(path)
+        req = Request(path_info='/chrome/site/site.css')
+        self.assertTrue(self.chrome.match_request(req))
+        self.assertRaises(HTTPNotFound, self.chrome.process_request, req)
+
 
 class NavigationOrderTestCase(unittest.TestCase):
 
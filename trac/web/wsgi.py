@@ -16,12 +16,21 @@
 
 from abc import ABCMeta, abstractmethod
 import errno
+import os
 import socket
 import sys
 from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
 from SocketServer import ForkingMixIn, ThreadingMixIn
 import urllib
 
+try:
+    from os import sendfile
+except ImportError:
+    try:
+        from sendfile import sendfile  # pysendfile
+    except ImportError:
+        sendfile = None
+
 
 class _ErrorsWrapper(object):
 
@@ -39,11 +48,16 @@ class _ErrorsWrapper(object):
 
 
 class _FileWrapper(object):
-    """Wrapper for sending a file as response."""
+    """Wrapper for sending a file as response.
+
+    When `length` is given, only that number of bytes is sent from the
+    current position of the file.
+    """
 
-    def __init__(self, fileobj, blocksize=None):
+    def __init__(self, fileobj, blocksize=None, length=None):
         self.fileobj = fileobj
         self.blocksize = blocksize
+        self.length = length
         self.read = self.fileobj.read
         if hasattr(fileobj, 'close'):
             self.close = fileobj.close
@@ -52,9 +66,17 @@ class _FileWrapper(object):
         return self
 
     def next(self):
-        data = self.fileobj.read(self.blocksize)
+        size = self.blocksize or -1
+        if self.length is not None:
+            if self.length <= 0:
+                raise StopIteration
+            if size < 0 or size > self.length:
+                size = self.length
+        data = self.fileobj.read(size)
         if not data:
             raise StopIteration
+        if self.length is not None:
+            self.length -= len(data)
         return data
 
 
@@ -96,8 +118,8 @@ class WSGIGateway(object):
         try:
             if self.wsgi_file_wrapper is not None \
                     and isinstance(response, self.wsgi_file_wrapper) \
-                    and hasattr(self, '_sendfile'):
-                self._sendfile(response.fileobj)
+                    and self._sendfile(response):
+                pass
             else:
                 for chunk in response:
                     if chunk:
@@ -122,6 +144,14 @@ class WSGIGateway(object):
         self.headers_set = [status, headers]
         return self._write
 
+    def _sendfile(self, wrapper):
+        """Send the file of a `wsgi.file_wrapper` response directly.
+
+        Return `False` if the file has not been sent and the response
+        must be iterated instead, which is the default. (''since 1.2'')
+        """
+        return False
+
     @abstractmethod
     def _write(self, data):
         """Callback for writing data to the response.
@@ -251,6 +281,46 @@ class WSGIServerGateway(WSGIGateway):
             else:
                 raise
 
+    def _sendfile(self, wrapper):
+        """Send the file with the zero-copy `sendfile` system call, when
+        available and the length of the response is known.
+        """
+        if sendfile is None or not hasattr(wrapper.fileobj, 'fileno'):
+            return False
+        status, headers = self.headers_set
+        if not any(n.lower() == 'content-length' for n, v in headers):
+            return False
+        connection = self.handler.connection
+        if connection.gettimeout() is not None:
+            return False
+        try:
+            in_fd = wrapper.fileobj.fileno()
+            offset = wrapper.fileobj.tell()
+        except (AttributeError, IOError, OSError):
+            return False
+        remaining = wrapper.length
+        if remaining is None:
+            remaining = os.fstat(in_fd).st_size - offset
+        self._write('')  # send the headers
+        if self.handler.wfile.closed:
+            return True
+        try:
+            self.handler.wfile.flush()
+            while remaining > 0:
+                sent = sendfile(connection.fileno(), in_fd, offset,
+                                remaining)
+                if not sent:
+                    break
+                offset += sent
+                remaining -= sent
+        except (IOError, OSError, socket.error) as e:
+            if e.args[0] in (errno.EPIPE, errno.ECONNRESET, 10053, 10054):
+                # client disconnect
+                self.handler.close_connection = 1
+            else:
+                raise
+        return True
+
 
 class WSGIServer(HTTPServer):
 
@@ -11,6 +11,7 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/.
 
+from contextlib import contextmanager
 from datetime import datetime
 import os.path
 import pkg_resources
@@ -85,6 +86,19 @@ class WikiAdmin(Component):
         yield ('wiki upgrade', '',
                'Upgrade default wiki pages to current version',
                None, self._do_upgrade)
+        yield ('wiki compact', '[--expand] [page] [...]',
+               """Store the previous versions of wiki pages as deltas
+
+               The versions of the pages are stored as compressed line
+               deltas against their next version, except for the latest
+               version and every "[wiki] snapshot_interval"-th version.
+               With --expand, the full text of every version is stored
+               again.
+
+               A name ending with a * means that all wiki pages starting
+               with that prefix should be converted. If no name is
+               specified, all wiki pages are converted.""",
+               self._complete_compact, self._do_compact)
 
     def get_wiki_list(self):
         return list(WikiSystem(self.env).get_pages())
@@ -123,7 +137,7 @@ class WikiAdmin(Component):
 
         with self.env.db_transaction as db:
             # Make sure we don't insert the exact same page twice
-            old = db("""SELECT text FROM wiki WHERE name=%s
+            old = db("""SELECT text, version FROM wiki WHERE name=%s
                         ORDER BY version DESC LIMIT 1
                         """, (title,))
             if old and title in create_only:
@@ -134,6 +148,7 @@ class WikiAdmin(Component):
                 return False
 
             if replace and old:
+                model.expand_dependent_versions(db, title, old[0][1])
                 db("""UPDATE wiki SET text=%s
                       WHERE name=%s
                         AND version=(SELECT max(version) FROM wiki
@@ -146,11 +161,11 @@ class WikiAdmin(Component):
                       """, (title, to_utimestamp(datetime.now(utc)), data,
                             title))
             if not old:
-                del WikiSystem(self.env).pages
+                WikiSystem(self.env).update_pages(added=[title])
         return True
 
     def load_pages(self, dir, ignore=[], create_only=[], replace=False):
-        with self.env.db_transaction:
+        with self._pages_transaction():
             for page in os.listdir(dir):
                 if page in ignore:
                     continue
@@ -162,6 +177,19 @@ class WikiAdmin(Component):
                                    filename=path_to_unicode(filename),
                                    page=page))
 
+    @contextmanager
+    def _pages_transaction(self):
+        """Transaction adding or removing several pages. The cached page
+        names are updated as each page is changed, so they are
+        retrieved again if the transaction is rolled back.
+        """
+        try:
+            with self.env.db_transaction as db:
+                yield db
+        except:
+            del WikiSystem(self.env).pages
+            raise
+
     def _complete_page(self, args):
         if len(args) == 1:
             return self.get_wiki_list()
@@ -182,6 +210,9 @@ class WikiAdmin(Component):
         if len(args) >= 1:
             return get_dir_list(args[-1])
 
+    def _complete_compact(self, args):
+        return ['--expand'] + self.get_wiki_list()
+
     def _do_list(self):
         print_table(
             [(title, int(edits), format_datetime(from_utimestamp(modified),
@@ -206,7 +237,7 @@ class WikiAdmin(Component):
             page.rename(new_name)
 
     def _do_remove(self, name):
-        with self.env.db_transaction:
+        with self._pages_transaction():
             if name.endswith('*'):
                 pages = list(WikiSystem(self.env).get_pages(name.rstrip('*')
                                                             or None))
@@ -218,6 +249,22 @@ class WikiAdmin(Component):
                 page = model.WikiPage(self.env, name)
                 page.delete()
 
+    def _do_compact(self, *names):
+        expand = '--expand' in names
+        names = [name for name in names if name != '--expand'] or ['*']
+        pages = [p for p in self.get_wiki_list()
+                 if any(p == name or (name.endswith('*')
+                                      and p.startswith(name[:-1]))
+                        for name in names)]
+        rows = []
+        for p in pages:
+            # Each page is converted in its own transaction
+            count = model.WikiPage(self.env, p).compact(0 if expand
+                                                        else None)
+            if count:
+                rows.append((p, count))
+        print_table(rows, [_("Page"), _("Converted versions")])
+
     def _do_export(self, page, filename=None):
         self.export_page(page, filename)
 
@@ -243,7 +290,7 @@ class WikiAdmin(Component):
                 self.export_page(p, dst)
 
     def _load_or_replace(self, paths, replace):
-        with self.env.db_transaction:
+        with self._pages_transaction():
             for path in paths:
                 if os.path.isdir(path):
                     self.load_pages(path, replace=replace)
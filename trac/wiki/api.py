@@ -16,12 +16,13 @@
 # Author: Jonas Borgström <jonas@edgewall.com>
 #         Christopher Lenz <cmlenz@gmx.de>
 
+from bisect import bisect_left
 import re
 
 from genshi.builder import tag
 
 from trac.cache import cached
-from trac.config import BoolOption, ListOption
+from trac.config import BoolOption, IntOption, ListOption
 from trac.core import *
 from trac.resource import IResourceManager
 from trac.util.text import unquote_label
@@ -94,6 +95,12 @@ class IWikiMacroProvider(Interface):
 
     .. versionchanged :: 0.12
        new Wiki processors can also be added that way.
+
+    .. versionchanged :: 1.2
+       the output of the macros is cached by the `WikiRenderCache` if
+       the provider has a true `cacheable` attribute. Macros whose
+       output depends on resources should then record them with
+       `formatter.add_dependency`.
     """
 
     def get_macros():
@@ -201,6 +208,18 @@ class IWikiSyntaxProvider(Interface):
         for the link.
         """
 
+    def resolve_links(formatter, ns, targets):
+        """Resolve in bulk the `targets` of the links of namespace `ns`.
+
+        This method is optional. It is called for the targets requested
+        by the link resolvers through `formatter.resolve_link`, which
+        are collected from the whole wiki text before it is formatted.
+        Return a `dict` mapping the existing targets to the data needed
+        for rendering their links.
+
+        .. versionadded :: 1.2
+        """
+
 
 def parse_args(args, strict=True):
     """Utility for parsing macro "content" and splitting them into arguments.
@@ -251,6 +270,103 @@ def validate_page_name(pagename):
            all(part not in ('', '.', '..') for part in pagename.split('/'))
 
 
+def _trigrams(text):
+    return set(text[i:i + 3] for i in xrange(len(text) - 2))
+
+
+class PageNameIndex(object):
+    """Sorted collection of the names of wiki pages.
+
+    Names starting with a prefix are found by a binary search, and
+    names containing a substring by an index of the trigrams of the
+    lowercase names, built on first use.
+
+    Instances are immutable: `updated` returns an updated copy.
+
+    >>> index = PageNameIndex([u'WikiStart', u'SandBox', u'Sandbox/Child'])
+    >>> list(index.startswith(u'Sand'))
+    [u'SandBox', u'Sandbox/Child']
+    >>> index.containing(u'box')
+    [u'SandBox', u'Sandbox/Child']
+    >>> index = index.updated(added=[u'ToolBox'], removed=[u'SandBox'])
+    >>> index.containing(u'box')
+    [u'Sandbox/Child', u'ToolBox']
+
+    :since 1.2:
+    """
+
+    def __init__(self, names=()):
+        self._names = sorted(set(names))
+        self._set = frozenset(self._names)
+        self._trigrams = None
+
+    def __contains__(self, name):
+        return name in self._set
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def startswith(self, prefix):
+        """Iterate over the sorted names starting with `prefix`."""
+        names = self._names
+        idx = bisect_left(names, prefix)
+        while idx < len(names) and names[idx].startswith(prefix):
+            yield names[idx]
+            idx += 1
+
+    def containing(self, text):
+        """Return the sorted list of the names containing `text`,
+        ignoring case.
+        """
+        text = text.lower()
+        if len(text) < 3:
+            return [name for name in self._names if text in name.lower()]
+        trigrams = self._get_trigrams()
+        candidates = sorted((trigrams.get(trigram, frozenset())
+                             for trigram in _trigrams(text)), key=len)
+        names = candidates[0].intersection(*candidates[1:])
+        return sorted(name for name in names if text in name.lower())
+
+    def updated(self, added=(), removed=()):
+        """Return a copy of the index with the `added` names and
+        without the `removed` names.
+        """
+        removed = self._set.intersection(removed)
+        added = set(added) - self._set
+        index = PageNameIndex()
+        index._names = names = list(self._names)
+        for name in removed:
+            del names[bisect_left(names, name)]
+        for name in added:
+            names.insert(bisect_left(names, name), name)
+        index._set = self._set.difference(removed).union(added)
+        if self._trigrams is not None:
+            index._trigrams = trigrams = self._trigrams.copy()
+            for name in removed:
+                for trigram in _trigrams(name.lower()):
+                    trigrams[trigram] = trigrams[trigram] - {name}
+            for name in added:
+                for trigram in _trigrams(name.lower()):
+                    trigrams[trigram] = \
+                        trigrams.get(trigram, frozenset()) | {name}
+        return index
+
+    def _get_trigrams(self):
+        trigrams = self._trigrams
+        if trigrams is None:
+            names_by_trigram = {}
+            for name in self._names:
+                for trigram in _trigrams(name.lower()):
+                    names_by_trigram.setdefault(trigram, []).append(name)
+            trigrams = self._trigrams = \
+                dict((trigram, frozenset(names))
+                     for trigram, names in names_by_trigram.iteritems())
+        return trigrams
+
+
 class WikiSystem(Component):
     """Wiki system manager."""
 
@@ -285,23 +401,61 @@ class WikiSystem(Component):
         external links even if `[wiki] render_unsafe_content` is `false`.
         """)
 
+    delta_storage = BoolOption('wiki', 'delta_storage', 'false',
+        """Store the previous version of a wiki page as a compressed
+        line delta against the new version when the page is saved,
+        instead of its full text. The latest version and every
+        `[wiki] snapshot_interval`-th version are always stored in
+        full. The versions already stored can be converted either way
+        with `trac-admin $ENV wiki compact`. (''since 1.2'')""")
+
+    snapshot_interval = IntOption('wiki', 'snapshot_interval', 20,
+        """Interval between the versions of a wiki page stored in full
+        when `[wiki] delta_storage` is enabled. Retrieving a version
+        requires applying at most this number of deltas minus one.
+        (''since 1.2'')""")
+
     @cached
     def pages(self):
-        """Return the names of all existing wiki pages."""
-        return set(name for name, in
-                   self.env.db_query("SELECT DISTINCT name FROM wiki"))
+        """Return the names of all existing wiki pages, as a
+        `PageNameIndex` (''since 1.2'').
+        """
+        return PageNameIndex(name for name, in
+                             self.env.db_query("""
+                                SELECT name FROM wiki GROUP BY name"""))
 
     # Public API
 
     def get_pages(self, prefix=None):
-        """Iterate over the names of existing Wiki pages.
+        """Iterate over the names of existing Wiki pages, in sorted
+        order.
 
         :param prefix: if given, only names that start with that
           prefix are included.
         """
-        for page in self.pages:
-            if not prefix or page.startswith(prefix):
-                yield page
+        if prefix:
+            return self.pages.startswith(prefix)
+        return iter(self.pages)
+
+    def get_pages_containing(self, text):
+        """Return the sorted list of the names of existing Wiki pages
+        containing `text`, ignoring case. (''since 1.2'')
+        """
+        return self.pages.containing(text)
+
+    def update_pages(self, added=(), removed=()):
+        """Update the cached page names after pages have been `added`
+        or `removed`, without retrieving all the names again.
+
+        This must be called as the last statement of the transaction
+        changing the pages: the cached names of this process are
+        updated immediately, and are not restored if the transaction
+        is rolled back afterwards. Callers wrapping it in a larger
+        transaction must invalidate the `pages` cache if that
+        transaction fails. (''since 1.2'')
+        """
+        WikiSystem.pages.update(self, lambda pages: pages.updated(added,
+                                                                  removed))
 
     def has_page(self, pagename):
         """Whether a page with the specified name exists."""
@@ -402,6 +556,7 @@ class WikiSystem(Component):
 
     def _format_link(self, formatter, ns, pagename, label, ignore_missing,
                      original_label=None):
+        formatter.add_dependency(self.realm)
         pagename, query, fragment = formatter.split_link(pagename)
         version = None
         if '@' in pagename:
@@ -18,8 +18,11 @@
 #         Christopher Lenz <cmlenz@gmx.de>
 #         Christian Boos <cboos@edgewall.org>
 
-import re
+import hashlib
+import marshal
 import os
+import re
+import time
 
 from StringIO import StringIO
 
@@ -28,21 +31,25 @@ from genshi.core import Stream, Markup, escape
 from genshi.input import HTMLParser, ParseError
 from genshi.util import plaintext
 
+from trac.cache import CacheManager, key_to_id
+from trac.config import IntOption, PathOption
 from trac.core import *
 from trac.mimeview import *
 from trac.resource import get_relative_resource, get_resource_url
-from trac.util import arity, as_int
+from trac.util import AtomicFile, arity, as_int
+from trac.util.compat import OrderedDict
+from trac.util.concurrency import ThreadLocal, threading
 from trac.util.text import exception_to_unicode, shorten_line, to_unicode, \
                            unicode_quote, unicode_quote_plus, unquote_label
 from trac.util.html import TracHTMLSanitizer
 from trac.util.translation import _, tag_
-from trac.wiki.api import WikiSystem, parse_args
+from trac.wiki.api import IWikiChangeListener, WikiSystem, parse_args
 from trac.wiki.parser import WikiParser, parse_processor_args
 
 __all__ = ['wiki_to_html', 'wiki_to_oneliner', 'wiki_to_outline',
            'Formatter', 'format_to', 'format_to_html', 'format_to_oneliner',
            'extract_link', 'split_url_into_path_query_fragment',
-           'concat_path_query_fragment']
+           'concat_path_query_fragment', 'WikiRenderCache']
 
 
 def system_message(msg, text=None):
@@ -339,6 +346,8 @@ class WikiProcessor(object):
     def _macro_processor(self, text):
         self.env.log.debug('Executing Wiki macro %s by provider %s',
                            self.name, self.macro_provider)
+        if not getattr(self.macro_provider, 'cacheable', False):
+            self.formatter.disable_caching()
         if arity(self.macro_provider.expand_macro) == 4:
             return self.macro_provider.expand_macro(self.formatter, self.name,
                                                     text, self.args)
@@ -347,6 +356,8 @@ class WikiProcessor(object):
                                                     text)
 
     def _mimeview_processor(self, text):
+        # Renderers may add stylesheets and scripts to the request
+        self.formatter.disable_caching()
         annotations = []
         context = self.formatter.context.child()
         args = self.args.copy() if self.args else self.args
@@ -420,6 +431,9 @@ class Formatter(object):
 
     flavor = 'default'
 
+    # Resolve in bulk the links of the text before formatting it
+    prefetch_links = True
+
     def __init__(self, env, context):
         self.env = env
         self.context = context.child()
@@ -432,6 +446,7 @@ class Formatter(object):
         self.wikiparser = WikiParser(self.env)
         self._anchors = {}
         self._open_tags = []
+        self._resolved_links = {}
         self._safe_schemes = None
         if not self.wiki.render_unsafe_content:
             self._safe_schemes = set(self.wiki.safe_schemes)
@@ -440,6 +455,54 @@ class Formatter(object):
     def split_link(self, target):
         return split_url_into_path_query_fragment(target)
 
+    def resolve_link(self, provider, ns, target):
+        """Return the data resolved by `provider.resolve_links` for the
+        `target` of a link of namespace `ns`, or `None` if the target
+        doesn't exist.
+
+        The targets requested while formatting are collected from the
+        whole wiki text beforehand, and resolved with one call to
+        `resolve_links` per namespace.
+
+        (''since 1.2'')
+        """
+        resolved = self._resolved_links.setdefault(ns, {})
+        if target not in resolved:
+            resolved[target] = None
+            resolved.update(provider.resolve_links(self, ns, [target]))
+        return resolved[target]
+
+    def _prefetch_links(self, text):
+        collector = LinkCollector(self.env, self.context)
+        for (provider, ns), targets in collector.collect(text).iteritems():
+            resolved = self._resolved_links.setdefault(ns, {})
+            targets = [target for target in targets
+                              if target not in resolved]
+            if targets:
+                resolved.update(dict.fromkeys(targets))
+                resolved.update(provider.resolve_links(self, ns, targets))
+
+    def add_dependency(self, realm, id=None):
+        """Record that the output depends on the resource `realm:id`,
+        or on any resource of `realm` if `id` is `None`, so that the
+        `WikiRenderCache` discards the output when the resource changes.
+
+        (''since 1.2'')
+        """
+        cache = self.env[WikiRenderCache]
+        if cache:
+            cache.add_dependency(realm, id)
+
+    def disable_caching(self):
+        """Prevent the output from being cached by the `WikiRenderCache`,
+        e.g. because it depends on the request or on the current time.
+
+        (''since 1.2'')
+        """
+        cache = self.env[WikiRenderCache]
+        if cache:
+            cache.disable_caching()
+
     # -- Pre- IWikiSyntaxProvider rules (Font styles)
 
     _indirect_tags = {
@@ -722,6 +785,7 @@ class Formatter(object):
 
     def _make_interwiki_link(self, ns, target, label):
         from trac.wiki.interwiki import InterWikiMap
+        self.add_dependency(WikiSystem.realm, InterWikiMap._page_name)
         interwiki = InterWikiMap(self.env)
         if ns in interwiki:
             url, title = interwiki.url(ns, target)
@@ -1271,6 +1335,8 @@ class Formatter(object):
         text = self.reset(text, out)
         if isinstance(text, basestring):
             text = text.splitlines()
+        if self.prefetch_links:
+            self._prefetch_links(text)
 
         for line in text:
             # Detect start of code block (new block or embedded block)
@@ -1420,6 +1486,8 @@ class OneLinerFormatter(Formatter):
         if shorten:
             result = shorten_line(result)
 
+        if self.prefetch_links:
+            self._prefetch_links(result)
         result = re.sub(self.wikiparser.rules, self.replace, result)
         result = result.replace('[...]', u'[\u2026]')
         if result.endswith('...'):
@@ -1436,6 +1504,7 @@ class OneLinerFormatter(Formatter):
 class OutlineFormatter(Formatter):
     """Special formatter that generates an outline of all the headings."""
     flavor = 'outline'
+    prefetch_links = False
 
     # Avoid the possible side-effects of rendering WikiProcessors
     def _macro_formatter(self, match, fullmatch, macro):
@@ -1514,6 +1583,59 @@ class LinkFormatter(OutlineFormatter):
             return self.handle_match(match)
 
 
+class LinkCollector(OutlineFormatter):
+    """Special formatter that collects the targets requested through
+    `resolve_link` by the link resolvers, without resolving them.
+
+    Only the links and wiki syntax of the providers implementing
+    `resolve_links` are dispatched, the others are skipped so that
+    their resolvers run once, when the text is actually formatted.
+    The content of code blocks, citations, headings and macros is not
+    scanned, as it is formatted by formatters of its own.
+    """
+    flavor = 'collect'
+
+    def __init__(self, env, context):
+        OutlineFormatter.__init__(self, env, context)
+        self.links = {}
+
+    def resolve_link(self, provider, ns, target):
+        self.links.setdefault((provider, ns), set()).add(target)
+
+    def handle_match(self, fullmatch):
+        for itype, match in fullmatch.groupdict().items():
+            if match and not itype in self.wikiparser.helper_patterns:
+                if itype in self.wikiparser.external_handlers and \
+                        not hasattr(self.wikiparser.external_providers[itype],
+                                    'resolve_links'):
+                    return ''
+                break
+        return OutlineFormatter.handle_match(self, fullmatch)
+
+    def _make_link(self, ns, target, match, label, fullmatch):
+        ns = self.env.config['intertrac'].get(ns, ns)
+        if hasattr(self.wikiparser.link_providers.get(ns), 'resolve_links'):
+            return OutlineFormatter._make_link(self, ns, target, match, label,
+                                               fullmatch)
+        return ''
+
+    def _macro_formatter(self, match, fullmatch, macro):
+        return ''
+
+    def _heading_formatter(self, match, fullmatch):
+        return ''
+
+    def close_quote_block(self, escape_newlines):
+        self._quote_buffer = []
+
+    def collect(self, text):
+        """Return the targets requested for the wiki `text`, as a `dict`
+        mapping `(provider, ns)` pairs to sets of targets.
+        """
+        Formatter.format(self, text)
+        return self.links
+
+
 # Pure Wiki Formatter
 
 class HtmlFormatter(object):
@@ -1568,6 +1690,289 @@ class InlineHtmlFormatter(object):
         return Markup(out.getvalue())
 
 
+class WikiRenderCache(Component):
+    """Cache of the HTML rendered from wiki text, shared by the requests
+    and optionally stored on disk.
+
+    The renderings are keyed on a hash of the wiki text, the flavor and
+    options of the formatter and the rendering context: resource, base
+    URL, user, locale and rendering hints. The link resolvers record the
+    resources on which a rendering depends with
+    `Formatter.add_dependency`, and the rendering is discarded when
+    one of these resources changes, also in the other processes serving
+    the environment. As the links depend on the permissions of the
+    user, all renderings are also discarded when the permissions
+    change. The output of a wiki macro is only cached if the macro
+    provider has a true `cacheable` attribute.
+
+    (''since 1.2'')
+    """
+
+    implements(IWikiChangeListener)
+
+    max_size = IntOption('wiki', 'render_cache_size', 1000,
+        """Maximum number of rendered wiki texts kept in memory. Set
+        to 0 to disable the caching of rendered wiki texts.
+        (''since 1.2'')
+        """)
+
+    lifetime = IntOption('wiki', 'render_cache_lifetime', 600,
+        """Number of seconds after which a rendered wiki text is
+        discarded, so that changes to resources which are not tracked
+        by the cache, such as the changesets of a repository, are
+        eventually reflected. (''since 1.2'')
+        """)
+
+    cache_dir = PathOption('wiki', 'render_cache_dir', '',
+        """Directory in which the rendered wiki texts are also stored,
+        so that they are shared by the processes serving the
+        environment and kept when Trac is restarted. Relative paths
+        are resolved relative to the `conf` directory of the
+        environment. The files older than
+        [#wiki-section render_cache_lifetime] are removed from the
+        directory at most once per lifetime. Leave empty to keep the
+        rendered wiki texts in memory only. (''since 1.2'')
+        """)
+
+    #: Number of groups into which the resources of a realm are
+    #: hashed for tracking changes to individual resources
+    buckets = 64
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = ThreadLocal(recordings=None)
+        self._cache_ids = {}
+        self._next_prune = 0
+
+    def render(self, context, flavor, text, options, generate):
+        """Return the rendering of the wiki `text`, either from the
+        cache or by calling `generate()`.
+
+        :param flavor: the name of the formatter
+        :param options: the value of the formatting options, which
+                        must have a stable `repr`
+        """
+        if self.max_size <= 0:
+            return generate()
+        key = self._make_key(context, flavor, text, options)
+        recordings = self._local.recordings
+        if recordings is None:
+            recordings = self._local.recordings = []
+        entry = self._get(key)
+        if entry is not None:
+            # The enclosing renderings depend on the same resources
+            expires, dependencies, markup = entry
+            for outer in recordings:
+                for name, generation in dependencies.iteritems():
+                    outer.setdefault(name, generation)
+            return markup
+        dependencies = {}
+        recordings.append(dependencies)
+        try:
+            self.add_dependency('permission')
+            markup = generate()
+        finally:
+            recordings.pop()
+        if None not in dependencies:
+            self._set(key, dependencies, markup)
+        return markup
+
+    def add_dependency(self, realm, id=None):
+        """Record that the renderings in progress depend on the
+        resource `realm:id`, or on any resource of `realm`.
+        """
+        recordings = self._local.recordings
+        if not recordings:
+            return
+        names = [realm]
+        if id is not None:
+            names.append(self._bucket_name(realm, id))
+        for name in names:
+            generation = None
+            for dependencies in recordings:
+                if name not in dependencies:
+                    if generation is None:
+                        generation = self._get_generation(name)
+                    dependencies[name] = generation
+
+    def disable_caching(self):
+        """Prevent the renderings in progress from being cached."""
+        for dependencies in self._local.recordings or ():
+            dependencies[None] = None
+
+    def invalidate(self, realm, id=None):
+        """Discard the renderings which depend on the resource
+        `realm:id`, or on any resource of `realm` if `id` is `None`.
+        """
+        name = realm if id is None else self._bucket_name(realm, id)
+        CacheManager(self.env).invalidate(self._cache_id(name))
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        self.invalidate(WikiSystem.realm)
+
+    def wiki_page_changed(self, page, version, t, comment, author):
+        self.invalidate(WikiSystem.realm, page.name)
+
+    def wiki_page_deleted(self, page):
+        self.invalidate(WikiSystem.realm)
+
+    def wiki_page_version_deleted(self, page):
+        self.invalidate(WikiSystem.realm, page.name)
+
+    def wiki_page_renamed(self, page, old_name):
+        self.invalidate(WikiSystem.realm)
+
+    def wiki_page_comment_modified(self, page, old_comment):
+        pass
+
+    # Internal methods
+
+    def _make_key(self, context, flavor, text, options):
+        req = getattr(context, 'req', None)
+        hints = context._hints
+        if hints is None:
+            hints = context._parent_hints()
+        values = (flavor, options, repr(context.resource),
+                  context.href.base if context.href else None,
+                  getattr(context.perm, 'username', None),
+                  getattr(req, 'locale', None), getattr(req, 'tz', None),
+                  getattr(req, 'lc_time', None),
+                  sorted(hints.iteritems()) if hints else None)
+        digest = hashlib.sha1(repr(values))
+        digest.update(text.encode('utf-8') if isinstance(text, unicode)
+                      else text)
+        return digest.hexdigest()
+
+    def _bucket_name(self, realm, id):
+        if not isinstance(id, (int, long)):
+            id = int(hashlib.sha1(to_unicode(id).encode('utf-8'))
+                     .hexdigest()[:8], 16)
+        return '%s:%d' % (realm, id % self.buckets)
+
+    def _cache_id(self, name):
+        id = self._cache_ids.get(name)
+        if id is None:
+            id = self._cache_ids[name] = \
+                key_to_id('%s.%s.%s' % (self.__module__,
+                                        self.__class__.__name__, name))
+        return id
+
+    def _get_generation(self, name):
+        id = self._cache_id(name)
+        return CacheManager(self.env).get(
+            id, lambda self: self._fetch_generation(id), self)
+
+    def _fetch_generation(self, id):
+        for generation, in self.env.db_query(
+                "SELECT generation FROM cache WHERE id=%s", (id,)):
+            return generation
+        return -1
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+        loaded = False
+        if entry is None:
+            entry = self._load(key)
+            if entry is None:
+                return None
+            loaded = True
+        expires, dependencies, markup = entry
+        if expires < time.time() or \
+                any(self._get_generation(name) != generation
+                    for name, generation in dependencies.iteritems()):
+            with self._lock:
+                self._entries.pop(key, None)
+            if loaded:
+                self._remove(key)
+            return None
+        if loaded:
+            self._add(key, entry)
+        return entry
+
+    def _set(self, key, dependencies, markup):
+        now = time.time()
+        entry = (now + self.lifetime, dependencies, markup)
+        self._add(key, entry)
+        self._store(key, entry)
+        if self.cache_dir and now >= self._next_prune:
+            self._next_prune = now + self.lifetime
+            self.prune()
+
+    def prune(self):
+        """Remove the expired renderings from the cache directory."""
+        cache_dir = self.cache_dir
+        if not cache_dir or not os.path.isdir(cache_dir):
+            return
+        expired = time.time() - self.lifetime
+        for dirpath, dirnames, filenames in os.walk(cache_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    if os.path.getmtime(path) < expired:
+                        os.unlink(path)
+                except OSError:
+                    pass
+
+    def _add(self, key, entry):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _path(self, key):
+        if self.cache_dir:
+            return os.path.join(self.cache_dir, key[:2], key)
+
+    def _load(self, key):
+        path = self._path(key)
+        if not path or not os.path.isfile(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                format, expires, dependencies, text = marshal.loads(f.read())
+        except Exception as e:
+            self.log.warning("Can't read rendered wiki text '%s': %s",
+                             path, exception_to_unicode(e))
+            return None
+        if format != 1:
+            return None
+        return expires, dependencies, Markup(text)
+
+    def _store(self, key, entry):
+        path = self._path(key)
+        if not path:
+            return
+        expires, dependencies, markup = entry
+        try:
+            dir = os.path.dirname(path)
+            if not os.path.isdir(dir):
+                os.makedirs(dir)
+            f = AtomicFile(path, 'wb')
+            try:
+                f.write(marshal.dumps((1, expires, dependencies,
+                                       unicode(markup))))
+            except Exception:
+                f.rollback()
+                raise
+            f.commit()
+        except (IOError, OSError) as e:
+            self.log.warning("Can't write rendered wiki text '%s': %s",
+                             path, exception_to_unicode(e))
+
+    def _remove(self, key):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+
 def format_to(env, flavor, context, wikidom, **options):
     if flavor is None:
         flavor = context.get_hint('wiki_flavor', 'html')
@@ -1581,14 +1986,26 @@ def format_to_html(env, context, wikidom, escape_newlines=None):
         return Markup()
     if escape_newlines is None:
         escape_newlines = context.get_hint('preserve_newlines', False)
-    return HtmlFormatter(env, context, wikidom).generate(escape_newlines)
+    generate = lambda: HtmlFormatter(env, context, wikidom) \
+                       .generate(escape_newlines)
+    cache = env[WikiRenderCache]
+    if cache and isinstance(wikidom, basestring):
+        return cache.render(context, HtmlFormatter.flavor, wikidom,
+                            escape_newlines, generate)
+    return generate()
 
 def format_to_oneliner(env, context, wikidom, shorten=None):
     if not wikidom:
         return Markup()
     if shorten is None:
         shorten = context.get_hint('shorten_lines', False)
-    return InlineHtmlFormatter(env, context, wikidom).generate(shorten)
+    generate = lambda: InlineHtmlFormatter(env, context, wikidom) \
+                       .generate(shorten)
+    cache = env[WikiRenderCache]
+    if cache and isinstance(wikidom, basestring):
+        return cache.render(context, InlineHtmlFormatter.flavor, wikidom,
+                            shorten, generate)
+    return generate()
 
 def extract_link(env, context, wikidom):
     if not wikidom:
@@ -55,6 +55,10 @@ class WikiMacroBase(Component):
     #: A macro description
     _description = None
 
+    #: Whether the output of the macros only depends on the wiki text
+    #: and on the rendering context, and can therefore be cached
+    cacheable = False
+
     def get_macros(self):
         """Yield the name of the macro based on the class name."""
         name = self.__class__.__name__
@@ -148,11 +152,11 @@ class TitleIndexMacro(WikiMacroBase):
         else:
             omitprefix = lambda page: page
 
-        pages = sorted(page for page in wiki.get_pages(prefix)
-                       if (depth < 0 or depth >= page.count('/') - start)
-                       and 'WIKI_VIEW' in formatter.perm('wiki', page)
-                       and any(fnmatchcase(page, inc) for inc in includes)
-                       and not any(fnmatchcase(page, exc) for exc in excludes))
+        pages = [page for page in wiki.get_pages(prefix)
+                 if (depth < 0 or depth >= page.count('/') - start)
+                 and 'WIKI_VIEW' in formatter.perm('wiki', page)
+                 and any(fnmatchcase(page, inc) for inc in includes)
+                 and not any(fnmatchcase(page, exc) for exc in excludes)]
 
         if format == 'compact':
             return tag(
@@ -407,6 +411,8 @@ class PageOutlineMacro(WikiMacroBase):
        default). This parameter only has an effect in `inline` style.
     """)
 
+    cacheable = True
+
     def expand_macro(self, formatter, name, content):
         min_depth, max_depth = 1, 6
         title = None
@@ -709,6 +715,8 @@ class MacroListMacro(WikiMacroBase):
     macros if the `PythonOptimize` option is enabled for mod_python!
     """)
 
+    cacheable = True
+
     def expand_macro(self, formatter, name, content):
         from trac.wiki.formatter import system_message
 
@@ -769,6 +777,8 @@ class TracIniMacro(WikiMacroBase):
     options whose section and name start with the filters are output.
     """)
 
+    cacheable = True
+
     def expand_macro(self, formatter, name, content):
         from trac.config import ConfigSection, Option
         section_filter = key_filter = ''
@@ -828,6 +838,8 @@ class KnownMimeTypesMacro(WikiMacroBase):
     Can be given an optional argument which is interpreted as mime-type filter.
     """)
 
+    cacheable = True
+
     def expand_macro(self, formatter, name, content):
         from trac.mimeview.api import Mimeview
         mime_map = Mimeview(self.env).mime_map
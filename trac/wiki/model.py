@@ -16,7 +16,11 @@
 # Author: Jonas Borgström <jonas@edgewall.com>
 #         Christopher Lenz <cmlenz@gmx.de>
 
+import base64
 from datetime import datetime
+from difflib import SequenceMatcher
+import json
+import zlib
 
 from trac.core import *
 from trac.resource import Resource
@@ -93,6 +97,9 @@ class WikiPage(object):
             self.version = int(version)
             self.author = author
             self.time = from_utimestamp(time)
+            if text is None:
+                with self.env.db_query as db:
+                    text = _read_stored_text(db, name, self.version)
             self.text = text
             self.comment = comment
             self.readonly = int(readonly) if readonly else 0
@@ -122,11 +129,15 @@ class WikiPage(object):
             if version is None:
                 # Delete a wiki page completely
                 db("DELETE FROM wiki WHERE name=%s", (self.name,))
+                db("DELETE FROM wiki_delta WHERE name=%s", (self.name,))
                 self.env.log.info("Deleted page %s", self.name)
             else:
                 # Delete only a specific page version
+                expand_dependent_versions(db, self.name, version)
                 db("DELETE FROM wiki WHERE name=%s and version=%s",
                    (self.name, version))
+                db("DELETE FROM wiki_delta WHERE name=%s and version=%s",
+                   (self.name, version))
                 self.env.log.info("Deleted version %d of page %s", version,
                                   self.name)
 
@@ -134,11 +145,11 @@ class WikiPage(object):
                 self._fetch(self.name, None)
 
             if not self.exists:
-                # Invalidate page name cache
-                del WikiSystem(self.env).pages
                 # Delete orphaned attachments
                 from trac.attachment import Attachment
                 Attachment.delete_all(self.env, self.realm, self.name)
+                # Update page name cache, last as it can't be rolled back
+                WikiSystem(self.env).update_pages(removed=[self.name])
 
         # Let change listeners know about the deletion
         if not self.exists:
@@ -173,12 +184,20 @@ class WikiPage(object):
                             author, remote_addr, self.text, comment,
                             self.readonly))
                 self.version += 1
+                # Store the previous version as a delta if enabled
+                previous = self.version - 1
+                wiki = WikiSystem(self.env)
+                interval = wiki.snapshot_interval
+                if wiki.delta_storage and previous > 0 and interval > 1 \
+                        and previous % interval:
+                    _store_version(db, self.name, previous, self.old_text,
+                                   self.version, self.text)
             else:
                 db("UPDATE wiki SET readonly=%s WHERE name=%s",
                    (self.readonly, self.name))
             if self.version == 1:
-                # Invalidate page name cache
-                del WikiSystem(self.env).pages
+                # Update page name cache
+                WikiSystem(self.env).update_pages(added=[self.name])
 
         self.author = author
         self.comment = comment
@@ -219,12 +238,15 @@ class WikiPage(object):
                                   name=new_name))
 
             db("UPDATE wiki SET name=%s WHERE name=%s", (new_name, old_name))
-            # Invalidate page name cache
-            del WikiSystem(self.env).pages
+            db("UPDATE wiki_delta SET name=%s WHERE name=%s",
+               (new_name, old_name))
             # Reparent attachments
             from trac.attachment import Attachment
             Attachment.reparent_all(self.env, self.realm, old_name,
                                     self.realm, new_name)
+            # Update page name cache, last as it can't be rolled back
+            WikiSystem(self.env).update_pages(added=[new_name],
+                                              removed=[old_name])
 
         self.name = new_name
         self.env.log.info("Renamed page %s to %s", old_name, new_name)
@@ -252,6 +274,57 @@ class WikiPage(object):
             if hasattr(listener, 'wiki_page_comment_modified'):
                 listener.wiki_page_comment_modified(self, old_comment)
 
+    def compact(self, snapshot_interval=None):
+        """Store the versions of the page as compressed line deltas
+        against their next version, except for the latest version and
+        every `snapshot_interval`-th version, which are stored in full.
+
+        :param snapshot_interval: defaults to `[wiki] snapshot_interval`.
+                                  All the versions are stored in full if
+                                  the interval is lower than 2.
+        :return: the number of versions whose storage has been changed.
+        :since 1.2:
+        """
+        if not self.exists:
+            raise TracError(_("Cannot compact non-existent page"))
+        if snapshot_interval is None:
+            snapshot_interval = WikiSystem(self.env).snapshot_interval
+
+        count = 0
+        with self.env.db_transaction as db:
+            newer_version = newer_text = None
+            for version, base in db("""
+                    SELECT w.version, d.base FROM wiki w
+                    LEFT OUTER JOIN wiki_delta d
+                      ON (d.name=w.name AND d.version=w.version)
+                    WHERE w.name=%s ORDER BY w.version DESC
+                    """, (self.name,)):
+                if base is None:
+                    text = db("""SELECT text FROM wiki
+                                 WHERE name=%s AND version=%s
+                                 """, (self.name, version))[0][0]
+                elif base == newer_version:
+                    delta = db("""SELECT delta FROM wiki_delta
+                                  WHERE name=%s AND version=%s
+                                  """, (self.name, version))[0][0]
+                    text = _apply_delta(newer_text, delta)
+                else:
+                    text = _read_stored_text(db, self.name, version)
+                if newer_version is None or snapshot_interval < 2 or \
+                        version % snapshot_interval == 0:
+                    if base is not None:
+                        _store_version(db, self.name, version, text)
+                        count += 1
+                elif base != newer_version:
+                    _store_version(db, self.name, version, text,
+                                   newer_version, newer_text)
+                    count += 1
+                newer_version, newer_text = version, text
+        if count:
+            self.env.log.info("Changed the storage of %d versions of page "
+                              "%s", count, self.name)
+        return count
+
     def get_history(self):
         """Retrieve the edit history of a wiki page.
 
@@ -264,3 +337,87 @@ class WikiPage(object):
                 WHERE name=%s AND version<=%s ORDER BY version DESC
                 """, (self.name, self.version)):
             yield version, from_utimestamp(ts), author, comment, ipnr
+
+
+def expand_dependent_versions(db, name, version):
+    """Store in full the versions of page `name` stored as deltas
+    against `version`, before that version is deleted or its text is
+    replaced.
+
+    :since 1.2:
+    """
+    for dependent, in db("""
+            SELECT version FROM wiki_delta WHERE name=%s AND base=%s
+            """, (name, version)):
+        _store_version(db, name, dependent,
+                       _read_stored_text(db, name, dependent))
+
+
+def _encode_delta(base, text):
+    """Return the compressed line delta from `base` to `text`."""
+    base_lines = base.splitlines(True)
+    lines = text.splitlines(True)
+    ops = []
+    matcher = SequenceMatcher(None, base_lines, lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append((i1, i2))
+        elif j1 < j2:
+            ops.append(u''.join(lines[j1:j2]))
+    return base64.b64encode(zlib.compress(json.dumps(ops)))
+
+
+def _apply_delta(base, delta):
+    """Return the text obtained by applying `delta` to `base`."""
+    base_lines = base.splitlines(True)
+    parts = []
+    for op in json.loads(zlib.decompress(base64.b64decode(delta))):
+        if isinstance(op, list):
+            parts.extend(base_lines[op[0]:op[1]])
+        else:
+            parts.append(op)
+    return u''.join(parts)
+
+
+def _store_version(db, name, version, text, base=None, base_text=None):
+    """Store `version` of page `name` in full, or as a delta against
+    the `base` version if specified.
+    """
+    db("DELETE FROM wiki_delta WHERE name=%s AND version=%s",
+       (name, version))
+    if base is None:
+        db("UPDATE wiki SET text=%s WHERE name=%s AND version=%s",
+           (text, name, version))
+    else:
+        db("UPDATE wiki SET text=NULL WHERE name=%s AND version=%s",
+           (name, version))
+        db("""INSERT INTO wiki_delta (name,version,base,delta)
+              VALUES (%s,%s,%s,%s)
+              """, (name, version, base, _encode_delta(base_text, text)))
+
+
+def _read_stored_text(db, name, version):
+    """Return the text of `version` of page `name` stored as a delta,
+    by applying the deltas from the next version stored in full.
+    """
+    # The chain of deltas ends at the next version stored in full
+    for full_version, text in db("""
+            SELECT version, text FROM wiki
+            WHERE name=%s AND version>%s AND text IS NOT NULL
+            ORDER BY version LIMIT 1
+            """, (name, version)):
+        deltas = dict((v, (base, delta)) for v, base, delta in db("""
+                SELECT version, base, delta FROM wiki_delta
+                WHERE name=%s AND version>=%s AND version<%s
+                """, (name, version, full_version)))
+        chain = []
+        v = version
+        while v in deltas:
+            chain.append(v)
+            v = deltas[v][0]
+        if v == full_version:
+            for v in reversed(chain):
+                text = _apply_delta(text, deltas[v][1])
+            return text
+    raise TracError(_("The text of version %(num)s of page %(name)s is "
+                      "missing", num=version, name=name))
@@ -170,8 +170,10 @@ class WikiParser(Component):
     def __init__(self):
         self._compiled_rules = None
         self._link_resolvers = None
+        self._link_providers = None
         self._helper_patterns = None
         self._external_handlers = None
+        self._external_providers = None
 
     @property
     def rules(self):
@@ -188,16 +190,28 @@ class WikiParser(Component):
         self._prepare_rules()
         return self._external_handlers
 
+    @property
+    def external_providers(self):
+        """Dictionary mapping the names of the external handlers to the
+        `IWikiSyntaxProvider` they come from.
+
+        (''since 1.2'')
+        """
+        self._prepare_rules()
+        return self._external_providers
+
     def _prepare_rules(self):
         from trac.wiki.api import WikiSystem
         if not self._compiled_rules:
             helpers = []
             handlers = {}
+            providers = {}
             syntax = self._pre_rules[:]
             i = 0
             for resolver in WikiSystem(self.env).syntax_providers:
                 for regexp, handler in resolver.get_wiki_syntax() or []:
                     handlers['i' + str(i)] = handler
+                    providers['i' + str(i)] = resolver
                     syntax.append('(?P<i%d>%s)' % (i, regexp))
                     i += 1
             syntax += self._post_rules[:]
@@ -206,19 +220,36 @@ class WikiParser(Component):
                 helpers += helper_re.findall(rule)[1:]
             rules = re.compile('(?:' + '|'.join(syntax) + ')', re.UNICODE)
             self._external_handlers = handlers
+            self._external_providers = providers
             self._helper_patterns = helpers
             self._compiled_rules = rules
 
     @property
     def link_resolvers(self):
+        self._prepare_link_resolvers()
+        return self._link_resolvers
+
+    @property
+    def link_providers(self):
+        """Dictionary mapping the link namespaces to the
+        `IWikiSyntaxProvider` resolving them.
+
+        (''since 1.2'')
+        """
+        self._prepare_link_resolvers()
+        return self._link_providers
+
+    def _prepare_link_resolvers(self):
         if not self._link_resolvers:
             from trac.wiki.api import WikiSystem
             resolvers = {}
+            providers = {}
             for resolver in WikiSystem(self.env).syntax_providers:
                 for namespace, handler in resolver.get_link_resolvers() or []:
                     resolvers[namespace] = handler
+                    providers[namespace] = resolver
+            self._link_providers = providers
             self._link_resolvers = resolvers
-        return self._link_resolvers
 
     def parse(self, wikitext):
         """Parse `wikitext` and produce a WikiDOM tree."""
@@ -23,7 +23,8 @@ from trac.core import *
 from trac.resource import Resource
 from trac.test import EnvironmentStub
 from trac.util.datefmt import utc, to_utimestamp
-from trac.wiki import WikiPage, IWikiChangeListener
+from trac.wiki import WikiPage, WikiSystem, IWikiChangeListener
+from trac.wiki.model import _apply_delta, _encode_delta
 
 
 class TestWikiChangeListener(Component):
@@ -350,8 +351,135 @@ class WikiPageTestCase(unittest.TestCase):
         self.assertEqual(1, page.version)
 
 
+    def test_page_names_updated_in_place(self):
+        ws = WikiSystem(self.env)
+        self.assertEqual([], list(ws.get_pages()))
+        retriever = WikiSystem.pages.retriever
+        WikiSystem.pages.retriever = None  # Page names can't be retrieved
+        try:
+            page = WikiPage(self.env, 'TestPage')
+            page.text = 'Bla bla'
+            page.save('joe', 'Testing')
+            self.assertEqual(['TestPage'], list(ws.get_pages()))
+            page.rename('Test/RenamedPage')
+            self.assertEqual(['Test/RenamedPage'],
+                             list(ws.get_pages('Test/')))
+            self.assertEqual(['Test/RenamedPage'],
+                             ws.get_pages_containing('renamed'))
+            self.assertFalse(ws.has_page('TestPage'))
+            page.delete()
+            self.assertEqual([], list(ws.get_pages()))
+            self.assertEqual([], ws.get_pages_containing('renamed'))
+        finally:
+            WikiSystem.pages.retriever = retriever
+
+    def test_page_names_kept_when_change_fails(self):
+        ws = WikiSystem(self.env)
+        page = WikiPage(self.env, 'TestPage')
+        page.text = 'Bla bla'
+        page.save('joe', 'Testing')
+        self.assertTrue(ws.has_page('TestPage'))
+
+        def fail(*args):
+            raise TracError("Failed")
+        delete_all = Attachment.delete_all
+        reparent_all = Attachment.reparent_all
+        Attachment.delete_all = Attachment.reparent_all = staticmethod(fail)
+        try:
+            self.assertRaises(TracError, page.delete)
+            self.assertTrue(ws.has_page('TestPage'))
+            self.assertRaises(TracError, page.rename, 'RenamedPage')
+            self.assertTrue(ws.has_page('TestPage'))
+            self.assertFalse(ws.has_page('RenamedPage'))
+        finally:
+            Attachment.delete_all = delete_all
+            Attachment.reparent_all = reparent_all
+        self.assertEqual(['TestPage'], list(ws.get_pages()))
+
+
+class WikiDeltaStorageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.env.config.set('wiki', 'snapshot_interval', 3)
+        self.texts = [u'Line %d\nCommon line\r\nÉdition %d' % (i, i)
+                      for i in xrange(1, 8)]
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _save_versions(self, name='TestPage'):
+        page = WikiPage(self.env, name)
+        for text in self.texts:
+            page.text = text
+            page.save('joe', 'Testing')
+        return page
+
+    def _full_versions(self, name='TestPage'):
+        return [version for version, in self.env.db_query("""
+                SELECT version FROM wiki WHERE name=%s AND text IS NOT NULL
+                ORDER BY version""", (name,))]
+
+    def _assert_texts(self, name='TestPage'):
+        for version, text in enumerate(self.texts, 1):
+            self.assertEqual(text, WikiPage(self.env, name, version).text)
+        self.assertEqual(self.texts[-1], WikiPage(self.env, name).text)
+
+    def test_delta_roundtrip(self):
+        for base, text in [(u'a\nb\nc\n', u'a\nc\nd'), (u'', u'x\r\ny'),
+                           (u'x\r\ny', u''), (u'Élan\n', u'Élan\nÉté\n')]:
+            self.assertEqual(text, _apply_delta(base,
+                                                _encode_delta(base, text)))
+
+    def test_storage_disabled(self):
+        self._save_versions()
+        self.assertEqual(range(1, 8), self._full_versions())
+
+    def test_previous_version_stored_as_delta(self):
+        self.env.config.set('wiki', 'delta_storage', True)
+        self._save_versions()
+        self.assertEqual([3, 6, 7], self._full_versions())
+        self._assert_texts()
+
+    def test_compact_and_expand(self):
+        page = self._save_versions()
+        self.assertEqual(4, page.compact())
+        self.assertEqual([3, 6, 7], self._full_versions())
+        self._assert_texts()
+        self.assertEqual(0, page.compact())
+        self.assertEqual(3, page.compact(5))
+        self.assertEqual([5, 7], self._full_versions())
+        self._assert_texts()
+        self.assertEqual(5, page.compact(0))
+        self.assertEqual(range(1, 8), self._full_versions())
+        self.assertEqual([], self.env.db_query("SELECT * FROM wiki_delta"))
+        self._assert_texts()
+
+    def test_delete_versions(self):
+        self.env.config.set('wiki', 'delta_storage', True)
+        page = self._save_versions()
+        page.delete(7)
+        del self.texts[6]
+        self.assertEqual([3, 6], self._full_versions())
+        page.delete(5)
+        self.assertEqual([3, 4, 6], self._full_versions())
+        self.assertEqual(self.texts[3], WikiPage(self.env, 'TestPage', 4).text)
+        self.assertEqual(self.texts[0], WikiPage(self.env, 'TestPage', 1).text)
+        page.delete()
+        self.assertEqual([], self.env.db_query("SELECT * FROM wiki_delta"))
+
+    def test_rename(self):
+        self.env.config.set('wiki', 'delta_storage', True)
+        page = self._save_versions()
+        page.rename('RenamedPage')
+        self._assert_texts('RenamedPage')
+
+
 def suite():
-    return unittest.makeSuite(WikiPageTestCase)
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(WikiPageTestCase))
+    suite.addTest(unittest.makeSuite(WikiDeltaStorageTestCase))
+    return suite
 
 if __name__ == '__main__':
     unittest.main(defaultTest='suite')
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from trac.core import *
+from trac.perm import PermissionSystem
+from trac.test import EnvironmentStub, Mock, MockPerm, locale_en
+from trac.ticket.model import Ticket
+from trac.util.datefmt import utc
+from trac.web.chrome import web_context
+from trac.web.href import Href
+from trac.wiki.api import IWikiMacroProvider
+from trac.wiki.formatter import WikiRenderCache, format_to_html, \
+                                format_to_oneliner
+from trac.wiki.model import WikiPage
+
+
+class RenderCounterMacros(Component):
+
+    implements(IWikiMacroProvider)
+
+    cacheable = True
+    expansions = 0
+
+    def get_macros(self):
+        yield 'RenderCounter'
+
+    def get_macro_description(self, name):
+        return ''
+
+    def expand_macro(self, formatter, name, content):
+        RenderCounterMacros.expansions += 1
+        return content
+
+
+class UncacheableMacros(Component):
+
+    implements(IWikiMacroProvider)
+
+    def get_macros(self):
+        yield 'Uncacheable'
+
+    def get_macro_description(self, name):
+        return ''
+
+    def expand_macro(self, formatter, name, content):
+        RenderCounterMacros.expansions += 1
+        return content
+
+
+class WikiRenderCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True,
+                                   enable=['trac.*', RenderCounterMacros,
+                                           UncacheableMacros])
+        self.env.path = tempfile.mkdtemp(prefix='trac-tempenv-')
+        self.cache = WikiRenderCache(self.env)
+        RenderCounterMacros.expansions = 0
+
+    def tearDown(self):
+        self.env.reset_db()
+        shutil.rmtree(self.env.path)
+
+    def _context(self, realm='wiki', id='WikiStart'):
+        req = Mock(href=Href('/trac'), abs_href=Href('http://example.org/'),
+                   chrome={}, session={}, authname='anonymous',
+                   perm=MockPerm(), tz=utc, args={}, locale=locale_en,
+                   lc_time=locale_en)
+        return web_context(req, realm, id)
+
+    def _render(self, text, context=None):
+        return unicode(format_to_html(self.env, context or self._context(),
+                                      text))
+
+    def _insert_ticket(self, summary):
+        ticket = Ticket(self.env)
+        ticket['summary'] = summary
+        ticket['reporter'] = 'joe'
+        ticket.insert()
+        return ticket
+
+    def test_cacheable_macro(self):
+        html = self._render("[[RenderCounter(text)]]")
+        self.assertEqual(html, self._render("[[RenderCounter(text)]]"))
+        self.assertEqual(1, RenderCounterMacros.expansions)
+        self._render("[[RenderCounter(other text)]]")
+        self.assertEqual(2, RenderCounterMacros.expansions)
+
+    def test_uncacheable_macro(self):
+        self._render("[[Uncacheable(text)]]")
+        self._render("[[Uncacheable(text)]]")
+        self.assertEqual(2, RenderCounterMacros.expansions)
+
+    def test_uncacheable_nested_macro(self):
+        text = "{{{#!div\n[[Uncacheable(text)]] [[RenderCounter(text)]]\n}}}"
+        self._render(text)
+        self._render(text)
+        self.assertEqual(4, RenderCounterMacros.expansions)
+
+    def test_cache_disabled(self):
+        self.env.config.set('wiki', 'render_cache_size', 0)
+        self._render("[[RenderCounter(text)]]")
+        self._render("[[RenderCounter(text)]]")
+        self.assertEqual(2, RenderCounterMacros.expansions)
+
+    def test_key_includes_context(self):
+        text = "[[RenderCounter(text)]]"
+        self._render(text)
+        self._render(text, self._context('wiki', 'SandBox'))
+        context = self._context()
+        context.set_hints(preserve_newlines=True)
+        self._render(text, context)
+        self.assertEqual(3, RenderCounterMacros.expansions)
+
+    def test_key_includes_flavor(self):
+        text = "''text''\n\nmore"
+        html = self._render(text)
+        oneliner = unicode(format_to_oneliner(self.env, self._context(),
+                                              text))
+        self.assertIn('<p>', html)
+        self.assertNotIn('<p>', oneliner)
+
+    def test_lru_eviction(self):
+        self.env.config.set('wiki', 'render_cache_size', 2)
+        for content in ('a', 'b', 'a', 'c', 'a', 'b'):
+            self._render("[[RenderCounter(%s)]]" % content)
+        self.assertEqual(4, RenderCounterMacros.expansions)
+
+    def test_wiki_page_added(self):
+        text = "[[RenderCounter(text)]] NewPage"
+        self.assertIn('class="missing wiki"', self._render(text))
+        page = WikiPage(self.env, 'NewPage')
+        page.text = 'content'
+        page.save('joe', 'created')
+        self.assertIn('class="wiki"', self._render(text))
+        self.assertEqual(2, RenderCounterMacros.expansions)
+
+    def test_ticket_changed(self):
+        ticket1 = self._insert_ticket('First summary')
+        ticket2 = self._insert_ticket('Other summary')
+        text = "[[RenderCounter(text)]] #%d" % ticket1.id
+        self.assertIn('First summary', self._render(text))
+        ticket2['summary'] = 'Changed other summary'
+        ticket2.save_changes('joe')
+        self._render(text)
+        self.assertEqual(1, RenderCounterMacros.expansions)
+        ticket1['summary'] = 'Changed summary'
+        ticket1.save_changes('joe')
+        self.assertIn('Changed summary', self._render(text))
+        self.assertEqual(2, RenderCounterMacros.expansions)
+
+    def test_dependencies_of_nested_rendering(self):
+        ticket = self._insert_ticket('First summary')
+        div = "{{{#!div\n#%d [[RenderCounter(text)]]\n}}}\n" % ticket.id
+        text = div + "other text"
+        self._render(div + "text")
+        self._render(text)
+        self.assertEqual(1, RenderCounterMacros.expansions)
+        ticket['summary'] = 'Changed summary'
+        ticket.save_changes('joe')
+        self.assertIn('Changed summary', self._render(text))
+        self.assertEqual(2, RenderCounterMacros.expansions)
+
+    def test_disk_store(self):
+        cache_dir = os.path.join(self.env.path, 'render-cache')
+        self.env.config.set('wiki', 'render_cache_dir', cache_dir)
+        ticket = self._insert_ticket('First summary')
+        text = "[[RenderCounter(text)]] #%d" % ticket.id
+        html = self._render(text)
+        self.cache._entries.clear()
+        self.assertEqual(html, self._render(text))
+        self.assertEqual(1, RenderCounterMacros.expansions)
+        ticket['summary'] = 'Changed summary'
+        ticket.save_changes('joe')
+        self.cache._entries.clear()
+        self.assertIn('Changed summary', self._render(text))
+        self.assertEqual(2, RenderCounterMacros.expansions)
+
+    def test_permission_changed(self):
+        text = "[[RenderCounter(text)]]"
+        self._render(text)
+        PermissionSystem(self.env).grant_permission('joe', 'TICKET_VIEW')
+        self._render(text)
+        self.assertEqual(2, RenderCounterMacros.expansions)
+        self._render(text)
+        PermissionSystem(self.env).revoke_permission('joe', 'TICKET_VIEW')
+        self._render(text)
+        self.assertEqual(3, RenderCounterMacros.expansions)
+
+    def test_disk_store_pruned(self):
+        cache_dir = os.path.join(self.env.path, 'render-cache')
+        self.env.config.set('wiki', 'render_cache_dir', cache_dir)
+        self._render("[[RenderCounter(text)]]")
+        self._render("[[RenderCounter(other text)]]")
+        paths = [os.path.join(dirpath, filename)
+                 for dirpath, dirnames, filenames in os.walk(cache_dir)
+                 for filename in filenames]
+        self.assertEqual(2, len(paths))
+        expired = time.time() - self.cache.lifetime - 10
+        os.utime(paths[0], (expired, expired))
+        self.cache.prune()
+        self.assertFalse(os.path.exists(paths[0]))
+        self.assertTrue(os.path.exists(paths[1]))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(WikiRenderCacheTestCase))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -58,6 +58,19 @@ class ReadonlyWikiPolicyTestCase(unittest.TestCase):
                                                        self.page.resource,
                                                        perm_cache))
 
+    def test_readonly_change_invalidates_cached_decisions(self):
+        resource = self.page.resource
+        self.assertNotIn('WIKI_MODIFY', PermissionCache(self.env, 'user2',
+                                                        resource))
+        self.page.readonly = 0
+        self.page.save('user', 'readonly attribute removed')
+        self.assertIn('WIKI_MODIFY', PermissionCache(self.env, 'user2',
+                                                     resource))
+        self.page.readonly = 1
+        self.page.save('user', 'readonly attribute set')
+        self.assertNotIn('WIKI_MODIFY', PermissionCache(self.env, 'user2',
+                                                        resource))
+
 
 def suite():
     return unittest.makeSuite(ReadonlyWikiPolicyTestCase)
@@ -25,9 +25,11 @@ from trac.attachment import AttachmentModule, Attachment
 from trac.config import IntOption
 from trac.core import *
 from trac.mimeview.api import IContentConverter, Mimeview
-from trac.perm import IPermissionPolicy, IPermissionRequestor
+from trac.perm import IPermissionPolicy, IPermissionRequestor, \
+                     PermissionDecisionCache
 from trac.resource import *
-from trac.search import ISearchSource, search_to_sql, shorten_result
+from trac.search import ISearchSource, SearchIndex, fetch_ordered_rows, \
+                         merge_search_results, search_to_sql, shorten_result
 from trac.timeline.api import ITimelineEventProvider
 from trac.util import get_reporter_id
 from trac.util.datefmt import from_utimestamp, to_utimestamp
@@ -39,7 +41,8 @@ from trac.web.chrome import (Chrome, INavigationContributor,
                              ITemplateProvider, add_ctxtnav, add_link,
                              add_notice, add_script, add_stylesheet,
                              add_warning, prevnext_nav, web_context)
-from trac.wiki.api import IWikiPageManipulator, WikiSystem, validate_page_name
+from trac.wiki.api import IWikiChangeListener, IWikiPageManipulator, \
+                          WikiSystem, validate_page_name
 from trac.wiki.formatter import format_to, OneLinerFormatter
 from trac.wiki.model import WikiPage
 
@@ -54,6 +57,8 @@ class WikiModule(Component):
 
     realm = WikiSystem.realm
 
+    timeline_events_cacheable = True
+
     max_size = IntOption('wiki', 'max_size', 262144,
         """Maximum allowed wiki page size in characters.""")
 
@@ -652,11 +657,8 @@ class WikiModule(Component):
                                                       '/' + name, name, False))
             else:
                 name = page.name
-            name = name.lower()
-            related = [each for each in ws.pages
-                       if name in each.lower()
-                          and 'WIKI_VIEW' in req.perm(self.realm, each)]
-            related.sort()
+            related = [each for each in ws.get_pages_containing(name)
+                       if 'WIKI_VIEW' in req.perm(self.realm, each)]
             related = [ws._format_link(formatter, 'wiki', '/' + each, each,
                                        False)
                        for each in related]
@@ -792,18 +794,44 @@ class WikiModule(Component):
             yield ('wiki', _('Wiki'))
 
     def get_search_results(self, req, terms, filters):
+        return self.get_ordered_search_results(req, terms, filters, None)
+
+    def get_ordered_search_results(self, req, terms, filters, limit):
         if not 'wiki' in filters:
-            return
+            return []
+        wiki_realm = Resource(self.realm)
+        return merge_search_results([
+            self._get_page_search_results(req, wiki_realm, terms, limit),
+            AttachmentModule(self.env).get_search_results(req, wiki_realm,
+                                                          terms, limit)])
+
+    def _get_page_search_results(self, req, wiki_realm, terms, limit):
+        index = SearchIndex(self.env)
         with self.env.db_query as db:
-            sql_query, args = search_to_sql(db, ['w1.name', 'w1.author',
-                                                 'w1.text'], terms)
-            wiki_realm = Resource(self.realm)
-            for name, ts, author, text in db("""
+            if index.enabled:
+                names = [id for realm, id, score
+                            in index.search(terms, self.realm)]
+                rows = []
+                for chunk in (names[i:i + 100]
+                              for i in xrange(0, len(names), 100)):
+                    rows.extend(db("""
+                        SELECT w1.name, w1.time, w1.author, w1.text
+                        FROM wiki w1 WHERE w1.name IN (%s)
+                        AND w1.version=(SELECT max(version) FROM wiki w2
+                                        WHERE w2.name=w1.name)
+                        """ % ','.join(('%s',) * len(chunk)), chunk))
+                rows.sort(key=lambda row: row[1], reverse=True)
+            else:
+                sql_query, args = search_to_sql(db, ['w1.name', 'w1.author',
+                                                     'w1.text'], terms)
+                rows = fetch_ordered_rows(self.env, """
                     SELECT w1.name, w1.time, w1.author, w1.text
                     FROM wiki w1,(SELECT name, max(version) AS ver
                                   FROM wiki GROUP BY name) w2
                     WHERE w1.version = w2.ver AND w1.name = w2.name
-                    AND """ + sql_query, args):
+                    AND """ + sql_query + " ORDER BY w1.time DESC, w1.name",
+                    args, limit)
+            for name, ts, author, text in rows:
                 page = wiki_realm(id=name)
                 if 'WIKI_VIEW' in req.perm(page):
                     yield (get_resource_url(self.env, page, req.href),
@@ -811,20 +839,17 @@ class WikiModule(Component):
                            from_utimestamp(ts), author,
                            shorten_result(text, terms))
 
-        # Attachments
-        for result in AttachmentModule(self.env).get_search_results(
-                req, wiki_realm, terms):
-            yield result
-
 
 class ReadonlyWikiPolicy(Component):
     """Permission policy for the wiki that enforces the read-only attribute
     for wiki pages."""
 
-    implements(IPermissionPolicy)
+    implements(IPermissionPolicy, IWikiChangeListener)
 
     realm = WikiSystem.realm
 
+    cacheable = True
+
     # IPermissionPolicy methods
 
     def check_permission(self, action, username, resource, perm):
@@ -833,3 +858,27 @@ class ReadonlyWikiPolicy(Component):
             page = WikiPage(self.env, resource)
             if page.readonly and 'WIKI_ADMIN' not in perm(resource):
                 return False
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        # Also called when changing the attribute of the first version
+        if page.readonly != page.old_readonly:
+            PermissionDecisionCache(self.env).invalidate()
+
+    def wiki_page_changed(self, page, version, t, comment, author, ipnr):
+        if page.readonly != page.old_readonly:
+            PermissionDecisionCache(self.env).invalidate()
+
+    def wiki_page_deleted(self, page):
+        PermissionDecisionCache(self.env).invalidate()
+
+    def wiki_page_version_deleted(self, page):
+        PermissionDecisionCache(self.env).invalidate()
+
+    def wiki_page_renamed(self, page, old_name):
+        if page.readonly:
+            PermissionDecisionCache(self.env).invalidate()
+
+    def wiki_page_comment_modified(self, page, old_comment):
+        pass
@@ -15,15 +15,18 @@
 # Author: Alec Thomas <alec@swapoff.org>
 
 import os
+import re
 from ConfigParser import ParsingError
-from fnmatch import fnmatchcase
+from fnmatch import translate
 from itertools import groupby
 
 from trac.config import ConfigurationError, PathOption, UnicodeConfigParser
 from trac.core import *
-from trac.perm import IPermissionPolicy, PermissionSystem
+from trac.perm import IPermissionPolicy, PermissionDecisionCache, \
+                     PermissionSystem
 from trac.util import to_list
 from trac.util.text import to_unicode
+from trac.web.api import IRequestFilter
 
 
 class AuthzPolicy(Component):
@@ -119,7 +122,9 @@ class AuthzPolicy(Component):
     authenticated = REPO_SEARCH, XML_RPC
     }}}
     """
-    implements(IPermissionPolicy)
+    implements(IPermissionPolicy, IRequestFilter)
+
+    cacheable = True
 
     authz_file = PathOption('authz_policy', 'authz_file', '',
                             "Location of authz policy configuration file. "
@@ -129,6 +134,18 @@ class AuthzPolicy(Component):
     authz = None
     authz_mtime = None
 
+    # (rules, rules trie, groups by user, permissions by user, decisions)
+    # compiled from the authz file, replaced as a whole when the file is
+    # parsed again so that concurrent checks always see a consistent set
+    _compiled = None
+
+    # number of users for which the matching entry of each section is
+    # remembered
+    max_cached_users = 1000
+
+    # number of (action, permissions) decisions remembered
+    max_cached_decisions = 10000
+
     def __init__(self):
         if not self.authz_file:
             self.log.error("The `[authz_policy] authz_file` configuration "
@@ -149,26 +166,74 @@ class AuthzPolicy(Component):
         if not self.authz_mtime or \
                 os.path.getmtime(self.authz_file) != self.authz_mtime:
             self.parse_authz()
+        compiled = self._compiled
         resource_key = self.normalise_resource(resource)
         self.log.debug('Checking %s on %s', action, resource_key)
-        permissions = self.authz_permissions(resource_key, username)
+        permissions = self._authz_permissions(compiled, resource_key,
+                                              username)
+        return self._decide(compiled, action, permissions)
+
+    def check_permissions_bulk(self, action, username, resources, perm):
+        if not self.authz_mtime or \
+                os.path.getmtime(self.authz_file) != self.authz_mtime:
+            self.parse_authz()
+        compiled = self._compiled
+        self.log.debug('Checking %s on %d resources', action, len(resources))
+        return [self._decide(compiled, action,
+                             self._authz_permissions(
+                                 compiled, self.normalise_resource(resource),
+                                 username))
+                for resource in resources]
+
+    # IRequestFilter methods
+
+    def pre_process_request(self, req, handler):
+        # The cached decisions must not outlive a change of the authz
+        # file, which check_permission doesn't see when they are reused
+        if self.authz_mtime and \
+                os.path.getmtime(self.authz_file) != self.authz_mtime:
+            self.parse_authz()
+        return handler
+
+    def post_process_request(self, req, template, data, content_type):
+        return template, data, content_type
+
+    # Internal methods
+
+    def decide(self, action, permissions):
+        """Return the decision on `action` given the `permissions`
+        matched in the authz file.
+        """
+        return self._decide(self._compiled, action, permissions)
+
+    def _decide(self, compiled, action, permissions):
         if permissions is None:
             return None                 # no match, can't decide
         elif permissions == []:
             return False                # all actions are denied
 
-        # FIXME: expand all permissions once for all
+        # Sections usually share a few permission lists, so the meta
+        # actions are expanded once per permission list and action
+        decisions = compiled[4]
+        key = (action, tuple(permissions))
+        try:
+            return decisions[key]
+        except KeyError:
+            pass
+        decision = None                 # no match for action, can't decide
         ps = PermissionSystem(self.env)
         for deny, perms in groupby(permissions,
                                    key=lambda p: p.startswith('!')):
             if deny and action in ps.expand_actions(p[1:] for p in perms):
-                return False            # action is explicitly denied
+                decision = False        # action is explicitly denied
+                break
             elif action in ps.expand_actions(perms):
-                return True             # action is explicitly granted
-
-        return None                     # no match for action, can't decide
-
-    # Internal methods
+                decision = True         # action is explicitly granted
+                break
+        if len(decisions) >= self.max_cached_decisions:
+            decisions.clear()
+        decisions[key] = decision
+        return decision
 
     def parse_authz(self):
         self.log.debug("Parsing authz security policy %s",
@@ -186,20 +251,55 @@ class AuthzPolicy(Component):
             for group, users in self.authz.items('groups'):
                 groups[group] = to_list(users)
 
-        self.groups_by_user = {}
+        groups_by_user = {}
 
         def add_items(group, items):
             for item in items:
                 if item.startswith('@'):
                     add_items(group, groups[item[1:]])
                 else:
-                    self.groups_by_user.setdefault(item, set()).add(group)
+                    groups_by_user.setdefault(item, set()).add(group)
 
         for group, users in groups.iteritems():
             add_items('@' + group, users)
 
+        self._compiled = self.compile_authz(groups_by_user)
+        self.groups_by_user = groups_by_user
+
+        if self.authz_mtime is not None:
+            PermissionDecisionCache(self.env).invalidate()
         self.authz_mtime = os.path.getmtime(self.authz_file)
 
+    def compile_authz(self, groups_by_user):
+        """Compile the sections of the parsed authz file.
+
+        The glob of each section is compiled to a regular expression,
+        and the sections are indexed in a trie by the literal prefix of
+        their glob, so that only the sections whose prefix matches are
+        tried for a resource.
+
+        :return: a `(rules, trie, groups_by_user, user_permissions,
+                 decisions)` tuple, the last two being empty memo tables
+        """
+        rules = []
+        trie = {}
+        for idx, section in enumerate(s for s in self.authz.sections()
+                                        if s != 'groups'):
+            resource_glob = section
+            if '@' not in resource_glob:
+                resource_glob += '@*'
+            entries = [(who, to_list(permissions))
+                       for who, permissions in self.authz.items(section)]
+            rules.append((resource_glob, re.compile(translate(resource_glob)),
+                          entries))
+            node = trie
+            for c in self._literal_prefix_re.match(resource_glob).group(0):
+                node = node.setdefault(c, {})
+            node.setdefault(None, []).append(idx)
+        return rules, trie, groups_by_user, {}, {}
+
+    _literal_prefix_re = re.compile(r'[^*?[]*')
+
     def normalise_resource(self, resource):
         def to_descriptor(resource):
             id = resource.id
@@ -227,27 +327,56 @@ class AuthzPolicy(Component):
         return '/'.join(flatten(resource))
 
     def authz_permissions(self, resource_key, username):
+        return self._authz_permissions(self._compiled, resource_key,
+                                       username)
+
+    def _authz_permissions(self, compiled, resource_key, username):
         # TODO: Handle permission negation in sections. eg. "if in this
         # ticket, remove TICKET_MODIFY"
-        if username and username != 'anonymous':
-            valid_users = ['*', 'authenticated', username]
+        rules, trie = compiled[:2]
+        permissions_by_rule = self._permissions_by_rule(compiled, username)
+        candidates = []
+        node = trie
+        for c in resource_key:
+            candidates.extend(node.get(None, ()))
+            node = node.get(c)
+            if node is None:
+                break
         else:
-            valid_users = ['*', 'anonymous']
-        for resource_section in [a for a in self.authz.sections()
-                                   if a != 'groups']:
-            resource_glob = resource_section
-            if '@' not in resource_glob:
-                resource_glob += '@*'
-
-            if fnmatchcase(resource_key, resource_glob):
-                for who, permissions in self.authz.items(resource_section):
-                    permissions = to_list(permissions)
-                    if who in valid_users or \
-                            who in self.groups_by_user.get(username, []):
-                        self.log.debug("%s matched section %s for user %s",
-                                       resource_key, resource_glob, username)
-                        if isinstance(permissions, basestring):
-                            return [permissions]
-                        else:
-                            return permissions
+            candidates.extend(node.get(None, ()))
+        for idx in sorted(candidates):
+            permissions = permissions_by_rule[idx]
+            if permissions is not None:
+                resource_glob, resource_re, entries = rules[idx]
+                if resource_re.match(resource_key):
+                    self.log.debug("%s matched section %s for user %s",
+                                   resource_key, resource_glob, username)
+                    return permissions
         return None
+
+    def _permissions_by_rule(self, compiled, username):
+        """Return the permissions of the first entry matching the user
+        in each section, or `None` for the sections without such entry.
+        """
+        rules, trie, groups_by_user, user_permissions = compiled[:4]
+        try:
+            return user_permissions[username]
+        except KeyError:
+            pass
+        if username and username != 'anonymous':
+            valid_users = set(['*', 'authenticated', username])
+        else:
+            valid_users = set(['*', 'anonymous'])
+        valid_users.update(groups_by_user.get(username, ()))
+        permissions_by_rule = []
+        for resource_glob, resource_re, entries in rules:
+            for who, permissions in entries:
+                if who in valid_users:
+                    permissions_by_rule.append(permissions)
+                    break
+            else:
+                permissions_by_rule.append(None)
+        if len(user_permissions) >= self.max_cached_users:
+            user_permissions.clear()
+        user_permissions[username] = permissions_by_rule
+        return permissions_by_rule
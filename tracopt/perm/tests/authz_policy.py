@@ -129,6 +129,92 @@ administrators = éat
         self.assertNotIn('WIKI_VIEW', perm)
         self.assertIn('WIKI_VIEW', perm(resource))
 
+    def test_authz_file_change_invalidates_cached_decisions(self):
+        resource = Resource('wiki', 'WikiStart')
+        self.assertIn('WIKI_VIEW', self.get_perm(u'änon', resource))
+
+        create_file(self.authz_file, """\
+[wiki:WikiStart]
+* =
+""")
+        mtime = os.path.getmtime(self.authz_file) + 10
+        os.utime(self.authz_file, (mtime, mtime))
+        # Cached decision until the next request
+        self.assertIn('WIKI_VIEW', self.get_perm(u'änon', resource))
+        AuthzPolicy(self.env).pre_process_request(Mock(), None)
+        self.assertNotIn('WIKI_VIEW', self.get_perm(u'änon', resource))
+
+    def test_reparse_keeps_compiled_rules_of_pending_checks(self):
+        authz_policy = AuthzPolicy(self.env)
+        resource = Resource('ticket', 43)
+        self.assertTrue(self.check_permission('TICKET_VIEW', u'änon',
+                                              resource, None))
+        compiled = authz_policy._compiled
+        create_file(self.authz_file, """\
+[*]
+* =
+""")
+        authz_policy.parse_authz()
+        self.assertIsNot(compiled, authz_policy._compiled)
+        self.assertEqual(['TICKET_VIEW'],
+                         authz_policy._authz_permissions(
+                             compiled, 'ticket:43@*', u'änon'))
+        self.assertEqual([], authz_policy.authz_permissions('ticket:43@*',
+                                                            u'änon'))
+
+    def test_cached_decisions_are_bounded(self):
+        authz_policy = AuthzPolicy(self.env)
+        authz_policy.max_cached_decisions = 2
+        authz_policy.parse_authz()
+        for action in ('WIKI_VIEW', 'WIKI_MODIFY', 'WIKI_ADMIN'):
+            authz_policy.decide(action, ['WIKI_VIEW'])
+        self.assertEqual(1, len(authz_policy._compiled[4]))
+        self.assertTrue(authz_policy.decide('WIKI_VIEW', ['WIKI_VIEW']))
+
+    def test_check_permissions_bulk(self):
+        authz_policy = AuthzPolicy(self.env)
+        resources = [Resource('ticket', id) for id in (42, 43, 44)]
+        for username in ('anonymous', u'änon', u'éat'):
+            perm = self.get_perm(username)
+            self.assertEqual(
+                [self.check_permission('TICKET_VIEW', username, resource,
+                                       perm)
+                 for resource in resources],
+                authz_policy.check_permissions_bulk('TICKET_VIEW', username,
+                                                    resources, perm))
+        self.assertEqual([resources[1]],
+                         self.get_perm(u'änon').filter('TICKET_VIEW',
+                                                       resources))
+        self.assertEqual([resources[0], resources[2]],
+                         self.get_perm(u'éat').filter('TICKET_VIEW',
+                                                      resources))
+
+    def test_sections_checked_in_order(self):
+        create_file(self.authz_file, """\
+[wiki:Wiki*]
+alice = WIKI_VIEW
+
+[*]
+alice = !WIKI_VIEW
+bob = WIKI_ADMIN
+
+[wiki:WikiStart]
+bob = !WIKI_VIEW
+
+[wiki:Page?]
+* = WIKI_VIEW
+""")
+        def check(username, id):
+            return self.check_permission('WIKI_VIEW', username,
+                                         Resource('wiki', id), None)
+        self.assertEqual(True, check('alice', 'WikiStart'))
+        self.assertEqual(False, check('alice', 'Page1'))
+        self.assertEqual(True, check('bob', 'WikiStart'))
+        self.assertEqual(True, check('carol', 'Page1'))
+        self.assertEqual(True, check('carol', 'Page2'))
+        self.assertEqual(None, check('carol', 'Page10'))
+        self.assertEqual(None, check('carol', 'WikiStart'))
+
     def test_resource_without_id(self):
         perm = self.get_perm('anonymous')
         self.assertNotIn('TICKET_VIEW', perm)
@@ -13,20 +13,25 @@
 # history and logs, available at http://trac.edgewall.org/log/.
 
 import os
+from array import array
+import binascii
 import codecs
 from collections import deque
 from contextlib import contextmanager
 import cStringIO
 from functools import partial
+import hashlib
+import marshal
 import re
 from subprocess import Popen, PIPE
-from threading import Lock
+import sys
+from threading import Condition, Lock
 import time
 import weakref
 
 from trac.core import TracBaseError
-from trac.util import terminate
-from trac.util.compat import close_fds
+from trac.util import AtomicFile, terminate
+from trac.util.compat import OrderedDict, close_fds
 from trac.util.text import to_unicode
 
 __all__ = ['GitError', 'GitErrorSha', 'Storage', 'StorageFactory']
@@ -145,11 +150,16 @@ class GitCore(object):
     def cat_file_batch(self):
         return self.__pipe('cat-file', '--batch', stdin=PIPE, stdout=PIPE)
 
+    def cat_file_batch_check(self):
+        return self.__pipe('cat-file', '--batch-check', stdin=PIPE,
+                           stdout=PIPE)
+
     def log_pipe(self, *cmd_args):
         return self.__pipe('log', stdout=PIPE, *cmd_args)
 
     def __getattr__(self, name):
-        if name[0] == '_' or name in ['cat_file_batch', 'log_pipe']:
+        if name[0] == '_' or name in ['cat_file_batch',
+                                      'cat_file_batch_check', 'log_pipe']:
             raise AttributeError, name
         return partial(self.__execute, name.replace('_','-'))
 
@@ -197,6 +207,119 @@ class SizedDict(dict):
         raise NotImplementedError("SizedDict has no setdefault() method")
 
 
+class SizedLRUCache(object):
+    """Size-bounded cache with LRU replacement strategy, where the size
+    is the total size of the cached values, by default their length
+    """
+
+    def __init__(self, max_size=0):
+        self.__max_size = max_size
+        self.__size = 0
+        self.__items = OrderedDict()
+        self.__lock = Lock()
+
+    def __len__(self):
+        return len(self.__items)
+
+    @property
+    def size(self):
+        return self.__size
+
+    def get(self, key, default=None):
+        with self.__lock:
+            try:
+                item = self.__items.pop(key)
+            except KeyError:
+                return default
+            self.__items[key] = item
+            return item[0]
+
+    def set(self, key, value, size=None):
+        """Cache `value`, counting `size` in the total size of the
+        cache, or the length of `value` if `size` is not given.
+        """
+        if size is None:
+            size = len(value)
+        with self.__lock:
+            if key in self.__items:
+                self.__size -= self.__items.pop(key)[1]
+            self.__items[key] = (value, size)
+            self.__size += size
+            while self.__size > self.__max_size:
+                self.__size -= self.__items.popitem(last=False)[1][1]
+
+
+class GitProcessPool(object):
+    """Pool of long-running git processes communicating through pipes,
+    such as `git cat-file --batch`
+
+    At most `max_size` processes are started, and a process is used by
+    a single thread at a time.
+    """
+
+    def __init__(self, spawn, max_size=1):
+        self.__spawn = spawn
+        self.__max_size = max(1, max_size)
+        self.__count = 0
+        self.__idle = []
+        self.__cond = Condition(Lock())
+
+    @contextmanager
+    def process(self):
+        """Context manager returning a process of the pool.
+
+        The process is killed rather than returned to the pool if an
+        exception is raised, as it may have unread output.
+        """
+        proc = None
+        with self.__cond:
+            while not self.__idle and self.__count >= self.__max_size:
+                self.__cond.wait()
+            if self.__idle:
+                proc = self.__idle.pop()
+            else:
+                self.__count += 1
+        if proc is not None and proc.poll() is not None:
+            proc.wait()
+            proc = None
+        if proc is None:
+            try:
+                proc = self.__spawn()
+            except:
+                self.__release(None)
+                raise
+        try:
+            yield proc
+        except:
+            self.__release(proc)
+            raise
+        with self.__cond:
+            self.__idle.append(proc)
+            self.__cond.notify()
+
+    def close(self):
+        """Terminate the idle processes."""
+        with self.__cond:
+            idle, self.__idle = self.__idle, []
+            self.__count -= len(idle)
+            self.__cond.notify_all()
+        for proc in idle:
+            self.__terminate(proc)
+
+    def __release(self, proc):
+        if proc is not None:
+            self.__terminate(proc)
+        with self.__cond:
+            self.__count -= 1
+            self.__cond.notify()
+
+    @staticmethod
+    def __terminate(proc):
+        proc.stdin.close()
+        terminate(proc)
+        proc.wait()
+
+
 class StorageFactory(object):
     __dict = weakref.WeakValueDictionary()
     __dict_nonweak = {}
@@ -204,7 +327,8 @@ class StorageFactory(object):
     __dict_lock = Lock()
 
     def __init__(self, repo, log, weak=True, git_bin='git',
-                 git_fs_encoding=None):
+                 git_fs_encoding=None, rev_cache_dir=None,
+                 cat_file_pool_size=1):
         self.logger = log
 
         with self.__dict_lock:
@@ -219,7 +343,8 @@ class StorageFactory(object):
                 i = self.__dict[repo]
             except KeyError:
                 rev_cache = self.__dict_rev_cache.get(repo)
-                i = Storage(repo, log, git_bin, git_fs_encoding, rev_cache)
+                i = Storage(repo, log, git_bin, git_fs_encoding, rev_cache,
+                            rev_cache_dir, cat_file_pool_size)
                 self.__dict[repo] = i
 
             # create additional reference depending on 'weak' argument
@@ -247,11 +372,314 @@ class StorageFactory(object):
             cls.__dict_rev_cache.clear()
 
 
+class RevGraph(object):
+    """Commit graph of a repository stored in flat integer arrays.
+
+    Commits are numbered in the order in which they are added, parents
+    before children, so that the commits found by an incremental update
+    are appended after the commits they descend from. Branches are
+    numbered as well, and the branches containing a commit are stored
+    as a bitset.
+
+    For compatibility with the former dictionary, `graph[rev]` returns
+    a `(children, parents, ordinal, rheads)` tuple where the ordinal is
+    1 for the youngest commit.
+    """
+
+    __slots__ = ('revs', 'index', 'parent1', 'parents_extra', 'child1',
+                 'children_extra', 'rheads', 'branches', 'head_revs')
+
+    # rheads are recomputed in a single pass over the graph, rather than
+    # per branch, when more branches than this have been updated
+    max_branch_updates = 16
+
+    def __init__(self):
+        self.revs = []  # commit number -> sha
+        self.index = {}  # sha -> commit number
+        self.parent1 = array('i')  # first parent, -1 for root commits
+        self.parents_extra = {}  # commit number -> other parents
+        self.child1 = array('i')  # first child, -1 for none
+        self.children_extra = {}  # commit number -> other children
+        self.rheads = []  # commit number -> bitset of branches
+        self.branches = {}  # refname -> branch number
+        self.head_revs = []  # branch number -> sha, None if unused
+
+    def __repr__(self):
+        return '<RevGraph %d commits, %d branches>' % (len(self.revs),
+                                                      len(self.branches))
+
+    def __len__(self):
+        return len(self.revs)
+
+    def __contains__(self, rev):
+        return rev in self.index
+
+    def __iter__(self):
+        return iter(self.revs)
+
+    iterkeys = __iter__
+
+    def __getitem__(self, rev):
+        i = self.index[rev]
+        revs = self.revs
+        return (frozenset(revs[c] for c in self._children(i)),
+                tuple(revs[p] for p in self._parents(i)),
+                len(revs) - i, self._rheads(self.rheads[i]))
+
+    def iteritems(self):
+        for rev in self.revs:
+            yield rev, self[rev]
+
+    @property
+    def youngest_rev(self):
+        return self.revs[-1] if self.revs else None
+
+    @property
+    def oldest_rev(self):
+        return self.revs[0] if self.revs else None
+
+    def rev_at(self, ordinal):
+        """Return the sha of the commit with the given ordinal, or
+        `None` if it is out of range.
+        """
+        if 1 <= ordinal <= len(self.revs):
+            return self.revs[len(self.revs) - ordinal]
+
+    def is_ancestor(self, rev1, rev2):
+        """Return whether `rev1` is a (strict) ancestor of `rev2`."""
+        i1 = self.index.get(rev1)
+        i2 = self.index.get(rev2)
+        if i1 is None or i2 is None or i1 >= i2:
+            return False
+        # ancestors always have a lower commit number
+        stack = [i2]
+        seen = set()
+        while stack:
+            for p in self._parents(stack.pop()):
+                if p == i1:
+                    return True
+                if p > i1 and p not in seen:
+                    seen.add(p)
+                    stack.append(p)
+        return False
+
+    def copy(self):
+        graph = RevGraph()
+        graph.revs = list(self.revs)
+        graph.index = self.index.copy()
+        graph.parent1 = self.parent1[:]
+        graph.parents_extra = self.parents_extra.copy()
+        graph.child1 = self.child1[:]
+        graph.children_extra = self.children_extra.copy()
+        graph.rheads = list(self.rheads)
+        graph.branches = self.branches.copy()
+        graph.head_revs = list(self.head_revs)
+        return graph
+
+    def add_commits(self, rev_list):
+        """Add the commits of `rev_list`, a list of `[rev, parent...]`
+        lists ordered children first as output by `git rev-list
+        --parents --topo-order`.
+
+        Return `False` if a parent is neither in the graph nor in
+        `rev_list`.
+        """
+        revs = self.revs
+        index = self.index
+        parent1 = self.parent1
+        child1 = self.child1
+        children_extra = self.children_extra
+        for line in reversed(rev_list):
+            rev = line[0]
+            if rev in index:
+                continue
+            try:
+                parents = [index[p] for p in line[1:]]
+            except KeyError:
+                return False
+            i = len(revs)
+            revs.append(rev)
+            index[rev] = i
+            parent1.append(parents[0] if parents else -1)
+            if len(parents) > 1:
+                self.parents_extra[i] = tuple(parents[1:])
+            child1.append(-1)
+            self.rheads.append(0)
+            for p in parents:
+                if child1[p] < 0:
+                    child1[p] = i
+                else:
+                    children_extra[p] = children_extra.get(p, ()) + (i,)
+        return True
+
+    def set_branches(self, heads):
+        """Update the branches containing each commit from the `heads`
+        dictionary of branch refnames and head shas.
+        """
+        branches = self.branches
+        head_revs = self.head_revs
+        updates = []
+        for refname in set(branches) - set(heads):
+            bit = branches.pop(refname)
+            updates.append((bit, head_revs[bit], None))
+            head_revs[bit] = None
+        for refname, rev in sorted(heads.iteritems()):
+            bit = branches.get(refname)
+            if bit is None:
+                try:
+                    bit = head_revs.index(None)
+                except ValueError:
+                    bit = len(head_revs)
+                    head_revs.append(None)
+                branches[refname] = bit
+            old_rev = head_revs[bit]
+            if old_rev != rev:
+                head_revs[bit] = rev
+                updates.append((bit, old_rev, rev))
+        if len(updates) > self.max_branch_updates:
+            self._compute_rheads()
+        else:
+            for bit, old_rev, rev in updates:
+                self._update_rheads(bit, old_rev, rev)
+
+    def _parents(self, i):
+        p = self.parent1[i]
+        if p < 0:
+            return ()
+        extra = self.parents_extra.get(i)
+        return (p,) + extra if extra else (p,)
+
+    def _children(self, i):
+        c = self.child1[i]
+        if c < 0:
+            return ()
+        extra = self.children_extra.get(i)
+        return (c,) + extra if extra else (c,)
+
+    def _rheads(self, bits):
+        head_revs = self.head_revs
+        rheads = set()
+        bit = 0
+        while bits:
+            if bits & 1:
+                rheads.add(head_revs[bit])
+            bits >>= 1
+            bit += 1
+        return frozenset(rheads)
+
+    def _compute_rheads(self):
+        rheads = [0] * len(self.revs)
+        for bit, rev in enumerate(self.head_revs):
+            i = self.index.get(rev)
+            if i is not None:
+                rheads[i] |= 1 << bit
+        parent1 = self.parent1
+        parents_extra = self.parents_extra
+        for i in xrange(len(rheads) - 1, -1, -1):
+            bits = rheads[i]
+            if bits:
+                p = parent1[i]
+                if p >= 0:
+                    rheads[p] |= bits
+                    for p in parents_extra.get(i, ()):
+                        rheads[p] |= bits
+        # share the bitsets between commits
+        seen = {}
+        self.rheads = [seen.setdefault(bits, bits) for bits in rheads]
+
+    def _update_rheads(self, bit, old_rev, rev):
+        """Move the head of branch number `bit` from `old_rev` to `rev`,
+        either of which can be `None`.
+        """
+        mask = 1 << bit
+        old = self.index.get(old_rev)
+        new = self.index.get(rev)
+        if new is not None and \
+                (self._set_bit(mask, new, old) or old is None):
+            return  # new branch or fast-forward
+        # clear the bit from the ancestors of both heads and set it again
+        rheads = self.rheads
+        stack = [i for i in (old, new) if i is not None]
+        while stack:
+            i = stack.pop()
+            if rheads[i] & mask:
+                rheads[i] &= ~mask
+                stack.extend(self._parents(i))
+        if new is not None:
+            self._set_bit(mask, new, None)
+
+    def _set_bit(self, mask, start, old):
+        """Set `mask` on `start` and its ancestors, and return whether
+        `old` is one of them.
+        """
+        rheads = self.rheads
+        reached = False
+        stack = [start]
+        while stack:
+            i = stack.pop()
+            if i == old:
+                reached = True
+            if not rheads[i] & mask:
+                rheads[i] |= mask
+                stack.extend(self._parents(i))
+        return reached
+
+    # Snapshots
+
+    _snapshot_format = (1, array('i').itemsize, sys.byteorder)
+
+    def dumps(self, refs):
+        """Serialize the graph together with the `refs` it was built
+        from.
+        """
+        table = {}
+        rheads = array('i', (table.setdefault(bits, len(table))
+                             for bits in self.rheads))
+        return marshal.dumps((self._snapshot_format, refs,
+                              ''.join(binascii.unhexlify(rev)
+                                      for rev in self.revs),
+                              self.parent1.tostring(), self.parents_extra,
+                              self.child1.tostring(), self.children_extra,
+                              sorted(table, key=table.get),
+                              rheads.tostring(), self.branches,
+                              self.head_revs))
+
+    @classmethod
+    def loads(cls, data):
+        """Deserialize a graph serialized by `dumps()` and return a
+        `(graph, refs)` tuple, or `None` if the format is not supported.
+        """
+        data = marshal.loads(data)
+        if data[0] != cls._snapshot_format:
+            return None
+        graph = cls()
+        refs, revs, parent1, graph.parents_extra, child1, \
+            graph.children_extra, table, rheads, graph.branches, \
+            graph.head_revs = data[1:]
+        graph.revs = [binascii.hexlify(revs[i:i + 20])
+                      for i in xrange(0, len(revs), 20)]
+        graph.index = dict((rev, i) for i, rev in enumerate(graph.revs))
+        graph.parent1.fromstring(parent1)
+        graph.child1.fromstring(child1)
+        graph.rheads = [table[i] for i in array('i', rheads)]
+        return graph, refs
+
+
 class Storage(object):
     """High-level wrapper around GitCore with in-memory caching"""
 
     __SREV_MIN = 4 # minimum short-rev length
 
+    # number of objects requested at once from `git cat-file --batch`,
+    # small enough for the requests to fit in the pipe buffer
+    cat_file_batch_size = 64
+
+    # commits and trees up to `object_cache_max_object` bytes are kept
+    # in a cache of `object_cache_size` bytes
+    object_cache_size = 4 * 1024 * 1024
+    object_cache_max_object = 64 * 1024
+    object_cache_kinds = ('commit', 'tree')
+
     class RevCache(object):
 
         __slots__ = ('youngest_rev', 'oldest_rev', 'rev_dict', 'refs_dict',
@@ -275,7 +703,7 @@ class Storage(object):
 
         @classmethod
         def empty(cls):
-            return cls(None, None, {}, {}, {})
+            return cls(None, None, RevGraph(), {}, {})
 
         def __repr__(self):
             return 'RevCache(youngest_rev=%r, oldest_rev=%r, ' \
@@ -338,7 +766,7 @@ class Storage(object):
                            % (git_bin, repr(e)))
 
     def __init__(self, git_dir, log, git_bin='git', git_fs_encoding=None,
-                 rev_cache=None):
+                 rev_cache=None, rev_cache_dir=None, cat_file_pool_size=1):
         """Initialize PyGit.Storage instance
 
         `git_dir`: path to .git folder;
@@ -353,6 +781,13 @@ class Storage(object):
                 if `None`, no implicit decoding/encoding to/from
                 unicode objects is performed, and bytestrings are
                 returned instead
+
+        `rev_cache_dir`: directory in which a snapshot of the revision
+                cache is stored, so that it is not rebuilt from scratch
+                by new processes; if `None`, no snapshot is stored
+
+        `cat_file_pool_size`: maximum number of `git cat-file`
+                processes used concurrently to read objects
         """
 
         self.logger = log
@@ -368,8 +803,8 @@ class Storage(object):
         self.__commit_msg_cache = SizedDict(200)
         self.__commit_msg_lock = Lock()
 
-        self.__cat_file_pipe = None
-        self.__cat_file_pipe_lock = Lock()
+        self.__object_cache = SizedLRUCache(self.object_cache_size)
+        self.__cat_file_pool = self.__cat_file_check_pool = None
 
         if git_fs_encoding is not None:
             # validate encoding name
@@ -409,15 +844,26 @@ class Storage(object):
         self.repo = GitCore(git_dir, git_bin, log, git_fs_encoding)
         self.repo_path = git_dir
 
+        self.__cat_file_pool = GitProcessPool(self.repo.cat_file_batch,
+                                              cat_file_pool_size)
+        self.__cat_file_check_pool = \
+            GitProcessPool(self.repo.cat_file_batch_check, cat_file_pool_size)
+
+        if rev_cache_dir:
+            if isinstance(git_dir, unicode):
+                git_dir = git_dir.encode('utf-8')
+            self.__rev_cache_file = os.path.join(
+                rev_cache_dir, hashlib.sha1(git_dir).hexdigest() + '.revs')
+        else:
+            self.__rev_cache_file = None
+
         self.logger.debug("PyGIT.Storage instance for '%s' is constructed",
                           git_dir)
 
     def __del__(self):
-        with self.__cat_file_pipe_lock:
-            if self.__cat_file_pipe is not None:
-                self.__cat_file_pipe.stdin.close()
-                terminate(self.__cat_file_pipe)
-                self.__cat_file_pipe.wait()
+        for pool in (self.__cat_file_pool, self.__cat_file_check_pool):
+            if pool is not None:
+                pool.close()
 
     #
     # cache handling
@@ -444,16 +890,22 @@ class Storage(object):
         if force or self.__rev_cache_refresh:
             self.__rev_cache_refresh = False
             refs = self._get_refs()
-            if self.__rev_cache.refs_dict != refs:
+            rev_cache = self.__rev_cache
+            if refs and not rev_cache.rev_dict:
+                rev_cache = self._load_rev_cache() or rev_cache
+            if rev_cache.refs_dict != refs:
                 self.logger.debug("Detected changes in git repository "
                                   "'%s'", self.repo_path)
-                rev_cache = self._build_rev_cache(refs)
-                self.__rev_cache = rev_cache
-                StorageFactory.set_rev_cache(self.repo_path, rev_cache)
-                refreshed = True
+                rev_cache = self._update_rev_cache(rev_cache, refs) or \
+                            self._build_rev_cache(refs)
+                self._save_rev_cache(rev_cache)
             else:
                 self.logger.debug("Detected no changes in git repository "
                                   "'%s'", self.repo_path)
+            if rev_cache is not self.__rev_cache:
+                self.__rev_cache = rev_cache
+                StorageFactory.set_rev_cache(self.repo_path, rev_cache)
+                refreshed = True
         return refreshed
 
     def _build_rev_cache(self, refs):
@@ -461,94 +913,133 @@ class Storage(object):
                           self.repo_path)
         ts0 = time.time()
 
-        new_db = {} # db
-        new_sdb = {} # short_rev db
-
-        # helper for reusing strings
-        revs_seen = {}
-        def _rev_reuse(rev):
-            return revs_seen.setdefault(rev, rev)
-
-        refs = dict((refname, _rev_reuse(rev))
-                    for refname, rev in refs.iteritems())
-        head_revs = set(rev for refname, rev in refs.iteritems()
-                            if refname.startswith('refs/heads/'))
-        rev_list = [map(_rev_reuse, line.split())
+        rev_list = [line.split()
                     for line in self.repo.rev_list('--parents', '--topo-order',
                                                    '--all').splitlines()]
-        revs_seen = None
+        graph = RevGraph()
+        if not graph.add_commits(rev_list):
+            raise GitError("internal inconsistency detected")
+        rev_list = None
+        graph.set_branches(self.__branch_heads(refs))
+
+        # use an array rather than a dict for large repositories
+        srev_dict = [()] * 0x10000 if len(graph) > 5000 else {}
+        self.__add_short_revs(srev_dict, graph.revs)
+
+        rev_cache = self.RevCache(graph.youngest_rev, graph.oldest_rev,
+                                  graph, refs, srev_dict)
+        self.logger.debug("rebuilt commit tree db for '%s' with %d entries "
+                          "(took %.1f ms)", self.repo_path, len(graph),
+                          1000 * (time.time() - ts0))
+        return rev_cache
 
-        if rev_list:
-            # first rev seen is assumed to be the youngest one
-            youngest = rev_list[0][0]
-            # last rev seen is assumed to be the oldest one
-            oldest = rev_list[-1][0]
-        else:
-            youngest = oldest = None
+    def _update_rev_cache(self, rev_cache, refs):
+        """Return a copy of `rev_cache` extended with the commits which
+        are reachable from `refs` but not from the refs of `rev_cache`.
 
-        rheads_seen = {}
-        def _rheads_reuse(rheads):
-            rheads = frozenset(rheads)
-            return rheads_seen.setdefault(rheads, rheads)
+        Return `None` if the revision cache must be rebuilt, because it
+        is empty or because commits are no longer reachable.
+        """
+        old_tips = self.__ref_tips(rev_cache.refs_dict)
+        new_tips = self.__ref_tips(refs)
+        if not old_tips or not new_tips:
+            return None
+        # commits only reachable from the old refs would have to be
+        # removed from the graph
+        if self.repo.rev_list('--count', *(old_tips + ['--not'] +
+                                           new_tips)).strip() != '0':
+            return None
 
-        __rev_key = self.__rev_key
-        for ord_rev, revs in enumerate(rev_list):
-            rev = revs[0]
-            parents = revs[1:]
-
-            # shortrev "hash" map
-            new_sdb.setdefault(__rev_key(rev), []).append(rev)
-
-            # new_db[rev] = (children(rev), parents(rev),
-            #                ordinal_id(rev), rheads(rev))
-            if rev in new_db:
-                # (incomplete) entry was already created by children
-                _children, _parents, _ord_rev, _rheads = new_db[rev]
-                assert _children
-                assert not _parents
-                assert _ord_rev == 0
-            else: # new entry
-                _children = set()
-                _rheads = set()
-            if rev in head_revs:
-                _rheads.add(rev)
-
-            # create/update entry
-            # transform into frozenset and tuple since entry will be final
-            new_db[rev] = (frozenset(_children), tuple(parents), ord_rev + 1,
-                           _rheads_reuse(_rheads))
-
-            # update parents(rev)s
-            for parent in parents:
-                # by default, a dummy ordinal_id is used for the mean-time
-                _children, _parents, _ord_rev, _rheads2 = \
-                    new_db.setdefault(parent, (set(), [], 0, set()))
-
-                # update parent(rev)'s children
-                _children.add(rev)
-
-                # update parent(rev)'s rheads
-                _rheads2.update(_rheads)
-
-        rheads_seen = None
-
-        # convert sdb either to dict or array depending on size
-        tmp = [()] * (max(new_sdb.keys()) + 1) if len(new_sdb) > 5000 else {}
-        try:
-            while True:
-                k, v = new_sdb.popitem()
-                tmp[k] = tuple(v)
-        except KeyError:
-            pass
-        assert len(new_sdb) == 0
-        new_sdb = tmp
+        self.logger.debug("triggered update of commit tree db for '%s'",
+                          self.repo_path)
+        ts0 = time.time()
 
-        rev_cache = self.RevCache(youngest, oldest, new_db, refs, new_sdb)
-        self.logger.debug("rebuilt commit tree db for '%s' with %d entries "
-                          "(took %.1f ms)", self.repo_path, len(new_db),
+        rev_list = [line.split()
+                    for line in self.repo.rev_list('--parents', '--topo-order',
+                                                   *(new_tips + ['--not'] +
+                                                     old_tips)).splitlines()]
+        old_graph = rev_cache.rev_dict
+        graph = old_graph.copy()
+        if not graph.add_commits(rev_list) or \
+                not all(rev in graph for rev in new_tips):
+            return None
+        graph.set_branches(self.__branch_heads(refs))
+
+        srev_dict = rev_cache.srev_dict
+        srev_dict = srev_dict.copy() if isinstance(srev_dict, dict) \
+                    else list(srev_dict)
+        self.__add_short_revs(srev_dict, graph.revs[len(old_graph):])
+
+        rev_cache = self.RevCache(graph.youngest_rev, graph.oldest_rev,
+                                  graph, refs, srev_dict)
+        self.logger.debug("updated commit tree db for '%s' with %d new "
+                          "entries (took %.1f ms)", self.repo_path,
+                          len(graph) - len(old_graph),
                           1000 * (time.time() - ts0))
         return rev_cache
 
+    def _load_rev_cache(self):
+        """Return the revision cache stored in the snapshot file, or
+        `None` if there is no usable snapshot.
+        """
+        path = self.__rev_cache_file
+        if not path or not os.path.isfile(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                snapshot = RevGraph.loads(f.read())
+        except Exception as e:
+            self.logger.warning("Can't read commit tree snapshot '%s': %s",
+                                path, to_unicode(e))
+            return None
+        if snapshot is None:
+            return None
+        graph, refs = snapshot
+        srev_dict = [()] * 0x10000 if len(graph) > 5000 else {}
+        self.__add_short_revs(srev_dict, graph.revs)
+        self.logger.debug("loaded commit tree db for '%s' with %d entries "
+                          "from '%s'", self.repo_path, len(graph), path)
+        return self.RevCache(graph.youngest_rev, graph.oldest_rev, graph,
+                             refs, srev_dict)
+
+    def _save_rev_cache(self, rev_cache):
+        path = self.__rev_cache_file
+        if not path or not rev_cache.rev_dict:
+            return
+        try:
+            dir = os.path.dirname(path)
+            if not os.path.isdir(dir):
+                os.makedirs(dir)
+            f = AtomicFile(path, 'wb')
+            try:
+                f.write(rev_cache.rev_dict.dumps(rev_cache.refs_dict))
+            except Exception:
+                f.rollback()
+                raise
+            f.commit()
+        except (IOError, OSError) as e:
+            self.logger.warning("Can't write commit tree snapshot '%s': %s",
+                                path, to_unicode(e))
+
+    @staticmethod
+    def __ref_tips(refs):
+        return sorted(set(rev for refname, rev in refs.iteritems()
+                              if refname != 'HEAD'))
+
+    @staticmethod
+    def __branch_heads(refs):
+        return dict((refname, rev) for refname, rev in refs.iteritems()
+                                   if refname.startswith('refs/heads/'))
+
+    def __add_short_revs(self, srev_dict, revs):
+        __rev_key = self.__rev_key
+        for rev in revs:
+            key = __rev_key(rev)
+            try:
+                srev_dict[key] += (rev,)
+            except KeyError:
+                srev_dict[key] = (rev,)
+
     def _get_refs(self):
         refs = {}
         tags = {}
@@ -619,17 +1110,7 @@ class Storage(object):
         if rel_pos == 0:
             return sha
 
-        lin_rev = db[sha][2] + rel_pos
-
-        if lin_rev < 1 or lin_rev > len(db):
-            return None
-
-        for k, v in db.iteritems():
-            if v[2] == lin_rev:
-                return k
-
-        # should never be reached if db is consistent
-        raise GitError("internal inconsistency detected")
+        return db.rev_at(db[sha][2] + rel_pos)
 
     def hist_next_revision(self, sha):
         return self.history_relative_rev(sha, -1)
@@ -650,38 +1131,56 @@ class Storage(object):
         return self.verifyrev('HEAD')
 
     def cat_file(self, kind, sha):
-        with self.__cat_file_pipe_lock:
-            if self.__cat_file_pipe is None:
-                self.__cat_file_pipe = self.repo.cat_file_batch()
+        return self.cat_files(kind, [sha])[0]
 
-            try:
-                self.__cat_file_pipe.stdin.write(sha + '\n')
-                self.__cat_file_pipe.stdin.flush()
+    def cat_files(self, kind, shas):
+        """Return the contents of the objects `shas`, which are expected
+        to be of type `kind`.
 
-                split_stdout_line = self.__cat_file_pipe.stdout.readline() \
-                                                               .split()
-                if len(split_stdout_line) != 3:
-                    raise GitError("internal error (could not split line "
-                                   "'%s')" % (split_stdout_line,))
-
-                _sha, _type, _size = split_stdout_line
-
-                if _type != kind:
-                    raise GitError("internal error (got unexpected object "
-                                   "kind '%s', expected '%s')"
-                                   % (_type, kind))
-
-                size = int(_size)
-                return self.__cat_file_pipe.stdout.read(size + 1)[:size]
-            except:
-                # There was an error, we should close the pipe to get to a
-                # consistent state (Otherwise it happens that next time we
-                # call cat_file we get payload from previous call)
-                self.logger.debug("closing cat_file pipe")
-                self.__cat_file_pipe.stdin.close()
-                terminate(self.__cat_file_pipe)
-                self.__cat_file_pipe.wait()
-                self.__cat_file_pipe = None
+        The objects which are not cached are requested in batches from
+        a single `git cat-file --batch` process. `None` is returned for
+        objects which don't exist or are of another type.
+        """
+        shas = [str(sha) for sha in shas]
+        contents = [None] * len(shas)
+        pending = []
+        for idx, sha in enumerate(shas):
+            obj = self.__object_cache.get(sha)
+            if obj is None:
+                pending.append(idx)
+            elif obj[0] == kind:
+                contents[idx] = obj[1]
+        if not pending:
+            return contents
+
+        cacheable = kind in self.object_cache_kinds
+        batch_size = self.cat_file_batch_size
+        with self.__cat_file_pool.process() as proc:
+            for start in xrange(0, len(pending), batch_size):
+                batch = pending[start:start + batch_size]
+                proc.stdin.write(''.join(shas[idx] + '\n' for idx in batch))
+                proc.stdin.flush()
+                for idx in batch:
+                    split_stdout_line = proc.stdout.readline().split()
+                    if len(split_stdout_line) == 2:  # missing object
+                        continue
+                    if len(split_stdout_line) != 3:
+                        raise GitError("internal error (could not split "
+                                       "line '%s')" % (split_stdout_line,))
+
+                    _sha, _type, _size = split_stdout_line
+                    size = int(_size)
+                    data = proc.stdout.read(size + 1)[:size]
+                    if _type != kind:
+                        self.logger.debug("got unexpected object kind '%s' "
+                                          "for '%s', expected '%s'",
+                                          _type, shas[idx], kind)
+                        continue
+                    contents[idx] = data
+                    if cacheable and _sha == shas[idx] and \
+                            size <= self.object_cache_max_object:
+                        self.__object_cache.set(_sha, (_type, data), size)
+        return contents
 
     def verifyrev(self, rev):
         """verify/lookup given revision object and return a sha id or None
@@ -821,23 +1320,39 @@ class Storage(object):
                 result = self.__commit_msg_cache[commit_id]
                 return result[0], dict(result[1])
 
-            # cache miss
-            raw = self.cat_file('commit', commit_id)
-            raw = unicode(raw, self.get_commit_encoding(), 'replace')
-            result = parse_commit(raw)
+        # cache miss, read the commit without holding the lock
+        raw = self.cat_file('commit', commit_id)
+        if raw is None:
+            raise GitErrorSha("commit '%s' not found" % commit_id)
+        raw = unicode(raw, self.get_commit_encoding(), 'replace')
+        result = parse_commit(raw)
 
+        with self.__commit_msg_lock:
             self.__commit_msg_cache[commit_id] = result
 
-            return result[0], dict(result[1])
+        return result[0], dict(result[1])
 
     def get_file(self, sha):
-        return cStringIO.StringIO(self.cat_file('blob', str(sha)))
+        content = self.cat_file('blob', str(sha))
+        if content is None:
+            raise GitErrorSha("blob '%s' not found" % sha)
+        return cStringIO.StringIO(content)
 
     def get_obj_size(self, sha):
         sha = str(sha)
 
+        obj = self.__object_cache.get(sha)
+        if obj is not None:
+            return len(obj[1])
+
+        with self.__cat_file_check_pool.process() as proc:
+            proc.stdin.write(sha + '\n')
+            proc.stdin.flush()
+            split_stdout_line = proc.stdout.readline().split()
+
         try:
-            obj_size = int(self.repo.cat_file('-s', sha).strip())
+            _sha, _type, obj_size = split_stdout_line
+            obj_size = int(obj_size)
         except ValueError:
             raise GitErrorSha("object '%s' not found" % sha)
 
@@ -970,9 +1485,7 @@ class Storage(object):
     def rev_is_anchestor_of(self, rev1, rev2):
         """return True if rev2 is successor of rev1"""
 
-        rev_dict = self.get_commits()
-        return (rev2 in rev_dict and
-                rev2 in self.children_recursive(rev1, rev_dict))
+        return self.get_commits().is_ancestor(rev1, rev2)
 
     def blame(self, commit_sha, path):
         in_metadata = False
@@ -15,6 +15,7 @@
 from datetime import datetime
 import itertools
 import os
+import time
 
 from genshi.builder import tag
 from genshi.core import Markup
@@ -30,7 +31,7 @@ from trac.util.translation import _
 from trac.versioncontrol.api import Changeset, Node, Repository, \
                                     IRepositoryConnector, InvalidRepository,\
                                     NoSuchChangeset, NoSuchNode, \
-                                    IRepositoryProvider
+                                    IRepositoryProvider, RepositoryManager
 from trac.versioncontrol.cache import CACHE_YOUNGEST_REV, CachedRepository, \
                                       CachedChangeset
 from trac.versioncontrol.web_ui import IPropertyRenderer
@@ -120,6 +121,11 @@ class GitCachedRepository(CachedRepository):
                     revs[idx:idx] = traverse(rev, seen)
             return revs
 
+        def insert_changesets(changesets):
+            with self.env.db_transaction as db:
+                self._insert_changesets(db, changesets)
+
+        batch_size = max(1, RepositoryManager(self.env).sync_batch_size)
         while True:
             repos.sync()
             repos_youngest = repos.youngest_rev or ''
@@ -131,18 +137,35 @@ class GitCachedRepository(CachedRepository):
                     continue
                 revs = traverse(rev, seen)  # topology ordered
                 while revs:
-                    # sync revision from older revision to newer revision
-                    rev = revs.pop()
-                    self.log.info("Trying to sync revision [%s]", rev)
-                    cset = repos.get_changeset(rev)
+                    # sync revisions from older revision to newer revision
+                    start = time.time()
+                    batch = [revs.pop()
+                             for idx in xrange(min(batch_size, len(revs)))]
+                    self.log.info("Trying to sync revisions [%s:%s]",
+                                  batch[0], batch[-1])
+                    changesets = self._get_changesets(batch)
                     try:
-                        self.insert_changeset(rev, cset)
-                        updated = True
+                        insert_changesets(changesets)
                     except self.env.db_exc.IntegrityError as e:
-                        self.log.info('Revision %s already cached: %r', rev, e)
-                        continue
+                        # Some revisions are already cached, retry the
+                        # others one at a time
+                        synced = []
+                        for changeset in changesets:
+                            try:
+                                insert_changesets([changeset])
+                            except self.env.db_exc.IntegrityError as e:
+                                self.log.info('Revision %s already cached: '
+                                              '%r', changeset[0], e)
+                            else:
+                                synced.append(changeset[0])
+                    else:
+                        synced = batch
+                    if synced:
+                        updated = True
+                        self._log_sync_throughput(len(synced), start)
                     if feedback:
-                        feedback(rev)
+                        for rev in synced:
+                            feedback(rev)
 
             if updated:
                 continue  # sync again
@@ -308,6 +331,20 @@ class GitConnector(Component):
     git_bin = Option('git', 'git_bin', 'git',
         """Path to the git executable.""")
 
+    rev_cache_dir = PathOption('git', 'rev_cache_dir', '',
+        """Directory in which a snapshot of the commit tree of each
+        repository is stored, so that the commit tree is updated from
+        the snapshot rather than rebuilt from scratch when Trac is
+        restarted. Relative paths are resolved relative to the `conf`
+        directory of the environment. Leave empty to disable the
+        snapshots. (''since 1.2'')
+        """)
+
+    cat_file_pool_size = IntOption('git', 'cat_file_pool_size', 4,
+        """Maximum number of `git cat-file` processes reading objects
+        concurrently from each repository. (''since 1.2'')
+        """)
+
 
     def get_supported_types(self):
         yield ('git', 8)
@@ -362,6 +399,8 @@ class GitConnector(Component):
                               persistent_cache=self.persistent_cache,
                               git_bin=self.git_bin,
                               git_fs_encoding=self.git_fs_encoding,
+                              rev_cache_dir=self.rev_cache_dir,
+                              cat_file_pool_size=self.cat_file_pool_size,
                               shortrev_len=self.shortrev_len,
                               rlookup_uid=rlookup_uid,
                               use_committer_id=self.use_committer_id,
@@ -471,6 +510,8 @@ class GitRepository(Repository):
                  persistent_cache=False,
                  git_bin='git',
                  git_fs_encoding='utf-8',
+                 rev_cache_dir=None,
+                 cat_file_pool_size=1,
                  shortrev_len=7,
                  rlookup_uid=lambda _: None,
                  use_committer_id=False,
@@ -490,7 +531,10 @@ class GitRepository(Repository):
         try:
             factory = PyGIT.StorageFactory(path, log, not persistent_cache,
                                            git_bin=git_bin,
-                                           git_fs_encoding=git_fs_encoding)
+                                           git_fs_encoding=git_fs_encoding,
+                                           rev_cache_dir=rev_cache_dir,
+                                           cat_file_pool_size=
+                                               cat_file_pool_size)
             self._git = factory.getInstance()
         except PyGIT.GitError as e:
             log.error(exception_to_unicode(e))
@@ -556,9 +600,14 @@ class GitRepository(Repository):
         return self.params.get('url')
 
     def get_changesets(self, start, stop):
-        for rev in self.git.history_timerange(to_timestamp(start),
-                                              to_timestamp(stop)):
-            yield self.get_changeset(rev)
+        git = self.git
+        revs = git.history_timerange(to_timestamp(start), to_timestamp(stop))
+        batch_size = git.cat_file_batch_size
+        for idx in xrange(0, len(revs), batch_size):
+            batch = revs[idx:idx + batch_size]
+            git.cat_files('commit', batch)  # read the commits at once
+            for rev in batch:
+                yield self.get_changeset(rev)
 
     def get_changeset(self, rev):
         """GitChangeset factory method"""
@@ -12,6 +12,7 @@
 # history and logs, available at http://trac.edgewall.org/log/.
 
 import os
+import sys
 import tempfile
 import unittest
 from datetime import datetime
@@ -25,9 +26,11 @@ from trac.util.compat import close_fds
 from trac.versioncontrol.api import Changeset, DbRepositoryProvider, \
                                     RepositoryManager
 from tracopt.versioncontrol.git.git_fs import GitConnector
-from tracopt.versioncontrol.git.PyGIT import GitCore, GitError, Storage, \
-                                             SizedDict, StorageFactory, \
-                                             parse_commit
+from tracopt.versioncontrol.git.PyGIT import GitCore, GitError, \
+                                             GitErrorSha, GitProcessPool, \
+                                             RevGraph, SizedDict, \
+                                             SizedLRUCache, Storage, \
+                                             StorageFactory, parse_commit
 from tracopt.versioncontrol.git.tests.git_fs import GitCommandMixin
 
 
@@ -179,10 +182,21 @@ class NormalTestCase(unittest.TestCase, GitCommandMixin):
             path = os.path.join(self.repos_path, '.git')
         return StorageFactory(path, self.env.log, weak)
 
-    def _storage(self, path=None):
+    def _storage(self, path=None, rev_cache_dir=None):
         if path is None:
             path = os.path.join(self.repos_path, '.git')
-        return Storage(path, self.env.log, self.git_bin, 'utf-8')
+        return Storage(path, self.env.log, self.git_bin, 'utf-8',
+                       rev_cache_dir=rev_cache_dir)
+
+    def _commit(self, message, date):
+        self._git_commit('-m', message, '--allow-empty', date=date)
+
+    def _assert_rev_dict(self, expected, actual):
+        self.assertEqual(sorted(expected), sorted(actual))
+        for rev in expected:
+            children, parents, ordinal, rheads = expected[rev]
+            self.assertEqual((children, parents, rheads),
+                             actual[rev][:2] + actual[rev][3:])
 
     def test_control_files_detection(self):
         # Exception not raised when path points to ctrl file dir
@@ -277,6 +291,126 @@ class NormalTestCase(unittest.TestCase, GitCommandMixin):
                          sorted(b[0] for b in storage.get_branches()))
         self.assertEqual(False, storage.sync())
 
+    def test_object_cache_bounded_by_object_sizes(self):
+        shas = []
+        for idx in xrange(5):
+            filename = os.path.join(self.repos_path, 'file%d.txt' % idx)
+            create_file(filename, '%d' % idx * 10000)
+            proc = self._spawn_git('hash-object', '-w', filename)
+            shas.append(proc.communicate()[0].strip())
+        object_cache_size = Storage.object_cache_size
+        Storage.object_cache_size = 25000
+        try:
+            storage = self._storage()
+        finally:
+            Storage.object_cache_size = object_cache_size
+        storage.object_cache_kinds = ('blob',)
+
+        contents = storage.cat_files('blob', shas)
+        self.assertEqual(['%d' % idx * 10000 for idx in xrange(5)], contents)
+        cache = storage._Storage__object_cache
+        self.assertEqual(2, len(cache))
+        self.assertEqual(20000, cache.size)
+        self.assertEqual(('blob', '4' * 10000), cache.get(shas[4]))
+        self.assertEqual(None, cache.get(shas[0]))
+
+    def test_sync_updates_rev_cache(self):
+        storage = self._storage()
+        storage.sync()
+        self._git('checkout', '-b', 'b1', 'master')
+        self._commit('b1 1', datetime(2016, 3, 1, 10, 0, 0))
+        self._git('checkout', 'master')
+        self._commit('master 1', datetime(2016, 3, 1, 11, 0, 0))
+        self._git('merge', '--no-ff', '-m', 'merge b1', 'b1')
+        self._git('tag', 't1', 'b1')
+
+        def build_rev_cache(refs):
+            self.fail("rev cache rebuilt")
+        storage._build_rev_cache = build_rev_cache
+        self.assertEqual(True, storage.sync())
+        del storage._build_rev_cache
+
+        rev_dict = storage.get_commits()
+        self._assert_rev_dict(self._storage().get_commits(), rev_dict)
+        master = storage.verifyrev('master')
+        b1 = storage.verifyrev('b1')
+        self.assertEqual(master, storage.youngest_rev())
+        self.assertEqual(2, len(storage.parents(master)))
+        self.assertEqual([('b1', b1), ('master', master)],
+                         storage.get_branch_contains(b1, resolve=True))
+        self.assertEqual(['t1'], storage.get_tags(b1))
+        self.assertEqual(b1, storage.fullrev(storage.shortrev(b1)))
+        self.assertTrue(storage.rev_is_anchestor_of(b1, master))
+        self.assertFalse(storage.rev_is_anchestor_of(master, b1))
+
+        # rewinding a branch updates the branches containing commits
+        self._git('branch', '-f', 'b1', 'master~1')
+        self.assertEqual(True, storage.sync())
+        self._assert_rev_dict(self._storage().get_commits(),
+                              storage.get_commits())
+        self.assertEqual([('master', master)],
+                         storage.get_branch_contains(b1, resolve=True))
+
+    def test_sync_rebuilds_rev_cache_for_unreachable_commits(self):
+        self._git('checkout', '-b', 'b1', 'master')
+        self._commit('b1 1', datetime(2016, 3, 1, 10, 0, 0))
+        b1 = self._storage().repo.rev_parse('b1').strip()
+        self._git('checkout', 'master')
+        storage = self._storage()
+        storage.sync()
+        self.assertIn(b1, storage.get_commits())
+
+        self._git('branch', '-D', 'b1')
+        self.assertEqual(True, storage.sync())
+        self.assertNotIn(b1, storage.get_commits())
+        self._assert_rev_dict(self._storage().get_commits(),
+                              storage.get_commits())
+
+    def test_rev_cache_snapshot(self):
+        rev_cache_dir = os.path.join(self.repos_path, 'rev-cache')
+        storage = self._storage(rev_cache_dir=rev_cache_dir)
+        rev = storage.youngest_rev()
+        self.assertEqual(1, len(os.listdir(rev_cache_dir)))
+
+        def build_rev_cache(refs):
+            self.fail("rev cache rebuilt")
+        storage = self._storage(rev_cache_dir=rev_cache_dir)
+        storage._build_rev_cache = build_rev_cache
+        self.assertEqual(rev, storage.youngest_rev())
+        self.assertEqual([('master', rev)], storage.get_branches())
+
+        self._commit('snapshot', datetime(2016, 3, 1, 10, 0, 0))
+        storage = self._storage(rev_cache_dir=rev_cache_dir)
+        storage._build_rev_cache = build_rev_cache
+        self.assertEqual([rev], storage.parents(storage.youngest_rev()))
+        self._assert_rev_dict(self._storage().get_commits(),
+                              storage.get_commits())
+
+    def test_cat_files(self):
+        create_file(os.path.join(self.repos_path, 'file.txt'), 'contents')
+        self._git('add', 'file.txt')
+        self._commit('add file.txt', datetime(2016, 3, 1, 10, 0, 0))
+        storage = self._storage()
+        rev = storage.youngest_rev()
+        parent_rev = storage.parents(rev)[0]
+        mode, kind, blob, size, name = storage.ls_tree(rev, 'file.txt')[0]
+
+        commits = storage.cat_files('commit', [rev, '0' * 40, blob,
+                                               parent_rev])
+        self.assertEqual(4, len(commits))
+        self.assertIn('add file.txt', commits[0])
+        self.assertEqual(None, commits[1])
+        self.assertEqual(None, commits[2])
+        self.assertIn('test', commits[3])
+        self.assertEqual(['contents'], storage.cat_files('blob', [blob]))
+        self.assertEqual('contents', storage.get_file(blob).read())
+        self.assertRaises(GitErrorSha, storage.get_file, '0' * 40)
+        self.assertEqual(commits[0], storage.cat_file('commit', rev))
+        self.assertEqual(len(commits[0]), storage.get_obj_size(rev))
+        self.assertEqual(8, storage.get_obj_size(blob))
+        self.assertRaises(GitErrorSha, storage.get_obj_size, '0' * 40)
+        self.assertEqual(u'add file.txt', storage.read_commit(rev)[0])
+
     def test_turn_off_persistent_cache(self):
         # persistent_cache is enabled
         parent_rev = self._factory(False).getInstance().youngest_rev()
@@ -417,6 +551,134 @@ class UnicodeNameTestCase(unittest.TestCase, GitCommandMixin):
         validate(paths[2], 'false')
 
 
+class RevGraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # 1 - 2 - 3 - 5   master
+        #      \     /
+        #       4 ---     b1
+        self.graph = RevGraph()
+        self.graph.add_commits([['5', '3', '4'], ['4', '2'], ['3', '2'],
+                                ['2', '1'], ['1']])
+        self.graph.set_branches({'refs/heads/master': '5',
+                                 'refs/heads/b1': '4'})
+
+    def test_getitem(self):
+        self.assertEqual((frozenset(['3', '4']), ('1',), 4,
+                          frozenset(['4', '5'])), self.graph['2'])
+        self.assertEqual((frozenset(), ('3', '4'), 1, frozenset(['5'])),
+                         self.graph['5'])
+        self.assertRaises(KeyError, self.graph.__getitem__, '6')
+
+    def test_rev_at(self):
+        self.assertEqual('5', self.graph.rev_at(1))
+        self.assertEqual('1', self.graph.rev_at(5))
+        self.assertEqual(None, self.graph.rev_at(0))
+        self.assertEqual(None, self.graph.rev_at(6))
+
+    def test_is_ancestor(self):
+        self.assertTrue(self.graph.is_ancestor('1', '5'))
+        self.assertTrue(self.graph.is_ancestor('4', '5'))
+        self.assertFalse(self.graph.is_ancestor('3', '4'))
+        self.assertFalse(self.graph.is_ancestor('5', '5'))
+        self.assertFalse(self.graph.is_ancestor('5', '1'))
+
+    def test_add_commits_with_unknown_parent(self):
+        self.assertFalse(self.graph.add_commits([['7', '6']]))
+
+    def test_set_branches(self):
+        self.graph.add_commits([['6', '4']])
+        self.graph.set_branches({'refs/heads/master': '3',
+                                 'refs/heads/b2': '6'})
+        self.assertEqual(frozenset(['3']), self.graph['3'][3])
+        self.assertEqual(frozenset(['6']), self.graph['4'][3])
+        self.assertEqual(frozenset(), self.graph['5'][3])
+        self.assertEqual(frozenset(['3', '6']), self.graph['1'][3])
+
+    def test_snapshot(self):
+        graph = RevGraph()
+        graph.add_commits([['%040x' % 3, '%040x' % 1, '%040x' % 2],
+                           ['%040x' % 2, '%040x' % 1], ['%040x' % 1]])
+        graph.set_branches({'refs/heads/master': '%040x' % 3})
+        refs = {'refs/heads/master': '%040x' % 3}
+        loaded, loaded_refs = RevGraph.loads(graph.dumps(refs))
+        self.assertEqual(refs, loaded_refs)
+        self.assertEqual(list(graph.iteritems()), list(loaded.iteritems()))
+
+
+class SizedLRUCacheTestCase(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = SizedLRUCache(10)
+        cache.set('a', 'aaaa')
+        cache.set('b', 'bbbb')
+        self.assertEqual('aaaa', cache.get('a'))
+        cache.set('c', 'cccc')
+        self.assertEqual(None, cache.get('b'))
+        self.assertEqual('aaaa', cache.get('a'))
+        self.assertEqual('cccc', cache.get('c'))
+        cache.set('c', 'cccccccccc')
+        self.assertEqual(1, len(cache))
+        self.assertEqual('default', cache.get('a', 'default'))
+
+    def test_explicit_size(self):
+        cache = SizedLRUCache(100)
+        for idx in xrange(50):
+            cache.set(idx, ('blob', 'x' * 40), 40)
+        self.assertEqual(2, len(cache))
+        self.assertEqual(80, cache.size)
+        self.assertEqual(('blob', 'x' * 40), cache.get(49))
+        self.assertEqual(None, cache.get(47))
+
+
+class GitProcessPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.spawned = []
+        self.pool = GitProcessPool(self._spawn, 2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def _spawn(self):
+        proc = Popen([sys.executable, '-c', 'import sys; sys.stdin.read()'],
+                     stdin=PIPE, close_fds=close_fds)
+        self.spawned.append(proc)
+        return proc
+
+    def test_reuses_processes(self):
+        with self.pool.process() as proc1:
+            with self.pool.process() as proc2:
+                self.assertIsNot(proc1, proc2)
+        with self.pool.process() as proc3:
+            self.assertIn(proc3, (proc1, proc2))
+        self.assertEqual(2, len(self.spawned))
+
+    def test_discards_process_on_error(self):
+        try:
+            with self.pool.process() as proc:
+                raise GitError()
+        except GitError:
+            pass
+        self.assertTrue(proc.stdin.closed)
+        with self.pool.process() as proc2:
+            self.assertIsNot(proc, proc2)
+
+    def test_discards_exited_process(self):
+        with self.pool.process() as proc:
+            pass
+        proc.stdin.close()
+        proc.wait()
+        with self.pool.process() as proc2:
+            self.assertIsNot(proc, proc2)
+
+    def test_close(self):
+        with self.pool.process() as proc:
+            pass
+        self.pool.close()
+        self.assertTrue(proc.stdin.closed)
+
+
 class SizedDictTestCase(unittest.TestCase):
 
     def test_setdefault_raises(self):
@@ -584,6 +846,9 @@ def suite():
     else:
         print("SKIP: tracopt/versioncontrol/git/tests/PyGIT.py (git cli "
               "binary, 'git', not found)")
+    suite.addTest(unittest.makeSuite(RevGraphTestCase))
+    suite.addTest(unittest.makeSuite(SizedLRUCacheTestCase))
+    suite.addTest(unittest.makeSuite(GitProcessPoolTestCase))
     suite.addTest(unittest.makeSuite(SizedDictTestCase))
     return suite
 
@@ -580,6 +580,28 @@ class GitCachedRepositoryTestCase(GitRepositoryTestCase):
             repos.sync(feedback=feedback_2)  # restart sync
         self.assertEqual(revs, revs2)
 
+    def test_sync_merge_batched(self):
+        self._git_init()
+        self._create_merge_commit()
+        self.env.config.set('versioncontrol', 'sync_batch_size', '4')
+        self.env.config.set('versioncontrol', 'sync_workers', '2')
+
+        self._add_repository('gitrepos')
+        repos = self._repomgr.get_repository('gitrepos')
+        revs = []
+        repos.sync(feedback=revs.append)
+        self.assertEqual(6, len(revs))
+        self.assertEqual(repos.repos.youngest_rev, revs[-1])
+        self.assertEqual(repos.repos.oldest_rev, revs[0])
+        with self.env.db_query as db:
+            self.assertEqual(sorted(revs),
+                             sorted(rev for rev, in db("SELECT rev FROM "
+                                                       "revision")))
+
+        revs2 = []
+        repos.sync(feedback=revs2.append, clean=True)
+        self.assertEqual(revs, revs2)
+
     def test_sync_too_many_merges(self):
         data = self._generate_data_many_merges(100)
         self._git_init(data=False, bare=True)